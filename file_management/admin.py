@@ -1,9 +1,10 @@
 from django.contrib import admin
-from .models import UserFile, FileCategory, OCRResult, OCRPreference, CardDetails, AppSubscription, ExpiryDetails
+from .models import UserFile, FileCategory, OCRResult, OCRJob, OCRPreference, CardDetails, AppSubscription, ExpiryDetails
 from storage_management.utils import S3StorageManager
 from django.db import transaction
 from .views import process_document_ocr_logic
 from .services import OCRService
+from .ocr_queue import enqueue_ocr
 from django.contrib import messages
 
 @admin.register(UserFile)
@@ -125,6 +126,14 @@ class OCRResultAdmin(admin.ModelAdmin):
     search_fields = ('file__original_filename',)
 
 
+@admin.register(OCRJob)
+class OCRJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'file', 'user', 'lane', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('lane', 'status')
+    search_fields = ('file__original_filename', 'user__email')
+    raw_id_fields = ('file', 'user')
+
+
 @admin.register(OCRPreference)
 class OCRPreferenceAdmin(admin.ModelAdmin):
     list_display = ('user', 'preference')
@@ -148,15 +157,14 @@ class AppSubscriptionAdmin(admin.ModelAdmin):
 def reprocess_ocr(modeladmin, request, queryset):
     """Custom admin action to re-trigger OCR processing."""
     processed_count = 0
-    ocr_service = OCRService()
     for file in queryset.filter(file_type__in=['document', 'image']):
         try:
             # Set the pending flag to ensure categorization is attempted
             file.pending_auto_categorization = True
             file.save(update_fields=['pending_auto_categorization'])
             
-            # Trigger OCR processing
-            ocr_service.process_file(file)
+            # Queue on the backfill lane so uploads keep priority
+            enqueue_ocr(file, lane='backfill')
             processed_count += 1
         except Exception as e:
             modeladmin.message_user(request, f"Error processing file {file.id}: {e}", messages.ERROR)
@@ -0,0 +1,173 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+from .learned_categorizer import get_model, learned_mode_enabled
+from .models import FileCategory, OCRResult, UserFile
+from .utils import FileCategorizationService
+
+# Same bar as process_document_ocr_logic, which the pending-files command used per file
+CONFIDENCE_THRESHOLD = 40
+
+_service = None
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def categorize_text(text_content):
+    """Process-pool worker: (suggested category, confidence) for one text"""
+    global _service
+    if _service is None:
+        _service = FileCategorizationService()
+    analysis = _service.analyze_file_content(text_content)
+    return analysis['category'], analysis['confidence']
+
+
+def iter_chunks(queryset, chunk_size, limit=None):
+    """
+    Yield a queryset as lists of at most chunk_size rows, in primary key order.
+
+    Each chunk is its own `pk > last` query rather than one long iterator()
+    cursor, because the rows are updated between chunks and SQLite gives no
+    isolation between an open cursor and writes on the same connection.
+    """
+    last_id = 0
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        chunk = list(queryset.filter(pk__gt=last_id).order_by('pk')[:size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].pk
+        if remaining is not None:
+            remaining -= len(chunk)
+
+
+def ocr_texts(file_ids):
+    """{file_id: text} of the completed OCR results of these files, in one query"""
+    texts = {}
+    rows = (
+        OCRResult.objects.filter(file_id__in=file_ids, status='completed', text_content__isnull=False)
+        .order_by('id')
+        .values_list('file_id', 'text_content')
+    )
+    for file_id, text_content in rows:
+        if text_content.strip():
+            texts[file_id] = text_content
+    return texts
+
+
+class BatchCategorizer:
+    """
+    Categorizes pending UserFiles in chunks instead of one save() per file.
+
+    Per chunk: one query for the rows, one for their OCR text, the keyword
+    scoring spread over a process pool, then one bulk_update for changed
+    categories and one UPDATE clearing the pending flags. Files without OCR
+    text yet are queued as backfill OCR jobs; the job categorizes them when
+    the text arrives. Throughput is capped by max_per_second (0 = no cap)
+    rather than a fixed sleep per file.
+    """
+
+    def __init__(self, chunk_size=None, workers=None, max_per_second=None, queue_missing_ocr=True, progress=None):
+        self.chunk_size = chunk_size or _setting('BATCH_CATEGORIZE_CHUNK_SIZE', 500)
+        self.workers = _setting('BATCH_CATEGORIZE_WORKERS', 4) if workers is None else workers
+        self.max_per_second = (
+            _setting('BATCH_CATEGORIZE_MAX_FILES_PER_SECOND', 0) if max_per_second is None else max_per_second
+        )
+        self.queue_missing_ocr = queue_missing_ocr
+        self.progress = progress
+        self._categories = {}
+
+    def _category(self, name):
+        if name not in self._categories:
+            # Shared categories only, never another user's category of the same name
+            category = FileCategory.objects.filter(name=name, created_by__isnull=True).order_by('id').first()
+            if category is None:
+                category = FileCategory.objects.create(name=name, is_default=True)
+            self._categories[name] = category
+        return self._categories[name]
+
+    def _analyze(self, executor, texts):
+        file_ids = list(texts)
+        values = [texts[file_id] for file_id in file_ids]
+        if learned_mode_enabled() and get_model() is not None:
+            # One vectorized prediction for the chunk; the keyword fallback runs in-process
+            analyses = FileCategorizationService().analyze_many(values)
+            return {
+                file_id: (analysis['category'], analysis['confidence'])
+                for file_id, analysis in zip(file_ids, analyses)
+            }
+        if executor is None:
+            results = map(categorize_text, values)
+        else:
+            results = executor.map(categorize_text, values, chunksize=max(1, len(values) // (self.workers * 4)))
+        return dict(zip(file_ids, results))
+
+    def _process_chunk(self, executor, files, summary):
+        from .ocr_queue import enqueue_ocr
+
+        texts = ocr_texts([user_file.id for user_file in files])
+        analyses = self._analyze(executor, texts)
+
+        changed = []
+        done = []
+        for user_file in files:
+            if user_file.id not in texts:
+                continue
+            done.append(user_file.id)
+            suggested, confidence = analyses[user_file.id]
+            current = user_file.category.name if user_file.category else 'Miscellaneous'
+            if confidence >= CONFIDENCE_THRESHOLD and suggested != current:
+                user_file.category = self._category(suggested)
+                changed.append(user_file)
+
+        with transaction.atomic():
+            if changed:
+                UserFile.objects.bulk_update(changed, ['category'])
+            if done:
+                UserFile.objects.filter(id__in=done).update(pending_auto_categorization=False)
+            if self.queue_missing_ocr:
+                for user_file in files:
+                    if user_file.id not in texts:
+                        enqueue_ocr(user_file, lane='backfill')
+                        summary['queued_for_ocr'] += 1
+
+        summary['files'] += len(files)
+        summary['categorized'] += len(done)
+        summary['changed'] += len(changed)
+
+    def _throttle(self, started, processed):
+        if not self.max_per_second:
+            return
+        delay = processed / self.max_per_second - (time.monotonic() - started)
+        if delay > 0:
+            time.sleep(delay)
+
+    def run(self, queryset=None, limit=None):
+        """Categorize pending files and return a summary with the throughput"""
+        if queryset is None:
+            queryset = UserFile.objects.filter(pending_auto_categorization=True)
+        queryset = queryset.select_related('category')
+
+        summary = {'files': 0, 'categorized': 0, 'changed': 0, 'queued_for_ocr': 0}
+        started = time.monotonic()
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers else None
+        try:
+            for files in iter_chunks(queryset, self.chunk_size, limit):
+                self._process_chunk(executor, files, summary)
+                if self.progress:
+                    self.progress(summary, time.monotonic() - started)
+                self._throttle(started, summary['files'])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        summary['seconds'] = time.monotonic() - started
+        summary['files_per_second'] = summary['files'] / summary['seconds'] if summary['seconds'] else 0.0
+        return summary
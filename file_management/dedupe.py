@@ -0,0 +1,140 @@
+import hashlib
+
+from django.db.models import Count, Max
+
+from .models import UserFile
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_obj):
+    """SHA-256 of a file-like object read in chunks; seekable files are rewound afterwards"""
+    sha256 = hashlib.sha256()
+    seekable = getattr(file_obj, 'seekable', lambda: False)()
+    if seekable:
+        file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b''):
+        sha256.update(chunk)
+    if seekable:
+        file_obj.seek(0)
+    return sha256.hexdigest()
+
+
+def find_duplicate(user, file_hash, file_size=None):
+    """An existing file of this user with identical content, or None"""
+    if not file_hash:
+        return None
+    duplicates = UserFile.objects.filter(user=user, file_hash=file_hash).exclude(s3_key='')
+    if file_size is not None:
+        duplicates = duplicates.filter(file_size=file_size)
+    return duplicates.order_by('id').first()
+
+
+def find_upload_duplicate(user, file_obj):
+    """
+    Check an incoming upload against the user's content hashes.
+
+    Identical bytes have identical sizes, so the local hashing pass only
+    runs when the user already has a hashed file of this exact size;
+    everything else goes straight to the streaming upload, which hashes in
+    the same pass.
+
+    Returns:
+        dict or None: an upload result ({'s3_key', 'size', 'sha256',
+        'duplicate_of'}) pointing at the stored copy, or None to upload.
+    """
+    candidates = UserFile.objects.filter(user=user, file_size=file_obj.size).exclude(file_hash='')
+    if not candidates.exists():
+        return None
+
+    file_hash = hash_file(file_obj)
+    duplicate = find_duplicate(user, file_hash, file_obj.size)
+    if duplicate is None:
+        return None
+
+    print(f"[Dedupe] User {user.id}: upload matches file {duplicate.id}, reusing {duplicate.s3_key}")
+    return {
+        's3_key': duplicate.s3_key,
+        'size': duplicate.file_size,
+        'sha256': file_hash,
+        'duplicate_of': duplicate,
+    }
+
+
+def shares_stored_copy(user_file):
+    """
+    True if another row of the same user points at this row's S3 object with
+    the same content hash. A row with the same key but other bytes is not a
+    shared copy (its object was written separately) and is counted on its own.
+    """
+    if not user_file.file_hash or not user_file.s3_key:
+        return False
+    return UserFile.objects.filter(
+        user_id=user_file.user_id, s3_key=user_file.s3_key, file_hash=user_file.file_hash
+    ).exclude(pk=user_file.pk).exists()
+
+
+def reference_count(user_id, s3_key):
+    """How many rows of a user reference one stored object"""
+    return UserFile.objects.filter(user_id=user_id, s3_key=s3_key).count()
+
+
+def shared_copy_overcount(user_ids):
+    """
+    Bytes a plain SUM(file_size) over-counts because deduplicated rows share an object.
+
+    Returns:
+        dict: {user_id: bytes to subtract}
+    """
+    overcount = {}
+    shared = (
+        UserFile.objects.filter(user_id__in=user_ids).exclude(file_hash='').exclude(s3_key='')
+        .values('user_id', 's3_key', 'file_hash')
+        .annotate(references=Count('id'), size=Max('file_size'))
+        .filter(references__gt=1)
+    )
+    for group in shared:
+        overcount[group['user_id']] = overcount.get(group['user_id'], 0) + (group['references'] - 1) * (group['size'] or 0)
+    return overcount
+
+
+def duplicate_groups(user, limit=None):
+    """
+    Groups of the user's files with identical content.
+
+    reclaimable_bytes only counts copies that are still stored separately;
+    rows deduplicated at upload already share one object.
+    """
+    groups = (
+        UserFile.objects.filter(user=user).exclude(file_hash='')
+        .values('file_hash')
+        .annotate(
+            count=Count('id'),
+            file_size=Max('file_size'),
+            stored_copies=Count('s3_key', distinct=True),
+        )
+        .filter(count__gt=1)
+        .order_by('-file_size')
+    )
+    if limit:
+        groups = groups[:limit]
+    groups = list(groups)
+
+    files_by_hash = {}
+    if groups:
+        for file_id, file_hash, original_filename in UserFile.objects.filter(
+            user=user, file_hash__in=[group['file_hash'] for group in groups]
+        ).order_by('id').values_list('id', 'file_hash', 'original_filename'):
+            files_by_hash.setdefault(file_hash, []).append({'id': file_id, 'original_filename': original_filename})
+
+    return [
+        {
+            'file_hash': group['file_hash'],
+            'file_size': group['file_size'],
+            'count': group['count'],
+            'stored_copies': group['stored_copies'],
+            'reclaimable_bytes': (group['stored_copies'] - 1) * (group['file_size'] or 0),
+            'files': files_by_hash.get(group['file_hash'], []),
+        }
+        for group in groups
+    ]
@@ -0,0 +1,231 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+from . import ocr_cache
+from .models import FileCategory, OCRPreference, OCRResult, UserFile
+from .ocr_pages import store_pages
+
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png')
+
+# Same bar as OCRService._categorize_file
+CONFIDENCE_THRESHOLD = 25
+
+SIDE_ORDER = {'front': 0, 'single': 1, 'back': 2}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def document_files(user_file):
+    """The UserFiles of the logical document user_file belongs to, front side first"""
+    files = [user_file]
+    paired = user_file.paired_document
+    if paired is not None and paired.pk != user_file.pk:
+        files.append(paired)
+    return sorted(files, key=lambda side: (SIDE_ORDER.get(side.document_side, 1), side.pk))
+
+
+def needs_ocr(user_file):
+    if user_file.file_type not in ('document', 'image'):
+        return False
+    status = OCRResult.objects.filter(file=user_file).values_list('status', flat=True).first()
+    return status not in ('completed', 'processing')
+
+
+def enqueue_document_ocr(user_file, lane='interactive'):
+    """
+    Queue one OCR job for the whole document user_file belongs to, or None.
+
+    The job runs on the first side; OCRService.process_file hands paired
+    files to DocumentOCR, which does every side.
+    """
+    from .ocr_queue import enqueue_ocr
+
+    files = document_files(user_file)
+    if not any(needs_ocr(side) for side in files):
+        return None
+    return enqueue_ocr(files[0], lane=lane)
+
+
+class DocumentOCR:
+    """
+    Fan-out/fan-in OCR for a document made of several files (front/back scans).
+
+    Every side still to be OCR'd is sent to the engine at the same time from
+    a thread pool (OCR_DOCUMENT_WORKERS); sides already completed or in the
+    OCR cache are not sent again. The texts are merged in side order, the
+    combined text is categorized once, and the page rows, OCR results and
+    categories of all sides are written in one transaction. The worker
+    threads only talk to the engine, never to the database.
+
+    Engines that OCR PDFs through an asynchronous job (Textract) can't be
+    fanned in here; process() returns None and the caller OCRs each file
+    on its own, as before.
+    """
+
+    def __init__(self, ocr_service, workers=None):
+        self.service = ocr_service
+        self.workers = _setting('OCR_DOCUMENT_WORKERS', 4) if workers is None else workers
+
+    def _extension(self, user_file):
+        return self.service._get_file_extension(user_file)
+
+    def supports(self, files, engine):
+        for user_file in files:
+            extension = self._extension(user_file)
+            if extension in IMAGE_EXTENSIONS:
+                continue
+            if extension == 'pdf' and not engine.async_pdf:
+                continue
+            return False
+        return True
+
+    def _recognise(self, engine, user_file, s3_key):
+        """Thread-pool worker: all pages of one side, in order"""
+        if self._extension(user_file) == 'pdf':
+            return list(engine.pdf_pages(s3_key))
+        return list(engine.image_pages(s3_key))
+
+    def _plan(self, files, engine):
+        """
+        Split the sides into ones whose text is already known and ones to OCR.
+
+        Returns ({file_id: OCRResult}, {file_id: (text, pages or None)}, [files to OCR]).
+        """
+        results = {}
+        known = {}
+        pending = []
+        for user_file in files:
+            ocr_result, _ = OCRResult.objects.get_or_create(file=user_file, defaults={'status': 'pending'})
+            results[user_file.id] = ocr_result
+            if ocr_result.status == 'completed' and ocr_result.text_content:
+                known[user_file.id] = (ocr_result.text_content, None)
+                continue
+            entry = ocr_cache.lookup(user_file.file_hash, engine.version)
+            if entry is not None:
+                known[user_file.id] = (entry.text_content, [tuple(page) for page in entry.pages])
+            else:
+                pending.append(user_file)
+        return results, known, pending
+
+    def _fan_out(self, engine, pending):
+        """OCR the pending sides concurrently: ({file_id: pages}, {file_id: error})"""
+        keys = {user_file.id: self.service._normalize_s3_key(user_file) for user_file in pending}
+        pages = {}
+        errors = {}
+        if not pending:
+            return pages, errors
+
+        workers = max(1, min(self.workers or 1, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='document-ocr') as executor:
+            futures = {
+                user_file.id: executor.submit(self._recognise, engine, user_file, keys[user_file.id])
+                for user_file in pending
+            }
+            for file_id, future in futures.items():
+                try:
+                    pages[file_id] = future.result()
+                except Exception as e:
+                    errors[file_id] = str(e)
+        return pages, errors
+
+    def _suggest_category(self, files, text_content):
+        """One analysis of the merged text; None when no side is up for automatic categorization"""
+        wants_category = any(
+            user_file.pending_auto_categorization
+            or (user_file.category and user_file.category.name == 'Miscellaneous')
+            for user_file in files
+        )
+        if not wants_category or len(text_content.strip()) <= 10:
+            return None
+        return self.service.categorization_service.analyze_file_content(text_content)
+
+    def process(self, files, ocr_pref=None):
+        """OCR and categorize a document's files together and return the OCR result dict, or None"""
+        files = list(files)
+        if ocr_pref is None:
+            ocr_pref, _ = OCRPreference.objects.get_or_create(user=files[0].user)
+        engine = self.service.get_engine(ocr_pref, pdf=any(self._extension(user_file) == 'pdf' for user_file in files))
+        if not self.supports(files, engine):
+            return None
+
+        print(f"[Document OCR] Files {[user_file.id for user_file in files]} with {engine.name}")
+        results, known, pending = self._plan(files, engine)
+        pages, errors = self._fan_out(engine, pending)
+
+        # Sides that did come back are cached now, so a retry only redoes the failed ones
+        for user_file in pending:
+            if user_file.id in pages:
+                side_pages = pages[user_file.id]
+                text_content = '\n'.join(page[1] for page in side_pages).strip()
+                known[user_file.id] = (text_content, side_pages)
+                ocr_cache.store(user_file.file_hash, engine.version, text_content, side_pages)
+
+        if errors:
+            error = '; '.join(f"file {file_id}: {message}" for file_id, message in errors.items())
+            print(f"[Document OCR] Error: {error}")
+            for user_file in files:
+                if user_file.id in errors:
+                    self.service._handle_error(user_file, errors[user_file.id])
+            return {'status': 'error', 'error': error}
+
+        # Fan in: one merged text, one categorization, one transaction
+        merged = '\n\n'.join(known[user_file.id][0] for user_file in files if known[user_file.id][0])
+        analysis = self._suggest_category(files, merged)
+        category = None
+        if analysis and analysis['confidence'] >= CONFIDENCE_THRESHOLD:
+            category, _ = FileCategory.objects.get_or_create(name=analysis['category'], defaults={'is_default': True})
+
+        changed = []
+        with transaction.atomic():
+            for user_file in files:
+                text_content, side_pages = known[user_file.id]
+                ocr_result = results[user_file.id]
+                if side_pages is not None:
+                    store_pages(ocr_result, side_pages)
+                if side_pages is not None or ocr_result.status != 'completed':
+                    ocr_result.text_content = text_content
+                    ocr_result.status = 'completed'
+                    ocr_result.save()
+
+                may_change = user_file.pending_auto_categorization or user_file.category is None \
+                    or user_file.category.name == 'Miscellaneous'
+                if category is not None and may_change and user_file.category_id != category.id:
+                    user_file.category = category
+                    changed.append(user_file)
+                elif user_file.category is None:
+                    user_file.category, _ = FileCategory.objects.get_or_create(
+                        name='Miscellaneous', defaults={'is_default': True}
+                    )
+                user_file.pending_auto_categorization = False
+            UserFile.objects.bulk_update(files, ['category', 'pending_auto_categorization'])
+
+        if changed:
+            self._notify(files[0], category)
+
+        print(f"[Document OCR] Completed {len(files)} files, {len(pending)} OCR'd, category {files[0].category.name}")
+        return {
+            'status': 'completed',
+            'files': [user_file.id for user_file in files],
+            'ocr_calls': len(pending),
+            'text_length': len(merged),
+            'category': files[0].category.name if files[0].category else 'Miscellaneous',
+            'category_changed': bool(changed),
+        }
+
+    def _notify(self, user_file, category):
+        """One email per document rather than one per side"""
+        try:
+            from django.core.mail import send_mail
+            send_mail(
+                'File Auto-Categorized',
+                f'Your document "{user_file.document_type_name or user_file.original_filename}" has been automatically categorized as "{category.name}" based on its content.',
+                settings.DEFAULT_FROM_EMAIL,
+                [user_file.user.email],
+                fail_silently=True,
+            )
+        except Exception as e:
+            print(f"[Document OCR] Email notification failed: {str(e)}")
@@ -0,0 +1,372 @@
+import codecs
+import csv
+import re
+import tempfile
+import threading
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.conf import settings
+
+# text: the extracted text; truncated: a byte or text budget cut it short;
+# bytes_read: input bytes consumed (decompressed bytes for zip members)
+Extraction = namedtuple('Extraction', ['text', 'truncated', 'bytes_read'])
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+A_NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+S_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Budget:
+    """
+    Input and output limits of one extraction.
+
+    Readers wrapped by reader() report end-of-file once max_input_bytes
+    have been read, so a huge object (or a zip bomb) is cut off instead of
+    read to the end; accept() refuses text beyond max_text_chars.
+    """
+
+    def __init__(self, max_input_bytes=None, max_text_chars=None):
+        self.max_input_bytes = max_input_bytes or _setting('EXTRACT_MAX_INPUT_BYTES', 50 * 1024 * 1024)
+        self.max_text_chars = max_text_chars or _setting('EXTRACT_MAX_TEXT_CHARS', 2 * 1024 * 1024)
+        self.bytes_read = 0
+        self.text_chars = 0
+        self.truncated = False
+
+    def reader(self, stream):
+        return _BudgetedReader(stream, self)
+
+    def accept(self, piece):
+        """The part of `piece` that still fits, or None once the text budget is spent"""
+        room = self.max_text_chars - self.text_chars
+        if room <= 0:
+            self.truncated = True
+            return None
+        if len(piece) > room:
+            piece = piece[:room]
+            self.truncated = True
+        self.text_chars += len(piece)
+        return piece
+
+
+class _BudgetedReader:
+    def __init__(self, stream, budget):
+        self.stream = stream
+        self.budget = budget
+
+    def read(self, size=-1):
+        budget = self.budget
+        room = budget.max_input_bytes - budget.bytes_read
+        if room <= 0:
+            budget.truncated = True
+            return b''
+        if size is None or size < 0 or size > room:
+            size = room
+        data = self.stream.read(size)
+        budget.bytes_read += len(data)
+        return data
+
+
+def _chunks(stream, chunk_size=None):
+    chunk_size = chunk_size or _setting('EXTRACT_CHUNK_SIZE', 64 * 1024)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _lines(stream):
+    """Decoded lines, line ends kept; a line that isn't UTF-8 is read as latin-1 as before"""
+    pending = b''
+    for chunk in _chunks(stream):
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield _decode(line + b'\n')
+    if pending:
+        yield _decode(pending)
+
+
+def _decode(data):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+# Handlers: generators of text pieces read from a binary stream
+
+def text_handler(stream, budget):
+    """txt/md: line by line"""
+    yield from _lines(budget.reader(stream))
+
+
+def csv_handler(stream, budget):
+    """csv: one line per row, cells separated by tabs (quoted newlines are kept inside a row)"""
+    for row in csv.reader(_lines(budget.reader(stream))):
+        yield '\t'.join(cell.strip() for cell in row) + '\n'
+
+
+class _HTMLText(HTMLParser):
+    SKIP = {'script', 'style', 'noscript', 'template', 'head'}
+    BLOCKS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article', 'table'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.pieces = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skipping += 1
+        elif tag in self.BLOCKS:
+            self.pieces.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self.BLOCKS:
+            self.pieces.append('\n')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.pieces.append(data)
+
+
+def html_handler(stream, budget):
+    """html: fed to the parser chunk by chunk, script and style dropped"""
+    parser = _HTMLText()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in _chunks(budget.reader(stream)):
+        parser.feed(decoder.decode(chunk))
+        yield from parser.pieces
+        parser.pieces = []
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    yield from parser.pieces
+
+
+def _archive_too_large(budget):
+    return ExtractionError(
+        f"Office file is larger than the {budget.max_input_bytes} byte input budget (a zip can't be read in part)"
+    )
+
+
+def _spool(stream, budget):
+    """
+    Copy a stream to a seekable file: in memory up to EXTRACT_SPOOL_MEMORY
+    bytes, on disk beyond, and never more than the input budget.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=_setting('EXTRACT_SPOOL_MEMORY', 8 * 1024 * 1024))
+    copied = 0
+    for chunk in _chunks(stream):
+        copied += len(chunk)
+        if copied > budget.max_input_bytes:
+            spooled.close()
+            raise _archive_too_large(budget)
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+
+def _numbered_members(archive, pattern):
+    """Members matching pattern, ordered by the number in their name (slide2 before slide10)"""
+    members = []
+    for name in archive.namelist():
+        match = re.fullmatch(pattern, name)
+        if match:
+            members.append((int(match.group(1)), name))
+    return [name for _, name in sorted(members)]
+
+
+def _iterparse(member, budget):
+    """iterparse end events of a zip member; a member cut off by the input budget just ends early"""
+    try:
+        yield from iterparse(budget.reader(member), events=('end',))
+    except ParseError:
+        if not budget.truncated:
+            raise
+
+
+def _xml_text(member, budget, text_tag, break_tag):
+    """Stream the text of text_tag elements, a newline after each break_tag; parsed elements are freed"""
+    for event, element in _iterparse(member, budget):
+        if element.tag == text_tag:
+            if element.text:
+                yield element.text
+        elif element.tag == break_tag:
+            yield '\n'
+            element.clear()
+
+
+def _open_archive(stream, budget):
+    try:
+        return zipfile.ZipFile(_spool(stream, budget))
+    except zipfile.BadZipFile as e:
+        raise ExtractionError(f"Not a valid Office file: {str(e)}")
+
+
+def docx_handler(stream, budget):
+    """docx: word/document.xml streamed paragraph by paragraph"""
+    with _open_archive(stream, budget) as archive:
+        with archive.open('word/document.xml') as member:
+            yield from _xml_text(member, budget, f"{W_NS}t", f"{W_NS}p")
+
+
+def pptx_handler(stream, budget):
+    """pptx: one slide member at a time, in slide order"""
+    with _open_archive(stream, budget) as archive:
+        for name in _numbered_members(archive, r'ppt/slides/slide(\d+)\.xml'):
+            with archive.open(name) as member:
+                yield from _xml_text(member, budget, f"{A_NS}t", f"{A_NS}p")
+            yield '\n'
+
+
+def _shared_strings(archive, budget):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as member:
+        parts = []
+        for event, element in _iterparse(member, budget):
+            if element.tag == f"{S_NS}t":
+                parts.append(element.text or '')
+            elif element.tag == f"{S_NS}si":
+                strings.append(''.join(parts))
+                parts = []
+                element.clear()
+    return strings
+
+
+def xlsx_handler(stream, budget):
+    """xlsx: one worksheet member at a time, one line per row, cells separated by tabs"""
+    with _open_archive(stream, budget) as archive:
+        strings = _shared_strings(archive, budget)
+        for name in _numbered_members(archive, r'xl/worksheets/sheet(\d+)\.xml'):
+            with archive.open(name) as member:
+                row = []
+                for event, element in _iterparse(member, budget):
+                    if element.tag == f"{S_NS}c":
+                        cell_type = element.get('t')
+                        if cell_type == 'inlineStr':
+                            value = ''.join(element.itertext())
+                        else:
+                            value = element.findtext(f"{S_NS}v") or ''
+                            if cell_type == 's' and value.isdigit() and int(value) < len(strings):
+                                value = strings[int(value)]
+                        if value:
+                            row.append(value)
+                        element.clear()
+                    elif element.tag == f"{S_NS}row":
+                        if row:
+                            yield '\t'.join(row) + '\n'
+                        row = []
+                        element.clear()
+            yield '\n'
+
+
+HANDLERS = {
+    'txt': text_handler,
+    'md': text_handler,
+    'csv': csv_handler,
+    'html': html_handler,
+    'htm': html_handler,
+    'docx': docx_handler,
+    'xlsx': xlsx_handler,
+    'pptx': pptx_handler,
+}
+
+EXTRACTABLE_EXTENSIONS = tuple(HANDLERS)
+
+# Zip based: the whole file is needed before anything can be read
+ARCHIVE_EXTENSIONS = ('docx', 'xlsx', 'pptx')
+
+
+def extract_stream(stream, file_extension, budget=None):
+    """Extract text from a binary stream with the handler for its extension"""
+    handler = HANDLERS.get(file_extension)
+    if handler is None:
+        raise ExtractionError(f"No text extractor for .{file_extension} files")
+    budget = budget or Budget()
+    pieces = []
+    generator = handler(stream, budget)
+    try:
+        for piece in generator:
+            piece = budget.accept(piece)
+            if piece is None:
+                break
+            pieces.append(piece)
+    finally:
+        generator.close()
+    return Extraction(re.sub(r'\n{3,}', '\n\n', ''.join(pieces)).strip(), budget.truncated, budget.bytes_read)
+
+
+def extract_s3_object(s3_key, file_extension, s3_client=None):
+    """
+    Extract text from an S3 object, reading its body as a stream. Office
+    files over the input budget are refused by ContentLength, before any
+    of the body is downloaded.
+    """
+    from storage_management.clients import get_s3_client
+
+    s3_client = s3_client or get_s3_client()
+    response = s3_client.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=s3_key)
+    body = response['Body']
+    budget = Budget()
+    try:
+        size = response.get('ContentLength')
+        if file_extension in ARCHIVE_EXTENSIONS and size is not None and size > budget.max_input_bytes:
+            raise _archive_too_large(budget)
+        return extract_stream(body, file_extension, budget)
+    finally:
+        body.close()
+
+
+# Worker pool
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    workers = _setting('EXTRACT_WORKERS', 2)
+    if not workers:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def extract_text(s3_key, file_extension, s3_client=None):
+    """
+    Extract an S3 object's text in the extractor pool (EXTRACT_WORKERS
+    processes, 0 = in the calling process), waiting up to EXTRACT_TIMEOUT.
+
+    Parsing is CPU bound, so it runs outside the web/OCR worker's
+    interpreter; a pool that can't be used (e.g. inside a daemonic Celery
+    worker process) falls back to extracting here.
+    """
+    pool = _get_pool()
+    if pool is None:
+        return extract_s3_object(s3_key, file_extension, s3_client)
+    try:
+        future = pool.submit(extract_s3_object, s3_key, file_extension)
+    except Exception as e:
+        print(f"[Extractors] Pool unavailable ({str(e)}), extracting in process")
+        return extract_s3_object(s3_key, file_extension, s3_client)
+    return future.result(timeout=_setting('EXTRACT_TIMEOUT', 120))
@@ -0,0 +1,88 @@
+from datetime import date
+
+from django.db.models import Count, Q, Sum
+
+from .models import AppSubscription, CardDetails
+
+# Flag counts computed alongside the category counts
+FILE_FLAGS = {
+    'favorites': Q(is_favorite=True),
+    'hidden': Q(is_hidden=True),
+    'locked': Q(locked=True),
+}
+
+
+def file_facets(files):
+    """
+    Category and flag counts of a UserFile queryset in one grouped query.
+
+    Returns {'categories': {category_id: {'name', 'count', 'size', <flag>: n}},
+    'counts': {'total', 'favorites', 'hidden', 'locked'}, 'total_size'}.
+    Files without a category are grouped under the key None.
+    """
+    rows = (
+        files.order_by()
+        .values('category_id', 'category__name')
+        .annotate(
+            count=Count('id'),
+            size=Sum('file_size'),
+            **{name: Count('id', filter=condition) for name, condition in FILE_FLAGS.items()}
+        )
+    )
+
+    facets = {
+        'categories': {},
+        'counts': dict.fromkeys(['total', *FILE_FLAGS], 0),
+        'total_size': 0,
+    }
+    for row in rows:
+        size = row['size'] or 0
+        facets['categories'][row['category_id']] = {
+            'name': row['category__name'],
+            'count': row['count'],
+            'size': size,
+            **{name: row[name] for name in FILE_FLAGS},
+        }
+        facets['counts']['total'] += row['count']
+        for name in FILE_FLAGS:
+            facets['counts'][name] += row[name]
+        facets['total_size'] += size
+    return facets
+
+
+def category_counts(facets, categories):
+    """[{'id', 'name', 'count'}] for every category, including the ones with no files"""
+    return [
+        {
+            'id': category.id,
+            'name': category.name,
+            'count': facets['categories'].get(category.id, {}).get('count', 0),
+        }
+        for category in categories
+    ]
+
+
+def active_card_filter(today=None):
+    today = today or date.today()
+    return Q(expiry_year__gt=today.year) | (Q(expiry_year=today.year) & Q(expiry_month__gte=today.month))
+
+
+def active_subscription_filter(today=None):
+    today = today or date.today()
+    return Q(end_date__gte=today) | Q(auto_renewal=True)
+
+
+def _active_counts(queryset, active):
+    counts = queryset.aggregate(total_count=Count('id'), count=Count('id', filter=active))
+    counts['expired_count'] = counts['total_count'] - counts['count']
+    return counts
+
+
+def card_facets(user, today=None):
+    """{'count' (active), 'total_count', 'expired_count'} of the user's cards in one query"""
+    return _active_counts(CardDetails.objects.filter(user=user), active_card_filter(today))
+
+
+def subscription_facets(user, today=None):
+    """{'count' (active), 'total_count', 'expired_count'} of the user's subscriptions in one query"""
+    return _active_counts(AppSubscription.objects.filter(user=user), active_subscription_filter(today))
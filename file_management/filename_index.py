@@ -0,0 +1,256 @@
+import math
+import re
+import threading
+import uuid
+from collections import Counter, OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import FilenameIndexVersion, UserFile
+
+# file_id: the UserFile id; score: higher is better, above 1 for an exact name match
+FilenameMatch = namedtuple('FilenameMatch', ['file_id', 'filename', 'score'])
+
+_Entry = namedtuple('_Entry', ['filename', 'compact', 'words', 'grams', 'uploaded'])
+
+# "CGProjectPlanes" -> "CG Project Planes", "report2023" -> "report 2023"
+_CAMEL = re.compile(r'(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])|(?<=[A-Za-z])(?=[0-9])|(?<=[0-9])(?=[A-Za-z])')
+_SEPARATORS = re.compile(r'[\W_]+', re.UNICODE)
+
+# Dropped from the end of a query ("open invoice pdf"); file names lose their real extension instead
+EXTENSIONS = {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'csv', 'md', 'jpg', 'jpeg', 'png', 'html'}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def split_words(name, strip_extension=False):
+    """Lowercase words of a file name or query, split at separators, camelCase and letter/digit boundaries"""
+    if strip_extension:
+        stem, dot, extension = name.rpartition('.')
+        if dot and stem and extension.isalnum() and len(extension) <= 5:
+            name = stem
+    return [word for word in _SEPARATORS.split(_CAMEL.sub(' ', name).lower()) if word]
+
+
+def trigrams(words):
+    """
+    Padded trigrams of each word, plus the trigrams of the words run
+    together so "my document" still meets "mydocument.pdf".
+    """
+    grams = set()
+    for word in words:
+        padded = f"  {word} "
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    compact = ''.join(words)
+    grams.update(compact[index:index + 3] for index in range(len(compact) - 2))
+    return grams
+
+
+def query_words(query):
+    words = split_words(query.strip(), strip_extension=True)
+    if len(words) > 1 and words[-1] in EXTENSIONS:
+        words = words[:-1]
+    return words
+
+
+class FilenameIndex:
+    """
+    Trigram index over one user's file names.
+
+    search() counts shared trigrams through the postings of the query's
+    trigrams only, and only for files in the rarest postings that any file
+    above the score threshold must appear in, so its cost follows the
+    number of files sharing uncommon trigrams, not the library size. Scores are the trigram Jaccard similarity plus
+    bonuses that keep the resolver's old priorities: exact name, then name
+    prefix, then containment, then matching words.
+    """
+
+    def __init__(self, rows=()):
+        self.entries = {}
+        self.postings = {}
+        self.lock = threading.Lock()
+        for file_id, filename, uploaded in rows:
+            self._add(file_id, filename, uploaded)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _add(self, file_id, filename, uploaded):
+        words = split_words(filename or '', strip_extension=True)
+        grams = trigrams(words)
+        self.entries[file_id] = _Entry(filename or '', ''.join(words), set(words), len(grams), uploaded)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(file_id)
+
+    def _remove(self, file_id):
+        entry = self.entries.pop(file_id, None)
+        if entry is None:
+            return
+        for gram in trigrams(split_words(entry.filename, strip_extension=True)):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(file_id)
+                if not posting:
+                    del self.postings[gram]
+
+    def update(self, file_id, filename, uploaded):
+        with self.lock:
+            self._remove(file_id)
+            self._add(file_id, filename, uploaded)
+
+    def remove(self, file_id):
+        with self.lock:
+            self._remove(file_id)
+
+    def _score(self, entry, shared, query_size, compact, words):
+        score = shared / (query_size + entry.grams - shared)
+        if compact == entry.compact:
+            score += 1.0
+        elif entry.compact.startswith(compact):
+            score += 0.5
+        elif compact in entry.compact:
+            score += 0.3
+        found = len(words & entry.words)
+        if found < len(words):
+            found += sum(1 for word in words - entry.words if any(name.startswith(word) for name in entry.words))
+        return score + 0.2 * found / len(words)
+
+    def search(self, query, limit=5, min_score=None):
+        """The best `limit` FilenameMatches for a query, best first; newer files win ties"""
+        min_score = _setting('FILENAME_MATCH_MIN_SCORE', 0.25) if min_score is None else min_score
+        words = query_words(query)
+        grams = trigrams(words)
+        if not grams:
+            return []
+        compact = ''.join(words)
+        words = set(words)
+
+        # A file scoring min_score shares at least `needed` of the query's trigrams: on overlap alone
+        # that takes min_score / (1 + min_score) of them, with a bonus half of them. A name containing
+        # the query may share only the trigrams of the query run together, so never ask for more
+        needed = math.ceil(len(grams) * min(0.5, min_score / (1 + min_score)))
+        needed = max(1, min(needed, len(compact) - 2))
+
+        with self.lock:
+            postings = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+            # Prefix filter: such a file is in at least one of the rarest len - needed + 1 postings
+            split = len(postings) - needed + 1
+            shared = Counter()
+            for posting in postings[:split]:
+                shared.update(posting)
+            candidates = set(shared)
+            for posting in postings[split:]:
+                shared.update(candidates & posting if len(candidates) < len(posting) else posting)
+
+            scored = []
+            for file_id, count in shared.items():
+                if count < needed or file_id not in candidates:
+                    continue
+                entry = self.entries[file_id]
+                score = self._score(entry, count, len(grams), compact, words)
+                if score >= min_score:
+                    scored.append((score, entry.uploaded, file_id))
+
+        scored.sort(reverse=True)
+        return [
+            FilenameMatch(file_id, self.entries[file_id].filename, round(score, 4))
+            for score, _, file_id in scored[:limit]
+        ]
+
+
+# Per-process indexes, least recently used first: user_id -> (version, FilenameIndex);
+# the version is the user's FilenameIndexVersion token when the index was built
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _current_version(user_id):
+    """The user's version token from the database, shared by every process"""
+    version = FilenameIndexVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first()
+    if version is None:
+        version = FilenameIndexVersion.objects.get_or_create(user_id=user_id, defaults={'version': uuid.uuid4().hex})[0].version
+    return version
+
+
+def _build(user_id):
+    rows = (
+        (file_id, filename, uploaded.timestamp() if uploaded else 0)
+        for file_id, filename, uploaded in UserFile.objects.filter(user_id=user_id)
+        .values_list('id', 'original_filename', 'upload_date').iterator(chunk_size=2000)
+    )
+    return FilenameIndex(rows)
+
+
+def get_index(user_id):
+    """This process's index of a user's file names, rebuilt from the database when the version moved"""
+    version = _current_version(user_id)
+    with _indexes_lock:
+        cached = _indexes.get(user_id)
+        if cached is not None and cached[0] == version:
+            _indexes.move_to_end(user_id)
+            return cached[1]
+
+    index = _build(user_id)
+    with _indexes_lock:
+        _indexes[user_id] = (version, index)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > _setting('FILENAME_INDEX_USERS', 256):
+            _indexes.popitem(last=False)
+    return index
+
+
+def _changed(user_id, apply):
+    """
+    After the change commits, replace the user's version token so every
+    process rebuilds; this process applies the change to its own index in
+    place if that index was current. A rolled back change touches nothing.
+    """
+    def committed():
+        old = FilenameIndexVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first()
+        version = uuid.uuid4().hex
+        swapped = old is not None and FilenameIndexVersion.objects.filter(
+            user_id=user_id, version=old
+        ).update(version=version) == 1
+        if old is None:
+            FilenameIndexVersion.objects.update_or_create(user_id=user_id, defaults={'version': version})
+        with _indexes_lock:
+            cached = _indexes.pop(user_id, None)
+            if swapped and cached is not None and cached[0] == old:
+                apply(cached[1])
+                _indexes[user_id] = (version, cached[1])
+
+    transaction.on_commit(committed)
+
+
+def file_saved(user_file):
+    """Index a new or renamed file"""
+    uploaded = user_file.upload_date.timestamp() if user_file.upload_date else 0
+    _changed(user_file.user_id, lambda index: index.update(user_file.id, user_file.original_filename, uploaded))
+
+
+def file_deleted(user_file):
+    _changed(user_file.user_id, lambda index: index.remove(user_file.id))
+
+
+def resolve_filename(user, query, limit=5, min_score=None):
+    """Top FilenameMatches of the user's files for a spoken or typed file name"""
+    if not query or not str(query).strip():
+        return []
+    return get_index(user.pk).search(str(query), limit=limit, min_score=min_score)
+
+
+def resolve_file(user, query, queryset=None):
+    """The best matching UserFile for a file name, or None (skipping files deleted since they were indexed)"""
+    matches = resolve_filename(user, query)
+    if not matches:
+        return None
+    files = (queryset if queryset is not None else UserFile.objects.filter(user=user)).in_bulk(
+        [match.file_id for match in matches]
+    )
+    for match in matches:
+        if match.file_id in files:
+            return files[match.file_id]
+    return None
@@ -0,0 +1,182 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+
+from storage_management.clients import get_s3_client
+from .models import S3KeyIndex, UserFile
+
+
+class S3KeyNotFound(Exception):
+    pass
+
+
+def candidate_keys(user_file):
+    """Key variants a UserFile has historically been stored under, most likely first"""
+    keys = [user_file.s3_key, user_file.file.name if user_file.file else None]
+    if user_file.original_filename:
+        keys.extend([
+            f"uploads/{user_file.original_filename}",
+            f"user_{user_file.user_id}/{user_file.original_filename}",
+            user_file.original_filename,
+        ])
+    return list(dict.fromkeys(key for key in keys if key))
+
+
+def get_indexed_key(user_file):
+    """
+    The indexed key if it is still current, else None.
+
+    An entry only counts while it matches the row's canonical key: anything
+    that repoints s3_key (moves, expiry) invalidates it without a signal.
+    """
+    try:
+        entry = user_file.key_index
+    except S3KeyIndex.DoesNotExist:
+        return None
+    if entry.s3_key != user_file.storage_key:
+        return None
+    return entry.s3_key
+
+
+def probe_keys(keys, s3_client=None):
+    """HEAD every key in parallel. Returns {key: head_response} for the ones that exist"""
+    s3_client = s3_client or get_s3_client()
+
+    def head(key):
+        try:
+            return key, s3_client.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+        except Exception:
+            return key, None
+
+    if not keys:
+        return {}
+    if len(keys) == 1:
+        results = [head(keys[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(keys), 8)) as executor:
+            results = list(executor.map(head, keys))
+    return {key: response for key, response in results if response is not None}
+
+
+def record_key(user_file, s3_key, etag='', size=None):
+    """Store a verified key and point the row at it"""
+    if user_file.s3_key != s3_key:
+        # update() rather than save(): no ledger/OCR signals for a key fix
+        UserFile.objects.filter(pk=user_file.pk).update(s3_key=s3_key)
+        user_file.s3_key = s3_key
+
+    entry, _ = S3KeyIndex.objects.update_or_create(
+        file_id=user_file.pk,
+        defaults={
+            's3_key': s3_key,
+            'etag': (etag or '').strip('"'),
+            'size': size,
+            'verified_at': timezone.now(),
+        }
+    )
+    user_file.key_index = entry
+    return entry
+
+
+def resolve_s3_key(user_file, s3_client=None):
+    """
+    Canonical S3 key of a UserFile.
+
+    Trusts S3KeyIndex; on a miss, probes all candidate keys concurrently
+    (one round trip instead of up to five serial ones) and indexes the
+    winner, preferring candidates in candidate_keys() order.
+    """
+    indexed = get_indexed_key(user_file)
+    if indexed:
+        return indexed
+
+    keys = candidate_keys(user_file)
+    found = probe_keys(keys, s3_client)
+    for key in keys:
+        if key in found:
+            print(f"[Key Index] File {user_file.id}: resolved S3 key {key} by probing")
+            record_key(user_file, key, found[key].get('ETag'), found[key].get('ContentLength'))
+            return key
+
+    raise S3KeyNotFound(f"S3 object not found with any key variation for file {user_file.id}")
+
+
+def list_user_objects(user_id, s3_client=None):
+    """{key: (etag, size)} for every object under the user's prefix, via ListObjectsV2"""
+    s3_client = s3_client or get_s3_client()
+    objects = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Prefix=f"user_{user_id}/"):
+        for obj in page.get('Contents', []):
+            objects[obj['Key']] = (obj.get('ETag', '').strip('"'), obj['Size'])
+    return objects
+
+
+def index_user_files(user_id, files=None, s3_client=None, probe=True):
+    """
+    Index the S3 keys of one user's files.
+
+    Candidates under the user's prefix are matched against one prefix
+    listing (1 request per 1,000 objects); only files with no match there
+    fall back to parallel HEAD probes of their other candidates.
+
+    Returns:
+        dict: {'indexed', 'probed', 'missing': [file ids], 'keys_fixed'}
+    """
+    s3_client = s3_client or get_s3_client()
+    if files is None:
+        files = UserFile.objects.filter(user_id=user_id)
+    files = list(files)
+
+    listing = list_user_objects(user_id, s3_client)
+    now = timezone.now()
+    entries, fixed_files, unmatched = [], [], []
+
+    for user_file in files:
+        match = next((key for key in candidate_keys(user_file) if key in listing), None)
+        if match:
+            etag, size = listing[match]
+            entries.append(S3KeyIndex(file_id=user_file.pk, s3_key=match, etag=etag, size=size, verified_at=now))
+            if user_file.s3_key != match:
+                user_file.s3_key = match
+                fixed_files.append(user_file)
+        else:
+            unmatched.append(user_file)
+
+    missing = []
+    if probe:
+        for user_file in unmatched:
+            keys = [key for key in candidate_keys(user_file) if not key.startswith(f"user_{user_id}/")]
+            found = probe_keys(keys, s3_client) if keys else {}
+            match = next((key for key in keys if key in found), None)
+            if match:
+                head = found[match]
+                entries.append(S3KeyIndex(
+                    file_id=user_file.pk, s3_key=match,
+                    etag=head.get('ETag', '').strip('"'), size=head.get('ContentLength'), verified_at=now
+                ))
+                if user_file.s3_key != match:
+                    user_file.s3_key = match
+                    fixed_files.append(user_file)
+            else:
+                missing.append(user_file.pk)
+    else:
+        missing = [user_file.pk for user_file in unmatched]
+
+    S3KeyIndex.objects.bulk_create(
+        entries,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['file'],
+        update_fields=['s3_key', 'etag', 'size', 'verified_at']
+    )
+    if fixed_files:
+        UserFile.objects.bulk_update(fixed_files, ['s3_key'], batch_size=500)
+
+    return {
+        'indexed': len(entries),
+        'probed': len(unmatched) if probe else 0,
+        'missing': missing,
+        'keys_fixed': len(fixed_files),
+    }
@@ -0,0 +1,108 @@
+from collections import deque, namedtuple
+
+# count: non-overlapping occurrences, as str.count reports them
+# exact_match: some occurrence is delimited by spaces or the text edges,
+#     i.e. f" {keyword} " in f" {text} "
+# in_first_part: some occurrence ends within the first `first_part` characters
+KeywordHit = namedtuple('KeywordHit', ['count', 'exact_match', 'in_first_part'])
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a fixed keyword set.
+
+    scan() finds every occurrence of every keyword in one left-to-right
+    pass over the text instead of one str.count (plus an f-string
+    containment check) per keyword. The automaton is compiled to a DFA up
+    front, so each character costs a single dict lookup.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keyword.lower() for keyword in keywords if keyword))
+        self._lengths = [len(keyword) for keyword in self.keywords]
+        self._build()
+
+    def _build(self):
+        goto = [{}]
+        outputs = [[]]
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for char in keyword:
+                if char not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            outputs[state].append(index)
+
+        # Breadth-first: a state's failure target is always shallower, so its
+        # transitions and outputs are final by the time they are copied
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        pending = deque(goto[0].values())
+        while pending:
+            state = pending.popleft()
+            transitions = dict(delta[fail[state]])
+            for char, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(char, 0)
+                transitions[char] = child
+                pending.append(child)
+            delta[state] = transitions
+            outputs[state] = outputs[state] + outputs[fail[state]]
+
+        self._delta = delta
+        self._outputs = [tuple(output) for output in outputs]
+
+    def scan(self, text, first_part=500):
+        """
+        Return {keyword: KeywordHit} for the keywords found in `text`.
+
+        `text` must already be lowercased, as the keywords are.
+        """
+        delta = self._delta
+        outputs = self._outputs
+        lengths = self._lengths
+        text_length = len(text)
+        # keyword index -> [count, next allowed start, exact_match, in_first_part]
+        found = {}
+
+        state = 0
+        for end, char in enumerate(text):
+            state = delta[state].get(char, 0)
+            if not outputs[state]:
+                continue
+            for index in outputs[state]:
+                start = end - lengths[index] + 1
+                hit = found.get(index)
+                if hit is None:
+                    hit = found[index] = [0, 0, False, False]
+                if start >= hit[1]:
+                    hit[0] += 1
+                    hit[1] = end + 1
+                if not hit[2] and (start == 0 or text[start - 1] == ' ') \
+                        and (end + 1 == text_length or text[end + 1] == ' '):
+                    hit[2] = True
+                if end < first_part:
+                    hit[3] = True
+
+        keywords = self.keywords
+        return {
+            keywords[index]: KeywordHit(count, exact_match, in_first_part)
+            for index, (count, _, exact_match, in_first_part) in found.items()
+        }
+
+
+def scan_with_str_count(keywords, text, first_part=500):
+    """
+    The per-keyword scans KeywordMatcher replaces, with the same result.
+
+    Kept as the reference for parity tests and benchmark_categorization.
+    """
+    padded = f" {text} "
+    head = text[:first_part]
+    found = {}
+    for keyword in dict.fromkeys(keyword.lower() for keyword in keywords if keyword):
+        count = text.count(keyword)
+        if count:
+            found[keyword] = KeywordHit(count, f" {keyword} " in padded, keyword in head)
+    return found
@@ -0,0 +1,286 @@
+import json
+import os
+import re
+import threading
+import zlib
+from collections import Counter, namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Compressed sparse rows: row i holds indices/data[indptr[i]:indptr[i + 1]]
+SparseRows = namedtuple('SparseRows', ['indptr', 'indices', 'data'])
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class HashingVectorizer:
+    """
+    Token uni/bigrams hashed into n_features buckets (CRC32), TF-IDF weighted.
+
+    No vocabulary to store or grow: the same text always maps to the same
+    columns, so the model file is just the weights plus the IDF vector.
+    """
+
+    def __init__(self, n_features=2 ** 18, ngrams=2):
+        self.n_features = n_features
+        self.ngrams = ngrams
+        self.idf = None
+        self._hashes = {}
+
+    def _bucket_lookup(self, terms):
+        """dict term -> bucket covering `terms`; only unseen terms are hashed"""
+        hashes = self._hashes
+        missing = set(terms).difference(hashes)
+        if missing:
+            if len(hashes) + len(missing) > 500000:
+                hashes.clear()
+                missing = terms.keys()
+            n_features = self.n_features
+            hashes.update((term, zlib.crc32(term.encode('utf-8')) % n_features) for term in missing)
+        return hashes
+
+    def _terms(self, text):
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        terms = Counter(tokens)
+        for n in range(2, self.ngrams + 1):
+            terms.update(map(' '.join, zip(*(tokens[offset:] for offset in range(n)))))
+        return terms
+
+    def counts(self, texts):
+        """Raw term counts of each text as SparseRows, merged in one numpy pass for the whole batch"""
+        buckets = []
+        term_counts = []
+        lengths = []
+        for text in texts:
+            terms = self._terms(text or '')
+            buckets.extend(map(self._bucket_lookup(terms).__getitem__, terms))
+            term_counts.extend(terms.values())
+            lengths.append(len(terms))
+
+        # (document, bucket) keys: distinct terms that share a bucket are summed
+        documents = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+        keys = documents * self.n_features + np.asarray(buckets, dtype=np.int64)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        data = np.bincount(inverse, weights=np.asarray(term_counts, dtype=np.float64), minlength=len(unique_keys))
+        indptr = np.searchsorted(unique_keys // self.n_features, np.arange(len(lengths) + 1), side='left')
+        return SparseRows(indptr.astype(np.int64), unique_keys % self.n_features, data.astype(np.float32))
+
+    def fit_idf(self, rows):
+        documents = len(rows.indptr) - 1
+        document_frequency = np.bincount(rows.indices, minlength=self.n_features)
+        self.idf = (np.log((1 + documents) / (1 + document_frequency)) + 1).astype(np.float32)
+
+    def transform(self, texts):
+        """Sublinear TF-IDF rows, each scaled to unit length"""
+        rows = self.counts(texts)
+        data = (1 + np.log(rows.data)) * self.idf[rows.indices]
+        row_ids = row_index(rows)
+        norms = np.sqrt(np.bincount(row_ids, weights=data * data, minlength=len(rows.indptr) - 1))
+        norms[norms == 0] = 1
+        return SparseRows(rows.indptr, rows.indices, (data / norms[row_ids]).astype(np.float32))
+
+
+def row_index(rows):
+    """Row number of every stored value"""
+    return np.repeat(np.arange(len(rows.indptr) - 1), np.diff(rows.indptr))
+
+
+def sparse_dot(rows, weights):
+    """rows @ weights for SparseRows and a dense (n_features, k) matrix"""
+    row_ids = row_index(rows)
+    contributions = weights[rows.indices] * rows.data[:, None]
+    documents = len(rows.indptr) - 1
+    return np.column_stack([
+        np.bincount(row_ids, weights=contributions[:, column], minlength=documents)
+        for column in range(weights.shape[1])
+    ])
+
+
+def softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class LinearCategoryModel:
+    """
+    Multinomial logistic regression over hashed TF-IDF features.
+
+    predict() scores any number of documents with one sparse product, so a
+    backfill chunk is classified in a single vectorized call.
+    """
+
+    def __init__(self, vectorizer, classes, weights, bias, metadata=None):
+        self.vectorizer = vectorizer
+        self.classes = list(classes)
+        self.weights = weights
+        self.bias = bias
+        self.metadata = metadata or {}
+
+    @classmethod
+    def train(cls, texts, labels, n_features=2 ** 18, epochs=60, learning_rate=0.5, l2=1e-5):
+        """Fit on (text, category name) pairs with full-batch Adam"""
+        vectorizer = HashingVectorizer(n_features=n_features)
+        vectorizer.fit_idf(vectorizer.counts(texts))
+        rows = vectorizer.transform(texts)
+
+        classes = sorted(set(labels))
+        class_index = {name: index for index, name in enumerate(classes)}
+        targets = np.zeros((len(labels), len(classes)), dtype=np.float32)
+        targets[np.arange(len(labels)), [class_index[label] for label in labels]] = 1
+
+        weights = np.zeros((n_features, len(classes)), dtype=np.float32)
+        # The bias stays at the log class prior: Adam's normalised steps would
+        # otherwise keep pushing it around once the training loss is near zero
+        bias = np.log(targets.mean(axis=0)).astype(np.float32)
+        row_ids = row_index(rows)
+        first = np.zeros_like(weights)
+        second = np.zeros_like(weights)
+        beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+
+        for step in range(1, epochs + 1):
+            error = (softmax(sparse_dot(rows, weights) + bias) - targets) / len(labels)
+            gradient = np.column_stack([
+                np.bincount(rows.indices, weights=rows.data * error[row_ids, column], minlength=n_features)
+                for column in range(len(classes))
+            ]).astype(np.float32) + l2 * weights
+
+            first *= beta1
+            first += (1 - beta1) * gradient
+            second *= beta2
+            second += (1 - beta2) * gradient * gradient
+            step_size = learning_rate * np.sqrt(1 - beta2 ** step) / (1 - beta1 ** step)
+            weights -= step_size * first / (np.sqrt(second) + epsilon)
+
+        metadata = {
+            'trained_at': timezone.now().isoformat(),
+            'documents': len(labels),
+            'epochs': epochs,
+            'class_counts': {name: int(targets[:, index].sum()) for index, name in enumerate(classes)},
+        }
+        return cls(vectorizer, classes, weights, bias, metadata)
+
+    def predict_proba(self, texts):
+        rows = self.vectorizer.transform(texts)
+        return softmax(sparse_dot(rows, self.weights) + self.bias)
+
+    def predict(self, texts):
+        """[(category, probability)] for each text, in one vectorized pass"""
+        if not texts:
+            return []
+        probabilities = self.predict_proba(texts)
+        best = probabilities.argmax(axis=1)
+        return [(self.classes[index], float(probabilities[row, index])) for row, index in enumerate(best)]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        header = {
+            'classes': self.classes,
+            'n_features': self.vectorizer.n_features,
+            'ngrams': self.vectorizer.ngrams,
+            'metadata': self.metadata,
+        }
+        # Write then rename, so a worker never loads a half-written file
+        temp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            temp_path,
+            header=np.array(json.dumps(header)),
+            idf=self.vectorizer.idf,
+            weights=self.weights,
+            bias=self.bias,
+        )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as archive:
+            header = json.loads(str(archive['header']))
+            vectorizer = HashingVectorizer(n_features=header['n_features'], ngrams=header['ngrams'])
+            vectorizer.idf = archive['idf']
+            return cls(vectorizer, header['classes'], archive['weights'], archive['bias'], header['metadata'])
+
+
+# Lazily loaded shared model
+
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def learned_mode_enabled():
+    return _setting('CATEGORIZATION_MODE', 'keywords') == 'learned'
+
+
+def model_path():
+    return str(_setting('CATEGORIZER_MODEL_PATH', os.path.join(settings.BASE_DIR, 'models', 'categorizer.npz')))
+
+
+def get_model():
+    """
+    The trained model, loaded from CATEGORIZER_MODEL_PATH on first use, or None.
+
+    A missing or unreadable file is reported once and categorization stays
+    on the keyword scorer; reset_model() makes the next call look again.
+    """
+    global _model, _model_loaded
+    if _model_loaded:
+        return _model
+    with _model_lock:
+        if not _model_loaded:
+            path = model_path()
+            try:
+                _model = LinearCategoryModel.load(path)
+                print(f"[Categorizer] Loaded model {path} ({len(_model.classes)} categories)")
+            except FileNotFoundError:
+                print(f"[Categorizer] No trained model at {path}, using the keyword scorer")
+                _model = None
+            except Exception as e:
+                print(f"[Categorizer] Could not load model {path}: {str(e)}")
+                _model = None
+            _model_loaded = True
+    return _model
+
+
+def reset_model():
+    global _model, _model_loaded
+    with _model_lock:
+        _model = None
+        _model_loaded = False
+
+
+def warm_model(**kwargs):
+    """Load the model at worker startup instead of on the first document"""
+    if learned_mode_enabled():
+        get_model()
+
+
+def training_examples(min_length=20):
+    """
+    (texts, category names) from completed OCR of files in a real shared
+    category. The model is global, so categories a user created themselves
+    are left out: their names and documents must not reach other users.
+    """
+    from .models import OCRResult
+
+    rows = (
+        OCRResult.objects.filter(
+            status='completed', file__category__isnull=False, file__category__created_by__isnull=True,
+            text_content__isnull=False,
+        )
+        .exclude(file__category__name='Miscellaneous')
+        .values_list('text_content', 'file__category__name')
+        .iterator(chunk_size=1000)
+    )
+    texts = []
+    labels = []
+    for text_content, category in rows:
+        if len(text_content.strip()) >= min_length:
+            texts.append(text_content)
+            labels.append(category)
+    return texts, labels
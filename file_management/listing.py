@@ -0,0 +1,129 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .search_index import search_filter
+
+# Short names the mobile grid uses for serializer fields
+FIELD_ALIASES = {
+    'name': 'original_filename',
+    'type': 'file_type',
+    'thumbnail': 'thumbnail_url',
+    'url': 'file_url',
+    'size': 'file_size',
+}
+
+
+class ListingError(ValueError):
+    """A bad cursor, page size or fields parameter (reported as a 400)"""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def encode_cursor(user_file):
+    """Opaque cursor pointing just past user_file in (upload_date, id) order"""
+    payload = json.dumps([user_file.upload_date.isoformat(), user_file.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(upload_date, id) from a cursor made by encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        upload_date, file_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        upload_date = parse_datetime(upload_date)
+        if upload_date is None or not isinstance(file_id, int):
+            raise ValueError(cursor)
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        raise ListingError('Invalid cursor')
+    return upload_date, file_id
+
+
+def parse_fields(value, available):
+    """
+    Serializer field names for a `fields=` parameter, or None for all fields.
+
+    Accepts the serializer names and the FIELD_ALIASES short names; `id` is
+    always included, so every row can be told apart.
+    """
+    if not value:
+        return None
+    fields = ['id']
+    for name in value.split(','):
+        name = FIELD_ALIASES.get(name.strip(), name.strip())
+        if not name:
+            continue
+        if name not in available:
+            raise ListingError(f"Unknown field: {name}")
+        if name not in fields:
+            fields.append(name)
+    return fields
+
+
+def parse_limit(value):
+    default = _setting('FILE_LIST_PAGE_SIZE', 50)
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ListingError('limit must be an integer')
+    return max(1, min(limit, _setting('FILE_LIST_MAX_PAGE_SIZE', 200)))
+
+
+def keyset_page(queryset, cursor=None, limit=50, descending=True):
+    """
+    One page of a queryset in (upload_date, id) order, plus the cursor of the next page.
+
+    The cursor holds the last row's sort key, so the next page is a range
+    scan on the (user, upload_date, id) index starting right after it,
+    however deep the page: no OFFSET, and rows added or removed meanwhile
+    never shift the pages.
+    """
+    if descending:
+        queryset = queryset.order_by('-upload_date', '-id')
+    else:
+        queryset = queryset.order_by('upload_date', 'id')
+
+    if cursor:
+        upload_date, file_id = decode_cursor(cursor)
+        # (upload_date, id) < (d, i), spelled with a leading upload_date bound
+        # so the database can seek into the index instead of filtering it
+        if descending:
+            queryset = queryset.filter(upload_date__lte=upload_date).filter(
+                Q(upload_date__lt=upload_date) | Q(id__lt=file_id)
+            )
+        else:
+            queryset = queryset.filter(upload_date__gte=upload_date).filter(
+                Q(upload_date__gt=upload_date) | Q(id__gt=file_id)
+            )
+
+    rows = list(queryset[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]) if has_more else None
+
+
+def filter_files(files, params, user):
+    """The category, file_type, search, show_hidden and favorites_only filters of file_list_view"""
+    if params.get('show_hidden', 'false').lower() != 'true':
+        files = files.filter(is_hidden=False)
+    if params.get('favorites_only', 'false').lower() == 'true':
+        files = files.filter(is_favorite=True)
+
+    category = params.get('category')
+    if category and category != 'all':
+        files = files.filter(category__name=category)
+    if params.get('file_type'):
+        files = files.filter(file_type=params['file_type'])
+
+    search = params.get('search')
+    if search:
+        files = files.filter(search_filter(user, search))
+    return files
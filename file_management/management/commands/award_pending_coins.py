@@ -1,73 +1,101 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 import math
+import time
+from file_management.batch_categorization import iter_chunks
 from file_management.models import UserFile
 from coin_wallet.models import CoinWallet, CoinTransaction
 
+
+def upload_coins(file_size):
+    """1 coin per started MB, minimum 1 coin per file"""
+    return max(math.ceil(file_size / (1024 * 1024)), 1)
+
+
 class Command(BaseCommand):
-    help = 'Award coins for files that have not been awarded coins yet'
+    help = 'Award coins for files that have not been awarded coins yet (in batches)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Files per batch')
+
+    def _award_chunk(self, files):
+        """Award one chunk: a handful of queries whatever the number of files"""
+        file_ids = [user_file.id for user_file in files]
+        already_awarded = set(
+            CoinTransaction.objects.filter(transaction_type='upload', related_file_id__in=file_ids)
+            .values_list('related_file_id', flat=True)
+        )
+        to_award = [user_file for user_file in files if user_file.id not in already_awarded]
+
+        with transaction.atomic():
+            user_ids = {user_file.user_id for user_file in to_award}
+            wallets = {
+                wallet.user_id: wallet
+                for wallet in CoinWallet.objects.select_for_update().filter(user_id__in=user_ids)
+            }
+            missing = user_ids - set(wallets)
+            if missing:
+                CoinWallet.objects.bulk_create([CoinWallet(user_id=user_id) for user_id in missing])
+                wallets.update({
+                    wallet.user_id: wallet
+                    for wallet in CoinWallet.objects.select_for_update().filter(user_id__in=missing)
+                })
+
+            transactions = []
+            awarded = {}
+            for user_file in to_award:
+                wallet = wallets[user_file.user_id]
+                amount = upload_coins(user_file.file_size)
+                awarded[wallet.id] = awarded.get(wallet.id, 0) + amount
+                transactions.append(CoinTransaction(
+                    wallet=wallet,
+                    amount=amount,
+                    transaction_type='upload',
+                    source=f'File upload: {user_file.original_filename}',
+                    related_file=user_file,
+                    running_balance=wallet.balance + awarded[wallet.id],
+                ))
+            CoinTransaction.objects.bulk_create(transactions)
+
+            now = timezone.now()
+            for wallet_id, amount in awarded.items():
+                CoinWallet.objects.filter(pk=wallet_id).update(balance=F('balance') + amount, updated_at=now)
+
+            # Files that already had a transaction only needed the flag
+            UserFile.objects.filter(id__in=file_ids).update(coins_awarded=True)
+
+        return len(to_award), len(already_awarded), sum(awarded.values())
 
     def handle(self, *args, **options):
-        files_without_coins = UserFile.objects.filter(coins_awarded=False, file_size__gt=0)
+        files_without_coins = UserFile.objects.filter(coins_awarded=False, file_size__gt=0).only(
+            'id', 'user_id', 'file_size', 'original_filename'
+        )
         self.stdout.write(f"Found {files_without_coins.count()} files without coins awarded")
-        
-        for user_file in files_without_coins:
+
+        started = time.monotonic()
+        totals = {'files': 0, 'awarded': 0, 'marked': 0, 'coins': 0}
+        for files in iter_chunks(files_without_coins, options['chunk_size']):
             try:
-                # Calculate coins (1 coin per MB)
-                file_size_mb = math.ceil(user_file.file_size / (1024 * 1024))
-                if file_size_mb < 1:
-                    file_size_mb = 1  # Minimum 1 coin per file
-                
-                # Get or create the user's wallet
-                wallet, created = CoinWallet.objects.get_or_create(user=user_file.user)
-                
-                # Check if coins were already awarded for this file
-                existing_transaction = CoinTransaction.objects.filter(
-                    wallet=wallet,
-                    transaction_type='upload',
-                    related_file=user_file
-                ).exists()
-                
-                if not existing_transaction:
-                    # Award coins
-                    wallet.add_coins(
-                        amount=file_size_mb,
-                        transaction_type='upload',
-                        source=f'File upload: {user_file.original_filename}'
-                    )
-                    
-                    # Update the transaction with the related file
-                    transaction = CoinTransaction.objects.filter(
-                        wallet=wallet,
-                        transaction_type='upload'
-                    ).latest('created_at')
-                    transaction.related_file = user_file
-                    transaction.save()
-                    
-                    # Mark coins as awarded
-                    user_file.coins_awarded = True
-                    user_file.save(update_fields=['coins_awarded'])
-                    
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f"Awarded {file_size_mb} coins for file '{user_file.original_filename}' (ID: {user_file.id})"
-                        )
-                    )
-                else:
-                    # Already awarded but not marked
-                    user_file.coins_awarded = True
-                    user_file.save(update_fields=['coins_awarded'])
-                    
-                    self.stdout.write(
-                        self.style.WARNING(
-                            f"File '{user_file.original_filename}' already had coins awarded, marked as awarded"
-                        )
-                    )
-                    
+                awarded, marked, coins = self._award_chunk(files)
             except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f"Error awarding coins for file '{user_file.original_filename}' (ID: {user_file.id}): {str(e)}"
-                    )
-                )
-        
-        self.stdout.write(self.style.SUCCESS("Finished awarding coins for files")) 
\ No newline at end of file
+                self.stdout.write(self.style.ERROR(
+                    f"Error awarding coins for files {files[0].id}-{files[-1].id}: {str(e)}"
+                ))
+                continue
+            totals['files'] += len(files)
+            totals['awarded'] += awarded
+            totals['marked'] += marked
+            totals['coins'] += coins
+            self.stdout.write(f"  {totals['files']} files: {totals['coins']} coins awarded so far")
+
+        elapsed = time.monotonic() - started
+        if totals['marked']:
+            self.stdout.write(self.style.WARNING(
+                f"{totals['marked']} files already had coins awarded, marked as awarded"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Finished awarding coins: {totals['coins']} coins for {totals['awarded']} files "
+            f"in {elapsed:.1f}s ({totals['files'] / elapsed if elapsed else 0:.0f} files/s)"
+        ))
@@ -0,0 +1,116 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from file_management import views
+from file_management.models import FileCategory, UserFile
+from file_management.listing import encode_cursor, keyset_page
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the full file listing against the cursor-paginated one at growing file counts '
+        '(rows are created inside a transaction that is rolled back)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000', help='Comma-separated file counts')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--full-max', type=int, default=100000,
+                            help='Largest file count to time the unpaginated file_list_view at')
+        parser.add_argument('--rounds', type=int, default=3, help='Timed rounds per measurement')
+
+    def _time(self, label, func, rounds):
+        timings = []
+        size = 0
+        for _ in range(rounds):
+            start = time.perf_counter()
+            response = func()
+            response.render()
+            timings.append(time.perf_counter() - start)
+            size = len(response.content)
+        best = min(timings)
+        self.stdout.write(f"  {label:<40} best {best * 1000:10.1f} ms   {size / 1024:10.1f} KB")
+        return best
+
+    def _time_query(self, func, rounds):
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def _add_files(self, user, category, start, end):
+        batch = 10000
+        for offset in range(start, end, batch):
+            UserFile.objects.bulk_create([
+                UserFile(
+                    user=user,
+                    file_type='image' if index % 3 == 0 else 'document',
+                    file=f"user_{user.id}/file_{index}.pdf",
+                    s3_key=f"user_{user.id}/file_{index}.pdf",
+                    original_filename=f"file_{index}.pdf",
+                    file_size=1024 + index,
+                    category=category,
+                )
+                for index in range(offset, min(offset + batch, end))
+            ])
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        page_size = options['page_size']
+        rounds = options['rounds']
+        factory = APIRequestFactory()
+
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(
+                username=f"listing-benchmark-{uuid.uuid4().hex[:8]}",
+                email=f"listing-benchmark-{uuid.uuid4().hex[:8]}@example.com",
+                password=uuid.uuid4().hex,
+            )
+            category, _ = FileCategory.objects.get_or_create(name='Miscellaneous', defaults={'is_default': True})
+
+            def call(view, path, **params):
+                request = factory.get(path, params)
+                force_authenticate(request, user=user)
+                return view(request)
+
+            created = 0
+            for size in sizes:
+                self._add_files(user, category, created, size)
+                created = size
+                self.stdout.write(f"{size} files, {page_size} per page, {rounds} rounds each")
+
+                if size <= options['full_max']:
+                    # One run: at these sizes a single unpaginated listing already takes seconds
+                    self._time('file_list_view (everything)', lambda: call(views.file_list_view, '/'), 1)
+                else:
+                    self.stdout.write(f"  {'file_list_view (everything)':<40} skipped above --full-max")
+
+                self._time('first page, all fields',
+                           lambda: call(views.file_list_page, '/', limit=page_size), rounds)
+                self._time('first page, fields=id,name,type,thumbnail',
+                           lambda: call(views.file_list_page, '/', limit=page_size,
+                                        fields='id,name,type,thumbnail'), rounds)
+
+                # The cursor of the row just before the last page, as a client paging through would hold
+                ordered = UserFile.objects.filter(user=user).order_by('-upload_date', '-id')
+                before_last = ordered[size - page_size - 1]
+                cursor = encode_cursor(before_last)
+                self._time('last page by cursor',
+                           lambda: call(views.file_list_page, '/', limit=page_size, cursor=cursor), rounds)
+
+                # The row queries alone: keyset range scan vs OFFSET over everything before the page
+                keyset = self._time_query(lambda: keyset_page(ordered, cursor=cursor, limit=page_size), rounds)
+                offset = self._time_query(lambda: list(ordered[size - page_size:size]), rounds)
+                self.stdout.write(self.style.SUCCESS(
+                    f"  Last page rows: cursor {keyset * 1000:.2f} ms vs OFFSET {offset * 1000:.2f} ms "
+                    f"({offset / keyset:.1f}x)"
+                ))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,103 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from file_management.filename_index import _build
+from file_management.models import FileCategory, UserFile
+
+WORDS = [
+    'invoice', 'electricity', 'bill', 'passport', 'aadhaar', 'card', 'front', 'back', 'project', 'plan',
+    'report', 'statement', 'bank', 'salary', 'slip', 'insurance', 'policy', 'rent', 'agreement', 'tax',
+    'return', 'receipt', 'medical', 'prescription', 'resume', 'offer', 'letter', 'ticket', 'boarding', 'pass',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark filename resolution: the old load-every-file loop of force_open_file against the '
+        'per-user trigram index (rows are created inside a transaction that is rolled back)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated file counts')
+        parser.add_argument('--rounds', type=int, default=20, help='Timed rounds per query')
+        parser.add_argument('--seed', type=int, default=7)
+
+    def _name(self, rng, index):
+        words = rng.sample(WORDS, rng.randint(1, 4))
+        style = index % 3
+        if style == 0:
+            stem = ''.join(word.capitalize() for word in words)
+        elif style == 1:
+            stem = '_'.join(words)
+        else:
+            stem = ' '.join(word.capitalize() for word in words)
+        return f"{stem} {index}.{rng.choice(['pdf', 'jpg', 'docx'])}"
+
+    def _legacy_scan(self, user, query):
+        """The matching loop force_open_file ran over every file before the index"""
+        best, best_weight = None, 0
+        for user_file in UserFile.objects.filter(user=user).order_by('-upload_date'):
+            filename = user_file.original_filename.lower()
+            if query == filename:
+                return user_file
+            if query in filename:
+                weight = 3 if len(query) / len(filename) > 0.5 else 2
+            else:
+                weight = sum(1 for term in query.split() if len(term) > 2 and term in filename)
+            if weight > best_weight:
+                best, best_weight = user_file, weight
+        return best
+
+    def _time(self, func, rounds):
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return sorted(timings)[len(timings) // 2]
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        rounds = options['rounds']
+        queries = ['electricity bill', 'PassportBack', 'rent agreement 42', 'insurnce polcy']
+
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(
+                username=f"resolution-benchmark-{uuid.uuid4().hex[:8]}",
+                email=f"resolution-benchmark-{uuid.uuid4().hex[:8]}@example.com",
+                password=uuid.uuid4().hex,
+            )
+            category, _ = FileCategory.objects.get_or_create(name='Miscellaneous', defaults={'is_default': True})
+
+            created = 0
+            for size in sizes:
+                UserFile.objects.bulk_create([
+                    UserFile(user=user, s3_key=f"benchmark/{index}", original_filename=self._name(rng, index),
+                             file_size=1, category=category)
+                    for index in range(created, size)
+                ], batch_size=5000)
+                created = size
+
+                # What a process pays once per version change (bulk_create sends no signals to move it)
+                start = time.perf_counter()
+                index = _build(user.id)
+                build = time.perf_counter() - start
+                self.stdout.write(f"{size} files: index built from the database in {build * 1000:.1f} ms")
+
+                for query in queries:
+                    legacy = self._time(lambda: self._legacy_scan(user, query.lower()), max(1, rounds // 10))
+                    indexed = self._time(lambda: index.search(query), rounds)
+                    top = index.search(query, limit=1)
+                    self.stdout.write(
+                        f"  {query!r:<22} loop {legacy * 1000:9.2f} ms | index {indexed * 1000:7.3f} ms"
+                        f"  -> {top[0].filename if top else '-'}"
+                    )
+            self.stdout.write(self.style.SUCCESS('Timings are medians'))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,93 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+
+from file_management.models import UserFile
+from file_management.serializers import UserFileSerializer
+from storage_management.clients import get_s3_client
+from storage_management.signing import PresignedURLSigner
+import storage_management.signing as signing
+
+
+class PerRowPresignSerializer(UserFileSerializer):
+    """The pre-signer code path: one botocore generate_presigned_url per row"""
+
+    class Meta(UserFileSerializer.Meta):
+        list_serializer_class = serializers.ListSerializer
+
+    def get_file_url(self, obj):
+        return get_s3_client().generate_presigned_url(
+            ClientMethod='get_object',
+            Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': obj.s3_key},
+            ExpiresIn=3600
+        )
+
+
+class Command(BaseCommand):
+    help = 'Benchmark UserFileSerializer list serialization with and without the batched URL signer (offline, no DB writes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=1000, help='Number of files to serialize')
+        parser.add_argument('--rounds', type=int, default=5, help='Timed rounds per variant')
+
+    def _build_files(self, count):
+        User = get_user_model()
+        user = User(id=1, username='benchmark', email='benchmark@example.com')
+        return [
+            UserFile(
+                id=index + 1,
+                user=user,
+                file_type='document',
+                file=f"user_1/report_{index}.pdf",
+                s3_key=f"user_1/report_{index}.pdf",
+                original_filename=f"report_{index}.pdf",
+                file_size=1024 * (index + 1),
+            )
+            for index in range(count)
+        ]
+
+    def _time(self, label, func, rounds):
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        self.stdout.write(f"  {label:<32} best {best * 1000:8.1f} ms   mean {sum(timings) / len(timings) * 1000:8.1f} ms")
+        return best
+
+    def handle(self, *args, **options):
+        files = self._build_files(options['files'])
+        rounds = options['rounds']
+        self.stdout.write(f"Serializing {len(files)} files, {rounds} rounds each")
+
+        # Warm up the shared client so client construction isn't measured
+        get_s3_client()
+
+        per_row = self._time(
+            'per-row generate_presigned_url',
+            lambda: PerRowPresignSerializer(files, many=True).data,
+            rounds
+        )
+
+        def cold_signer():
+            signing._signer = PresignedURLSigner()
+            return UserFileSerializer(files, many=True).data
+
+        cold = self._time('batched signer (cold cache)', cold_signer, rounds)
+
+        signing._signer = PresignedURLSigner()
+        UserFileSerializer(files, many=True).data
+        warm = self._time(
+            'batched signer (warm cache)',
+            lambda: UserFileSerializer(files, many=True).data,
+            rounds
+        )
+        signing._signer = None
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Speedup: {per_row / cold:.1f}x cold, {per_row / warm:.1f}x warm"
+        ))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from file_management.ocr_engines import OCREngineError, TesseractEngine
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the local Tesseract OCR engine on local images/PDFs at several pool sizes (offline, no S3 or DB)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Image or PDF files to OCR')
+        parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4],
+                            help='Process pool sizes to compare (0 = in-process)')
+        parser.add_argument('--rounds', type=int, default=1, help='Timed rounds per pool size')
+
+    def _run(self, engine, paths):
+        pages = 0
+        characters = 0
+        for path in paths:
+            for _, text, _, _ in engine.path_pages(path):
+                pages += 1
+                characters += len(text)
+        return pages, characters
+
+    def handle(self, *args, **options):
+        paths = options['paths']
+        rounds = options['rounds']
+        results = {}
+
+        for workers in options['workers']:
+            engine = TesseractEngine(workers=workers)
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                try:
+                    pages, characters = self._run(engine, paths)
+                except OCREngineError as e:
+                    raise CommandError(str(e))
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            results[workers] = best
+            self.stdout.write(
+                f"  workers={workers:<3} {pages} pages, {characters} chars   "
+                f"best {best:8.2f} s   {pages / best if best else 0:8.2f} pages/s"
+            )
+
+        baseline = results[options['workers'][0]]
+        fastest = min(results, key=results.get)
+        self.stdout.write(self.style.SUCCESS(
+            f"Fastest: workers={fastest}, {baseline / results[fastest]:.1f}x the first configuration"
+        ))
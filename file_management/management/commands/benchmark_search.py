@@ -0,0 +1,125 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from file_management.models import FileCategory, OCRResult, UserFile
+from file_management.search_index import DatabaseSearchBackend, SQLiteFTS5Backend
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the FTS5 search index against the icontains scan over a synthetic corpus of OCR\'d '
+        'documents (rows are created inside a transaction that is rolled back)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=100000)
+        parser.add_argument('--words', type=int, default=200, help='OCR words per document')
+        parser.add_argument('--vocabulary', type=int, default=20000, help='Distinct words in the corpus')
+        parser.add_argument('--users', type=int, default=10, help='Users the documents are spread over')
+        parser.add_argument('--rounds', type=int, default=3, help='Timed rounds per query')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _time(self, func, rounds):
+        timings = []
+        result = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
+
+    def _corpus(self, users, category, options):
+        """Bulk-create files and completed OCR results; word frequencies follow Zipf's law"""
+        rng = random.Random(options['seed'])
+        vocabulary = [f"w{index}" for index in range(options['vocabulary'])]
+        weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+        batch = 5000
+        file_ids = []
+        for offset in range(0, options['documents'], batch):
+            count = min(batch, options['documents'] - offset)
+            files = UserFile.objects.bulk_create([
+                UserFile(
+                    user=users[index % len(users)],
+                    file_type='document',
+                    s3_key=f"benchmark/doc_{index}.pdf",
+                    original_filename=f"{' '.join(rng.choices(vocabulary[:2000], k=2))} {index}.pdf",
+                    file_size=1024,
+                    category=category,
+                )
+                for index in range(offset, offset + count)
+            ])
+            OCRResult.objects.bulk_create([
+                OCRResult(
+                    file=user_file,
+                    status='completed',
+                    text_content=' '.join(rng.choices(vocabulary, weights=weights, k=options['words'])),
+                )
+                for user_file in files
+            ])
+            file_ids.extend(user_file.id for user_file in files)
+        return file_ids
+
+    def handle(self, *args, **options):
+        fts = SQLiteFTS5Backend()
+        if not fts.is_available():
+            self.stdout.write(self.style.ERROR('The FTS5 search index table does not exist; run migrate on SQLite'))
+            return
+        scan = DatabaseSearchBackend()
+        rounds = options['rounds']
+
+        with transaction.atomic():
+            users = [
+                get_user_model().objects.create_user(
+                    username=f"search-benchmark-{uuid.uuid4().hex[:8]}",
+                    email=f"search-benchmark-{uuid.uuid4().hex[:8]}@example.com",
+                    password=uuid.uuid4().hex,
+                )
+                for _ in range(options['users'])
+            ]
+            category, _ = FileCategory.objects.get_or_create(name='Miscellaneous', defaults={'is_default': True})
+
+            start = time.perf_counter()
+            file_ids = self._corpus(users, category, options)
+            self.stdout.write(f"Created {len(file_ids)} documents in {time.perf_counter() - start:.1f} s")
+
+            # Rows were bulk-created, so no signals ran: index them the way a rebuild does
+            start = time.perf_counter()
+            for offset in range(0, len(file_ids), 1000):
+                fts.refresh(file_ids[offset:offset + 1000])
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"Indexed in {elapsed:.1f} s ({len(file_ids) / elapsed:.0f} documents/s)")
+
+            user = users[0]
+            queries = {
+                'common word': 'w1',
+                'mid-frequency word': 'w500',
+                'rare word': f"w{options['vocabulary'] - 1}",
+                'two words': 'w3 w700',  # icontains looks for the phrase, the index for both words
+                'prefix': 'w19',
+            }
+            self.stdout.write(f"Queries for one user ({len(file_ids) // len(users)} documents), {rounds} rounds each")
+            for label, query in queries.items():
+                # The query the views ran before: icontains on the name and every OCR blob
+                old_query = UserFile.objects.filter(
+                    Q(user=user) & (Q(original_filename__icontains=query) | Q(
+                        ocrresult__text_content__icontains=query, ocrresult__status='completed'
+                    ))
+                ).distinct()
+                old, old_count = self._time(lambda: old_query.count(), rounds)
+                fallback, _ = self._time(lambda: scan.search(user, query, limit=20), rounds)
+                ranked, hits = self._time(lambda: fts.search(user, query, limit=20), rounds)
+                counted, count = self._time(lambda: fts.count(user, query), rounds)
+                self.stdout.write(
+                    f"  {label:<20} {query!r:<10} icontains count {old * 1000:8.1f} ms ({old_count} files) | "
+                    f"fallback top 20 {fallback * 1000:8.1f} ms | "
+                    f"fts top 20 {ranked * 1000:7.1f} ms, count {counted * 1000:7.1f} ms ({count} files)"
+                )
+            self.stdout.write(self.style.SUCCESS(f"Sample snippet: {hits[0].snippet if hits else '-'}"))
+
+            transaction.set_rollback(True)
@@ -1,10 +1,17 @@
 from django.core.management.base import BaseCommand
 from file_management.services import OCRService
+from file_management.textract_events import sweep_silent_jobs
 
 class Command(BaseCommand):
-    help = 'Check and complete pending OCR jobs'
+    help = 'Sweep pending Textract jobs that have gone silent (batched and rate limited)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Jobs to check in this run (default OCR_SWEEP_BATCH_SIZE)')
+        parser.add_argument('--rate', type=float, help='Max status calls per second (default OCR_SWEEP_MAX_CALLS_PER_SECOND)')
 
     def handle(self, *args, **options):
-        ocr_service = OCRService()
-        ocr_service.check_pending_jobs()
-        self.stdout.write(self.style.SUCCESS('Successfully checked pending OCR jobs'))
+        summary = sweep_silent_jobs(OCRService(max_pdf_wait=0), batch_size=options['batch_size'], rate=options['rate'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {summary['checked']} pending OCR jobs: {summary['completed']} completed, "
+            f"{summary['error']} failed, {summary['still_running']} still running"
+        ))
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from file_management.services import OCRService
+from file_management.textract_events import consume_queue
+from storage_management.clients import get_client
+
+
+class Command(BaseCommand):
+    help = 'Finish PDF OCR from Textract completion messages on the SQS queue subscribed to TEXTRACT_SNS_TOPIC_ARN'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue-url', help='SQS queue URL (default TEXTRACT_SQS_QUEUE_URL)')
+        parser.add_argument('--once', action='store_true', help='Read a single batch and exit')
+        parser.add_argument('--wait', type=int, default=20, help='Long-poll wait in seconds (max 20)')
+
+    def handle(self, *args, **options):
+        queue_url = options['queue_url'] or getattr(settings, 'TEXTRACT_SQS_QUEUE_URL', '')
+        if not queue_url:
+            raise CommandError('Set TEXTRACT_SQS_QUEUE_URL or pass --queue-url')
+
+        sqs_client = get_client('sqs')
+        ocr_service = OCRService(max_pdf_wait=0)
+        self.stdout.write(f"Consuming Textract events from {queue_url}")
+        while True:
+            summary = consume_queue(sqs_client, queue_url, wait_seconds=options['wait'], ocr_service=ocr_service)
+            if summary['received']:
+                self.stdout.write(f"Handled {summary}")
+            if options['once']:
+                break
+        self.stdout.write(self.style.SUCCESS('Done'))
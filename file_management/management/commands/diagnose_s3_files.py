@@ -1,8 +1,8 @@
 from django.core.management.base import BaseCommand
 from file_management.models import UserFile
-from storage_management.utils import S3StorageManager
-import boto3
-from django.conf import settings
+from file_management.keys import (
+    candidate_keys, get_indexed_key, index_user_files, list_user_objects, probe_keys, record_key
+)
 
 class Command(BaseCommand):
     help = 'Diagnose S3 file storage issues'
@@ -28,35 +28,25 @@ class Command(BaseCommand):
             self.stdout.write(f"File field: {file.file.name if file.file else 'None'}")
             self.stdout.write(f"S3 key: {file.s3_key}")
             
-            storage_manager = S3StorageManager(file.user)
+            indexed_key = get_indexed_key(file)
+            self.stdout.write(f"Indexed key: {indexed_key or 'None'}")
             
-            # Check current S3 key
-            if file.s3_key:
-                exists = storage_manager.file_exists(file.s3_key)
-                self.stdout.write(f"S3 key exists: {exists}")
-            
-            # Try to find the file with different keys
-            possible_keys = [
-                file.s3_key,
-                file.file.name if file.file else None,
-                f"uploads/{file.original_filename}",
-                f"user_{file.user.id}/{file.original_filename}",
-                file.original_filename
-            ]
+            # Probe every candidate key at once
+            possible_keys = candidate_keys(file)
+            found = probe_keys(possible_keys)
             
             working_key = None
             self.stdout.write(f"\nTrying different S3 keys:")
             for key in possible_keys:
-                if key:
-                    exists = storage_manager.file_exists(key)
-                    self.stdout.write(f"  {key}: {'✓' if exists else '✗'}")
-                    if exists and not working_key:
-                        working_key = key
+                exists = key in found
+                self.stdout.write(f"  {key}: {'✓' if exists else '✗'}")
+                if exists and not working_key:
+                    working_key = key
             
-            if working_key and working_key != file.s3_key and fix_keys:
+            if working_key and fix_keys and (working_key != file.s3_key or working_key != indexed_key):
                 self.stdout.write(f"\nFixing S3 key: {file.s3_key} → {working_key}")
-                file.s3_key = working_key
-                file.save(update_fields=['s3_key'])
+                head = found[working_key]
+                record_key(file, working_key, head.get('ETag'), head.get('ContentLength'))
                 self.stdout.write("✓ S3 key updated")
             
         except UserFile.DoesNotExist:
@@ -75,18 +65,26 @@ class Command(BaseCommand):
         files = UserFile.objects.all()
         self.stdout.write(f"\n=== Diagnosing {files.count()} total files ===")
         
+        # One prefix listing per user instead of a HEAD per file
         issues_found = 0
-        for file in files:
+        user_ids = files.order_by().values_list('user_id', flat=True).distinct()
+        for user_id in user_ids:
             try:
-                storage_manager = S3StorageManager(file.user)
-                if file.s3_key and not storage_manager.file_exists(file.s3_key):
+                user_files = files.filter(user_id=user_id)
+                if fix_keys:
+                    missing = index_user_files(user_id, files=user_files)['missing']
+                else:
+                    listing_keys = set(list_user_objects(user_id))
+                    unlisted = {file.id: file.s3_key for file in user_files if file.s3_key and file.s3_key not in listing_keys}
+                    # Keys outside user_<id>/ aren't in the listing, HEAD those
+                    found = probe_keys([key for key in set(unlisted.values()) if not key.startswith(f"user_{user_id}/")])
+                    missing = [file_id for file_id, key in unlisted.items() if key not in found]
+                
+                for file_id in missing:
                     issues_found += 1
-                    self.stdout.write(f"Issue: File {file.id} - S3 key not found: {file.s3_key}")
-                    
-                    if fix_keys:
-                        self.diagnose_file(file.id, True)
+                    self.stdout.write(f"Issue: File {file_id} - no S3 object found")
                         
             except Exception as e:
-                self.stdout.write(f"Error checking file {file.id}: {str(e)}")
+                self.stdout.write(f"Error checking files of user {user_id}: {str(e)}")
         
-        self.stdout.write(f"\nFound {issues_found} files with S3 issues")
\ No newline at end of file
+        self.stdout.write(f"\nFound {issues_found} files with S3 issues")
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from file_management.dedupe import hash_file
+from file_management.keys import resolve_s3_key
+from file_management.models import UserFile
+from storage_management.clients import get_s3_client
+
+
+class Command(BaseCommand):
+    help = 'Backfill UserFile.file_hash (SHA-256) by streaming each stored object once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='Hash a specific user ID')
+        parser.add_argument('--limit', type=int, help='Stop after this many files')
+
+    def handle(self, *args, **options):
+        files = UserFile.objects.filter(file_hash='').select_related('key_index').order_by('id')
+        if options['user_id']:
+            files = files.filter(user_id=options['user_id'])
+        if options['limit']:
+            files = files[:options['limit']]
+
+        s3_client = get_s3_client()
+        hashed = failed = 0
+        for user_file in files.iterator(chunk_size=500):
+            try:
+                s3_key = resolve_s3_key(user_file, s3_client)
+                body = s3_client.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=s3_key)['Body']
+                file_hash = hash_file(body)
+            except Exception as e:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f"File {user_file.id}: {str(e)}"))
+                continue
+
+            # update() rather than save(): a backfilled hash must not move the ledger
+            UserFile.objects.filter(pk=user_file.pk).update(file_hash=file_hash)
+            hashed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Hashed {hashed} files ({failed} failed)"))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from file_management.keys import index_user_files
+from file_management.models import UserFile
+
+
+class Command(BaseCommand):
+    help = 'Record the verified S3 key (ETag, size) of every UserFile in S3KeyIndex'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='Index a specific user ID')
+        parser.add_argument(
+            '--reverify',
+            action='store_true',
+            help='Re-check files that already have an index entry',
+        )
+        parser.add_argument(
+            '--no-probe',
+            action='store_true',
+            help='Only use prefix listings, skip HEAD probes for keys outside user_<id>/',
+        )
+
+    def handle(self, *args, **options):
+        files = UserFile.objects.all()
+        if options['user_id']:
+            files = files.filter(user_id=options['user_id'])
+        if not options['reverify']:
+            files = files.filter(key_index__isnull=True)
+
+        user_ids = files.order_by().values_list('user_id', flat=True).distinct()
+
+        totals = {'indexed': 0, 'probed': 0, 'missing': 0, 'keys_fixed': 0}
+        for user_id in user_ids:
+            try:
+                result = index_user_files(
+                    user_id,
+                    files=files.filter(user_id=user_id),
+                    probe=not options['no_probe']
+                )
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"User {user_id}: {str(e)}"))
+                continue
+
+            for field in ('indexed', 'probed', 'keys_fixed'):
+                totals[field] += result[field]
+            totals['missing'] += len(result['missing'])
+            if result['missing']:
+                self.stdout.write(self.style.WARNING(
+                    f"User {user_id}: no S3 object for files {result['missing']}"
+                ))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {totals['indexed']} files ({totals['probed']} needed probes, "
+            f"{totals['keys_fixed']} s3_key fixes, {totals['missing']} missing)"
+        ))
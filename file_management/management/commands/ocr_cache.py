@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from file_management.models import OCRCacheEntry
+from file_management.ocr_cache import evict, get_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show OCR result cache statistics, evict expired/LRU entries, or clear the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help='Apply OCR_CACHE_TTL and OCR_CACHE_MAX_ENTRIES now')
+        parser.add_argument('--clear', action='store_true', help='Delete every cached OCR result')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = OCRCacheEntry.objects.all().delete()[0]
+            self.stdout.write(self.style.WARNING(f"Deleted {deleted} cache entries"))
+        elif options['evict']:
+            self.stdout.write(f"Evicted {evict()} cache entries")
+
+        stats = get_cache_stats()
+        served = OCRCacheEntry.objects.aggregate(total=Sum('hits'))['total'] or 0
+        self.stdout.write(f"Entries: {stats['entries']}")
+        self.stdout.write(f"Engine calls saved (all time): {served}")
+        self.stdout.write(self.style.SUCCESS(
+            f"This process: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['stores']} stores, {stats['evictions']} evictions"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from file_management.search_index import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Re-index every file name and OCR text (after bulk imports or updates that bypass signals)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Files re-read per batch')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        count = backend.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} files with the {backend.name} search backend"))
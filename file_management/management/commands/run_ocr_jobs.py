@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from file_management.models import OCRJob, OCRResult, UserFile
+from file_management.ocr_queue import enqueue_ocr, recover_stale_jobs, run_pending
+
+
+class Command(BaseCommand):
+    help = 'Run queued OCR jobs in this process (recovers jobs whose dispatch was lost)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='First queue backfill jobs for documents and images that have no OCR result',
+        )
+        parser.add_argument('--limit', type=int, help='Run at most this many jobs')
+        parser.add_argument(
+            '--lane',
+            choices=[lane for lane, _ in OCRJob.LANES],
+            action='append',
+            help='Only run jobs from this lane (repeatable)',
+        )
+
+    def handle(self, *args, **options):
+        recovered = recover_stale_jobs()
+        if recovered:
+            self.stdout.write(self.style.WARNING(f"Requeued {recovered} stale running jobs"))
+
+        if options['backfill']:
+            files = UserFile.objects.filter(file_type__in=['document', 'image']).exclude(
+                Exists(OCRResult.objects.filter(file=OuterRef('pk')))
+            )
+            queued = 0
+            for user_file in files.iterator(chunk_size=500):
+                enqueue_ocr(user_file, lane='backfill')
+                queued += 1
+            self.stdout.write(f"Queued {queued} backfill jobs")
+
+        executed = run_pending(limit=options['limit'], lanes=options['lane'])
+        self.stdout.write(self.style.SUCCESS(f"Ran {executed} OCR jobs"))
@@ -5,5 +5,5 @@ class Command(BaseCommand):
     help = 'Creates default file categories'
 
     def handle(self, *args, **options):
-        create_default_categories()
-        self.stdout.write(self.style.SUCCESS('Successfully created default categories'))
\ No newline at end of file
+        created = create_default_categories()
+        self.stdout.write(self.style.SUCCESS(f'Successfully created default categories ({created} new)'))
\ No newline at end of file
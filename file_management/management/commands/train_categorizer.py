@@ -0,0 +1,123 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from file_management.learned_categorizer import LinearCategoryModel, model_path, reset_model, training_examples
+from file_management.utils import FileCategorizationService
+
+
+class Command(BaseCommand):
+    help = ('Train the learned categorizer from categorized files with OCR text, evaluate it against the '
+            'keyword scorer on a holdout split and benchmark both (offline)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Model file (default CATEGORIZER_MODEL_PATH)')
+        parser.add_argument('--holdout', type=float, default=0.2, help='Share of documents kept for evaluation')
+        parser.add_argument('--epochs', type=int, default=60)
+        parser.add_argument('--features', type=int, default=2 ** 18, help='Hashed feature buckets')
+        parser.add_argument('--min-per-category', type=int, default=5,
+                            help='Drop categories with fewer training documents')
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Train on this many generated documents instead of the database')
+        parser.add_argument('--seed', type=int, default=13)
+        parser.add_argument('--evaluate-only', action='store_true', help="Don't write the model file")
+
+    def _synthetic_examples(self, count, rng):
+        """Documents drawn from each category's keywords plus shared filler, with overlapping vocabularies"""
+        keywords = FileCategorizationService.CATEGORY_KEYWORDS
+        filler = ['the', 'and', 'date', 'page', 'total', 'name', 'number', 'reference', 'details', 'address']
+        everything = [keyword for words in keywords.values() for keyword in words]
+        texts, labels = [], []
+        for _ in range(count):
+            category = rng.choice(list(keywords))
+            words = []
+            for _ in range(rng.randint(30, 200)):
+                roll = rng.random()
+                if roll < 0.1:
+                    words.append(rng.choice(keywords[category]))
+                elif roll < 0.2:
+                    words.append(rng.choice(everything))
+                elif roll < 0.5:
+                    words.append(str(rng.randint(1, 99999)))
+                else:
+                    words.append(rng.choice(filler))
+            texts.append(' '.join(words))
+            labels.append(category)
+        return texts, labels
+
+    def _accuracy(self, predicted, expected):
+        correct = sum(1 for guess, label in zip(predicted, expected) if guess == label)
+        return correct / len(expected) if expected else 0.0
+
+    def _macro_f1(self, predicted, expected):
+        scores = []
+        for category in set(expected):
+            true_positive = sum(1 for guess, label in zip(predicted, expected) if guess == label == category)
+            predicted_count = sum(1 for guess in predicted if guess == category)
+            actual_count = sum(1 for label in expected if label == category)
+            precision = true_positive / predicted_count if predicted_count else 0.0
+            recall = true_positive / actual_count if actual_count else 0.0
+            scores.append(2 * precision * recall / (precision + recall) if precision + recall else 0.0)
+        return sum(scores) / len(scores) if scores else 0.0
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['synthetic']:
+            texts, labels = self._synthetic_examples(options['synthetic'], rng)
+            source = f"{len(texts)} synthetic documents"
+        else:
+            texts, labels = training_examples()
+            source = f"{len(texts)} categorized files with OCR text"
+
+        counts = {}
+        for label in labels:
+            counts[label] = counts.get(label, 0) + 1
+        kept = {label for label, count in counts.items() if count >= options['min_per_category']}
+        pairs = [(text, label) for text, label in zip(texts, labels) if label in kept]
+        if len(kept) < 2:
+            raise CommandError(f"Need at least two categories with {options['min_per_category']} documents ({source})")
+
+        rng.shuffle(pairs)
+        split = int(len(pairs) * (1 - options['holdout']))
+        train, test = pairs[:split], pairs[split:]
+        self.stdout.write(f"Data: {source}; {len(kept)} categories, {len(train)} train / {len(test)} holdout")
+
+        start = time.perf_counter()
+        model = LinearCategoryModel.train(
+            [text for text, _ in train], [label for _, label in train],
+            n_features=options['features'], epochs=options['epochs']
+        )
+        self.stdout.write(f"Trained in {time.perf_counter() - start:.1f}s")
+
+        if test:
+            test_texts = [text for text, _ in test]
+            expected = [label for _, label in test]
+
+            start = time.perf_counter()
+            learned = [category for category, _ in model.predict(test_texts)]
+            learned_time = time.perf_counter() - start
+
+            keyword_scorer = FileCategorizationService()
+            start = time.perf_counter()
+            keywords = [keyword_scorer.analyze_file_content(text, learned=False)['category'] for text in test_texts]
+            keyword_time = time.perf_counter() - start
+
+            self.stdout.write(
+                f"  learned   accuracy {self._accuracy(learned, expected):6.1%}   macro-F1 {self._macro_f1(learned, expected):.3f}   "
+                f"{len(test) / learned_time:9.0f} docs/s (one batch call)"
+            )
+            self.stdout.write(
+                f"  keywords  accuracy {self._accuracy(keywords, expected):6.1%}   macro-F1 {self._macro_f1(keywords, expected):.3f}   "
+                f"{len(test) / keyword_time:9.0f} docs/s"
+            )
+
+        if options['evaluate_only']:
+            return
+        path = options['output'] or model_path()
+        model.metadata['source'] = source
+        model.save(path)
+        reset_model()
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved model to {path}; set CATEGORIZATION_MODE='learned' to use it"
+        ))
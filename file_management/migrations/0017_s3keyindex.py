@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0016_userfile_is_hidden_userfile_locked_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='S3KeyIndex',
+            fields=[
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='key_index', serialize=False, to='file_management.userfile')),
+                ('s3_key', models.CharField(max_length=255)),
+                ('etag', models.CharField(blank=True, max_length=100)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('verified_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'S3 Key Index',
+                'verbose_name_plural': 'S3 Key Index',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0017_s3keyindex'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfile',
+            name='file_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'file_hash'], name='file_manage_user_id_33b5c1_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0019_ocrjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ocrresult',
+            name='job_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ocrresult',
+            name='last_polled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0020_ocrresult_job_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OCRPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('text', models.TextField(blank=True)),
+                ('confidence', models.FloatField(blank=True, null=True)),
+                ('line_count', models.PositiveIntegerField(default=0)),
+                ('ocr_result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='file_management.ocrresult')),
+            ],
+            options={
+                'ordering': ['ocr_result', 'page_number'],
+                'constraints': [models.UniqueConstraint(fields=('ocr_result', 'page_number'), name='unique_ocr_page')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0021_ocrpage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ocrpreference',
+            name='engine',
+            field=models.CharField(choices=[('default', 'Server default (OCR_ENGINE)'), ('textract', 'Amazon Textract'), ('tesseract', 'Local Tesseract')], default='default', max_length=20),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:11
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0022_ocrpreference_engine'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OCRCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('engine_version', models.CharField(max_length=100)),
+                ('text_content', models.TextField(blank=True)),
+                ('pages', models.JSONField(default=list)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'engine_version'), name='unique_ocr_cache_entry')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0023_ocrcacheentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'upload_date', 'id'], name='file_manage_user_id_152925_idx'),
+        ),
+    ]
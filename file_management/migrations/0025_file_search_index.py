@@ -0,0 +1,41 @@
+from django.db import migrations
+
+FTS_TABLE = 'file_management_search'
+
+
+def create_search_index(apps, schema_editor):
+    """FTS5 index of file names and OCR text (SQLite only; other databases use the fallback backend)"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "filename, content, owner, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        # Every existing file with the text of its latest completed OCR result
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, filename, content, owner) "
+            "SELECT f.id, coalesce(f.original_filename, ''), coalesce(("
+            "    SELECT o.text_content FROM file_management_ocrresult o"
+            "    WHERE o.file_id = f.id AND o.status = 'completed' ORDER BY o.id DESC LIMIT 1"
+            "), ''), 'u' || f.user_id "
+            "FROM file_management_userfile f"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0024_userfile_listing_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
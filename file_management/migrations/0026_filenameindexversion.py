@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0025_file_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilenameIndexVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=32)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='filename_index_version', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -2,8 +2,10 @@ from django.db import models
 from django.conf import settings
 from django.contrib.auth.models import User
 from storage_management.utils import S3StorageManager
+from storage_management.signing import get_url_signer, attachment_disposition
 import math
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 class OCRResult(models.Model):
     file = models.ForeignKey('UserFile', on_delete=models.CASCADE)
@@ -11,11 +13,67 @@ class OCRResult(models.Model):
     processed_date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, default='pending')
     job_id = models.CharField(max_length=100, blank=True, null=True)  # Add this field
+    job_started_at = models.DateTimeField(blank=True, null=True)  # Textract async job start
+    last_polled_at = models.DateTimeField(blank=True, null=True)  # last get_document_analysis status check
 
     def __str__(self):
         return f"OCR Result for {self.file.file.name}"
     
 
+class OCRPage(models.Model):
+    """One page of OCR output, written as Textract results stream in (see file_management.ocr_pages)"""
+    ocr_result = models.ForeignKey(OCRResult, on_delete=models.CASCADE, related_name='pages')
+    page_number = models.PositiveIntegerField()
+    text = models.TextField(blank=True)
+    confidence = models.FloatField(blank=True, null=True)  # mean LINE confidence, 0-100
+    line_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['ocr_result', 'page_number']
+        constraints = [
+            models.UniqueConstraint(fields=['ocr_result', 'page_number'], name='unique_ocr_page'),
+        ]
+
+    def __str__(self):
+        return f"Page {self.page_number} of OCR result {self.ocr_result_id}"
+
+
+class FilenameIndexVersion(models.Model):
+    """
+    Version token of a user's file names (see file_management.filename_index).
+
+    Every process compares its cached filename index against this row and
+    rebuilds when the token moved; it is replaced after each committed
+    upload, rename or delete.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='filename_index_version')
+    version = models.CharField(max_length=32)
+
+
+class OCRCacheEntry(models.Model):
+    """
+    OCR output of a document's bytes for one engine version (see file_management.ocr_cache).
+
+    Keyed by UserFile.file_hash, so re-uploads and re-runs of identical
+    content reuse the text instead of calling the engine again.
+    """
+    content_hash = models.CharField(max_length=64)
+    engine_version = models.CharField(max_length=100)
+    text_content = models.TextField(blank=True)
+    pages = models.JSONField(default=list)  # [page_number, text, confidence, line_count] per page
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'engine_version'], name='unique_ocr_cache_entry'),
+        ]
+
+    def __str__(self):
+        return f"OCR cache {self.content_hash[:12]} ({self.engine_version})"
+
+
 class FileCategory(models.Model):
     name = models.CharField(max_length=50)
     description = models.TextField(blank=True, null=True)
@@ -64,6 +122,7 @@ class UserFile(models.Model):
     is_favorite = models.BooleanField(default=False)
     s3_key = models.CharField(max_length=255, blank=True)
     file_size = models.BigIntegerField(default=0)
+    file_hash = models.CharField(max_length=64, blank=True, default='')  # SHA-256 of the content
     original_filename = models.CharField(max_length=255, blank=True)
     coins_awarded = models.BooleanField(default=False)
     pending_auto_categorization = models.BooleanField(default=False)
@@ -146,98 +205,50 @@ class UserFile(models.Model):
         if not self.s3_key:
             return None
             
-        storage_manager = S3StorageManager(self.user)
-        return storage_manager.get_file_url(self.s3_key)
+        return get_url_signer().sign(self.s3_key)
 
     def get_download_url(self):
         """Get presigned URL for file download"""
         if not self.s3_key:
             return None
             
-        storage_manager = S3StorageManager(self.user)
-        return storage_manager.get_file_url(
-            self.s3_key, 
-            response_content_disposition=f'attachment; filename="{self.original_filename}"'
+        return get_url_signer().sign(
+            self.s3_key,
+            disposition=attachment_disposition(self.original_filename)
         )
 
     def get_file_size_display(self):
         """Return human-readable file size"""
+        # Work on a copy: mutating file_size here used to corrupt later saves
+        size = self.file_size
         for unit in ['B', 'KB', 'MB', 'GB']:
-            if self.file_size < 1024:
-                return f"{self.file_size:.2f} {unit}"
-            self.file_size /= 1024
-        return f"{self.file_size:.2f} TB"
+            if size < 1024:
+                return f"{size:.2f} {unit}"
+            size /= 1024
+        return f"{size:.2f} TB"
+
+    @property
+    def storage_key(self):
+        """Canonical S3 key of this file: s3_key, falling back to the FileField name"""
+        return self.s3_key or (self.file.name if self.file else '')
 
     def delete(self, *args, **kwargs):
-        """Override delete to remove file from S3 with enhanced error handling"""
-        s3_deletion_success = False
+        """Delete the database record, then its S3 object with a single DeleteObject"""
+        storage_key = self.storage_key
+        file_id = self.id
         
-        # Try multiple S3 key variations to find and delete the file
-        if self.s3_key or self.file:
+        print(f"[Delete] Deleting database record for file {file_id}: {self.original_filename}")
+        result = super().delete(*args, **kwargs)
+        
+        if storage_key:
             try:
-                storage_manager = S3StorageManager(self.user)
-            
-                # List of possible S3 keys to try
-                possible_keys = []
-                
-                # Add current s3_key if it exists
-                if self.s3_key:
-                    possible_keys.append(self.s3_key)
-                
-                # Add file.name if it exists and is different
-                if self.file and self.file.name and self.file.name != self.s3_key:
-                    possible_keys.append(self.file.name)
-                
-                # Add variations based on original filename
-                if self.original_filename:
-                    possible_keys.extend([
-                        f"uploads/{self.original_filename}",
-                        f"user_{self.user.id}/{self.original_filename}",
-                        self.original_filename
-                    ])
-                
-                # Remove duplicates while preserving order
-                seen = set()
-                unique_keys = []
-                for key in possible_keys:
-                    if key and key not in seen:
-                        seen.add(key)
-                        unique_keys.append(key)
-                
-                print(f"[Delete] Attempting to delete file {self.id}: {self.original_filename}")
-                print(f"[Delete] Trying S3 keys: {unique_keys}")
-                
-                # Try each key until one succeeds
-                for key in unique_keys:
-                    try:
-                        # First, check if file exists in S3
-                        if storage_manager.file_exists(key):
-                            print(f"[Delete] Found file with key: {key}")
-                            storage_manager.delete_file(key)
-                            print(f"[Delete] Successfully deleted file from S3: {key}")
-                            s3_deletion_success = True
-                            break
-                        else:
-                            print(f"[Delete] File not found with key: {key}")
-                    except Exception as key_error:
-                        print(f"[Delete] Failed to delete with key '{key}': {str(key_error)}")
-                        continue
-                
-                if not s3_deletion_success:
-                    print(f"[Delete] Warning: Could not find file in S3 with any key variation")
-                    print(f"[Delete] File may have been already deleted or moved")
-            
+                from .services import FileDeletionService
+                FileDeletionService(self.user).release_keys([storage_key])
             except Exception as e:
-                print(f"[Delete] Error during S3 deletion process: {str(e)}")
-        
-        # Always delete the database record, even if S3 deletion failed
-        print(f"[Delete] Deleting database record for file {self.id}")
-        super().delete(*args, **kwargs)
+                # The row is gone either way; clean_orphaned_files picks up leftovers
+                print(f"[Delete] Error deleting S3 object {storage_key} for file {file_id}: {str(e)}")
         
-        if s3_deletion_success:
-            print(f"[Delete] Successfully deleted file {self.id} from both S3 and database")
-        else:
-            print(f"[Delete] Deleted database record for file {self.id}, but S3 file was not found")
+        return result
 
     def __str__(self):
         return f"{self.file_type} - {self.original_filename}"
@@ -259,12 +270,12 @@ class UserFile(models.Model):
     
     def has_pair(self):
         """Check if document has a paired document"""
-        return self.paired_document is not None
+        return self.paired_document_id is not None
 
     def is_accessible_by_user(self, user, password=None):
         """Check if user can access this file"""
-        # Owner can always access
-        if self.user == user:
+        # Owner can always access (compared by id: loading self.user costs a query per file)
+        if user is not None and self.user_id == user.pk:
             if self.locked and password:
                 from django.contrib.auth.hashers import check_password
                 return check_password(password, self.locked_password)
@@ -329,6 +340,8 @@ class UserFile(models.Model):
             models.Index(fields=['user', 'is_hidden']),
             models.Index(fields=['user', 'is_favorite']),
             models.Index(fields=['user', 'locked']),
+            models.Index(fields=['user', 'file_hash']),
+            models.Index(fields=['user', 'upload_date', 'id']),
         ]
 
 class CardDetails(models.Model):
@@ -463,13 +476,90 @@ class OCRPreference(models.Model):
         ('selected', 'Process OCR only on selected files'),
         ('none', 'Do not process OCR on any files')
     )
+    ENGINE_CHOICES = (
+        ('default', 'Server default (OCR_ENGINE)'),
+        ('textract', 'Amazon Textract'),
+        ('tesseract', 'Local Tesseract'),
+    )
     
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     preference = models.CharField(max_length=10, choices=OCR_CHOICES, default='all')
+    engine = models.CharField(max_length=20, choices=ENGINE_CHOICES, default='default')
     
     def __str__(self):
         return f"{self.user.username}'s OCR preference: {self.get_preference_display()}"
 
+
+class S3KeyIndex(models.Model):
+    """
+    The verified S3 key of a UserFile.
+
+    Filled by the index_s3_keys command and on resolver misses (see
+    file_management.keys); lets OCR, delete and diagnostics skip the
+    key-guessing head_object probes.
+    """
+    file = models.OneToOneField('UserFile', on_delete=models.CASCADE, primary_key=True, related_name='key_index')
+    s3_key = models.CharField(max_length=255)
+    etag = models.CharField(max_length=100, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    verified_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'S3 Key Index'
+        verbose_name_plural = 'S3 Key Index'
+
+    def __str__(self):
+        return f"{self.file_id} -> {self.s3_key}"
+
+
+class OCRJob(models.Model):
+    """
+    A durable OCR work item (see file_management.ocr_queue).
+
+    Rows are the source of truth; the Celery or local backend only carries
+    job ids, so anything lost in a broker or a restarted process is picked
+    up again by the run_ocr_jobs command.
+    """
+    LANES = (
+        ('interactive', 'Interactive'),  # a user just uploaded and is waiting
+        ('backfill', 'Backfill'),        # admin reprocessing, bulk catch-up
+    )
+    STATUSES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('waiting', 'Waiting on Textract'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    ACTIVE_STATUSES = ('queued', 'running', 'waiting')
+
+    file = models.ForeignKey('UserFile', on_delete=models.CASCADE, related_name='ocr_jobs')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ocr_jobs')
+    lane = models.CharField(max_length=20, choices=LANES, default='interactive')
+    status = models.CharField(max_length=20, choices=STATUSES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    polls = models.PositiveIntegerField(default=0)
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'lane', 'available_at']),
+            models.Index(fields=['user', 'status']),
+        ]
+
+    def __str__(self):
+        return f"OCR job {self.id} for file {self.file_id} ({self.lane}, {self.status})"
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
     
 
 
@@ -0,0 +1,153 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OCRCacheEntry
+from .ocr_pages import store_pages
+
+# Process-local hit/miss counters; the per-entry hit count lives on the rows
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'stores': 0,
+    'evictions': 0,
+}
+_lock = threading.Lock()
+_stores_since_evict = 0
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _count(name, amount=1):
+    with _lock:
+        _stats[name] += amount
+
+
+def cache_enabled():
+    return _setting('OCR_CACHE_ENABLED', True)
+
+
+def lookup(content_hash, engine_version):
+    """
+    Return the fresh OCRCacheEntry for these bytes and engine, or None.
+
+    A hit moves the entry to the front of the LRU order. Entries older than
+    OCR_CACHE_TTL seconds are dropped instead of served.
+    """
+    if not content_hash or not cache_enabled():
+        return None
+
+    entry = OCRCacheEntry.objects.filter(content_hash=content_hash, engine_version=engine_version).first()
+    ttl = _setting('OCR_CACHE_TTL', 90 * 24 * 3600)
+    if entry is not None and ttl and entry.created_at < timezone.now() - timedelta(seconds=ttl):
+        entry.delete()
+        _count('evictions')
+        entry = None
+
+    if entry is None:
+        _count('misses')
+        return None
+
+    OCRCacheEntry.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    _count('hits')
+    print(f"[OCR Cache] Hit for {content_hash[:12]} ({engine_version})")
+    return entry
+
+
+def restore(entry, ocr_result):
+    """Write a cached entry's pages onto an OCR result and return the document text"""
+    store_pages(ocr_result, (tuple(page) for page in entry.pages))
+    return entry.text_content
+
+
+def store(content_hash, engine_version, text_content, pages):
+    """Cache OCR output; failures are logged, never raised, since the OCR itself succeeded"""
+    if not content_hash or not cache_enabled():
+        return None
+    try:
+        entry, _ = OCRCacheEntry.objects.update_or_create(
+            content_hash=content_hash,
+            engine_version=engine_version,
+            defaults={
+                'text_content': text_content or '',
+                'pages': [list(page) for page in pages],
+                'last_used_at': timezone.now(),
+            }
+        )
+        _count('stores')
+        if _evict_due():
+            evict()
+        return entry
+    except Exception as e:
+        print(f"[OCR Cache] Could not cache {content_hash[:12]}: {str(e)}")
+        return None
+
+
+def _evict_due():
+    """
+    True on every OCR_CACHE_EVICT_EVERY-th store of this process.
+
+    Eviction is a range delete plus a count over the whole table, so it runs on
+    a sample of inserts rather than each one; lookup() still refuses expired
+    entries in between, and `manage.py ocr_cache --evict` can run it on demand.
+    """
+    global _stores_since_evict
+    every = _setting('OCR_CACHE_EVICT_EVERY', 100)
+    with _lock:
+        _stores_since_evict += 1
+        if _stores_since_evict < max(every, 1):
+            return False
+        _stores_since_evict = 0
+    return True
+
+
+def store_result(content_hash, engine_version, ocr_result):
+    """Cache a completed OCRResult with the page rows written for it"""
+    pages = ocr_result.pages.order_by('page_number').values_list('page_number', 'text', 'confidence', 'line_count')
+    return store(content_hash, engine_version, ocr_result.text_content, pages)
+
+
+def evict():
+    """
+    Drop expired entries, then the least recently used ones beyond OCR_CACHE_MAX_ENTRIES.
+
+    Returns the number of entries removed.
+    """
+    removed = 0
+    ttl = _setting('OCR_CACHE_TTL', 90 * 24 * 3600)
+    if ttl:
+        removed += OCRCacheEntry.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=ttl)).delete()[0]
+
+    max_entries = _setting('OCR_CACHE_MAX_ENTRIES', 10000)
+    if max_entries:
+        overflow = OCRCacheEntry.objects.count() - max_entries
+        if overflow > 0:
+            stale = list(OCRCacheEntry.objects.order_by('last_used_at', 'id').values_list('id', flat=True)[:overflow])
+            removed += OCRCacheEntry.objects.filter(id__in=stale).delete()[0]
+
+    if removed:
+        _count('evictions', removed)
+    return removed
+
+
+def get_cache_stats():
+    """Hit/miss counters of this process plus the size of the shared cache"""
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    stats['entries'] = OCRCacheEntry.objects.count()
+    return stats
+
+
+def reset_cache_stats():
+    global _stores_since_evict
+    with _lock:
+        for name in _stats:
+            _stats[name] = 0
+        _stores_since_evict = 0
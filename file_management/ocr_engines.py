@@ -0,0 +1,253 @@
+import io
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
+
+from django.conf import settings
+
+from .ocr_pages import iter_analysis_responses, iter_pages
+from .textract_events import notification_params
+
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:  # the local engine is optional
+    pytesseract = None
+    Image = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # only needed to rasterise PDFs for the local engine
+    pdfium = None
+
+
+class OCREngineError(Exception):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class OCREngine:
+    """
+    An OCR backend. Engines produce pages as (page_number, text, confidence,
+    line_count) tuples, the format file_management.ocr_pages.store_pages writes.
+
+    async_pdf engines start a job for PDFs that finishes later (Textract);
+    the others return all pages from pdf_pages() directly.
+    """
+    name = None
+    async_pdf = False
+
+    def is_available(self, pdf=False):
+        """Whether the engine can run here, for PDFs too when pdf is set"""
+        return True
+
+    @property
+    def version(self):
+        return self.name
+
+    def image_pages(self, s3_key):
+        raise NotImplementedError
+
+    def pdf_pages(self, s3_key):
+        raise NotImplementedError
+
+
+class TextractEngine(OCREngine):
+    name = 'textract'
+    version = 'textract:tables+forms'
+    async_pdf = True
+    FEATURE_TYPES = ['TABLES', 'FORMS']
+
+    def __init__(self, textract_client=None, s3_client=None):
+        from storage_management.clients import get_textract_client
+
+        self.textract_client = textract_client or get_textract_client()
+
+    def _document(self, s3_key):
+        return {'S3Object': {'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Name': s3_key}}
+
+    def image_pages(self, s3_key):
+        response = self.textract_client.detect_document_text(Document=self._document(s3_key))
+        return iter_pages([response])
+
+    def start_pdf_job(self, user_file, s3_key):
+        """Start StartDocumentAnalysis and return the JobId"""
+        response = self.textract_client.start_document_analysis(
+            DocumentLocation=self._document(s3_key),
+            FeatureTypes=self.FEATURE_TYPES,
+            **notification_params(user_file)
+        )
+        return response['JobId']
+
+    def result_pages(self, job_id, first_response=None):
+        return iter_pages(iter_analysis_responses(self.textract_client, job_id, first_response))
+
+
+def tesseract_lines(data):
+    """
+    Group pytesseract.image_to_data(output_type=DICT) words into lines.
+
+    Returns (text, mean word confidence or None, line_count).
+    """
+    lines = {}
+    confidences = []
+    for index, word in enumerate(data.get('text', [])):
+        word = (word or '').strip()
+        if not word:
+            continue
+        key = (data['block_num'][index], data['par_num'][index], data['line_num'][index])
+        lines.setdefault(key, []).append(word)
+        confidence = float(data['conf'][index])
+        if confidence >= 0:
+            confidences.append(confidence)
+    text = '\n'.join(' '.join(words) for _, words in sorted(lines.items()))
+    confidence = sum(confidences) / len(confidences) if confidences else None
+    return text, confidence, len(lines)
+
+
+def _recognise_page(page_number, image_bytes, lang, config):
+    """Process-pool worker: OCR one page image"""
+    image = Image.open(io.BytesIO(image_bytes))
+    data = pytesseract.image_to_data(image, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    text, confidence, line_count = tesseract_lines(data)
+    return page_number, text, confidence, line_count
+
+
+class TesseractEngine(OCREngine):
+    """
+    Local OCR with Tesseract: no network round trip and no per-page fee.
+
+    The object is downloaded once to a temp file, PDF pages are rasterised
+    with pypdfium2 one at a time and recognised in a process pool
+    (OCR_TESSERACT_WORKERS, 0 = in this process). At most twice as many
+    pages as workers are in flight, so memory stays bounded on long PDFs.
+    The worker count is fixed rather than the CPU count: several Celery
+    workers may be running documents on the same machine.
+    """
+    name = 'tesseract'
+
+    def __init__(self, textract_client=None, s3_client=None, workers=None):
+        from storage_management.clients import get_s3_client
+
+        self.s3_client = s3_client or get_s3_client()
+        self.workers = _setting('OCR_TESSERACT_WORKERS', 2) if workers is None else workers
+        self.lang = _setting('OCR_TESSERACT_LANG', 'eng')
+        self.config = _setting('OCR_TESSERACT_CONFIG', '')
+        self.dpi = _setting('OCR_PDF_RASTER_DPI', 200)
+
+    def is_available(self, pdf=False):
+        if pdf and pdfium is None:
+            return False
+        return pytesseract is not None and shutil.which(_setting('OCR_TESSERACT_CMD', 'tesseract')) is not None
+
+    @cached_property
+    def version(self):
+        try:
+            return f"tesseract:{pytesseract.get_tesseract_version()}:{self.lang}"
+        except Exception:
+            return f"tesseract:unknown:{self.lang}"
+
+    def _require(self, pdf=False):
+        if pytesseract is None:
+            raise OCREngineError('The Tesseract engine requires pytesseract: pip install pytesseract')
+        if pdf and pdfium is None:
+            raise OCREngineError('Rasterising PDFs for Tesseract requires pypdfium2: pip install pypdfium2')
+        pytesseract.pytesseract.tesseract_cmd = _setting('OCR_TESSERACT_CMD', 'tesseract')
+
+    def _download(self, s3_key):
+        temp_file = tempfile.NamedTemporaryFile(suffix=os.path.splitext(s3_key)[1], delete=False)
+        with temp_file:
+            self.s3_client.download_fileobj(settings.AWS_STORAGE_BUCKET_NAME, s3_key, temp_file)
+        return temp_file.name
+
+    def _render_pages(self, path):
+        """Yield (page_number, png_bytes) for each PDF page, one page rendered at a time"""
+        document = pdfium.PdfDocument(path)
+        try:
+            for index in range(len(document)):
+                page = document[index]
+                image = page.render(scale=self.dpi / 72).to_pil()
+                buffer = io.BytesIO()
+                image.save(buffer, format='PNG')
+                page.close()
+                yield index + 1, buffer.getvalue()
+        finally:
+            document.close()
+
+    def recognise(self, rendered_pages):
+        """OCR (page_number, image_bytes) pairs, yielding pages in order"""
+        if not self.workers:
+            for page_number, image_bytes in rendered_pages:
+                yield _recognise_page(page_number, image_bytes, self.lang, self.config)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = deque()
+            for page_number, image_bytes in rendered_pages:
+                in_flight.append(executor.submit(_recognise_page, page_number, image_bytes, self.lang, self.config))
+                if len(in_flight) >= self.workers * 2:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def path_pages(self, path):
+        """OCR a local image or PDF file, yielding its pages in order"""
+        if path.lower().endswith('.pdf'):
+            self._require(pdf=True)
+            yield from self.recognise(self._render_pages(path))
+            return
+        self._require()
+        with open(path, 'rb') as image_file:
+            # A single page isn't worth a trip to the process pool
+            yield _recognise_page(1, image_file.read(), self.lang, self.config)
+
+    def _s3_pages(self, s3_key):
+        path = self._download(s3_key)
+        try:
+            yield from self.path_pages(path)
+        finally:
+            os.remove(path)
+
+    def image_pages(self, s3_key):
+        return self._s3_pages(s3_key)
+
+    def pdf_pages(self, s3_key):
+        return self._s3_pages(s3_key)
+
+
+ENGINES = {
+    TextractEngine.name: TextractEngine,
+    TesseractEngine.name: TesseractEngine,
+}
+
+
+def engine_name_for(ocr_preference=None):
+    """The user's engine choice, else OCR_ENGINE"""
+    name = getattr(ocr_preference, 'engine', '') or 'default'
+    if name == 'default':
+        name = _setting('OCR_ENGINE', 'textract')
+    return name
+
+
+def get_engine(name, textract_client=None, s3_client=None, pdf=False):
+    """
+    Instantiate an engine by name. An unknown or unavailable engine falls
+    back to Textract, so a missing local install never blocks OCR; pass
+    pdf=True when the engine has to handle PDFs (Tesseract needs pypdfium2).
+    """
+    engine_class = ENGINES.get(name)
+    if engine_class is None:
+        print(f"[OCR Engines] Unknown OCR engine '{name}', using Textract")
+        engine_class = TextractEngine
+
+    engine = engine_class(textract_client=textract_client, s3_client=s3_client)
+    if not engine.is_available(pdf=pdf):
+        print(f"[OCR Engines] OCR engine '{name}' is not available here, using Textract")
+        engine = TextractEngine(textract_client=textract_client, s3_client=s3_client)
+    return engine
@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.db import transaction
+
+from .models import OCRPage
+
+
+def iter_analysis_responses(textract_client, job_id, first_response=None):
+    """Yield every GetDocumentAnalysis response of a job, following NextToken"""
+    response = first_response or textract_client.get_document_analysis(JobId=job_id)
+    while True:
+        yield response
+        next_token = response.get('NextToken')
+        if not next_token:
+            return
+        response = textract_client.get_document_analysis(JobId=job_id, NextToken=next_token)
+
+
+def iter_pages(responses):
+    """
+    Turn Textract responses into (page_number, text, confidence, line_count), one page at a time.
+
+    Responses are cut at 1,000 blocks, not at page boundaries, so a page
+    can span responses; Textract returns blocks in page order, so a page is
+    complete as soon as a block of a later page shows up. Only the current
+    page's lines are held; each response's block list is dropped once read.
+    """
+    current_page = None
+    lines = []
+    confidences = []
+
+    def page():
+        confidence = sum(confidences) / len(confidences) if confidences else None
+        return current_page, '\n'.join(lines), confidence, len(lines)
+
+    for response in responses:
+        for block in response.get('Blocks', []):
+            if block.get('BlockType') != 'LINE':
+                continue
+            page_number = block.get('Page', 1)
+            if current_page is not None and page_number != current_page:
+                yield page()
+                lines, confidences = [], []
+            current_page = page_number
+            lines.append(block.get('Text', ''))
+            if block.get('Confidence') is not None:
+                confidences.append(block['Confidence'])
+
+    if current_page is not None:
+        yield page()
+
+
+def store_pages(ocr_result, pages, batch_size=None):
+    """
+    Write page rows for an OCR result in batches and return the document text.
+
+    Existing pages of the result are replaced. pages may be a generator
+    fetching from Textract or running OCR, so no transaction is held while
+    it produces pages: the old rows are deleted up front and each batch is
+    inserted in its own short transaction. A failure part way leaves the
+    pages written so far; the result isn't completed, and a retry replaces
+    them. The full text is built with one join over the page texts instead
+    of growing a string per page.
+    """
+    batch_size = batch_size or getattr(settings, 'OCR_PAGE_BATCH_SIZE', 50)
+    page_texts = []
+    batch = []
+
+    def write(batch):
+        with transaction.atomic():
+            OCRPage.objects.bulk_create(batch)
+
+    OCRPage.objects.filter(ocr_result=ocr_result).delete()
+    for page_number, text, confidence, line_count in pages:
+        page_texts.append(text)
+        batch.append(OCRPage(
+            ocr_result=ocr_result,
+            page_number=page_number,
+            text=text,
+            confidence=confidence,
+            line_count=line_count,
+        ))
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+
+    return '\n'.join(page_texts).strip(), len(page_texts)
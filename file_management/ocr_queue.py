@@ -0,0 +1,310 @@
+import itertools
+import queue
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import OCRJob, OCRPreference
+from .textract_events import notifications_enabled
+
+LANE_PRIORITY = {'interactive': 0, 'backfill': 1}
+
+lane_order = Case(
+    *[When(lane=lane, then=Value(priority)) for lane, priority in LANE_PRIORITY.items()],
+    output_field=IntegerField()
+)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# Backends
+
+class LocalBackend:
+    """
+    In-process priority queue: interactive jobs are taken before backfill.
+
+    With OCR_LOCAL_WORKERS > 0, daemon threads run jobs as they arrive; with
+    0 nothing runs until drain() (tests, or the run_ocr_jobs command).
+    Needs no broker; jobs still survive restarts because the rows do.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, lane, countdown=0):
+        if countdown:
+            timer = threading.Timer(countdown, self.submit, args=(job_id, lane))
+            timer.daemon = True
+            timer.start()
+            return
+        self._queue.put((LANE_PRIORITY.get(lane, 1), next(self._sequence), job_id))
+        self._ensure_workers()
+
+    def _ensure_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"ocr-worker-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            _, _, job_id = self._queue.get()
+            try:
+                run_job(job_id)
+            except Exception as e:
+                print(f"[OCR Queue] Worker error on job {job_id}: {str(e)}")
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def drain(self):
+        """Run everything queued so far in the calling thread. Returns the number of jobs taken"""
+        taken = 0
+        while True:
+            try:
+                _, _, job_id = self._queue.get_nowait()
+            except queue.Empty:
+                return taken
+            try:
+                run_job(job_id)
+            finally:
+                self._queue.task_done()
+            taken += 1
+
+
+class CeleryBackend:
+    """
+    Sends job ids to file_management.tasks.run_ocr_job, one Celery queue per lane.
+
+    Start workers on both queues, e.g.
+    `celery -A voice_retrieval worker -Q celery,ocr_interactive,ocr_backfill`,
+    or dedicate workers to ocr_interactive so backfill can't starve uploads.
+    """
+
+    def submit(self, job_id, lane, countdown=0):
+        from voice_retrieval.celery import app
+
+        queues = _setting('OCR_CELERY_QUEUES', {'interactive': 'ocr_interactive', 'backfill': 'ocr_backfill'})
+        # send_task by name: the web process doesn't import the worker's OCR dependencies
+        app.send_task(
+            'file_management.tasks.run_ocr_job',
+            args=[job_id],
+            queue=queues.get(lane, queues['backfill']),
+            countdown=countdown or None,
+        )
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend():
+    name = _setting('OCR_QUEUE_BACKEND', 'local')
+    with _backends_lock:
+        if name not in _backends:
+            if name == 'celery':
+                _backends[name] = CeleryBackend()
+            elif name == 'local':
+                _backends[name] = LocalBackend(_setting('OCR_LOCAL_WORKERS', 2))
+            else:
+                raise ValueError(f"Unknown OCR_QUEUE_BACKEND: {name}")
+        return _backends[name]
+
+
+# Queueing
+
+def dispatch(job, countdown=0):
+    """Hand a job id to the backend; on failure the row stays queued for run_ocr_jobs"""
+    try:
+        get_backend().submit(job.id, job.lane, countdown)
+    except Exception as e:
+        print(f"[OCR Queue] Could not dispatch job {job.id}, it stays queued: {str(e)}")
+
+
+def enqueue_ocr(user_file, lane='interactive'):
+    """
+    Queue OCR for a file and return its OCRJob (an active job is reused).
+
+    The backend only sees the job once the surrounding transaction commits,
+    so a worker never looks for a row that isn't visible yet.
+    """
+    job = OCRJob.objects.filter(file=user_file, status__in=OCRJob.ACTIVE_STATUSES).first()
+    if job is not None:
+        return job
+
+    job = OCRJob.objects.create(file=user_file, user_id=user_file.user_id, lane=lane)
+    print(f"[OCR Queue] Queued job {job.id} for file {user_file.id} ({lane})")
+    transaction.on_commit(lambda: dispatch(job))
+    return job
+
+
+def claim_job(job_id):
+    """
+    Move a queued/waiting job to running, or return None.
+
+    None means another worker has it, it already finished, or the user is
+    at OCR_MAX_JOBS_PER_USER; in that last case the job stays queued and is
+    dispatched again when one of the user's running jobs ends.
+    """
+    with transaction.atomic():
+        job = (
+            OCRJob.objects.select_for_update()
+            .filter(pk=job_id, status__in=['queued', 'waiting'])
+            .first()
+        )
+        if job is None:
+            return None
+
+        # Claims for one user queue up on their OCRPreference row, so two workers
+        # can't both count the same free slot
+        OCRPreference.objects.get_or_create(user_id=job.user_id)
+        OCRPreference.objects.select_for_update().filter(user_id=job.user_id).first()
+
+        running = OCRJob.objects.filter(user_id=job.user_id, status='running').count()
+        if running >= _setting('OCR_MAX_JOBS_PER_USER', 2):
+            return None
+
+        if job.status == 'queued':
+            job.attempts += 1
+        job.status = 'running'
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'attempts', 'started_at'])
+    return job
+
+
+def _finish(job, status, result=None, error=''):
+    job.status = status
+    job.result = result
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+
+
+def _reschedule(job, status, delay):
+    job.status = status
+    job.available_at = timezone.now() + timedelta(seconds=delay)
+    job.save(update_fields=['status', 'polls', 'available_at'])
+    dispatch(job, countdown=delay)
+
+
+def _dispatch_next_for_user(user_id):
+    """
+    Release the user's next due job now that a slot is free, in run_pending's
+    order. Waiting jobs count too: a poll refused at OCR_MAX_JOBS_PER_USER
+    isn't dispatched again by anything else.
+    """
+    job = (
+        OCRJob.objects.filter(user_id=user_id, status__in=['queued', 'waiting'], available_at__lte=timezone.now())
+        .order_by(lane_order, 'available_at')
+        .first()
+    )
+    if job is not None:
+        dispatch(job)
+
+
+def run_job(job_id):
+    """
+    Execute one OCR job. Called by backend workers with a job id.
+
+    PDFs don't block the worker: Textract is started (or checked) and the
+    job goes to 'waiting', to be polled again after OCR_JOB_POLL_INTERVAL.
+    """
+    from .services import OCRService
+
+    job = claim_job(job_id)
+    if job is None:
+        return None
+
+    try:
+        result = OCRService(max_pdf_wait=0).process_file(job.file)
+    except Exception as e:
+        result = {'status': 'error', 'error': str(e)}
+
+    outcome = result.get('status')
+    if outcome == 'processing':
+        job.polls += 1
+        if job.polls > _setting('OCR_JOB_MAX_POLLS', 120):
+            _finish(job, 'failed', result, 'Textract did not finish in time')
+        elif notifications_enabled():
+            # The completion notification finishes the job; run_ocr_jobs or
+            # the sweeper only look again if it goes silent
+            job.status = 'waiting'
+            job.available_at = timezone.now() + timedelta(seconds=_setting('OCR_SWEEP_SILENT_AFTER', 120))
+            job.save(update_fields=['status', 'polls', 'available_at'])
+        else:
+            _reschedule(job, 'waiting', _setting('OCR_JOB_POLL_INTERVAL', 5))
+    elif outcome == 'error':
+        if job.attempts < _setting('OCR_JOB_MAX_ATTEMPTS', 3):
+            # Exponential backoff between attempts
+            _reschedule(job, 'queued', _setting('OCR_JOB_RETRY_DELAY', 10) * 2 ** (job.attempts - 1))
+        else:
+            _finish(job, 'failed', result, result.get('error', ''))
+    else:
+        _finish(job, 'completed', result)
+
+    print(f"[OCR Queue] Job {job.id} for file {job.file_id}: {job.status}")
+    _dispatch_next_for_user(job.user_id)
+    return job
+
+
+def finish_waiting_jobs(file_id, result):
+    """Close the jobs waiting on a file's Textract job once it has been finalised elsewhere"""
+    status = 'completed' if result.get('status') == 'completed' else 'failed'
+    for job in OCRJob.objects.filter(file_id=file_id, status='waiting'):
+        _finish(job, status, result, result.get('error', ''))
+
+
+def recover_stale_jobs():
+    """Requeue jobs left running by a worker that died (older than OCR_JOB_STALE_AFTER seconds)"""
+    cutoff = timezone.now() - timedelta(seconds=_setting('OCR_JOB_STALE_AFTER', 15 * 60))
+    return OCRJob.objects.filter(status='running', started_at__lt=cutoff).update(status='queued')
+
+
+def run_pending(limit=None, lanes=None):
+    """
+    Run due jobs from the database in this process, interactive lane first.
+
+    Covers jobs whose dispatch was lost (broker down, process restarted).
+    Returns the number of jobs executed.
+    """
+    due = OCRJob.objects.filter(
+        Q(status='queued') | Q(status='waiting'),
+        available_at__lte=timezone.now()
+    ).order_by(lane_order, 'available_at')
+    if lanes:
+        due = due.filter(lane__in=lanes)
+    if limit:
+        due = due[:limit]
+
+    executed = 0
+    for job_id in list(due.values_list('id', flat=True)):
+        if run_job(job_id) is not None:
+            executed += 1
+    return executed
+
+
+def job_status(job):
+    """Public view of a job for the upload response and the status endpoint"""
+    from django.urls import reverse
+
+    return {
+        'job_id': job.id,
+        'file_id': job.file_id,
+        'status': job.status,
+        'lane': job.lane,
+        'attempts': job.attempts,
+        'result': job.result,
+        'error': job.error or None,
+        'status_url': reverse('ocr_job_status', args=[job.id]),
+    }
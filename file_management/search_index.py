@@ -0,0 +1,302 @@
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import OCRResult, UserFile
+
+# file_id: the UserFile id; rank: lower is better; snippet: the matching passage, terms in [brackets]
+SearchHit = namedtuple('SearchHit', ['file_id', 'rank', 'snippet'])
+
+FTS_TABLE = 'file_management_search'
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# Highlight markers used inside the query, shown as brackets
+_MARKERS = str.maketrans({'\x02': '[', '\x03': ']'})
+
+# Whether the FTS5 table exists, per database name
+_fts_tables = {}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def query_terms(query):
+    """The words of a search box query, lowercased; punctuation and FTS operators are dropped"""
+    return [term.lower() for term in _TOKEN.findall(query or '')]
+
+
+def _index_rows(file_ids):
+    """(file_id, user_id, filename, OCR text) of the given files, the latest completed OCR text of each"""
+    texts = {}
+    completed = (
+        OCRResult.objects.filter(file_id__in=file_ids, status='completed')
+        .order_by('file_id', 'id')
+        .values_list('file_id', 'text_content')
+    )
+    for file_id, text_content in completed:
+        texts[file_id] = text_content or ''
+    rows = UserFile.objects.filter(id__in=file_ids).values_list('id', 'user_id', 'original_filename')
+    return [(file_id, user_id, filename or '', texts.get(file_id, '')) for file_id, user_id, filename in rows]
+
+
+class SearchBackend:
+    """
+    Full-text search over file names and OCR text.
+
+    refresh() re-reads the given files from their tables (called when an
+    OCR result completes or a file is renamed), remove() drops deleted
+    files, search() returns ranked SearchHits and matching() a Q usable in
+    any UserFile filter.
+    """
+    name = None
+
+    def is_available(self):
+        return True
+
+    def refresh(self, file_ids):
+        pass
+
+    def remove(self, file_ids):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        return 0
+
+    def matching(self, user, query):
+        raise NotImplementedError
+
+    def search(self, user, query, limit=20, within=None):
+        raise NotImplementedError
+
+    def count(self, user, query, within=None):
+        raise NotImplementedError
+
+
+class SQLiteFTS5Backend(SearchBackend):
+    """
+    An FTS5 inverted index, one row per UserFile (rowid = file id).
+
+    Columns: filename, content (the OCR text) and owner ("u<user id>"). The
+    owner is an indexed token, so a user's matches are found through the
+    index rather than by filtering everyone's. Query words are prefix
+    matched and all have to occur; results are ranked by BM25 with file
+    names weighted above content.
+    """
+    name = 'fts5'
+
+    def __init__(self):
+        self.table = FTS_TABLE
+
+    def is_available(self):
+        if connection.vendor != 'sqlite':
+            return False
+        database = connection.settings_dict['NAME']
+        if database not in _fts_tables:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+                _fts_tables[database] = cursor.fetchone() is not None
+        return _fts_tables[database]
+
+    def _expression(self, user, query):
+        terms = query_terms(query)
+        if not terms:
+            return None
+        words = ' '.join(f'"{term}"*' for term in terms)
+        return f'owner:"u{user.pk}" AND {{filename content}}: ({words})'
+
+    def _within(self, within):
+        """SQL restricting rowid to a UserFile queryset, and its params"""
+        if within is None:
+            return '', []
+        sql, params = within.order_by().values('id').query.sql_with_params()
+        return f' AND rowid IN ({sql})', list(params)
+
+    def refresh(self, file_ids):
+        file_ids = list(file_ids)
+        if not file_ids:
+            return
+        rows = _index_rows(file_ids)
+        with connection.cursor() as cursor:
+            self._delete(cursor, file_ids)
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, filename, content, owner) VALUES (%s, %s, %s, %s)",
+                [(file_id, filename, text, f"u{user_id}") for file_id, user_id, filename, text in rows],
+            )
+
+    def _delete(self, cursor, file_ids):
+        cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(file_id,) for file_id in file_ids])
+
+    def remove(self, file_ids):
+        with connection.cursor() as cursor:
+            self._delete(cursor, list(file_ids))
+
+    def rebuild(self, batch_size=1000):
+        """Re-index every file, batch_size files at a time"""
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+        ids = list(UserFile.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), batch_size):
+            self.refresh(ids[start:start + batch_size])
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+        return len(ids)
+
+    def matching(self, user, query):
+        expression = self._expression(user, query)
+        if expression is None:
+            return Q(pk__in=[])
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [expression]))
+
+    def search(self, user, query, limit=20, within=None):
+        expression = self._expression(user, query)
+        if expression is None:
+            return []
+        within_sql, within_params = self._within(within)
+        weights = _setting('FILE_SEARCH_WEIGHTS', (10.0, 1.0))
+        tokens = _setting('FILE_SEARCH_SNIPPET_TOKENS', 12)
+        with connection.cursor() as cursor:
+            # A passage of the content when the words are in it, else the highlighted file name
+            cursor.execute(
+                f"SELECT rowid, bm25({self.table}, %s, %s, 0.0), "
+                f"snippet({self.table}, 1, char(2), char(3), '…', %s), highlight({self.table}, 0, char(2), char(3)) "
+                f"FROM {self.table} WHERE {self.table} MATCH %s{within_sql} "
+                f"ORDER BY 2 LIMIT %s",
+                [weights[0], weights[1], tokens, expression, *within_params, limit],
+            )
+            return [
+                SearchHit(file_id, rank, (passage if '\x02' in passage else filename).translate(_MARKERS))
+                for file_id, rank, passage, filename in cursor.fetchall()
+            ]
+
+    def count(self, user, query, within=None):
+        expression = self._expression(user, query)
+        if expression is None:
+            return 0
+        within_sql, within_params = self._within(within)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM {self.table} WHERE {self.table} MATCH %s{within_sql}",
+                [expression, *within_params],
+            )
+            return cursor.fetchone()[0]
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """
+    Fallback for databases without an index here: icontains on the name and
+    the completed OCR text, newest first, snippets cut in Python. Every
+    query scans the user's OCR text, as the views did before.
+    """
+    name = 'database'
+
+    def matching(self, user, query):
+        terms = query_terms(query)
+        if not terms:
+            return Q(pk__in=[])
+        condition = Q()
+        for term in terms:
+            in_text = OCRResult.objects.filter(
+                file__user=user, status='completed', text_content__icontains=term
+            ).values('file_id')
+            condition &= Q(original_filename__icontains=term) | Q(pk__in=in_text)
+        return condition
+
+    def _snippet(self, text, terms, tokens):
+        lowered = text.lower()
+        positions = [lowered.find(term) for term in terms if term in lowered]
+        if not positions:
+            return ''
+        words = text[max(0, min(positions) - 60):].split()
+        snippet = ' '.join(words[:tokens])
+        for term in terms:
+            snippet = re.sub(f"({re.escape(term)})", r'[\1]', snippet, flags=re.IGNORECASE)
+        return f"…{snippet}…"
+
+    def search(self, user, query, limit=20, within=None):
+        terms = query_terms(query)
+        files = (within if within is not None else UserFile.objects.filter(user=user)).filter(user=user)
+        matches = list(
+            files.filter(self.matching(user, query)).order_by('-upload_date', '-id')
+            .values_list('id', 'original_filename')[:limit]
+        )
+        texts = dict(
+            OCRResult.objects.filter(file_id__in=[file_id for file_id, _ in matches], status='completed')
+            .values_list('file_id', 'text_content')
+        )
+        tokens = _setting('FILE_SEARCH_SNIPPET_TOKENS', 12)
+        return [
+            SearchHit(file_id, position, self._snippet(filename, terms, tokens)
+                      or self._snippet(texts.get(file_id) or '', terms, tokens))
+            for position, (file_id, filename) in enumerate(matches)
+        ]
+
+    def count(self, user, query, within=None):
+        files = (within if within is not None else UserFile.objects.filter(user=user)).filter(user=user)
+        return files.filter(self.matching(user, query)).count()
+
+
+BACKENDS = {
+    SQLiteFTS5Backend.name: SQLiteFTS5Backend,
+    DatabaseSearchBackend.name: DatabaseSearchBackend,
+}
+
+
+def get_backend(name=None):
+    """
+    The FILE_SEARCH_BACKEND backend. 'auto' uses FTS5 when the index table
+    exists (SQLite), else the database fallback; an unavailable backend
+    falls back too, so search never breaks for want of an index.
+    """
+    name = name or _setting('FILE_SEARCH_BACKEND', 'auto')
+    if name == 'auto':
+        name = SQLiteFTS5Backend.name
+    backend_class = BACKENDS.get(name)
+    if backend_class is None:
+        print(f"[Search Index] Unknown search backend '{name}', using the database")
+        backend_class = DatabaseSearchBackend
+    try:
+        backend = backend_class()
+        if backend.is_available():
+            return backend
+    except OperationalError as e:
+        print(f"[Search Index] Search backend '{name}' failed: {str(e)}")
+    return DatabaseSearchBackend()
+
+
+def search_files(user, query, limit=None, within=None):
+    """Ranked SearchHits of the user's files for a query"""
+    return get_backend().search(user, query, limit=limit or _setting('FILE_SEARCH_MAX_RESULTS', 200), within=within)
+
+
+def search_filter(user, query):
+    """
+    Q of the files whose name or OCR text matches, or whose name or category
+    name contains the query: the index matches whole words and their
+    prefixes, so "2023" wouldn't find invoice2023.pdf through it alone.
+    """
+    return (
+        get_backend().matching(user, query)
+        | Q(original_filename__icontains=query)
+        | Q(category__name__icontains=query)
+    )
+
+
+def refresh_files(file_ids):
+    """Re-index files after their name or OCR text changed; index errors never fail the caller"""
+    try:
+        get_backend().refresh(file_ids)
+    except Exception as e:
+        print(f"[Search Index] Error indexing files {list(file_ids)}: {str(e)}")
+
+
+def remove_files(file_ids):
+    try:
+        get_backend().remove(file_ids)
+    except Exception as e:
+        print(f"[Search Index] Error removing files {list(file_ids)} from the index: {str(e)}")
@@ -1,5 +1,8 @@
 
+from django.db import models
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
+from storage_management.signing import get_url_signer
 from .models import UserFile, FileCategory, CardDetails, AppSubscription, OCRResult
 
 
@@ -8,6 +11,55 @@ class FileCategorySerializer(serializers.ModelSerializer):
         model = FileCategory
         fields = ['id', 'name', 'description', 'is_default']
 
+class UserFileListSerializer(serializers.ListSerializer):
+    """
+    Serializes a page of files with a fixed number of queries, whatever its size.
+
+    Before any row is serialized: categories and paired documents are
+    loaded in one query each (skipped when the queryset already joined
+    them), access flags are computed for every file and partner, and every
+    file URL is presigned in one batch. Only URLs of fields the child
+    serializer actually has are signed, so a sparse listing without URL
+    fields signs nothing.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        files = list(iterable)
+
+        fields = self.child.fields
+        wants_file_urls = 'file_url' in fields
+        wants_thumbnails = 'thumbnail_url' in fields
+        wants_pairs = 'document_pair' in fields
+
+        lookups = []
+        if 'category' in fields:
+            lookups.append('category')
+        if wants_pairs:
+            lookups.append('paired_document')
+        if lookups:
+            prefetch_related_objects(files, *lookups)
+
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        access = {}
+        s3_keys = []
+        for user_file in files:
+            access[user_file.id] = user_file.is_accessible_by_user(user)
+            if wants_file_urls or (wants_thumbnails and user_file.file_type == 'image'):
+                s3_keys.append(user_file.s3_key)
+            if wants_pairs and user_file.document_side != 'single' and user_file.paired_document_id:
+                paired = user_file.paired_document
+                if paired:
+                    access[paired.id] = paired.is_accessible_by_user(user)
+                    if access[paired.id]:
+                        s3_keys.append(paired.s3_key)
+
+        self.child.context['access'] = access
+        self.child.context['file_urls'] = get_url_signer().sign_many(s3_keys) if s3_keys else {}
+        return [self.child.to_representation(item) for item in files]
+
+
 class UserFileSerializer(serializers.ModelSerializer):
     category = FileCategorySerializer(read_only=True)
     category_id = serializers.IntegerField(write_only=True, required=False)
@@ -30,17 +82,31 @@ class UserFileSerializer(serializers.ModelSerializer):
             'is_locked', 'locked_at', 'can_access'
         ]
         read_only_fields = ['upload_date', 'file_size', 'original_filename']
+        list_serializer_class = UserFileListSerializer
 
-    def get_file_url(self, obj):
+    def _presigned_url(self, obj):
+        urls = self.context.get('file_urls')
+        if urls and obj.s3_key in urls:
+            return urls[obj.s3_key]
         return obj.get_file_url()
+
+    def get_file_url(self, obj):
+        return self._presigned_url(obj)
     
-    def get_can_access(self, obj):
-        """Check if current user can access file"""
+    def _can_access(self, obj):
+        """Access flag precomputed by the list serializer, else checked for this file"""
+        access = self.context.get('access')
+        if access and obj.id in access:
+            return access[obj.id]
         request = self.context.get('request')
         if request:
             return obj.is_accessible_by_user(request.user)
         return False
 
+    def get_can_access(self, obj):
+        """Check if current user can access file"""
+        return self._can_access(obj)
+
     def get_file_size_display(self, obj):
         return obj.get_file_size_display()
     
@@ -55,7 +121,7 @@ class UserFileSerializer(serializers.ModelSerializer):
             if doc:
                 pair_data[side] = {
                     'id': doc.id,
-                    'file_url': doc.get_file_url() if doc.is_accessible_by_user(self.context.get('request').user) else None,
+                    'file_url': self._presigned_url(doc) if self._can_access(doc) else None,
                     'original_filename': doc.original_filename,
                     'is_locked': doc.locked
                 }
@@ -65,6 +131,27 @@ class UserFileSerializer(serializers.ModelSerializer):
     def get_has_pair(self, obj):
         return obj.has_pair()
 
+class SparseUserFileSerializer(UserFileSerializer):
+    """
+    UserFileSerializer limited to the requested fields (fields=None keeps all),
+    plus thumbnail_url: the presigned URL of image files, None for others.
+    """
+    thumbnail_url = serializers.SerializerMethodField()
+
+    class Meta(UserFileSerializer.Meta):
+        fields = UserFileSerializer.Meta.fields + ['thumbnail_url']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def get_thumbnail_url(self, obj):
+        if obj.file_type != 'image':
+            return None
+        return self._presigned_url(obj)
+
 class OCRResultSerializer(serializers.ModelSerializer):
     class Meta:
         model = OCRResult
@@ -1,19 +1,26 @@
 
 from datetime import date
-import boto3, time
-from django.db import models
+import time
+from django.db import models, transaction
+from django.db.models import Q, QuerySet
 from django.conf import settings
+from django.utils import timezone
 from .models import ExpiryDetails, FileCategory, UserFile, CardDetails, AppSubscription, OCRResult, OCRPreference
-from .utils import extract_text_from_document, FileCategorizationService
+from .utils import FileCategorizationService
+from storage_management.clients import get_s3_client, get_textract_client
+from storage_management.utils import S3StorageManager
+from storage_management import ledger
+from .keys import resolve_s3_key
+from . import ocr_cache
+from .document_ocr import DocumentOCR, document_files
+from .extractors import EXTRACTABLE_EXTENSIONS, extract_text
+from .ocr_engines import TextractEngine, engine_name_for, get_engine
+from .ocr_pages import iter_analysis_responses, iter_pages, store_pages
+from .textract_events import is_silent, notifications_enabled
 
 class ExpiryManagementService:
     def __init__(self):
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
+        self.s3_client = get_s3_client()
         self.bucket_name = settings.AWS_STORAGE_BUCKET_NAME
 
     def check_and_move_expired_items(self):
@@ -63,7 +70,7 @@ class ExpiryManagementService:
             subscription.status = 'expired'
             subscription.save()
 
-    def move_file_to_expired_folder(self, s3_key, expired_category):
+    def move_file_to_expired_folder(self, s3_key, expired_category, user_file=None):
         """Move file to expired folder in S3"""
         new_key = f"expired/{s3_key}"
         try:
@@ -78,6 +85,13 @@ class ExpiryManagementService:
                 Bucket=self.bucket_name,
                 Key=s3_key
             )
+            if user_file is not None:
+                # The bytes still belong to the user, so the storage ledger is
+                # unchanged; only repoint the row at the moved object
+                UserFile.objects.filter(pk=user_file.pk).update(
+                    s3_key=new_key,
+                    category=expired_category
+                )
             return new_key
         except Exception as e:
             print(f"Error moving file to expired folder: {str(e)}")
@@ -93,19 +107,12 @@ class ExpiryManagementService:
 
 
 class OCRService:
-    def __init__(self):
-        self.textract_client = boto3.client(
-            'textract',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
+    def __init__(self, max_pdf_wait=30):
+        # Seconds process_file may block polling a PDF Textract job; queue
+        # workers pass 0 and re-poll through the job queue instead
+        self.max_pdf_wait = max_pdf_wait
+        self.textract_client = get_textract_client()
+        self.s3_client = get_s3_client()
         self.categorization_service = FileCategorizationService()
 
     def _verify_s3_object_exists(self, s3_key):
@@ -130,31 +137,8 @@ class OCRService:
             return False
 
     def _normalize_s3_key(self, user_file):
-        """Normalize and fix S3 key if needed"""
-        original_key = user_file.s3_key
-        
-        # Try different possible S3 key formats
-        possible_keys = [
-            original_key,  # Original key
-            user_file.file.name,  # File field name
-            f"uploads/{user_file.original_filename}",  # uploads/ prefix
-            f"user_{user_file.user.id}/{user_file.original_filename}",  # user prefix
-            user_file.original_filename  # Just filename
-        ]
-        
-        print(f"[OCR Service] Trying to find S3 object with these keys:")
-        for i, key in enumerate(possible_keys):
-            if key:  # Skip empty keys
-                print(f"[OCR Service]   {i+1}. {key}")
-                if self._verify_s3_object_exists(key):
-                    if key != original_key:
-                        print(f"[OCR Service] Found working S3 key: {key}")
-                        # Update the file with the correct S3 key
-                        user_file.s3_key = key
-                        user_file.save(update_fields=['s3_key'])
-                    return key
-        
-        raise Exception(f"S3 object not found with any key variation for file {user_file.id}")
+        """Resolve the file's S3 key (index first, parallel probe on a miss)"""
+        return resolve_s3_key(user_file, self.s3_client)
 
     def process_file(self, user_file):
         """Main entry point for OCR processing with S3 debugging"""
@@ -173,6 +157,12 @@ class OCRService:
                 self._clear_pending_flag(user_file)
                 return {'status': 'skipped', 'reason': 'OCR disabled by user'}
 
+            # Both sides of a paired document are OCR'd and categorized together
+            if user_file.paired_document_id:
+                result = DocumentOCR(self).process(document_files(user_file), ocr_pref)
+                if result is not None:
+                    return result
+
             # Verify and normalize S3 key
             try:
                 s3_key = self._normalize_s3_key(user_file)
@@ -194,12 +184,16 @@ class OCRService:
             print(f"[OCR Service] Processing file type: {file_extension}")
             
             # Process based on file type
-            if file_extension in ['txt', 'docx', 'md']:
-                return self._process_text_file(user_file, ocr_result, file_extension)
-            elif file_extension in ['jpg', 'jpeg', 'png']:
-                return self._process_image_file(user_file, ocr_result)
-            elif file_extension == 'pdf':
-                return self._process_pdf_file(user_file, ocr_result)
+            if file_extension in EXTRACTABLE_EXTENSIONS:
+                return self._process_text_file(user_file, ocr_result, file_extension, s3_key)
+            elif file_extension in ['jpg', 'jpeg', 'png', 'pdf']:
+                engine = self.get_engine(ocr_pref, pdf=file_extension == 'pdf')
+                cached = self._process_from_cache(user_file, ocr_result, engine)
+                if cached is not None:
+                    return cached
+                if file_extension == 'pdf':
+                    return self._process_pdf_file(user_file, ocr_result, s3_key, engine)
+                return self._process_image_file(user_file, ocr_result, s3_key, engine)
             else:
                 print(f"[OCR Service] Unsupported file type: {file_extension}")
                 self._mark_as_not_applicable(user_file, ocr_result)
@@ -212,12 +206,15 @@ class OCRService:
             self._handle_error(user_file, str(e))
             return {'status': 'error', 'error': str(e)}
 
-    def _process_text_file(self, user_file, ocr_result, file_extension):
-        """Process text-based files (txt, docx, md)"""
+    def _process_text_file(self, user_file, ocr_result, file_extension, s3_key=None):
+        """Process text and Office files (see extractors.HANDLERS) without Textract"""
         try:
             print(f"[OCR Service] Processing text file: {file_extension}")
-            text_content = extract_text_from_document(user_file.s3_key, file_extension)
-            print(f"[OCR Service] Extracted text length: {len(text_content) if text_content else 0}")
+            extraction = extract_text(s3_key or user_file.s3_key, file_extension, self.s3_client)
+            text_content = extraction.text
+            print(f"[OCR Service] Extracted text length: {len(text_content)}")
+            if extraction.truncated:
+                print(f"[OCR Service] Extraction stopped at the byte budget after {extraction.bytes_read} bytes")
             
             if text_content:
                 # Update OCR result
@@ -246,32 +243,37 @@ class OCRService:
             self._handle_error(user_file, str(e))
             return {'status': 'error', 'error': str(e)}
 
-    def _process_image_file(self, user_file, ocr_result):
-        """Process image files using Textract"""
+    def get_engine(self, ocr_pref=None, pdf=False):
+        """OCR engine for the user's preference, else settings.OCR_ENGINE (see ocr_engines)"""
+        return get_engine(
+            engine_name_for(ocr_pref), textract_client=self.textract_client, s3_client=self.s3_client, pdf=pdf
+        )
+
+    def _process_from_cache(self, user_file, ocr_result, engine):
+        """Complete OCR from the content-hash cache without calling the engine, or return None"""
+        entry = ocr_cache.lookup(user_file.file_hash, engine.version)
+        if entry is None:
+            return None
+        text_content = ocr_cache.restore(entry, ocr_result)
+        result = self._complete_with_text(user_file, ocr_result, text_content)
+        result['cached'] = True
+        return result
+
+    def _process_image_file(self, user_file, ocr_result, s3_key=None, engine=None):
+        """Process image files with the selected OCR engine (Textract by default)"""
         try:
-            print(f"[OCR Service] Processing image file with Textract")
-            
-            response = self.textract_client.detect_document_text(
-                Document={
-                    'S3Object': {
-                        'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
-                        'Name': user_file.s3_key
-                    }
-                }
-            )
+            engine = engine or self.get_engine()
+            print(f"[OCR Service] Processing image file with {engine.name}")
             
-            # Extract text lines
-            extracted_lines = [
-                item['Text'] for item in response['Blocks'] 
-                if item['BlockType'] == 'LINE'
-            ]
-            text_content = '\n'.join(extracted_lines)
+            # Extract text lines (one page row for the image)
+            text_content, _ = store_pages(ocr_result, engine.image_pages(s3_key or user_file.s3_key))
             print(f"[OCR Service] Extracted text length: {len(text_content)}")
             
             # Update OCR result
             ocr_result.text_content = text_content
             ocr_result.status = 'completed'
             ocr_result.save()
+            ocr_cache.store_result(user_file.file_hash, engine.version, ocr_result)
             
             # Categorize and update file
             category_result = self._categorize_file(user_file, text_content)
@@ -291,13 +293,23 @@ class OCRService:
             self._handle_error(user_file, str(e))
             return {'status': 'error', 'error': str(e)}
 
-    def _process_pdf_file(self, user_file, ocr_result):
-        """Process PDF files using async Textract"""
+    def _process_pdf_file(self, user_file, ocr_result, s3_key=None, engine=None):
+        """Process PDF files using async Textract, or page by page with a local engine"""
         try:
+            engine = engine or self.get_engine(pdf=True)
+            if not engine.async_pdf:
+                print(f"[OCR Service] Processing PDF locally with {engine.name}")
+                text_content, page_count = store_pages(ocr_result, engine.pdf_pages(s3_key or user_file.s3_key))
+                print(f"[OCR Service] Total text extracted: {len(text_content)} characters from {page_count} pages")
+                return self._complete_with_text(user_file, ocr_result, text_content, engine.version)
+
             print(f"[OCR Service] Starting async PDF processing")
             
             # Check if job already exists
             if ocr_result.job_id and ocr_result.status == 'processing':
+                if not is_silent(ocr_result):
+                    # Completion arrives as a notification; don't poll yet
+                    return {'status': 'processing', 'job_id': ocr_result.job_id}
                 job_status = self._check_textract_job(ocr_result.job_id)
                 if job_status == 'SUCCEEDED':
                     return self._complete_pdf_processing(user_file, ocr_result)
@@ -307,27 +319,19 @@ class OCRService:
                     return {'status': 'processing', 'job_id': ocr_result.job_id}
             
             # Start new Textract job
-            response = self.textract_client.start_document_analysis(
-                DocumentLocation={
-                    'S3Object': {
-                        'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
-                        'Name': user_file.s3_key
-                    }
-                },
-                FeatureTypes=['TABLES', 'FORMS']
-            )
-            
-            job_id = response['JobId']
+            job_id = engine.start_pdf_job(user_file, s3_key or user_file.s3_key)
             
             # Update OCR result
             ocr_result.job_id = job_id
             ocr_result.status = 'processing'
+            ocr_result.job_started_at = timezone.now()
+            ocr_result.last_polled_at = None
             ocr_result.save()
             
             print(f"[OCR Service] Started Textract job: {job_id}")
             
             # Try to wait and complete immediately (for smaller PDFs)
-            return self._wait_for_pdf_completion(user_file, ocr_result, max_wait=30)
+            return self._wait_for_pdf_completion(user_file, ocr_result, max_wait=self.max_pdf_wait)
             
         except Exception as e:
             print(f"[OCR Service] Error processing PDF file: {str(e)}")
@@ -338,6 +342,8 @@ class OCRService:
 
     def _wait_for_pdf_completion(self, user_file, ocr_result, max_wait=30):
         """Wait for PDF processing to complete (up to max_wait seconds)"""
+        if notifications_enabled():
+            return {'status': 'processing', 'job_id': ocr_result.job_id}
         start_time = time.time()
         
         while time.time() - start_time < max_wait:
@@ -363,59 +369,22 @@ class OCRService:
     def _check_textract_job(self, job_id):
         """Check status of Textract job"""
         try:
+            OCRResult.objects.filter(job_id=job_id).update(last_polled_at=timezone.now())
             response = self.textract_client.get_document_analysis(JobId=job_id)
             return response['JobStatus']
         except Exception as e:
             print(f"[OCR Service] Error checking job {job_id}: {str(e)}")
             return 'FAILED'
 
-    def _complete_pdf_processing(self, user_file, ocr_result):
-        """Complete PDF processing when Textract job succeeds"""
+    def _complete_pdf_processing(self, user_file, ocr_result, response=None):
+        """Complete PDF processing when Textract job succeeds (response: an already fetched first page)"""
         try:
             print(f"[OCR Service] Completing PDF processing for job: {ocr_result.job_id}")
-            response = self.textract_client.get_document_analysis(JobId=ocr_result.job_id)
-            
-            # Extract text from all pages
-            text_content = ""
-            blocks = response.get('Blocks', [])
-            
-            # Handle pagination
-            page_count = 1
-            while True:
-                lines = [block['Text'] for block in blocks if block['BlockType'] == 'LINE']
-                text_content += '\n'.join(lines) + '\n'
-                print(f"[OCR Service] Processed page {page_count}, lines: {len(lines)}")
-                
-                # Check for more pages
-                next_token = response.get('NextToken')
-                if not next_token:
-                    break
-                    
-                response = self.textract_client.get_document_analysis(
-                    JobId=ocr_result.job_id,
-                    NextToken=next_token
-                )
-                blocks = response.get('Blocks', [])
-                page_count += 1
-            
-            text_content = text_content.strip()
+            # Stream result pages into OCRPage rows; only one page is held at a time
+            responses = iter_analysis_responses(self.textract_client, ocr_result.job_id, response)
+            text_content, page_count = store_pages(ocr_result, iter_pages(responses))
             print(f"[OCR Service] Total text extracted: {len(text_content)} characters from {page_count} pages")
-            
-            # Update OCR result
-            ocr_result.text_content = text_content
-            ocr_result.status = 'completed'
-            ocr_result.save()
-            
-            # Categorize and update file
-            category_result = self._categorize_file(user_file, text_content)
-            print(f"[OCR Service] Final categorization result: {category_result}")
-            
-            return {
-                'status': 'completed',
-                'text_length': len(text_content),
-                'category': user_file.category.name if user_file.category else 'Miscellaneous',
-                'category_changed': category_result.get('changed', False)
-            }
+            return self._complete_with_text(user_file, ocr_result, text_content, TextractEngine.version)
             
         except Exception as e:
             print(f"[OCR Service] Error completing PDF processing: {str(e)}")
@@ -424,6 +393,25 @@ class OCRService:
             self._handle_error(user_file, str(e))
             return {'status': 'error', 'error': str(e)}
 
+    def _complete_with_text(self, user_file, ocr_result, text_content, engine_version=None):
+        """Mark an OCR result completed (caching it under engine_version) and categorize the file"""
+        ocr_result.text_content = text_content
+        ocr_result.status = 'completed'
+        ocr_result.save()
+        if engine_version:
+            ocr_cache.store_result(user_file.file_hash, engine_version, ocr_result)
+        
+        # Categorize and update file
+        category_result = self._categorize_file(user_file, text_content)
+        print(f"[OCR Service] Final categorization result: {category_result}")
+        
+        return {
+            'status': 'completed',
+            'text_length': len(text_content),
+            'category': user_file.category.name if user_file.category else 'Miscellaneous',
+            'category_changed': category_result.get('changed', False)
+        }
+
     def _categorize_file(self, user_file, text_content):
         """ENHANCED categorization with detailed logging"""
         try:
@@ -596,28 +584,120 @@ class OCRService:
             return user_file.file.name.split('.')[-1].lower()
         return ''
 
+    def finalize_textract_job(self, ocr_result):
+        """
+        Fetch a PDF job's first result page and finish the OCRResult if the job is done.
+
+        Shared by the completion-notification handler and the sweeper. The
+        status comes from Textract itself, so a notification only says when
+        to look. Returns the OCR result dict, or None while still running.
+        """
+        from .ocr_queue import finish_waiting_jobs
+
+        OCRResult.objects.filter(pk=ocr_result.pk).update(last_polled_at=timezone.now())
+        response = self.textract_client.get_document_analysis(JobId=ocr_result.job_id)
+        job_status = response['JobStatus']
+
+        if job_status == 'SUCCEEDED':
+            result = self._complete_pdf_processing(ocr_result.file, ocr_result, response=response)
+        elif job_status in ('FAILED', 'PARTIAL_SUCCESS'):
+            error = response.get('StatusMessage') or f"Textract job {job_status.lower()}"
+            self._handle_error(ocr_result.file, error)
+            result = {'status': 'error', 'error': error}
+        else:
+            return None
+
+        finish_waiting_jobs(ocr_result.file_id, result)
+        return result
+
     def check_pending_jobs(self):
-        """Check and complete pending PDF jobs"""
-        print(f"[OCR Service] Checking pending jobs...")
-        pending_jobs = OCRResult.objects.filter(
-            status='processing',
-            job_id__isnull=False
-        ).select_related('file')
+        """Sweep PDF jobs whose completion notification never arrived (see textract_events)"""
+        from .textract_events import sweep_silent_jobs
+
+        print(f"[OCR Service] Sweeping silent Textract jobs...")
+        return sweep_silent_jobs(self)
+
+
+class FileDeletionService:
+    """
+    Delete a user's files in bulk: one QuerySet delete for the rows, one
+    aggregated storage ledger write, and DeleteObjects calls of up to 1,000
+    keys for S3 (see S3StorageManager.delete_keys).
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.storage_manager = S3StorageManager(user)
+
+    def delete_files(self, files):
+        """
+        Delete UserFile rows (a QuerySet or an iterable of UserFile/ids) owned by the user.
+
+        Returns:
+            dict: {'deleted_ids', 'deleted_count', 's3_deleted', 's3_errors'}
+        """
+        if isinstance(files, QuerySet):
+            queryset = files
+        else:
+            ids = [getattr(item, 'pk', item) for item in files]
+            queryset = UserFile.objects.filter(pk__in=ids)
         
-        print(f"[OCR Service] Found {pending_jobs.count()} pending jobs")
+        rows = list(queryset.filter(user=self.user).values_list('id', 's3_key', 'file', 'file_size', 'file_hash'))
+        if not rows:
+            return {'deleted_ids': [], 'deleted_count': 0, 's3_deleted': 0, 's3_errors': []}
         
-        for ocr_result in pending_jobs:
-            try:
-                job_status = self._check_textract_job(ocr_result.job_id)
-                
-                if job_status == 'SUCCEEDED':
-                    result = self._complete_pdf_processing(ocr_result.file, ocr_result)
-                    print(f"[OCR Service] Completed pending job: {ocr_result.job_id} - {result}")
-                elif job_status == 'FAILED':
-                    self._handle_error(ocr_result.file, "Textract job failed")
-                    print(f"[OCR Service] Failed pending job: {ocr_result.job_id}")
-                else:
-                    print(f"[OCR Service] Job {ocr_result.job_id} still {job_status}")
-                    
-            except Exception as e:
-                print(f"[OCR Service] Error checking pending job {ocr_result.job_id}: {str(e)}")
+        file_ids = [row[0] for row in rows]
+        
+        with transaction.atomic():
+            # OCR results, expiry links etc. cascade in the same delete; the
+            # per-row ledger signals are replaced by one write below
+            with ledger.suspended():
+                UserFile.objects.filter(pk__in=file_ids).delete()
+            
+            still_referenced = self._referenced_keys(
+                {s3_key or file_name for _, s3_key, file_name, _, _ in rows}
+            )
+            # Deduplicated (hashed) rows share one object: its bytes are
+            # released once, and only when nothing references it any more
+            released_bytes = 0
+            shared_released = set()
+            for _, s3_key, file_name, file_size, file_hash in rows:
+                key = s3_key or file_name
+                if not file_hash or not key:
+                    released_bytes += file_size or 0
+                elif key not in still_referenced and key not in shared_released:
+                    shared_released.add(key)
+                    released_bytes += file_size or 0
+            ledger.adjust_storage_used(self.user.id, -released_bytes)
+        
+        unreferenced = {s3_key or file_name for _, s3_key, file_name, _, _ in rows} - still_referenced
+        result = self.storage_manager.delete_keys(unreferenced)
+        print(f"[Delete] User {self.user.id}: deleted {len(file_ids)} files, "
+              f"{len(result['deleted'])} S3 objects, {len(result['errors'])} S3 errors")
+        
+        return {
+            'deleted_ids': file_ids,
+            'deleted_count': len(file_ids),
+            's3_deleted': len(result['deleted']),
+            's3_errors': result['errors'],
+        }
+
+    def _referenced_keys(self, keys):
+        """The subset of keys some remaining UserFile row still points at"""
+        keys = {key for key in keys if key}
+        if not keys:
+            return set()
+        referenced = set()
+        for s3_key, file_name in UserFile.objects.filter(
+            Q(s3_key__in=keys) | Q(file__in=keys)
+        ).values_list('s3_key', 'file'):
+            referenced.update((s3_key, file_name))
+        return referenced & keys
+
+    def release_keys(self, storage_keys):
+        """Delete S3 objects that no remaining UserFile row points at"""
+        keys = {key for key in storage_keys if key}
+        unreferenced = keys - self._referenced_keys(keys)
+        if not unreferenced:
+            return {'deleted': [], 'errors': []}
+        return self.storage_manager.delete_keys(unreferenced)
@@ -48,39 +48,91 @@ from .models import UserFile
 
 @receiver(post_save, sender=UserFile)
 def trigger_ocr_for_paired_documents(sender, instance, created, **kwargs):
-    """Trigger OCR when documents are paired"""
-    if not created and instance.paired_document:
-        # Check if both documents need OCR
-        files_to_process = []
-        
-        # Check current file
-        if instance.file_type in ['document', 'image']:
-            try:
-                from .models import OCRResult
-                ocr_result = OCRResult.objects.get(file=instance)
-                if ocr_result.status not in ['completed', 'processing']:
-                    files_to_process.append(instance)
-            except OCRResult.DoesNotExist:
-                files_to_process.append(instance)
-        
-        # Check paired document
-        paired_doc = instance.paired_document
-        if paired_doc and paired_doc.file_type in ['document', 'image']:
-            try:
-                from .models import OCRResult
-                ocr_result = OCRResult.objects.get(file=paired_doc)
-                if ocr_result.status not in ['completed', 'processing']:
-                    files_to_process.append(paired_doc)
-            except OCRResult.DoesNotExist:
-                files_to_process.append(paired_doc)
-        
-        # Process OCR for files that need it
-        if files_to_process:
-            try:
-                from .services import OCRService
-                ocr_service = OCRService()
-                for file_obj in files_to_process:
-                    print(f"[Signal] Triggering OCR for paired document: {file_obj.id}")
-                    ocr_service.process_file(file_obj)
-            except Exception as e:
-                print(f"[Signal] Error processing paired document OCR: {str(e)}")
+    """Queue one OCR job covering both sides when documents are paired"""
+    if not created and instance.paired_document_id:
+        try:
+            from .document_ocr import enqueue_document_ocr
+            job = enqueue_document_ocr(instance)
+            if job is not None:
+                print(f"[Signal] Queued document OCR job {job.id} for paired document: {instance.id}")
+        except Exception as e:
+            print(f"[Signal] Error queueing paired document OCR: {str(e)}")
+
+
+from django.db.models.signals import post_init, post_delete
+from storage_management.ledger import adjust_storage_used
+from .dedupe import shares_stored_copy
+
+@receiver(post_init, sender=UserFile)
+def remember_ledger_size(sender, instance, **kwargs):
+    """Remember the size the ledger has counted and the name the search index holds for this row"""
+    # Deferred fields are absent from __dict__; don't trigger a query for them
+    instance._ledger_file_size = instance.__dict__.get('file_size') if instance.pk else None
+    instance._indexed_filename = instance.__dict__.get('original_filename') if instance.pk else None
+
+@receiver(post_save, sender=UserFile)
+def update_storage_ledger_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """Keep UserStorage.storage_used in step with UserFile rows"""
+    if update_fields is not None and 'file_size' not in update_fields:
+        return
+    
+    current_size = instance.file_size or 0
+    if created:
+        # A deduplicated upload reuses an object that is already counted
+        delta = 0 if shares_stored_copy(instance) else current_size
+    elif getattr(instance, '_ledger_file_size', None) is None:
+        return
+    else:
+        delta = current_size - instance._ledger_file_size
+    
+    try:
+        adjust_storage_used(instance.user_id, delta)
+        instance._ledger_file_size = current_size
+    except Exception as e:
+        print(f"[Storage Ledger] Error updating storage for file {instance.id}: {str(e)}")
+
+@receiver(post_delete, sender=UserFile)
+def update_storage_ledger_on_delete(sender, instance, **kwargs):
+    """Release the bytes of a deleted UserFile"""
+    size = getattr(instance, '_ledger_file_size', None)
+    if size is None:
+        size = instance.file_size
+    try:
+        if shares_stored_copy(instance):
+            # Other rows still reference the object, its bytes stay counted
+            return
+        adjust_storage_used(instance.user_id, -(size or 0))
+    except Exception as e:
+        print(f"[Storage Ledger] Error releasing storage for file {instance.id}: {str(e)}")
+
+
+from .search_index import refresh_files, remove_files
+from . import filename_index
+
+@receiver(post_save, sender=UserFile)
+def index_file_name(sender, instance, created, update_fields=None, **kwargs):
+    """Add new files to the search and filename indexes and re-index renamed ones"""
+    if update_fields is not None and 'original_filename' not in update_fields:
+        return
+    if not created and instance.original_filename == getattr(instance, '_indexed_filename', None):
+        return
+    refresh_files([instance.id])
+    try:
+        filename_index.file_saved(instance)
+    except Exception as e:
+        print(f"[Filename Index] Error indexing file {instance.id}: {str(e)}")
+    instance._indexed_filename = instance.original_filename
+
+@receiver(post_save, sender=OCRResult)
+def index_ocr_text(sender, instance, **kwargs):
+    """Index a file's OCR text once its result completes"""
+    if instance.status == 'completed':
+        refresh_files([instance.file_id])
+
+@receiver(post_delete, sender=UserFile)
+def remove_file_from_index(sender, instance, **kwargs):
+    remove_files([instance.id])
+    try:
+        filename_index.file_deleted(instance)
+    except Exception as e:
+        print(f"[Filename Index] Error removing file {instance.id}: {str(e)}")
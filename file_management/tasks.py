@@ -71,4 +71,12 @@ def process_ocr(ocr_id, file_url):
             
     except Exception as e:
         logger.error(f"Unexpected error in OCR task: {str(e)}")
-        return {"status": "error", "message": f"Unexpected error: {str(e)}"} 
\ No newline at end of file
+        return {"status": "error", "message": f"Unexpected error: {str(e)}"} 
+
+@shared_task
+def run_ocr_job(job_id):
+    """Execute one queued OCRJob (see file_management.ocr_queue)"""
+    from .ocr_queue import run_job
+
+    job = run_job(job_id)
+    return {"job_id": job_id, "status": job.status if job else "skipped"}
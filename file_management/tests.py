@@ -1,3 +1,1395 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import random
+import unittest
+import zipfile
+from datetime import timedelta
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from storage_management.models import UserStorage
+from storage_management.utils import S3StorageManager
+from . import ocr_cache, ocr_queue
+from .batch_categorization import BatchCategorizer
+from .dedupe import duplicate_groups, find_upload_duplicate
+from .extractors import Budget, ExtractionError, extract_s3_object, extract_stream
+from .facets import file_facets
+from . import filename_index
+from .filename_index import FilenameIndex, split_words
+from .keys import S3KeyNotFound, index_user_files, resolve_s3_key
+from .keyword_matcher import KeywordMatcher, scan_with_str_count
+from . import learned_categorizer
+from .learned_categorizer import LinearCategoryModel
+from .ocr_engines import ENGINES, OCREngine, TesseractEngine, TextractEngine, get_engine, tesseract_lines
+from .ocr_pages import iter_analysis_responses, iter_pages, store_pages
+from .search_index import DatabaseSearchBackend, SQLiteFTS5Backend, get_backend, search_files, search_filter
+from .services import FileDeletionService, OCRService
+from .textract_events import FakeNotificationQueue, consume_queue, fake_notification, sweep_silent_jobs
+from .utils import FileCategorizationService
+from .models import (
+    FileCategory, FilenameIndexVersion, OCRCacheEntry, OCRJob, OCRPage, OCRPreference, OCRResult, S3KeyIndex, UserFile,
+)
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+User = get_user_model()
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class S3KeyIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='keyuser', email='keys@example.com', password='testpassword')
+        self.mock = mock_aws()
+        self.mock.start()
+        import boto3
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.bucket = settings.AWS_STORAGE_BUCKET_NAME
+        self.s3_client.create_bucket(Bucket=self.bucket)
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def _create_file(self, s3_key, original_filename):
+        return UserFile.objects.create(
+            user=self.user, file_type='other', s3_key=s3_key,
+            original_filename=original_filename, file_size=3
+        )
+
+    def test_resolver_probes_once_then_trusts_index(self):
+        # Stored under a legacy key, not the recorded one
+        self.s3_client.put_object(Bucket=self.bucket, Key='uploads/legacy.txt', Body=b'abc')
+        user_file = self._create_file(f"user_{self.user.id}/legacy.txt", 'legacy.txt')
+
+        self.assertEqual(resolve_s3_key(user_file, self.s3_client), 'uploads/legacy.txt')
+        entry = S3KeyIndex.objects.get(file=user_file)
+        self.assertEqual(entry.size, 3)
+        self.assertEqual(UserFile.objects.get(pk=user_file.pk).s3_key, 'uploads/legacy.txt')
+
+        # Index hit: no S3 request at all
+        self.mock.stop()
+        try:
+            reloaded = UserFile.objects.select_related('key_index').get(pk=user_file.pk)
+            self.assertEqual(resolve_s3_key(reloaded, s3_client=object()), 'uploads/legacy.txt')
+        finally:
+            self.mock.start()
+
+    def test_missing_object_raises(self):
+        user_file = self._create_file(f"user_{self.user.id}/gone.txt", 'gone.txt')
+        with self.assertRaises(S3KeyNotFound):
+            resolve_s3_key(user_file, self.s3_client)
+
+    def test_index_pass_uses_prefix_listing(self):
+        present = self._create_file(f"user_{self.user.id}/present.txt", 'present.txt')
+        absent = self._create_file(f"user_{self.user.id}/absent.txt", 'absent.txt')
+        self.s3_client.put_object(Bucket=self.bucket, Key=present.s3_key, Body=b'abc')
+
+        result = index_user_files(self.user.id, s3_client=self.s3_client)
+
+        self.assertEqual(result['indexed'], 1)
+        self.assertEqual(result['missing'], [absent.pk])
+        self.assertEqual(S3KeyIndex.objects.get(file=present).s3_key, present.s3_key)
+
+
+class ContentDedupeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='dedupeuser', email='dedupe@example.com', password='testpassword')
+        self.content = b'same bytes'
+        self.file_hash = hashlib.sha256(self.content).hexdigest()
+
+    def _storage_used(self):
+        return UserStorage.objects.get(user=self.user).storage_used
+
+    def _create_file(self, s3_key, file_hash=None):
+        return UserFile.objects.create(
+            user=self.user, file_type='other', s3_key=s3_key, original_filename=s3_key.rsplit('/', 1)[-1],
+            file_size=len(self.content), file_hash=self.file_hash if file_hash is None else file_hash
+        )
+
+    def test_upload_duplicate_reuses_stored_copy(self):
+        original = self._create_file(f"user_{self.user.id}/a.txt")
+        upload = SimpleUploadedFile('b.txt', self.content)
+
+        result = find_upload_duplicate(self.user, upload)
+
+        self.assertEqual(result['duplicate_of'], original)
+        self.assertEqual(result['s3_key'], original.s3_key)
+        self.assertEqual(upload.tell(), 0)
+        self.assertIsNone(find_upload_duplicate(self.user, SimpleUploadedFile('c.txt', b'other byte')))
+
+    def test_shared_copy_is_counted_and_released_once(self):
+        first = self._create_file(f"user_{self.user.id}/a.txt")
+        second = self._create_file(first.s3_key)
+        self.assertEqual(self._storage_used(), len(self.content))
+
+        with patch.object(S3StorageManager, 'delete_keys', return_value={'deleted': [], 'errors': []}) as delete_keys:
+            second.delete()
+            delete_keys.assert_not_called()
+            self.assertEqual(self._storage_used(), len(self.content))
+
+            third = self._create_file(first.s3_key)
+            FileDeletionService(self.user).delete_files(UserFile.objects.filter(pk__in=[first.pk, third.pk]))
+            delete_keys.assert_called_once_with({first.s3_key})
+        self.assertEqual(self._storage_used(), 0)
+
+    def test_same_name_different_bytes_is_counted_separately(self):
+        key = f"user_{self.user.id}/a.txt"
+        first = UserFile.objects.create(
+            user=self.user, file_type='other', s3_key=key, original_filename='a.txt', file_size=1000, file_hash='1' * 64
+        )
+        UserFile.objects.create(
+            user=self.user, file_type='other', s3_key=key, original_filename='a.txt', file_size=900000, file_hash='2' * 64
+        )
+        self.assertEqual(self._storage_used(), 901000)
+
+        first.delete()
+        self.assertEqual(self._storage_used(), 900000)
+
+        manager = S3StorageManager(self.user)
+        keys = {manager.new_object_key('a.txt') for _ in range(2)}
+        self.assertEqual(len(keys), 2)
+        for new_key in keys:
+            self.assertTrue(new_key.startswith(manager.user_prefix) and new_key.endswith('_a.txt'))
+
+    def test_audit_matches_ledger_with_shared_copies(self):
+        first = self._create_file(f"user_{self.user.id}/a.txt")
+        self._create_file(first.s3_key)
+        manager = S3StorageManager(self.user)
+
+        with patch.object(manager, '_calculate_s3_storage', return_value=len(self.content)):
+            manager.audit_storage()
+        self.assertEqual(self._storage_used(), len(self.content))
+
+    def test_duplicate_groups_report_reclaimable_bytes(self):
+        self._create_file(f"user_{self.user.id}/a.txt")
+        self._create_file(f"user_{self.user.id}/b.txt")
+        self._create_file(f"user_{self.user.id}/a.txt")
+        self._create_file(f"user_{self.user.id}/c.txt", file_hash='')
+
+        groups = duplicate_groups(self.user)
+
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(groups[0]['count'], 3)
+        self.assertEqual(groups[0]['stored_copies'], 2)
+        self.assertEqual(groups[0]['reclaimable_bytes'], len(self.content))
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class StreamFileTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='streamuser', email='stream@example.com', password='testpassword')
+        self.mock = mock_aws()
+        self.mock.start()
+        import boto3
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.s3_client.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+        self.content = bytes(range(256)) * 1024
+        self.user_file = UserFile.objects.create(
+            user=self.user, file_type='document', s3_key=f"user_{self.user.id}/big.pdf",
+            original_filename='big.pdf', file_size=len(self.content)
+        )
+        self.s3_client.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=self.user_file.s3_key, Body=self.content)
+        self.url = reverse('stream_file', args=[self.user_file.id])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = patch('storage_management.streaming.get_s3_client', return_value=self.s3_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('file_management.keys.get_s3_client', return_value=self.s3_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_range_request_returns_partial_content(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=1000-1999')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f"bytes 1000-1999/{len(self.content)}")
+        self.assertEqual(b''.join(response.streaming_content), self.content[1000:2000])
+
+        full = self.client.get(self.url)
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual(b''.join(full.streaming_content), self.content)
+
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=full['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_locked_file_needs_password_header(self):
+        self.user_file.lock_with_password('secret')
+
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        response = self.client.get(self.url, HTTP_X_FILE_PASSWORD='secret', HTTP_RANGE='bytes=-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+    def test_other_users_and_staff_are_refused(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpassword')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        staff = User.objects.create_user(username='staff', email='staff@example.com', password='testpassword', is_staff=True)
+        self.client.force_authenticate(staff)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        # A locked file stays locked for staff, whether or not the file is public
+        self.user_file.is_public = True
+        self.user_file.save(update_fields=['is_public'])
+        self.user_file.lock_with_password('secret')
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+@override_settings(OCR_QUEUE_BACKEND='local', OCR_LOCAL_WORKERS=0, OCR_JOB_POLL_INTERVAL=0, OCR_MAX_JOBS_PER_USER=1)
+class OCRQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ocruser', email='ocr@example.com', password='testpassword')
+        ocr_queue._backends.clear()
+        self.addCleanup(ocr_queue._backends.clear)
+
+    def _create_file(self, name):
+        return UserFile.objects.create(
+            user=self.user, file_type='document', s3_key=f"user_{self.user.id}/{name}",
+            original_filename=name, file_size=10
+        )
+
+    def _enqueue(self, user_file, lane='interactive'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ocr_queue.enqueue_ocr(user_file, lane=lane)
+
+    def test_upload_job_runs_off_the_request(self):
+        user_file = self._create_file('a.png')
+        with patch.object(OCRService, 'process_file', return_value={'status': 'completed'}) as process_file:
+            job = self._enqueue(user_file)
+            self.assertEqual(self._enqueue(user_file), job)
+            process_file.assert_not_called()
+
+            self.assertEqual(ocr_queue.get_backend().drain(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.attempts, 1)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('ocr_job_status', args=[job.id]))
+        self.assertEqual(response.json()['job']['status'], 'completed')
+
+    def test_interactive_lane_first_and_per_user_limit(self):
+        backfill = self._enqueue(self._create_file('old.png'), lane='backfill')
+        interactive = self._enqueue(self._create_file('new.png'))
+        order = []
+
+        def process(service, user_file):
+            order.append(user_file.id)
+            # The user's only slot is taken while this job runs
+            self.assertIsNone(ocr_queue.claim_job(backfill.id if user_file.id == interactive.file_id else interactive.id))
+            return {'status': 'completed'}
+
+        with patch.object(OCRService, 'process_file', autospec=True, side_effect=process):
+            ocr_queue.get_backend().drain()
+
+        self.assertEqual(order, [interactive.file_id, backfill.file_id])
+
+    def test_poll_refused_at_the_cap_runs_when_a_slot_frees(self):
+        image = self._enqueue(self._create_file('a.png'))
+        # A PDF polled once; its next poll arrives while the image holds the user's only slot
+        polled = OCRJob.objects.create(
+            file=self._create_file('scan.pdf'), user=self.user, status='waiting', polls=1, available_at=timezone.now()
+        )
+
+        def process(service, user_file):
+            if user_file.id == image.file_id:
+                self.assertIsNone(ocr_queue.run_job(polled.id))
+            return {'status': 'completed'}
+
+        with patch.object(OCRService, 'process_file', autospec=True, side_effect=process):
+            self.assertEqual(ocr_queue.get_backend().drain(), 2)
+
+        polled.refresh_from_db()
+        self.assertEqual(polled.status, 'completed')
+
+    def test_claims_lock_the_users_preference_row_before_counting(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        job = self._enqueue(self._create_file('a.png'))
+        OCRPreference.objects.filter(user=self.user).delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(ocr_queue.claim_job(job.id), job)
+
+        statements = [query['sql'] for query in queries.captured_queries]
+        locked = next(index for index, sql in enumerate(statements) if 'file_management_ocrpreference' in sql)
+        counted = next(index for index, sql in enumerate(statements) if 'COUNT(' in sql)
+        self.assertLess(locked, counted)
+        self.assertTrue(OCRPreference.objects.filter(user=self.user).exists())
+
+    def test_pdf_job_is_polled_without_blocking_a_worker(self):
+        job = self._enqueue(self._create_file('scan.pdf'))
+        results = iter([{'status': 'processing', 'job_id': 'textract-1'}, {'status': 'completed'}])
+
+        with patch.object(OCRService, 'process_file', side_effect=lambda user_file: next(results)):
+            ocr_queue.get_backend().drain()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.polls, 1)
+        self.assertEqual(job.attempts, 1)
+
+
+class FakeTextract:
+    def __init__(self, status='SUCCEEDED'):
+        self.status = status
+        self.calls = []
+
+    def get_document_analysis(self, JobId, NextToken=None):
+        self.calls.append(JobId)
+        return {
+            'JobStatus': self.status,
+            'Blocks': [{'BlockType': 'LINE', 'Text': 'Invoice total 42'}] if self.status == 'SUCCEEDED' else [],
+        }
+
+
+@override_settings(
+    TEXTRACT_SNS_TOPIC_ARN='arn:aws:sns:us-east-1:123456789012:textract-done',
+    TEXTRACT_SNS_ROLE_ARN='arn:aws:iam::123456789012:role/textract-sns',
+    OCR_SWEEP_SILENT_AFTER=120,
+    OCR_SWEEP_MAX_CALLS_PER_SECOND=0,
+)
+class TextractEventsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='eventsuser', email='events@example.com', password='testpassword')
+        self.textract = FakeTextract()
+        self.service = OCRService(max_pdf_wait=0)
+        self.service.textract_client = self.textract
+        patcher = patch.object(OCRService, '_categorize_file', return_value={'changed': False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _processing_pdf(self, job_id, started_ago=0):
+        user_file = UserFile.objects.create(
+            user=self.user, file_type='document', s3_key=f"user_{self.user.id}/{job_id}.pdf",
+            original_filename=f"{job_id}.pdf", file_size=10
+        )
+        return OCRResult.objects.create(
+            file=user_file, status='processing', job_id=job_id,
+            job_started_at=timezone.now() - timedelta(seconds=started_ago)
+        )
+
+    def test_queued_notification_finishes_result_and_job(self):
+        ocr_result = self._processing_pdf('job-1')
+        job = OCRJob.objects.create(file=ocr_result.file, user=self.user, status='waiting')
+        queue = FakeNotificationQueue()
+        queue.publish('job-1')
+        queue.publish('job-1')  # SNS delivers at least once
+
+        summary = consume_queue(queue, 'fake-queue', ocr_service=self.service)
+
+        self.assertEqual(summary, {'received': 2, 'completed': 1, 'already_final': 1})
+        self.assertEqual(self.textract.calls, ['job-1'])
+        self.assertEqual(queue.messages, [])
+        ocr_result.refresh_from_db()
+        self.assertEqual(ocr_result.status, 'completed')
+        self.assertEqual(ocr_result.text_content, 'Invoice total 42')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+
+    def _signing_certificate(self):
+        """A key and a self-signed certificate standing in for SNS's"""
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from cryptography.x509.oid import NameOID
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'sns.amazonaws.com')])
+        certificate = (
+            x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(timezone.now() - timedelta(days=1)).not_valid_after(timezone.now() + timedelta(days=1))
+            .sign(key, hashes.SHA256())
+        )
+        return key, certificate.public_bytes(serialization.Encoding.PEM)
+
+    def _sign(self, key, envelope):
+        import base64
+
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        from .textract_events import sns_string_to_sign
+
+        envelope['SignatureVersion'] = '2'
+        envelope['SigningCertURL'] = 'https://sns.us-east-1.amazonaws.com/SimpleNotificationService-test.pem'
+        signature = key.sign(sns_string_to_sign(envelope), padding.PKCS1v15(), hashes.SHA256())
+        envelope['Signature'] = base64.b64encode(signature).decode()
+        return envelope
+
+    def test_endpoint_accepts_only_signed_messages_of_the_configured_topic(self):
+        from . import textract_events
+
+        self._processing_pdf('job-2')
+        url = reverse('textract_notification')
+        key, certificate = self._signing_certificate()
+        textract_events._certificates.clear()
+        self.addCleanup(textract_events._certificates.clear)
+        patcher = patch.object(textract_events, '_fetch_certificate', return_value=certificate)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        forged = self._sign(key, fake_notification('job-2', topic_arn='arn:aws:sns:us-east-1:999999999999:other'))
+        response = self.client.post(url, data=json.dumps(forged), content_type='text/plain')
+        self.assertEqual(response.status_code, 403)
+
+        # Unsigned, tampered with after signing, or signed by a certificate outside SNS
+        unsigned = fake_notification('job-2')
+        tampered = self._sign(key, fake_notification('job-2'))
+        tampered['Message'] = json.dumps({'JobId': 'job-other', 'Status': 'SUCCEEDED'})
+        elsewhere = self._sign(key, fake_notification('job-2'))
+        elsewhere['SigningCertURL'] = 'https://sns.us-east-1.example.com/cert.pem'
+        for envelope in (unsigned, tampered, elsewhere):
+            response = self.client.post(url, data=json.dumps(envelope), content_type='text/plain')
+            self.assertEqual(response.status_code, 403)
+
+        with patch('file_management.services.get_textract_client', return_value=self.textract):
+            signed = self._sign(key, fake_notification('job-2'))
+            response = self.client.post(url, data=json.dumps(signed), content_type='text/plain')
+        self.assertEqual(response.json()['outcome'], 'completed')
+
+    @override_settings(TEXTRACT_NOTIFICATION_TOKEN='s3cret')
+    def test_endpoint_requires_the_configured_token(self):
+        from . import textract_events
+
+        self._processing_pdf('job-3')
+        url = reverse('textract_notification')
+        key, certificate = self._signing_certificate()
+        textract_events._certificates.clear()
+        self.addCleanup(textract_events._certificates.clear)
+        patcher = patch.object(textract_events, '_fetch_certificate', return_value=certificate)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        signed = json.dumps(self._sign(key, fake_notification('job-3')))
+        for query in ('', '?token=s3cre', '?token=s3cret%C3%A9'):
+            response = self.client.post(url + query, data=signed, content_type='text/plain')
+            self.assertEqual(response.status_code, 403)
+
+        with patch('file_management.services.get_textract_client', return_value=self.textract):
+            response = self.client.post(url + '?token=s3cret', data=signed, content_type='text/plain')
+        self.assertEqual(response.json()['outcome'], 'completed')
+
+    def test_sweeper_polls_only_silent_jobs(self):
+        fresh = self._processing_pdf('fresh')
+        self._processing_pdf('silent-1', started_ago=600)
+        self._processing_pdf('silent-2', started_ago=300)
+        self.textract.status = 'IN_PROGRESS'
+
+        summary = sweep_silent_jobs(self.service, batch_size=1)
+        self.assertEqual(summary['checked'], 1)
+        self.assertEqual(self.textract.calls, ['silent-1'])
+
+        sweep_silent_jobs(self.service)
+        self.assertEqual(self.textract.calls, ['silent-1', 'silent-2'])
+
+        # A job that was just started isn't polled by the upload path either
+        with patch.object(OCRService, '_normalize_s3_key', return_value=fresh.file.s3_key):
+            self.assertEqual(self.service.process_file(fresh.file)['status'], 'processing')
+        self.assertEqual(len(self.textract.calls), 2)
+
+
+class PagedTextract:
+    """Splits LINE blocks of `pages` pages into responses of `per_response` blocks, like GetDocumentAnalysis"""
+
+    def __init__(self, pages, lines_per_page, per_response):
+        blocks = [
+            {'BlockType': 'LINE', 'Page': page, 'Text': f"p{page} l{line}", 'Confidence': 90.0 + line}
+            for page in range(1, pages + 1) for line in range(lines_per_page)
+        ]
+        self.responses = [blocks[i:i + per_response] for i in range(0, len(blocks), per_response)]
+        self.calls = 0
+
+    def get_document_analysis(self, JobId, NextToken=None):
+        self.calls += 1
+        index = int(NextToken or 0)
+        response = {'JobStatus': 'SUCCEEDED', 'Blocks': self.responses[index]}
+        if index + 1 < len(self.responses):
+            response['NextToken'] = str(index + 1)
+        return response
+
+
+class OCRPageAssemblyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='pagesuser', email='pages@example.com', password='testpassword')
+        self.user_file = UserFile.objects.create(
+            user=self.user, file_type='document', s3_key=f"user_{self.user.id}/scan.pdf",
+            original_filename='scan.pdf', file_size=10
+        )
+        self.ocr_result = OCRResult.objects.create(file=self.user_file, status='processing', job_id='job-pages')
+
+    def test_pages_spanning_responses_are_assembled_once(self):
+        textract = PagedTextract(pages=5, lines_per_page=3, per_response=4)
+
+        text, page_count = store_pages(self.ocr_result, iter_pages(iter_analysis_responses(textract, 'job-pages')), batch_size=2)
+
+        self.assertEqual(page_count, 5)
+        self.assertEqual(textract.calls, 4)
+        pages = list(self.ocr_result.pages.order_by('page_number'))
+        self.assertEqual([page.page_number for page in pages], [1, 2, 3, 4, 5])
+        self.assertEqual(pages[1].text, 'p2 l0\np2 l1\np2 l2')
+        self.assertEqual(pages[1].line_count, 3)
+        self.assertAlmostEqual(pages[1].confidence, 91.0)
+        self.assertEqual(text, '\n'.join(page.text for page in pages))
+
+    def test_no_transaction_is_held_while_pages_are_fetched(self):
+        from django.db import connection
+
+        OCRPage.objects.create(ocr_result=self.ocr_result, page_number=9, text='stale')
+        depth = len(connection.savepoint_ids)
+        fetched = []
+
+        def pages():
+            for page_number in range(1, 6):
+                # The test's own transaction is the only one open between batches
+                fetched.append(len(connection.savepoint_ids) == depth)
+                yield page_number, f"page {page_number}", 90.0, 1
+
+        text, page_count = store_pages(self.ocr_result, pages(), batch_size=2)
+
+        self.assertEqual(fetched, [True] * 5)
+        self.assertEqual(page_count, 5)
+        self.assertEqual(list(self.ocr_result.pages.order_by('page_number').values_list('page_number', flat=True)),
+                         [1, 2, 3, 4, 5])
+
+    def test_completion_writes_pages_and_serves_them_in_slices(self):
+        service = OCRService(max_pdf_wait=0)
+        service.textract_client = PagedTextract(pages=30, lines_per_page=2, per_response=7)
+        with patch.object(OCRService, '_categorize_file', return_value={'changed': False}):
+            result = service._complete_pdf_processing(self.user_file, self.ocr_result)
+
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(self.ocr_result.pages.count(), 30)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('ocr_pages', args=[self.user_file.id]), {'start': 11, 'limit': 10}).json()
+        self.assertEqual([page['page_number'] for page in response['pages']], list(range(11, 21)))
+        self.assertEqual(response['next_start'], 21)
+
+
+class FakeLocalEngine(OCREngine):
+    name = 'tesseract'
+
+    def __init__(self, textract_client=None, s3_client=None):
+        pass
+
+    def pdf_pages(self, s3_key):
+        for page in range(1, 4):
+            yield page, f"{s3_key} page {page}", 80.0, 1
+
+
+class OCREngineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='engineuser', email='engine@example.com', password='testpassword')
+        self.user_file = UserFile.objects.create(
+            user=self.user, file_type='document', s3_key=f"user_{self.user.id}/scan.pdf",
+            original_filename='scan.pdf', file_size=10
+        )
+
+    def test_tesseract_words_are_grouped_into_lines(self):
+        data = {
+            'text': ['', 'Invoice', 'total', '', '42', 'Due'],
+            'conf': ['-1', '90', '80', '-1', '70', '60'],
+            'block_num': [0, 1, 1, 1, 1, 2],
+            'par_num': [0, 1, 1, 1, 1, 1],
+            'line_num': [0, 1, 1, 1, 2, 1],
+        }
+
+        text, confidence, line_count = tesseract_lines(data)
+
+        self.assertEqual(text, 'Invoice total\n42\nDue')
+        self.assertEqual(line_count, 3)
+        self.assertAlmostEqual(confidence, 75.0)
+
+    def test_user_preference_selects_a_synchronous_engine_for_pdfs(self):
+        OCRPreference.objects.create(user=self.user, engine='tesseract')
+        service = OCRService(max_pdf_wait=0)
+        service.textract_client = FakeTextract()
+
+        with patch.dict(ENGINES, {'tesseract': FakeLocalEngine}), \
+                patch.object(OCRService, '_normalize_s3_key', return_value=self.user_file.s3_key), \
+                patch.object(OCRService, '_categorize_file', return_value={'changed': False}):
+            result = service.process_file(self.user_file)
+
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(service.textract_client.calls, [])
+        ocr_result = OCRResult.objects.get(file=self.user_file)
+        self.assertEqual(ocr_result.pages.count(), 3)
+        self.assertEqual(ocr_result.text_content.splitlines()[-1], f"{self.user_file.s3_key} page 3")
+
+    def test_unavailable_engine_falls_back_to_textract(self):
+        with patch.object(TesseractEngine, 'is_available', return_value=False):
+            engine = get_engine('tesseract', textract_client=FakeTextract(), s3_client=object())
+
+        self.assertIsInstance(engine, TextractEngine)
+        self.assertIsInstance(get_engine('no-such-engine', textract_client=FakeTextract()), TextractEngine)
+
+
+    def test_pdfs_fall_back_to_textract_without_pypdfium2(self):
+        from . import ocr_engines
+
+        with patch.object(ocr_engines, 'pytesseract', object()), patch.object(ocr_engines, 'pdfium', None), \
+                patch.object(ocr_engines.shutil, 'which', return_value='/usr/bin/tesseract'):
+            self.assertIsInstance(get_engine('tesseract', s3_client=object()), TesseractEngine)
+            engine = get_engine('tesseract', textract_client=FakeTextract(), s3_client=object(), pdf=True)
+
+        self.assertIsInstance(engine, TextractEngine)
+
+class CountingEngine(FakeLocalEngine):
+    calls = 0
+
+    def pdf_pages(self, s3_key):
+        CountingEngine.calls += 1
+        return super().pdf_pages(s3_key)
+
+
+@override_settings(OCR_CACHE_ENABLED=True, OCR_CACHE_TTL=3600, OCR_CACHE_MAX_ENTRIES=100)
+class OCRCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cacheuser', email='cache@example.com', password='testpassword')
+        OCRPreference.objects.create(user=self.user, engine='tesseract')
+        CountingEngine.calls = 0
+        ocr_cache.reset_cache_stats()
+
+    def _file(self, name):
+        return UserFile.objects.create(
+            user=self.user, file_type='document', s3_key=f"user_{self.user.id}/{name}",
+            original_filename=name, file_size=10, file_hash='ab' * 32
+        )
+
+    def test_identical_content_is_served_from_the_cache(self):
+        first, second = self._file('scan.pdf'), self._file('scan copy.pdf')
+        service = OCRService(max_pdf_wait=0)
+
+        with patch.dict(ENGINES, {'tesseract': CountingEngine}), \
+                patch.object(OCRService, '_normalize_s3_key', side_effect=lambda user_file: user_file.s3_key), \
+                patch.object(OCRService, '_categorize_file', return_value={'changed': False}):
+            first_result = service.process_file(first)
+            second_result = service.process_file(second)
+
+        self.assertNotIn('cached', first_result)
+        self.assertTrue(second_result['cached'])
+        self.assertEqual(CountingEngine.calls, 1)
+        cached = OCRResult.objects.get(file=second)
+        self.assertEqual(cached.text_content, OCRResult.objects.get(file=first).text_content)
+        self.assertEqual(cached.pages.count(), 3)
+        stats = ocr_cache.get_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_least_recently_used_and_expired_entries_are_evicted(self):
+        for index in range(3):
+            ocr_cache.store(f"{index:064d}", 'textract:tables+forms', f"text {index}", [(1, f"text {index}", None, 1)])
+        OCRCacheEntry.objects.filter(content_hash=f"{0:064d}").update(last_used_at=timezone.now() - timedelta(days=1))
+
+        with override_settings(OCR_CACHE_MAX_ENTRIES=2):
+            self.assertEqual(ocr_cache.evict(), 1)
+        self.assertIsNone(ocr_cache.lookup(f"{0:064d}", 'textract:tables+forms'))
+
+        OCRCacheEntry.objects.filter(content_hash=f"{1:064d}").update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertIsNone(ocr_cache.lookup(f"{1:064d}", 'textract:tables+forms'))
+        self.assertEqual(ocr_cache.lookup(f"{2:064d}", 'textract:tables+forms').text_content, 'text 2')
+        self.assertEqual(OCRCacheEntry.objects.count(), 1)
+
+    @override_settings(OCR_CACHE_MAX_ENTRIES=1, OCR_CACHE_EVICT_EVERY=3)
+    def test_stores_evict_only_every_few_inserts(self):
+        for index in range(2):
+            ocr_cache.store(f"{index:064d}", 'tesseract', f"text {index}", [])
+        self.assertEqual(OCRCacheEntry.objects.count(), 2)
+
+        ocr_cache.store(f"{2:064d}", 'tesseract', 'text 2', [])
+        self.assertEqual(list(OCRCacheEntry.objects.values_list('text_content', flat=True)), ['text 2'])
+        self.assertEqual(ocr_cache.get_cache_stats()['evictions'], 2)
+
+
+class BarrierEngine(FakeLocalEngine):
+    """Each call waits for the other side: passes only if both sides are OCR'd at the same time"""
+    barrier = None
+
+    def image_pages(self, s3_key):
+        BarrierEngine.barrier.wait(timeout=5)
+        side = 'front' if 'front' in s3_key else 'back'
+        return iter([(1, f"{side}: bank account statement balance deposit", 90.0, 1)])
+
+
+@override_settings(OCR_CACHE_ENABLED=False, OCR_QUEUE_BACKEND='local', OCR_LOCAL_WORKERS=0, OCR_DOCUMENT_WORKERS=2)
+class DocumentOCRTests(TestCase):
+    def setUp(self):
+        import threading
+
+        self.user = User.objects.create_user(username='pairuser', email='pair@example.com', password='testpassword')
+        OCRPreference.objects.create(user=self.user, engine='tesseract')
+        BarrierEngine.barrier = threading.Barrier(2)
+        ocr_queue._backends.clear()
+        self.addCleanup(ocr_queue._backends.clear)
+        self.front, self.back = [
+            UserFile.objects.create(
+                user=self.user, file_type='image', s3_key=f"user_{self.user.id}/{name}",
+                original_filename=name, file_size=10, pending_auto_categorization=True
+            )
+            for name in ('front.png', 'back.png')
+        ]
+
+    def test_pairing_ocrs_both_sides_concurrently_and_categorizes_once(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('create_document_pair'), {
+                'front_file_id': self.front.id, 'back_file_id': self.back.id, 'document_type_name': 'Bank card'
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(OCRJob.objects.filter(file__in=[self.front, self.back]).count(), 1)
+
+        analyze = FileCategorizationService.analyze_file_content
+        with patch.dict(ENGINES, {'tesseract': BarrierEngine}), \
+                patch.object(OCRService, '_normalize_s3_key', side_effect=lambda user_file: user_file.s3_key), \
+                patch.object(FileCategorizationService, 'analyze_file_content', autospec=True,
+                             side_effect=analyze) as analyze_file_content:
+            self.assertEqual(ocr_queue.get_backend().drain(), 1)
+
+        analyze_file_content.assert_called_once()
+        merged = analyze_file_content.call_args.args[1]
+        self.assertLess(merged.index('front:'), merged.index('back:'))
+        self.front.refresh_from_db()
+        self.back.refresh_from_db()
+        self.assertEqual(self.front.category.name, 'Banking')
+        self.assertEqual(self.back.category_id, self.front.category_id)
+        self.assertFalse(self.front.pending_auto_categorization or self.back.pending_auto_categorization)
+        for user_file in (self.front, self.back):
+            ocr_result = OCRResult.objects.get(file=user_file)
+            self.assertEqual(ocr_result.status, 'completed')
+            self.assertEqual(ocr_result.pages.count(), 1)
+
+
+def office_file(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, xml in members.items():
+            archive.writestr(name, xml)
+    return buffer.getvalue()
+
+
+class StubBody(io.BytesIO):
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def iter_chunks(self, chunk_size):
+        return iter(lambda: self.read(chunk_size), b'')
+
+
+class StubS3:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key):
+        self.body = StubBody(self.objects[Key])
+        return {'Body': self.body, 'ContentLength': len(self.objects[Key])}
+
+
+@override_settings(EXTRACT_WORKERS=0, EXTRACT_CHUNK_SIZE=16)
+class ExtractorTests(TestCase):
+    W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    A = 'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"'
+    S = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+
+    def test_formats_are_extracted_in_order(self):
+        docx_bytes = office_file({'word/document.xml': (
+            f'<w:document {self.W}><w:body><w:p><w:r><w:t>Bank </w:t></w:r><w:r><w:t>statement</w:t></w:r></w:p>'
+            '<w:p><w:r><w:t>Balance 42</w:t></w:r></w:p></w:body></w:document>'
+        )})
+        pptx_bytes = office_file({
+            f'ppt/slides/slide{number}.xml': f'<p:sld xmlns:p="p" {self.A}><a:p><a:t>Slide {number}</a:t></a:p></p:sld>'
+            for number in (10, 2, 1)
+        })
+        xlsx_bytes = office_file({
+            'xl/sharedStrings.xml': f'<sst {self.S}><si><t>Invoice</t></si><si><r><t>To</t></r><r><t>tal</t></r></si></sst>',
+            'xl/worksheets/sheet1.xml': (
+                f'<worksheet {self.S}><sheetData><row><c t="s"><v>0</v></c><c><v>7</v></c></row>'
+                '<row><c t="s"><v>1</v></c><c t="inlineStr"><is><t>due</t></is></c></row></sheetData></worksheet>'
+            ),
+        })
+        cases = {
+            'txt': ('caf\u00e9\nplain line\n'.encode('utf-8'), 'caf\u00e9\nplain line'),
+            'csv': (b'name,amount\n"multi\nline",5\n', 'name\tamount\nmulti\nline\t5'),
+            'html': (b'<html><head><title>x</title><style>p{}</style></head><body><p>Hello &amp; bye</p>'
+                     b'<script>var a;</script><div>World</div></body></html>', 'Hello & bye\n\nWorld'),
+            'docx': (docx_bytes, 'Bank statement\nBalance 42'),
+            'pptx': (pptx_bytes, 'Slide 1\n\nSlide 2\n\nSlide 10'),
+            'xlsx': (xlsx_bytes, 'Invoice\t7\nTotal\tdue'),
+        }
+        for extension, (data, expected) in cases.items():
+            extraction = extract_stream(io.BytesIO(data), extension)
+            self.assertEqual(extraction.text, expected, extension)
+            self.assertFalse(extraction.truncated, extension)
+
+    def test_budgets_truncate_large_files(self):
+        data = b'line of text\n' * 10000
+        extraction = extract_stream(io.BytesIO(data), 'txt', Budget(max_input_bytes=1000))
+        self.assertTrue(extraction.truncated)
+        self.assertEqual(extraction.bytes_read, 1000)
+
+        extraction = extract_stream(io.BytesIO(data), 'txt', Budget(max_text_chars=50))
+        self.assertTrue(extraction.truncated)
+        self.assertEqual(len(extraction.text), 50)
+
+        # A zip member is cut off by its decompressed size, not the archive size
+        docx_bytes = office_file({'word/document.xml': (
+            f'<w:document {self.W}><w:body>' + '<w:p><w:r><w:t>word</w:t></w:r></w:p>' * 100000 + '</w:body></w:document>'
+        )})
+        extraction = extract_stream(io.BytesIO(docx_bytes), 'docx', Budget(max_input_bytes=64 * 1024))
+        self.assertTrue(extraction.truncated)
+        self.assertTrue(extraction.text.startswith('word\nword'))
+
+    def test_office_files_over_the_input_budget_are_not_downloaded(self):
+        docx_bytes = office_file({'word/document.xml': (
+            f'<w:document {self.W}><w:body>' + ''.join(
+                f'<w:p><w:r><w:t>{os.urandom(8).hex()}</w:t></w:r></w:p>' for _ in range(200)
+            ) + '</w:body></w:document>'
+        )})
+        s3_client = StubS3({'big.docx': docx_bytes, 'big.txt': b'line of text\n' * 1000})
+
+        with override_settings(EXTRACT_MAX_INPUT_BYTES=1024):
+            with self.assertRaises(ExtractionError):
+                extract_s3_object('big.docx', 'docx', s3_client)
+            self.assertEqual(s3_client.body.bytes_read, 0)
+
+            # Streams of unknown size stop spooling at the budget
+            with self.assertRaises(ExtractionError):
+                extract_stream(io.BytesIO(docx_bytes), 'docx')
+
+            # Text formats are still read in part
+            self.assertTrue(extract_s3_object('big.txt', 'txt', s3_client).truncated)
+
+    def test_office_files_are_ocr_results_without_textract(self):
+        user = User.objects.create_user(username='extractuser', email='extract@example.com', password='testpassword')
+        user_file = UserFile.objects.create(
+            user=user, file_type='document', s3_key=f"user_{user.id}/sheet.xlsx",
+            original_filename='sheet.xlsx', file_size=10
+        )
+        xlsx_bytes = office_file({'xl/worksheets/sheet1.xml': (
+            f'<worksheet {self.S}><sheetData><row><c t="inlineStr"><is><t>bank statement</t></is></c></row></sheetData></worksheet>'
+        )})
+        service = OCRService(max_pdf_wait=0)
+        service.s3_client = StubS3({user_file.s3_key: xlsx_bytes})
+        service.textract_client = FakeTextract()
+
+        with patch.object(OCRService, '_normalize_s3_key', return_value=user_file.s3_key), \
+                patch.object(OCRService, '_categorize_file', return_value={'changed': False}):
+            result = service.process_file(user_file)
+
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(service.textract_client.calls, [])
+        self.assertEqual(OCRResult.objects.get(file=user_file).text_content, 'bank statement')
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='facetuser', email='facet@example.com', password='testpassword')
+        other = User.objects.create_user(username='facetother', email='facetother@example.com', password='testpassword')
+        self.banking, self.personal = [FileCategory.objects.create(name=name) for name in ('Bank', 'Home')]
+        for index, (category, favorite, hidden, locked) in enumerate([
+            (self.banking, True, False, False),
+            (self.banking, False, True, True),
+            (self.personal, True, False, False),
+            (None, False, False, False),
+        ]):
+            UserFile.objects.create(
+                user=self.user, file_type='document', s3_key=f"f{index}", original_filename=f"f{index}.txt",
+                file_size=100 * (index + 1), category=category, is_favorite=favorite, is_hidden=hidden, locked=locked
+            )
+        UserFile.objects.create(user=other, file_type='document', s3_key='x', category=self.banking, file_size=5)
+
+    def test_counts_come_from_one_grouped_query(self):
+        with self.assertNumQueries(1):
+            facets = file_facets(UserFile.objects.filter(user=self.user))
+
+        self.assertEqual(facets['counts'], {'total': 4, 'favorites': 2, 'hidden': 1, 'locked': 1})
+        self.assertEqual(facets['total_size'], 1000)
+        self.assertEqual(facets['categories'][self.banking.id]['count'], 2)
+        self.assertEqual(facets['categories'][self.banking.id]['size'], 300)
+        self.assertEqual(sum(facet['count'] for facet in facets['categories'].values()), 4)
+
+    def test_file_list_queries_do_not_grow_with_categories(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        def list_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = client.get(reverse('file_list'))
+            return response, len(context.captured_queries)
+
+        response, before = list_queries()
+        FileCategory.objects.bulk_create(FileCategory(name=f"Extra {index}") for index in range(20))
+        _, after = list_queries()
+
+        self.assertEqual(before, after)
+        counts = {item['name']: item['count'] for item in response.data['categories']}
+        self.assertEqual((counts['Bank'], counts['Home']), (2, 1))
+        self.assertEqual(response.data['counts']['total'], 4)
+
+
+class FileListPageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='pageuser', email='page@example.com', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        files = [
+            UserFile.objects.create(
+                user=self.user, file_type='image' if index % 2 else 'document',
+                s3_key=f"user_{self.user.id}/f{index}.png", original_filename=f"f{index}.png", file_size=10
+            )
+            for index in range(7)
+        ]
+        # Pairs of files share a timestamp, so the id has to break ties
+        base = timezone.now() - timedelta(days=1)
+        for index, user_file in enumerate(files):
+            UserFile.objects.filter(pk=user_file.pk).update(upload_date=base + timedelta(minutes=index // 2))
+        self.newest_first = list(
+            UserFile.objects.filter(user=self.user).order_by('-upload_date', '-id').values_list('id', flat=True)
+        )
+
+    def _page(self, **params):
+        response = self.client.get(reverse('file_list_page'), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_cursor_walks_every_file_once_despite_new_uploads(self):
+        seen = []
+        page = self._page(limit=3)
+        seen += [row['id'] for row in page['files']]
+        # A file uploaded mid-walk lands before the cursor and doesn't shift the remaining pages
+        UserFile.objects.create(user=self.user, file_type='document', s3_key='new', original_filename='new.txt')
+        while page['has_more']:
+            page = self._page(limit=3, cursor=page['next_cursor'])
+            seen += [row['id'] for row in page['files']]
+
+        self.assertEqual(seen, self.newest_first)
+        self.assertIsNone(page['next_cursor'])
+
+    def test_sparse_fields_sign_only_requested_urls(self):
+        with patch('file_management.serializers.get_url_signer') as get_url_signer:
+            rows = self._page(limit=10, fields='name,type')['files']
+            get_url_signer.assert_not_called()
+
+            get_url_signer.return_value.sign_many.return_value = {}
+            self._page(limit=10, fields='id,name,type,thumbnail')
+            signed = get_url_signer.return_value.sign_many.call_args.args[0]
+
+        self.assertEqual(set(rows[0]), {'id', 'original_filename', 'file_type'})
+        self.assertEqual(len(signed), 3)
+        self.assertTrue(all(UserFile.objects.get(s3_key=key).file_type == 'image' for key in signed))
+
+    def test_bad_parameters_are_rejected(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'fields': 'id,password'}, {'limit': 'many'}):
+            response = self.client.get(reverse('file_list_page'), params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class ListingQueryCountTests(TestCase):
+    """
+    Regression harness: a listing endpoint's query count must not grow with
+    the number of files it returns. Add new listing URLs to ENDPOINTS.
+    """
+    ENDPOINTS = [
+        'file_list', 'api_file_list', 'mobile_file_list', 'file-list', 'file_list_page',
+        'card_list', 'subscription_list', 'get_paired_documents',
+    ]
+
+    def setUp(self):
+        from django.db import connection
+
+        self.connection = connection
+        self.user = User.objects.create_user(username='countuser', email='count@example.com', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.created = 0
+
+    def _add_files(self, count):
+        """count files, each pair of them a front/back document, each file in its own category"""
+        for _ in range(count // 2):
+            index = self.created
+            self.created += 2
+            front, back = [
+                UserFile.objects.create(
+                    user=self.user, file_type='image' if side == 'front' else 'document',
+                    s3_key=f"user_{self.user.id}/{side}{index}.png", original_filename=f"{side}{index}.png",
+                    file_size=10, locked=side == 'back',
+                    category=FileCategory.objects.create(name=f"Category {index} {side}"),
+                )
+                for side in ('front', 'back')
+            ]
+            UserFile.objects.filter(pk=front.pk).update(document_side='front', paired_document=back)
+            UserFile.objects.filter(pk=back.pk).update(document_side='back', paired_document=front)
+
+    def _queries(self, url):
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(self.connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(context.captured_queries)
+
+    def assertQueriesIndependentOfFiles(self, url):
+        self._add_files(2)
+        self._queries(url)  # warm-up: per-user rows created on first use
+        small = self._queries(url)
+        self._add_files(10)
+        self.assertEqual(self._queries(url), small, f"{url}: query count grows with the number of files")
+
+    def test_listing_endpoints_use_a_constant_number_of_queries(self):
+        for name in self.ENDPOINTS:
+            with self.subTest(endpoint=name):
+                self.assertQueriesIndependentOfFiles(reverse(name))
+
+    def test_pairs_are_serialized_with_access_flags(self):
+        self._add_files(2)
+        rows = {row['id']: row for row in self.client.get(reverse('file_list_page')).data['files']}
+        front = UserFile.objects.get(user=self.user, document_side='front')
+
+        self.assertTrue(rows[front.id]['can_access'])
+        self.assertFalse(rows[front.paired_document_id]['can_access'])
+        self.assertIsNone(rows[front.id]['document_pair']['back']['file_url'])
+        self.assertEqual(rows[front.id]['category']['name'], front.category.name)
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='searchuser', email='search@example.com', password='testpassword')
+        self.other = User.objects.create_user(username='searchother', email='other@example.com', password='testpassword')
+
+    def _file(self, name, text=None, user=None):
+        user_file = UserFile.objects.create(
+            user=user or self.user, file_type='document', s3_key=f"user_1/{name}", original_filename=name, file_size=10,
+        )
+        if text is not None:
+            OCRResult.objects.create(file=user_file, status='completed', text_content=text)
+        return user_file
+
+    def _ids(self, query, **kwargs):
+        return [hit.file_id for hit in search_files(self.user, query, **kwargs)]
+
+    def test_uses_the_fts5_index_on_sqlite(self):
+        self.assertIsInstance(get_backend(), SQLiteFTS5Backend)
+
+    def test_index_follows_ocr_results_renames_and_deletes(self):
+        scan = self._file('scan.pdf')
+        self.assertEqual(self._ids('electricity'), [])
+
+        OCRResult.objects.create(file=scan, status='completed', text_content='Monthly electricity bill for March')
+        hit, = search_files(self.user, 'electric')
+        self.assertEqual(hit.file_id, scan.id)
+        self.assertIn('[electricity]', hit.snippet)
+
+        scan.original_filename = 'power_bill.pdf'
+        scan.save(update_fields=['original_filename'])
+        self.assertEqual(self._ids('power bill'), [scan.id])
+        self.assertEqual(self._ids('scan'), [])
+
+        scan.delete()
+        self.assertEqual(self._ids('electricity'), [])
+
+    def test_ranks_names_above_content_and_keeps_users_apart(self):
+        in_text = self._file('notes.txt', 'the passport renewal form')
+        in_name = self._file('passport.pdf', 'scanned photo page')
+        self._file('passport.pdf', 'passport', user=self.other)
+
+        self.assertEqual(self._ids('passport'), [in_name.id, in_text.id])
+        self.assertEqual(self._ids('passport renewal'), [in_text.id])
+        self.assertEqual(self._ids('passport', within=UserFile.objects.filter(id=in_text.id)), [in_text.id])
+        self.assertEqual(get_backend().count(self.user, 'passport'), 2)
+        self.assertEqual(self._ids('" OR *'), [])
+
+    def test_database_backend_matches_the_same_files(self):
+        in_text = self._file('notes.txt', 'the passport renewal form')
+        in_name = self._file('passport.pdf', 'scanned photo page')
+        self._file('other.pdf', 'nothing here')
+
+        with override_settings(FILE_SEARCH_BACKEND='database'):
+            self.assertIsInstance(get_backend(), DatabaseSearchBackend)
+            hits = search_files(self.user, 'passport')
+        self.assertEqual({hit.file_id for hit in hits}, {in_text.id, in_name.id})
+        self.assertIn('[passport]', dict((hit.file_id, hit.snippet) for hit in hits)[in_text.id])
+
+    def test_file_names_match_substrings(self):
+        invoice = self._file('invoice2023.pdf')
+        report = self._file('report.pdf')
+        self._file('invoice2023.pdf', user=self.other)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        for query, expected in (('2023', invoice), ('port', report)):
+            self.assertEqual(list(UserFile.objects.filter(user=self.user).filter(search_filter(self.user, query))), [expected])
+            listed = client.get(reverse('file_list'), {'search': query}).data['files']
+            self.assertEqual([item['id'] for item in listed], [expected.id])
+            found = client.post(reverse('file-search'), {'query': query}, format='json').data
+            self.assertEqual([item['id'] for item in found], [expected.id])
+
+    def test_views_search_ocr_text(self):
+        in_text = self._file('notes.txt', 'the passport renewal form')
+        self._file('other.pdf', 'nothing here')
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        listed = client.get(reverse('file_list'), {'search': 'renewal'}).data['files']
+        self.assertEqual([item['id'] for item in listed], [in_text.id])
+
+        found = client.post(reverse('file-search'), {'query': 'renewal'}, format='json').data
+        self.assertEqual([item['id'] for item in found], [in_text.id])
+        self.assertIn('[renewal]', found[0]['snippet'])
+
+
+class FilenameIndexTests(TestCase):
+    NAMES = [
+        'Last Month Electricity Bill.pdf', 'CGProjectPlanes.pdf', 'Q3 project plan.pdf',
+        'my_document_final.docx', 'passport.jpg', 'Passport back.jpg', 'report2023.xlsx',
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='nameuser', email='names@example.com', password='testpassword')
+
+    def _top(self, index, query):
+        return [self.NAMES[match.file_id] for match in index.search(query, limit=2)]
+
+    def test_normalises_camel_case_separators_and_digits(self):
+        self.assertEqual(split_words('CGProjectPlanes_v2.pdf', strip_extension=True), ['cg', 'project', 'planes', 'v', '2'])
+        self.assertEqual(split_words('report2023-final.xlsx', strip_extension=True), ['report', '2023', 'final'])
+
+    def test_ranks_exact_then_prefix_then_fuzzy_matches(self):
+        index = FilenameIndex((file_id, name, file_id) for file_id, name in enumerate(self.NAMES))
+
+        self.assertEqual(self._top(index, 'cg project planes'), ['CGProjectPlanes.pdf', 'Q3 project plan.pdf'])
+        self.assertEqual(self._top(index, 'passport pdf'), ['passport.jpg', 'Passport back.jpg'])
+        self.assertEqual(self._top(index, 'mydocument')[0], 'my_document_final.docx')
+        self.assertEqual(self._top(index, 'report 2023')[0], 'report2023.xlsx')
+        self.assertEqual(self._top(index, 'electrcity bil'), ['Last Month Electricity Bill.pdf'])
+        self.assertEqual(self._top(index, 'zzz'), [])
+
+        index.remove(0)
+        index.update(4, 'Visa.jpg', 4)
+        self.assertEqual(self._top(index, 'electricity bill'), [])
+        self.assertEqual(self._top(index, 'passport'), ['Passport back.jpg'])
+
+    def test_multi_word_query_finds_a_name_containing_it(self):
+        # "my memo" shares only its run-together trigrams (4 of 9) with these names
+        index = FilenameIndex([(1, 'xmymemox.pdf', 1), (2, 'xmymemox archive 2019.pdf', 2), (3, 'holiday.jpg', 3)])
+        matches = index.search('my memo')
+        self.assertEqual([match.filename for match in matches], ['xmymemox.pdf', 'xmymemox archive 2019.pdf'])
+        self.assertGreater(matches[0].score, 0.5)
+
+    def test_follows_committed_uploads_renames_and_deletes(self):
+        from django.db import transaction
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bill = UserFile.objects.create(user=self.user, original_filename='Electricity Bill.pdf', s3_key='user_1/bill.pdf')
+        index = filename_index.get_index(self.user.id)
+        self.assertEqual([match.file_id for match in filename_index.resolve_filename(self.user, 'electricity')], [bill.id])
+
+        # A committed change updates this process's index in place and moves the database version
+        version = FilenameIndexVersion.objects.get(user=self.user).version
+        with self.captureOnCommitCallbacks(execute=True):
+            bill.original_filename = 'Water Bill.pdf'
+            bill.save()
+        self.assertNotEqual(FilenameIndexVersion.objects.get(user=self.user).version, version)
+        self.assertIs(filename_index.get_index(self.user.id), index)
+        self.assertEqual(filename_index.resolve_filename(self.user, 'electricity'), [])
+        self.assertEqual(filename_index.resolve_file(self.user, 'water bill'), bill)
+
+        # A rolled back rename changes nothing
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                bill.original_filename = 'Phone Bill.pdf'
+                bill.save()
+                transaction.set_rollback(True)
+        self.assertEqual(filename_index.resolve_file(self.user, 'water bill'), bill)
+
+        # Another process replacing the token makes this one rebuild from the database
+        UserFile.objects.filter(pk=bill.pk).update(original_filename='Gas Bill.pdf')
+        FilenameIndexVersion.objects.filter(user=self.user).update(version='elsewhere')
+        self.assertEqual(filename_index.resolve_file(self.user, 'gas bill'), bill)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bill.delete()
+        self.assertIsNone(filename_index.resolve_file(self.user, 'gas bill'))
+
+
+class KeywordMatcherTests(TestCase):
+    def test_scan_matches_str_count_semantics(self):
+        keywords = ['aa', 'note', 'notes', 'meeting notes', 'ira', 'bank', 'Tax']
+        matcher = KeywordMatcher(keywords)
+        texts = [
+            'aaaaa',
+            'notes meeting notes note',
+            'inspiration\nbank statement bank',
+            ' tax ',
+            'x' * 600 + ' bank',
+            'meeting notesnotes',
+        ]
+        for text in texts:
+            self.assertEqual(matcher.scan(text), scan_with_str_count(keywords, text), text)
+
+    def test_categorization_is_unchanged(self):
+        from file_management.management.commands.benchmark_categorization import (
+            Command, PerKeywordCategorizationService
+        )
+
+        legacy, service = PerKeywordCategorizationService(), FileCategorizationService()
+        rng = random.Random(3)
+        for size in (200, 5000, 20000):
+            text = Command()._build_text(size, rng)
+            self.assertEqual(service.analyze_file_content(text), legacy.analyze_file_content(text))
+            self.assertEqual(service.get_category(text), legacy.get_category(text))
+
+
+@override_settings(OCR_QUEUE_BACKEND='local', OCR_LOCAL_WORKERS=0)
+class BatchCategorizationTests(TestCase):
+    def setUp(self):
+        ocr_queue._backends.clear()
+        self.user = User.objects.create_user(username='batchuser', email='batch@example.com', password='testpassword')
+        self.misc = FileCategory.objects.create(name='Miscellaneous', is_default=True)
+
+    def _pending_file(self, name, text=None):
+        user_file = UserFile.objects.create(
+            user=self.user, file_type='document', s3_key=f"user_{self.user.id}/{name}",
+            original_filename=name, file_size=10, category=self.misc, pending_auto_categorization=True
+        )
+        if text is not None:
+            OCRResult.objects.create(file=user_file, status='completed', text_content=text)
+        return user_file
+
+    def test_pending_files_are_categorized_in_chunks(self):
+        statement = 'Bank statement for savings account: deposit, withdrawal, balance, ifsc, branch, interest. ' * 3
+        files = [self._pending_file(f"statement_{index}.pdf", statement) for index in range(5)]
+        unread = self._pending_file('scan.pdf')
+
+        summary = BatchCategorizer(chunk_size=2, workers=0).run()
+
+        self.assertEqual((summary['files'], summary['categorized'], summary['queued_for_ocr']), (6, 5, 1))
+        self.assertEqual(summary['changed'], 5)
+        for user_file in files:
+            user_file.refresh_from_db()
+            self.assertEqual(user_file.category.name, 'Banking')
+            self.assertFalse(user_file.pending_auto_categorization)
+        unread.refresh_from_db()
+        self.assertTrue(unread.pending_auto_categorization)
+        self.assertTrue(OCRJob.objects.filter(file=unread, lane='backfill').exists())
+
+    def test_award_pending_coins_in_bulk(self):
+        from django.core.management import call_command
+        from coin_wallet.models import CoinTransaction, CoinWallet
+
+        sizes = [10, 3 * 1024 * 1024, 1024 * 1024]
+        for index, size in enumerate(sizes):
+            UserFile.objects.create(
+                user=self.user, file_type='document', s3_key=f"user_{self.user.id}/coins_{index}.pdf",
+                original_filename=f"coins_{index}.pdf", file_size=size
+            )
+        CoinTransaction.objects.all().delete()
+        CoinWallet.objects.filter(user=self.user).update(balance=0)
+        UserFile.objects.update(coins_awarded=False)
+
+        call_command('award_pending_coins', chunk_size=2, stdout=io.StringIO())
+
+        wallet = CoinWallet.objects.get(user=self.user)
+        self.assertEqual(wallet.balance, 1 + 3 + 1)
+        self.assertEqual(CoinTransaction.objects.filter(wallet=wallet, transaction_type='upload').count(), 3)
+        self.assertEqual(
+            sorted(CoinTransaction.objects.values_list('running_balance', flat=True)), [1, 4, 5]
+        )
+        self.assertFalse(UserFile.objects.filter(coins_awarded=False).exists())
+
+
+class LearnedCategorizerTests(TestCase):
+    texts = [
+        'bank statement savings account balance deposit withdrawal',
+        'account statement interest credited balance bank branch',
+        'prescription doctor hospital diagnosis patient medicine',
+        'patient report blood test doctor clinic medicine dosage',
+    ] * 5
+    labels = ['Banking', 'Banking', 'Medical', 'Medical'] * 5
+
+    def setUp(self):
+        import tempfile
+
+        self.path = os.path.join(tempfile.mkdtemp(), 'categorizer.npz')
+        learned_categorizer.reset_model()
+        self.addCleanup(learned_categorizer.reset_model)
+
+    def test_model_round_trips_and_predicts_in_batch(self):
+        model = LinearCategoryModel.train(self.texts, self.labels, n_features=2 ** 12, epochs=40)
+        model.save(self.path)
+
+        loaded = LinearCategoryModel.load(self.path)
+        predictions = loaded.predict(['monthly bank statement with closing balance', 'doctor visit and medicine'])
+
+        self.assertEqual([category for category, _ in predictions], ['Banking', 'Medical'])
+        self.assertTrue(all(0.5 < probability <= 1 for _, probability in predictions))
+        self.assertEqual(loaded.metadata['documents'], 20)
+
+    def test_private_categories_are_not_learned(self):
+        owner = User.objects.create_user(username='private', email='private@example.com', password='pass')
+        secret = FileCategory.objects.create(name='Project Nightjar', created_by=owner)
+        shared = {label: FileCategory.objects.create(name=label, is_default=True) for label in set(self.labels)}
+        documents = [(text, shared[label]) for text, label in zip(self.texts, self.labels)]
+        documents += [('nightjar prototype wing assembly test flight telemetry', secret)] * 10
+        for index, (text, category) in enumerate(documents):
+            user_file = UserFile.objects.create(
+                user=owner, file_type='document', s3_key=f"user_{owner.id}/doc_{index}.pdf",
+                original_filename=f"doc_{index}.pdf", file_size=10, category=category,
+            )
+            OCRResult.objects.create(file=user_file, status='completed', text_content=text)
+
+        texts, labels = learned_categorizer.training_examples()
+        self.assertEqual(len(texts), len(self.texts))
+        self.assertNotIn('Project Nightjar', labels)
+
+        model = LinearCategoryModel.train(texts, labels, n_features=2 ** 12, epochs=40)
+        self.assertNotIn('Project Nightjar', model.classes)
+        [(category, _)] = model.predict(['nightjar prototype wing assembly test flight telemetry'])
+        self.assertIn(category, shared)
+
+        # A batch run never files a prediction under a user's own category of the same name
+        category = BatchCategorizer()._category('Project Nightjar')
+        self.assertNotEqual(category, secret)
+        self.assertIsNone(category.created_by)
+
+    def test_learned_mode_falls_back_to_keywords_without_a_model(self):
+        service = FileCategorizationService()
+        text = 'Doctor prescription from the hospital for the patient, medicine twice a day.'
+
+        with override_settings(CATEGORIZATION_MODE='learned', CATEGORIZER_MODEL_PATH=self.path):
+            self.assertNotIn('mode', service.analyze_file_content(text))
+
+            LinearCategoryModel.train(self.texts, self.labels, n_features=2 ** 12, epochs=40).save(self.path)
+            learned_categorizer.reset_model()
+            analyses = service.analyze_many([text, 'short'])
+
+        self.assertEqual(analyses[0]['mode'], 'learned')
+        self.assertEqual(analyses[0]['category'], 'Medical')
+        self.assertEqual(analyses[1]['category'], 'Miscellaneous')
@@ -0,0 +1,343 @@
+import base64
+import hmac
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import timedelta
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OCRResult
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def notifications_enabled():
+    """Textract reports completion to SNS (TEXTRACT_SNS_TOPIC_ARN + TEXTRACT_SNS_ROLE_ARN)"""
+    return bool(_setting('TEXTRACT_SNS_TOPIC_ARN', '') and _setting('TEXTRACT_SNS_ROLE_ARN', ''))
+
+
+def notification_params(user_file):
+    """Extra StartDocumentAnalysis arguments that make Textract publish its completion"""
+    if not notifications_enabled():
+        return {}
+    return {
+        'NotificationChannel': {
+            'SNSTopicArn': settings.TEXTRACT_SNS_TOPIC_ARN,
+            'RoleArn': settings.TEXTRACT_SNS_ROLE_ARN,
+        },
+        'JobTag': f"file-{user_file.id}",
+    }
+
+
+def is_silent(ocr_result):
+    """
+    True if a processing job should be polled.
+
+    Without notifications every job is polled as before. With them, a job
+    is only polled once nothing was heard for OCR_SWEEP_SILENT_AFTER seconds.
+    """
+    if not notifications_enabled():
+        return True
+    last_seen = ocr_result.last_polled_at or ocr_result.job_started_at
+    if last_seen is None:
+        return True
+    return timezone.now() - last_seen >= timedelta(seconds=_setting('OCR_SWEEP_SILENT_AFTER', 120))
+
+
+# Notifications
+
+def parse_notification(payload):
+    """
+    Extract the Textract completion from an SNS envelope, an SQS body
+    holding one, or a raw-delivery message.
+
+    Returns:
+        dict or None: {'job_id', 'status', 'job_tag', 'api'}
+    """
+    if isinstance(payload, (str, bytes)):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            return None
+    if not isinstance(payload, dict):
+        return None
+
+    if payload.get('Type') == 'Notification':
+        return parse_notification(payload.get('Message'))
+
+    if not payload.get('JobId') or not payload.get('Status'):
+        return None
+    return {
+        'job_id': payload['JobId'],
+        'status': payload['Status'],
+        'job_tag': payload.get('JobTag', ''),
+        'api': payload.get('API', ''),
+    }
+
+
+def handle_notification(message, ocr_service=None):
+    """
+    Finish the OCRResult a completion message refers to.
+
+    Returns a short outcome: 'completed', 'error', 'still_running',
+    'already_final', 'unknown_job' or 'invalid'.
+    """
+    from .services import OCRService
+
+    event = parse_notification(message)
+    if event is None:
+        return 'invalid'
+
+    ocr_result = OCRResult.objects.select_related('file').filter(job_id=event['job_id']).first()
+    if ocr_result is None:
+        return 'unknown_job'
+    if ocr_result.status != 'processing':
+        # Redelivered message, or the sweeper got there first
+        return 'already_final'
+
+    ocr_service = ocr_service or OCRService(max_pdf_wait=0)
+    result = ocr_service.finalize_textract_job(ocr_result)
+    if result is None:
+        return 'still_running'
+    print(f"[Textract Events] Job {event['job_id']} ({event['status']}) for file {ocr_result.file_id}: {result['status']}")
+    return result['status']
+
+
+def is_trusted_topic(topic_arn):
+    return bool(topic_arn) and topic_arn == _setting('TEXTRACT_SNS_TOPIC_ARN', '')
+
+
+def has_valid_token(token):
+    """True when TEXTRACT_NOTIFICATION_TOKEN is unset or matches, compared in constant time"""
+    expected = _setting('TEXTRACT_NOTIFICATION_TOKEN', '')
+    return not expected or hmac.compare_digest((token or '').encode(), expected.encode())
+
+
+def is_aws_url(url):
+    """Only follow SNS SubscribeURLs that point at AWS over HTTPS"""
+    parsed = urlparse(url or '')
+    return parsed.scheme == 'https' and (parsed.hostname or '').endswith('.amazonaws.com')
+
+
+# SNS message signatures (https://docs.aws.amazon.com/sns/latest/dg/sns-verify-signature-of-message.html)
+
+_SNS_CERT_HOST = re.compile(r'^sns\.[a-z0-9-]+\.amazonaws\.com(\.cn)?$')
+
+# The fields each message type signs, in the order they are signed; Subject only when present
+_SIGNED_FIELDS = {
+    'Notification': ['Message', 'MessageId', 'Subject', 'Timestamp', 'TopicArn', 'Type'],
+    'SubscriptionConfirmation': ['Message', 'MessageId', 'SubscribeURL', 'Timestamp', 'Token', 'TopicArn', 'Type'],
+    'UnsubscribeConfirmation': ['Message', 'MessageId', 'SubscribeURL', 'Timestamp', 'Token', 'TopicArn', 'Type'],
+}
+
+# Signing certificates by URL; SNS rotates them rarely
+_certificates = {}
+_certificates_lock = threading.Lock()
+
+
+def is_sns_certificate_url(url):
+    parsed = urlparse(url or '')
+    return (
+        parsed.scheme == 'https' and bool(_SNS_CERT_HOST.match(parsed.hostname or ''))
+        and parsed.path.endswith('.pem')
+    )
+
+
+def _fetch_certificate(url):
+    import requests
+
+    response = requests.get(url, timeout=10)
+    response.raise_for_status()
+    return response.content
+
+
+def _certificate(url):
+    from cryptography import x509
+
+    with _certificates_lock:
+        certificate = _certificates.get(url)
+    if certificate is None:
+        certificate = x509.load_pem_x509_certificate(_fetch_certificate(url))
+        with _certificates_lock:
+            _certificates[url] = certificate
+    return certificate
+
+
+def sns_string_to_sign(envelope):
+    fields = _SIGNED_FIELDS.get(envelope.get('Type'))
+    if fields is None:
+        return None
+    return ''.join(f"{field}\n{envelope[field]}\n" for field in fields if field in envelope).encode('utf-8')
+
+
+def verify_sns_signature(envelope):
+    """
+    True if an SNS HTTP(S) envelope carries a valid signature from an SNS
+    certificate. SignatureVersion 1 is SHA1 with RSA, 2 is SHA256 with RSA.
+    """
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    algorithm = {'1': hashes.SHA1, '2': hashes.SHA256}.get(str(envelope.get('SignatureVersion')))
+    certificate_url = envelope.get('SigningCertURL') or envelope.get('SigningCertUrl')
+    string_to_sign = sns_string_to_sign(envelope)
+    if algorithm is None or string_to_sign is None or not is_sns_certificate_url(certificate_url):
+        return False
+    try:
+        signature = base64.b64decode(envelope.get('Signature') or '', validate=True)
+        public_key = _certificate(certificate_url).public_key()
+        public_key.verify(signature, string_to_sign, padding.PKCS1v15(), algorithm())
+    except InvalidSignature:
+        return False
+    except Exception as e:
+        print(f"[Textract Events] Could not verify SNS signature: {str(e)}")
+        return False
+    return True
+
+
+def consume_queue(sqs_client, queue_url, max_messages=10, wait_seconds=20, ocr_service=None):
+    """
+    Read one batch of completion messages from SQS (long polling) and handle them.
+
+    Every received message is deleted once handled: a redelivery would
+    only find the job already final. Returns {'received', outcome: count}.
+    """
+    response = sqs_client.receive_message(
+        QueueUrl=queue_url,
+        MaxNumberOfMessages=max_messages,
+        WaitTimeSeconds=wait_seconds,
+    )
+    summary = {'received': 0}
+    for message in response.get('Messages', []):
+        summary['received'] += 1
+        try:
+            outcome = handle_notification(message['Body'], ocr_service)
+        except Exception as e:
+            # Leave it on the queue; it becomes visible again and is retried
+            print(f"[Textract Events] Error handling message {message.get('MessageId')}: {str(e)}")
+            summary['failed'] = summary.get('failed', 0) + 1
+            continue
+        summary[outcome] = summary.get(outcome, 0) + 1
+        sqs_client.delete_message(QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle'])
+    return summary
+
+
+# Fallback sweeper
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart (0 disables)"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def sweep_silent_jobs(ocr_service=None, batch_size=None, rate=None):
+    """
+    Poll, in one bounded batch, the processing jobs nothing was heard from.
+
+    Oldest-checked first, at most OCR_SWEEP_BATCH_SIZE jobs and
+    OCR_SWEEP_MAX_CALLS_PER_SECOND status calls, so a backlog of lost
+    notifications can't turn into a burst of Textract requests.
+    """
+    from .services import OCRService
+
+    ocr_service = ocr_service or OCRService(max_pdf_wait=0)
+    batch_size = batch_size or _setting('OCR_SWEEP_BATCH_SIZE', 50)
+    limiter = RateLimiter(rate if rate is not None else _setting('OCR_SWEEP_MAX_CALLS_PER_SECOND', 2))
+
+    pending = OCRResult.objects.filter(status='processing', job_id__isnull=False)
+    if notifications_enabled():
+        cutoff = timezone.now() - timedelta(seconds=_setting('OCR_SWEEP_SILENT_AFTER', 120))
+        pending = pending.filter(
+            Q(last_polled_at__lt=cutoff)
+            | Q(last_polled_at__isnull=True, job_started_at__lt=cutoff)
+            | Q(last_polled_at__isnull=True, job_started_at__isnull=True)
+        )
+    pending = pending.select_related('file').order_by(F('last_polled_at').asc(nulls_first=True), 'id')[:batch_size]
+
+    summary = {'checked': 0, 'completed': 0, 'error': 0, 'still_running': 0}
+    for ocr_result in pending:
+        limiter.wait()
+        summary['checked'] += 1
+        try:
+            result = ocr_service.finalize_textract_job(ocr_result)
+        except Exception as e:
+            print(f"[Textract Events] Error sweeping job {ocr_result.job_id}: {str(e)}")
+            summary['error'] += 1
+            continue
+        outcome = 'still_running' if result is None else result['status']
+        summary[outcome] = summary.get(outcome, 0) + 1
+
+    print(f"[Textract Events] Sweep: {summary}")
+    return summary
+
+
+# Fake notification source (tests, local development)
+
+def fake_notification(job_id, status='SUCCEEDED', job_tag='', topic_arn=None):
+    """An SNS Notification envelope as Textract would publish it"""
+    message = {
+        'JobId': job_id,
+        'Status': status,
+        'API': 'StartDocumentAnalysis',
+        'JobTag': job_tag,
+        'Timestamp': int(time.time() * 1000),
+        'DocumentLocation': {'S3ObjectName': '', 'S3Bucket': _setting('AWS_STORAGE_BUCKET_NAME', '')},
+    }
+    return {
+        'Type': 'Notification',
+        'MessageId': str(uuid.uuid4()),
+        'TopicArn': topic_arn or _setting('TEXTRACT_SNS_TOPIC_ARN', ''),
+        'Message': json.dumps(message),
+        'Timestamp': timezone.now().isoformat(),
+    }
+
+
+class FakeNotificationQueue:
+    """
+    In-memory stand-in for the SQS queue subscribed to the Textract topic.
+
+    Implements the receive_message/delete_message subset consume_queue uses;
+    publish() enqueues a completion the way SNS would deliver it.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.deleted = []
+
+    def publish(self, job_id, status='SUCCEEDED', job_tag=''):
+        receipt = str(uuid.uuid4())
+        self.messages.append({
+            'MessageId': str(uuid.uuid4()),
+            'ReceiptHandle': receipt,
+            'Body': json.dumps(fake_notification(job_id, status, job_tag)),
+        })
+        return receipt
+
+    def receive_message(self, QueueUrl=None, MaxNumberOfMessages=1, WaitTimeSeconds=0, **kwargs):
+        return {'Messages': list(self.messages[:MaxNumberOfMessages])}
+
+    def delete_message(self, QueueUrl=None, ReceiptHandle=None):
+        self.messages = [message for message in self.messages if message['ReceiptHandle'] != ReceiptHandle]
+        self.deleted.append(ReceiptHandle)
@@ -19,6 +19,8 @@ urlpatterns = [
     # path('search_documents/<str:job_name>/', views.search_documents, name='search_documents'),
     path('ocr/process/<int:file_id>/', views.process_document_ocr, name='process_ocr'),
     path('ocr/result/<str:job_id>/', views.get_ocr_result, name='get_ocr_result'),
+    # Before the router, whose files/<pk>/ route would take 'page'
+    path('api/files/page/', views.file_list_page, name='file_list_page'),
     path('api/', include(router.urls)),
     path('cards/', views.card_list_view, name='card_list'),
     path('subscriptions/', views.subscription_list_view, name='subscription_list'),
@@ -35,16 +37,25 @@ urlpatterns = [
     path('api/mobile/files/<int:file_id>/unlock/', views.unlock_file, name='unlock_file'),
     path('api/mobile/files/<int:file_id>/rename/', views.rename_file, name='rename_file'),
     path('api/mobile/files/<int:file_id>/ocr/', views.mobile_ocr_status, name='mobile_ocr_status'),
+    path('api/files/<int:file_id>/ocr/pages/', views.ocr_pages, name='ocr_pages'),
     path('api/mobile/files/<int:file_id>/process-ocr/', views.mobile_process_ocr, name='mobile_process_ocr'),
     path('api/mobile/ocr-preferences/', views.ocr_preferences, name='ocr_preferences'),
     path('api/mobile/upload/', views.mobile_file_upload, name='mobile_file_upload'),
+    path('api/uploads/direct/initiate/', views.direct_upload_initiate, name='direct_upload_initiate'),
+    path('api/uploads/direct/complete/', views.direct_upload_complete, name='direct_upload_complete'),
+    path('api/uploads/direct/abort/', views.direct_upload_abort, name='direct_upload_abort'),
+    path('api/uploads/<str:upload_id>/progress/', views.upload_progress, name='upload_progress'),
     path('api/documents/create-pair/', views.create_document_pair, name='create_document_pair'),
     path('api/documents/<int:file_id>/break-pair/', views.break_document_pair, name='break_document_pair'),
     path('api/documents/paired/', views.get_paired_documents, name='get_paired_documents'),
     path('api/ocr/check-pending/', views.check_pending_ocr_jobs, name='check_pending_ocr'),
     path('api/ocr/status/<int:file_id>/', views.get_file_ocr_status, name='get_file_ocr_status'),
+    path('api/ocr/jobs/<int:job_id>/', views.ocr_job_status, name='ocr_job_status'),
+    path('api/ocr/textract-events/', views.textract_notification, name='textract_notification'),
+    path('api/files/bulk-delete/', views.bulk_delete_files, name='bulk_delete_files'),
     path('api/files/<int:file_id>/toggle-favorite/', views.toggle_favorite, name='toggle_favorite'),
     path('api/files/<int:file_id>/toggle-hidden/', views.toggle_hidden, name='toggle_hidden'),
     path('api/files/<int:file_id>/access-locked/', views.access_locked_file, name='access_locked_file'),    
+    path('api/files/<int:file_id>/stream/', views.stream_file, name='stream_file'),
 ]
 
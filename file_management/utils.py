@@ -358,23 +358,18 @@
 #         )
 
 
-import docx
-import io
-import boto3
 from django.conf import settings
 from django.shortcuts import get_object_or_404
+from storage_management.clients import get_s3_client
 from .models import UserFile, OCRResult, FileCategory
+from .keyword_matcher import KeywordMatcher
+from .learned_categorizer import get_model, learned_mode_enabled
 import requests
 
 def download_file_from_s3(s3_key):
     """Download file content from S3"""
     try:
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
+        s3_client = get_s3_client()
         
         response = s3_client.get_object(
             Bucket=settings.AWS_STORAGE_BUCKET_NAME,
@@ -386,32 +381,13 @@ def download_file_from_s3(s3_key):
         raise
 
 def extract_text_from_document(s3_key, file_extension):
-    """Extract text from various document formats stored in S3"""
-    try:
-        # Download file content from S3
-        file_content = download_file_from_s3(s3_key)
-        
-        if file_extension == 'txt':
-            # For text files
-            try:
-                return file_content.decode('utf-8')
-            except UnicodeDecodeError:
-                return file_content.decode('latin-1')
-                
-        elif file_extension == 'docx':
-            # For Word documents
-            doc = docx.Document(io.BytesIO(file_content))
-            return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-            
-        elif file_extension == 'md':
-            # For Markdown files
-            try:
-                return file_content.decode('utf-8')
-            except UnicodeDecodeError:
-                return file_content.decode('latin-1')
-            
+    """Extract text from various document formats stored in S3 (streamed, see file_management.extractors)"""
+    from .extractors import HANDLERS, extract_text
+
+    if file_extension not in HANDLERS:
         return None
-        
+    try:
+        return extract_text(s3_key, file_extension).text
     except Exception as e:
         raise Exception(f"Error extracting text from {file_extension} file: {str(e)}")
 
@@ -527,12 +503,16 @@ class FileCategorizationService:
         ]
     }
 
-    def get_category(self, text_content, default_category='Miscellaneous'):
-        """Analyze text content and return the most likely category"""
-        if not text_content or len(text_content.strip()) < 10:
-            return default_category
+    # Compiled once: every keyword of every category, matched in one pass per text
+    KEYWORD_MATCHER = KeywordMatcher(
+        keyword for keywords in CATEGORY_KEYWORDS.values() for keyword in keywords
+    )
+
+    def _scan_keywords(self, text_lower):
+        return self.KEYWORD_MATCHER.scan(text_lower, first_part=500)
 
-        text_lower = text_content.lower()
+    def _category_scores(self, hits):
+        """Weighted category scores from a keyword scan"""
         category_scores = {}
         
         for category, keywords in self.CATEGORY_KEYWORDS.items():
@@ -540,26 +520,24 @@ class FileCategorizationService:
             keyword_matches = 0
             
             for keyword in keywords:
-                # Count occurrences
-                count = text_lower.count(keyword.lower())
-                if count > 0:
+                hit = hits.get(keyword.lower())
+                if hit is not None:
                     keyword_matches += 1
                     
                     # Add weight based on keyword specificity and length
                     if len(keyword) > 10:  # Very specific keywords
-                        score += count * 4
+                        score += hit.count * 4
                     elif len(keyword) > 6:  # Moderately specific
-                        score += count * 3
+                        score += hit.count * 3
                     else:
-                        score += count * 2
+                        score += hit.count * 2
                     
                     # Bonus for exact word matches
-                    if f" {keyword.lower()} " in f" {text_lower} ":
+                    if hit.exact_match:
                         score += 5
                         
                     # Extra bonus for keywords in first part of document
-                    first_part = text_lower[:500]
-                    if keyword.lower() in first_part:
+                    if hit.in_first_part:
                         score += 3
 
             # Apply multiplier based on number of different keywords matched
@@ -567,6 +545,9 @@ class FileCategorizationService:
                 diversity_multiplier = min(1 + (keyword_matches * 0.1), 2.0)
                 category_scores[category] = score * diversity_multiplier
 
+        return category_scores
+
+    def _best_category(self, category_scores, default_category='Miscellaneous'):
         if category_scores:
             max_score = max(category_scores.values())
             # Lower threshold for better categorization
@@ -575,12 +556,62 @@ class FileCategorizationService:
             
         return default_category
 
-    def analyze_file_content(self, text_content):
+    def get_category(self, text_content, default_category='Miscellaneous'):
+        """Analyze text content and return the most likely category"""
+        if not text_content or len(text_content.strip()) < 10:
+            return default_category
+
+        hits = self._scan_keywords(text_content.lower())
+        return self._best_category(self._category_scores(hits), default_category)
+
+    def _learned_analyses(self, texts):
+        """
+        Learned-model results (CATEGORIZATION_MODE='learned') for texts, in one
+        vectorized call. None where the model is missing or below
+        CATEGORIZER_MIN_PROBABILITY, so the keyword scorer decides those.
+        """
+        model = get_model() if learned_mode_enabled() else None
+        if model is None or not texts:
+            return [None] * len(texts)
+
+        minimum = getattr(settings, 'CATEGORIZER_MIN_PROBABILITY', 0.5)
+        results = []
+        for probabilities in model.predict_proba(texts):
+            best = int(probabilities.argmax())
+            if probabilities[best] < minimum:
+                results.append(None)
+                continue
+            results.append({
+                'category': model.classes[best],
+                'confidence': float(probabilities[best]) * 100,
+                'matches': {},
+                'scores': {name: float(probability) * 100 for name, probability in zip(model.classes, probabilities)},
+                'mode': 'learned',
+            })
+        return results
+
+    def analyze_many(self, texts):
+        """analyze_file_content for many texts; the learned model scores them all at once"""
+        results = [None] * len(texts)
+        usable = [index for index, text in enumerate(texts) if text and len(text.strip()) >= 10]
+        for index, learned in zip(usable, self._learned_analyses([texts[index] for index in usable])):
+            results[index] = learned
+        return [
+            result if result is not None else self.analyze_file_content(text, learned=False)
+            for text, result in zip(texts, results)
+        ]
+
+    def analyze_file_content(self, text_content, learned=True):
         """Analyze file content and return detailed categorization info"""
         if not text_content or len(text_content.strip()) < 10:
             return {'category': 'Miscellaneous', 'confidence': 0, 'matches': []}
 
-        text_lower = text_content.lower()
+        if learned:
+            analysis = self._learned_analyses([text_content])[0]
+            if analysis is not None:
+                return analysis
+
+        hits = self._scan_keywords(text_content.lower())
         category_matches = {}
         category_scores = {}
         
@@ -589,17 +620,17 @@ class FileCategorizationService:
             total_score = 0
             
             for keyword in keywords:
-                count = text_lower.count(keyword.lower())
-                if count > 0:
-                    keyword_score = count * (len(keyword) // 3 + 1)  # Length-based scoring
-                    if f" {keyword.lower()} " in f" {text_lower} ":
+                hit = hits.get(keyword.lower())
+                if hit is not None:
+                    keyword_score = hit.count * (len(keyword) // 3 + 1)  # Length-based scoring
+                    if hit.exact_match:
                         keyword_score += 5  # Exact match bonus
                     
                     total_score += keyword_score
                     matches.append({
                         'keyword': keyword,
-                        'count': count,
-                        'exact_match': f" {keyword.lower()} " in f" {text_lower} ",
+                        'count': hit.count,
+                        'exact_match': hit.exact_match,
                         'score': keyword_score
                     })
             
@@ -607,8 +638,8 @@ class FileCategorizationService:
                 category_matches[category] = matches
                 category_scores[category] = total_score
 
-        # Get primary category
-        category = self.get_category(text_content)
+        # Get primary category (from the same scan)
+        category = self._best_category(self._category_scores(hits))
         
         # Calculate confidence
         confidence = 0
@@ -641,13 +672,15 @@ def create_default_categories():
         ('Miscellaneous', 'Uncategorized documents')
     ]
     
-    for name, description in default_categories:
-        FileCategory.objects.get_or_create(
-            name=name,
-            defaults={
-                'description': description,
-                'is_default': True
-            }
-        )
+    # One query for what exists, one insert for the rest
+    existing = set(
+        FileCategory.objects.filter(name__in=[name for name, _ in default_categories]).values_list('name', flat=True)
+    )
+    created = FileCategory.objects.bulk_create([
+        FileCategory(name=name, description=description, is_default=True)
+        for name, description in default_categories
+        if name not in existing
+    ])
+    return len(created)
 
 
@@ -1,10 +1,10 @@
 from django.shortcuts import render
 from django.http import JsonResponse
-from .models import UserFile,OCRResult,FileCategory,CardDetails,ExpiryDetails
-from .serializers import UserFileSerializer, FileCategorySerializer, OCRResultSerializer,FileUploadSerializer, FileSearchSerializer, AppSubscription, CardDetailsSerializer, AppSubscriptionSerializer, FilePasswordSerializer
+from .models import UserFile,OCRResult,FileCategory,CardDetails,ExpiryDetails,OCRJob,OCRPage
+from .serializers import UserFileSerializer, SparseUserFileSerializer, FileCategorySerializer, OCRResultSerializer,FileUploadSerializer, FileSearchSerializer, AppSubscription, CardDetailsSerializer, AppSubscriptionSerializer, FilePasswordSerializer
 from rest_framework.decorators import api_view, permission_classes
 from .forms import FileUploadForm
-import os, boto3, time, re
+import os, time, re, json
 from django.core.files.storage import default_storage
 from django.conf import settings
 from voice_retrieval import settings
@@ -18,18 +18,28 @@ from rest_framework.permissions import IsAuthenticated
 from django.views.decorators.http import require_http_methods
 from rest_framework.response import Response
 from django.db.models import Q
-from .services import ExpiryManagementService
+from .services import ExpiryManagementService, FileDeletionService
 from datetime import date
 from storage_management.utils import S3StorageManager
+from storage_management.streaming import stream_s3_object
+from storage_management.clients import get_client, get_s3_client, get_textract_client
+from storage_management.transfer import UploadProgress
+from .dedupe import find_duplicate, find_upload_duplicate
+from .extractors import EXTRACTABLE_EXTENSIONS, extract_stream
+from .listing import ListingError, filter_files, keyset_page, parse_fields, parse_limit
+from .search_index import search_files, search_filter
+from .facets import (
+    active_card_filter, active_subscription_filter, card_facets, category_counts, file_facets, subscription_facets
+)
+from .keys import S3KeyNotFound, resolve_s3_key
+from . import ocr_cache
+from .ocr_engines import TextractEngine
+from .ocr_queue import enqueue_ocr, job_status
+from .textract_events import is_silent, notification_params
 from django.db import transaction, models
 from django.core.exceptions import ValidationError
 
-textract_client = boto3.client(
-    'textract',
-    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    region_name=settings.AWS_S3_REGION_NAME
-)
+textract_client = get_client('textract')
 
 
 # def file_upload_view(request):
@@ -194,30 +204,8 @@ def delete_file(request, file_id):
         user_file = get_object_or_404(UserFile, id=file_id, user=request.user)
         
         try:
-            # Use S3StorageManager to delete the file
-            storage_manager = S3StorageManager(request.user)
-            
-            # Extract the filename from the s3_key or file.name
-            file_key = user_file.s3_key
-            if not file_key and user_file.file:
-                file_key = user_file.file.name
-                
-            # If we have a full path, extract just the filename
-            if file_key and '/' in file_key:
-                file_name = file_key.split('/')[-1]
-            else:
-                file_name = file_key
-                
-            if file_name:
-                try:
-                    # Delete from S3 using the storage manager
-                    storage_manager.delete_file(file_name)
-                except Exception as s3_error:
-                    print(f"S3 deletion error: {str(s3_error)}")
-                    # Continue with database deletion even if S3 deletion fails
-            
-            # Delete the database record
-            user_file.delete()
+            # One row delete plus one DeleteObjects call on the canonical key
+            FileDeletionService(request.user).delete_files([user_file])
             
             return JsonResponse({
                 'status': 'success',
@@ -246,12 +234,7 @@ def cleanup_local_files():
 
 
 # Initialize Boto3 client for Transcribe
-transcribe_client = boto3.client(
-    'transcribe',
-    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    region_name=settings.AWS_S3_REGION_NAME
-)
+transcribe_client = get_client('transcribe')
 
 '''
 The feature to download the transcription would be handled at the frontend 
@@ -327,12 +310,7 @@ def get_transcription_result(request, job_name):
         return JsonResponse({"error": str(e)}, status=500)
 
 
-comprehend_client = boto3.client(
-    'comprehend',
-    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    region_name=settings.AWS_S3_REGION_NAME
-)
+comprehend_client = get_client('comprehend')
 
 def text_analysis(request, job_name):
     try:
@@ -425,7 +403,6 @@ def text_analysis(request, job_name):
 
 import pandas as pd
 import io
-from .utils import extract_text_from_document
 from .utils import FileCategorizationService
 
 
@@ -607,12 +584,7 @@ def get_ocr_result(request, job_id):
             })
 
         # Set up AWS Textract client
-        textract_client = boto3.client(
-            'textract',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
+        textract_client = get_textract_client()
 
         # Get OCR processing status and response
         try:
@@ -1078,12 +1050,6 @@ class FileViewSet(viewsets.ModelViewSet):
             queryset = self.get_queryset()
             
             # Apply filters
-            if query := serializer.validated_data.get('query'):
-                queryset = queryset.filter(
-                    Q(original_filename__icontains=query) |
-                    Q(category__name__icontains=query)
-                )
-            
             if file_type := serializer.validated_data.get('file_type'):
                 queryset = queryset.filter(file_type=file_type)
                 
@@ -1096,9 +1062,26 @@ class FileViewSet(viewsets.ModelViewSet):
             if date_to := serializer.validated_data.get('date_to'):
                 queryset = queryset.filter(upload_date__lte=date_to)
             
-            return Response(
-                UserFileSerializer(queryset, many=True).data
+            query = serializer.validated_data.get('query')
+            if not query:
+                return Response(
+                    UserFileSerializer(queryset, many=True).data
+                )
+
+            # Index matches in rank order with their snippets, then file and category names containing the query
+            hits = search_files(request.user, query, within=queryset)
+            snippets = {hit.file_id: hit.snippet for hit in hits}
+            position = {hit.file_id: index for index, hit in enumerate(hits)}
+            files = sorted(
+                queryset.filter(
+                    Q(id__in=list(snippets)) | Q(original_filename__icontains=query) | Q(category__name__icontains=query)
+                ).select_related('category'),
+                key=lambda user_file: (position.get(user_file.id, len(position)), -user_file.upload_date.timestamp()),
             )
+            data = UserFileSerializer(files, many=True).data
+            for item in data:
+                item['snippet'] = snippets.get(item['id'], '')
+            return Response(data)
             
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -1220,17 +1203,26 @@ def process_document_ocr_logic(user_id, file_id):
         # --- Step 1: Extract Text ---
         # Check if OCR result already exists and has content (e.g., from async job)
         existing_ocr = OCRResult.objects.filter(file=user_file).first()
+        cache_entry = None
+        if not (existing_ocr and existing_ocr.status == 'completed' and existing_ocr.text_content) \
+                and file_extension in ['jpg', 'jpeg', 'png', 'pdf']:
+            # Identical bytes were OCR'd before: reuse the text instead of calling Textract
+            cache_entry = ocr_cache.lookup(user_file.file_hash, TextractEngine.version)
         if existing_ocr and existing_ocr.status == 'completed' and existing_ocr.text_content:
             print(f"[OCR Logic] Using existing OCR text for file {user_file.id}")
             text_content = existing_ocr.text_content
             ocr_status = 'completed'
-        elif file_extension in ['txt', 'docx', 'md']:
+        elif cache_entry is not None:
+            print(f"[OCR Logic] Using cached OCR text for file {user_file.id}")
+            text_content = cache_entry.text_content
+            ocr_status = 'completed'
+        elif file_extension in EXTRACTABLE_EXTENSIONS:
              print(f"[OCR Logic] Extracting text directly for file {user_file.id}")
              try:
                  # Assuming user_file.file is FieldFile pointing to S3
                  storage = default_storage # Or your specific S3 storage backend
                  with storage.open(user_file.file.name, 'rb') as file_obj:
-                    text_content = extract_text_from_document(file_obj, file_extension)
+                    text_content = extract_stream(file_obj, file_extension).text
                  ocr_status = 'completed' if text_content is not None else 'failed'
              except Exception as extraction_error:
                  print(f"[OCR Logic] Error extracting text directly: {extraction_error}")
@@ -1239,18 +1231,15 @@ def process_document_ocr_logic(user_id, file_id):
         elif file_extension in ['jpg', 'jpeg', 'png']:
             print(f"[OCR Logic] Processing image with Textract synchronously for file {user_file.id}")
             try:
-                textract_client = boto3.client(
-                    'textract',
-                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                    region_name=settings.AWS_S3_REGION_NAME
-                )
+                textract_client = get_textract_client()
                 response = textract_client.detect_document_text(
                     Document={'S3Object': {'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Name': user_file.file.name}}
                 )
                 extracted_lines = [item['Text'] for item in response['Blocks'] if item['BlockType'] == 'LINE']
                 text_content = '\n'.join(extracted_lines)
                 ocr_status = 'completed'
+                ocr_cache.store(user_file.file_hash, TextractEngine.version, text_content,
+                                [(1, text_content, None, len(extracted_lines))])
             except Exception as textract_error:
                 print(f"[OCR Logic] Textract sync error: {textract_error}")
                 ocr_status = 'failed'
@@ -1258,18 +1247,22 @@ def process_document_ocr_logic(user_id, file_id):
         elif file_extension == 'pdf':
             print(f"[OCR Logic] Starting async Textract job for PDF file {user_file.id}")
             try:
-                textract_client = boto3.client(
-                    'textract',
-                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                    region_name=settings.AWS_S3_REGION_NAME
-                )
+                textract_client = get_textract_client()
                 # Check if a job is already running for this file
+                if existing_ocr and existing_ocr.status == 'processing' and existing_ocr.job_id and not is_silent(existing_ocr):
+                     # Completion arrives as a Textract notification; don't poll
+                     return {
+                         'status': 'processing',
+                         'job_id': existing_ocr.job_id,
+                         'message': "Textract job is still in progress"
+                     }
                 if existing_ocr and existing_ocr.status == 'processing' and existing_ocr.job_id:
                      print(f"[OCR Logic] Async job {existing_ocr.job_id} already in progress.")
                      # For admin panel, we want to wait and get results rather than return early
                      # Try to check the job status
                      try:
+                         existing_ocr.last_polled_at = timezone.now()
+                         existing_ocr.save(update_fields=['last_polled_at'])
                          response = textract_client.get_document_analysis(JobId=existing_ocr.job_id)
                          job_status = response['JobStatus']
                          if job_status == 'SUCCEEDED':
@@ -1298,14 +1291,18 @@ def process_document_ocr_logic(user_id, file_id):
                 if ocr_status != 'completed':  # If previous steps didn't complete OCR
                     response = textract_client.start_document_analysis(
                         DocumentLocation={'S3Object': {'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Name': user_file.file.name}},
-                        FeatureTypes=['TABLES', 'FORMS'] # Adjust as needed
+                        FeatureTypes=['TABLES', 'FORMS'], # Adjust as needed
+                        **notification_params(user_file)
                     )
                     job_id = response['JobId']
                     ocr_status = 'processing'
                     # Save job_id immediately
                     ocr_result, _ = OCRResult.objects.update_or_create(
                         file=user_file,
-                        defaults={'status': ocr_status, 'job_id': job_id, 'text_content': None}
+                        defaults={
+                            'status': ocr_status, 'job_id': job_id, 'text_content': None,
+                            'job_started_at': timezone.now(), 'last_polled_at': None
+                        }
                     )
                     print(f"[OCR Logic] Async job {job_id} started.")
                     
@@ -1347,6 +1344,8 @@ def process_document_ocr_logic(user_id, file_id):
             file=user_file,
             defaults=ocr_defaults
         )
+        if cache_entry is not None:
+            ocr_cache.restore(cache_entry, ocr_result)
         print(f"[OCR Logic] OCRResult updated/created for file {user_file.id} with status: {ocr_status}")
 
         # --- Step 3: Categorize if applicable ---
@@ -1482,16 +1481,22 @@ def file_upload_view(request):
             
             # Initialize storage manager
             storage_manager = S3StorageManager(request.user)
+            upload_id = request.data.get('upload_id')
             
-            # Check storage limit
-            if not storage_manager.check_storage_limit(file_obj.size):
-                return Response({
-                    'success': False,
-                    'error': 'Storage limit would be exceeded'
-                }, status=status.HTTP_400_BAD_REQUEST)
+            # Identical content already stored for this user: reuse it, no upload and no extra quota
+            upload_result = find_upload_duplicate(request.user, file_obj)
             
-            # Upload file to S3
-            file_key = storage_manager.upload_file(file_obj, file_obj.name)
+            if upload_result is None:
+                # Check storage limit
+                if not storage_manager.check_storage_limit(file_obj.size):
+                    return Response({
+                        'success': False,
+                        'error': 'Storage limit would be exceeded'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                
+                # Stream file to S3 (multipart above the threshold, checksum in the same pass)
+                upload_result = storage_manager.upload_file_stream(file_obj, file_obj.name, upload_id=upload_id)
+            file_key = upload_result['s3_key']
             
             # Determine category
             category = None
@@ -1518,7 +1523,8 @@ def file_upload_view(request):
                 file=file_key,
                 s3_key=file_key,  # Ensure s3_key is set
                 original_filename=file_obj.name,
-                file_size=file_obj.size,
+                file_size=upload_result['size'],
+                file_hash=upload_result['sha256'],
                 category=category,
                 pending_auto_categorization=should_auto_categorize
             )
@@ -1526,23 +1532,19 @@ def file_upload_view(request):
             # Get updated storage info
             storage_info = storage_manager.get_user_storage_info()
             
-            # Start OCR processing for document and image files
+            # Queue OCR for document and image files; the response doesn't wait for it
             ocr_result = {'status': 'not_applicable'}
             if file_type in ['document', 'image']:
-                try:
-                    from .services import OCRService
-                    ocr_service = OCRService()
-                    ocr_result = ocr_service.process_file(user_file)
-                    print(f"[Upload] OCR result: {ocr_result}")
-                except Exception as ocr_error:
-                    print(f"[Upload] OCR error: {str(ocr_error)}")
-                    ocr_result = {'status': 'error', 'error': str(ocr_error)}
+                ocr_result = job_status(enqueue_ocr(user_file, lane='interactive'))
             
             return Response({
                 'success': True,
                 'message': 'File uploaded successfully',
                 'file': UserFileSerializer(user_file).data,
                 'storage_info': storage_info,
+                'checksum': upload_result['sha256'],
+                'upload_id': upload_id,
+                'deduplicated': 'duplicate_of' in upload_result,
                 'ocr_result': ocr_result
             }, status=status.HTTP_201_CREATED)
                 
@@ -1587,65 +1589,32 @@ def file_list_view(request):
         files = files.filter(file_type=file_type)
     
     if search:
-        files = files.filter(
-            Q(original_filename__icontains=search) |
-            Q(category__name__icontains=search)
-        )
-    
-    # Get categories with counts for filters
-    categories = []
-    for category in FileCategory.objects.all():
-        count = UserFile.objects.filter(user=request.user, category=category).count()
-        categories.append({
-            'id': category.id,
-            'name': category.name,
-            'count': count,
-            'type': 'expired' if category.name == 'EXPIRED_DOCS' else 'regular'
-        })
-    # Added special counts
-    favorite_count = UserFile.objects.filter(user=request.user, is_favorite=True).count()
-    hidden_count = UserFile.objects.filter(user=request.user, is_hidden=True).count()
-    locked_count = UserFile.objects.filter(user=request.user, locked=True).count()
+        files = files.filter(search_filter(request.user, search))
     
+    # Category and flag counts for filters, from one grouped query
+    facets = file_facets(UserFile.objects.filter(user=request.user))
+    categories = [
+        dict(item, type='expired' if item['name'] == 'EXPIRED_DOCS' else 'regular')
+        for item in category_counts(facets, FileCategory.objects.all())
+    ]
     
-    # Special categories counts (cards, subscriptions)
+    # Special categories counts (cards, subscriptions), one query each
     today = date.today()
     cards = CardDetails.objects.filter(user=request.user)
-    active_cards = cards.filter(
-        Q(expiry_year__gt=today.year) |
-        (Q(expiry_year=today.year) & Q(expiry_month__gte=today.month))
-    )
+    active_cards = cards.filter(active_card_filter(today))
     
     subscriptions = AppSubscription.objects.filter(user=request.user)
-    active_subscriptions = subscriptions.filter(
-        Q(end_date__gte=today) |
-        Q(auto_renewal=True)
-    )
+    active_subscriptions = subscriptions.filter(active_subscription_filter(today))
     
     special_categories = [
-        {
-            'name': 'Cards',
-            'type': 'special',
-            'count': active_cards.count(),
-            'total_count': cards.count(),
-            'expired_count': cards.count() - active_cards.count()
-        },
-        {
-            'name': 'Subscriptions',
-            'type': 'special',
-            'count': active_subscriptions.count(),
-            'total_count': subscriptions.count(),
-            'expired_count': subscriptions.count() - active_subscriptions.count()
-        }
+        {'name': 'Cards', 'type': 'special', **card_facets(request.user, today)},
+        {'name': 'Subscriptions', 'type': 'special', **subscription_facets(request.user, today)},
     ]
     
     # Get expired items
     expired_items = {
-        'documents': UserFileSerializer(files.filter(category__name='EXPIRED_DOCS'), many=True).data,
-        'cards': CardDetailsSerializer(cards.exclude(
-            Q(expiry_year__gt=today.year) |
-            (Q(expiry_year=today.year) & Q(expiry_month__gte=today.month))
-        ), many=True).data,
+        'documents': UserFileSerializer(files.filter(category__name='EXPIRED_DOCS'), many=True, context={'request': request}).data,
+        'cards': CardDetailsSerializer(cards.exclude(active_card_filter(today)), many=True).data,
         'subscriptions': AppSubscriptionSerializer(subscriptions.filter(
             end_date__lt=today,
             auto_renewal=False
@@ -1653,17 +1622,45 @@ def file_list_view(request):
     }
     
     return Response({
-        'files': UserFileSerializer(files, many=True).data,
+        'files': UserFileSerializer(files, many=True, context={'request': request}).data,
         'categories': categories + special_categories,
         'expired_items': expired_items,
         'active_cards': CardDetailsSerializer(active_cards, many=True).data,
         'active_subscriptions': AppSubscriptionSerializer(active_subscriptions, many=True).data,
-        'counts': {
-            'favorites': favorite_count,
-            'hidden': hidden_count,
-            'locked': locked_count,
-            'total': UserFile.objects.filter(user=request.user).count()
-        },
+        'counts': facets['counts'],
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def file_list_page(request):
+    """
+    Cursor-paginated file listing in (upload_date, id) order, newest first.
+
+    Query params: the file_list_view filters, limit (FILE_LIST_PAGE_SIZE,
+    at most FILE_LIST_MAX_PAGE_SIZE), cursor (next_cursor of the previous
+    page), order=asc for oldest first, and fields=id,name,type,thumbnail to
+    serialize only those fields. URLs are only signed for requested URL fields.
+    """
+    params = request.query_params
+    try:
+        fields = parse_fields(params.get('fields'), SparseUserFileSerializer.Meta.fields)
+        limit = parse_limit(params.get('limit'))
+        files = filter_files(UserFile.objects.filter(user=request.user), params, request.user)
+        if fields is None or 'category' in fields:
+            files = files.select_related('category')
+        if fields is None or 'document_pair' in fields:
+            files = files.select_related('paired_document')
+        page, next_cursor = keyset_page(
+            files, cursor=params.get('cursor'), limit=limit, descending=params.get('order') != 'asc'
+        )
+    except ListingError as e:
+        return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'success': True,
+        'files': SparseUserFileSerializer(page, many=True, fields=fields, context={'request': request}).data,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
     })
 
 @csrf_exempt
@@ -1675,7 +1672,7 @@ def card_list_view(request):
     
     return Response({
         'cards': CardDetailsSerializer(cards, many=True).data,
-        'files': UserFileSerializer(files, many=True).data
+        'files': UserFileSerializer(files, many=True, context={'request': request}).data
     })
 
 @csrf_exempt
@@ -1689,7 +1686,7 @@ def subscription_list_view(request):
     return Response({
         'subscriptions': AppSubscriptionSerializer(subscriptions, many=True).data,
         'cards': CardDetailsSerializer(cards, many=True).data,
-        'files': UserFileSerializer(files, many=True).data
+        'files': UserFileSerializer(files, many=True, context={'request': request}).data
     })
 
 @csrf_exempt
@@ -1766,6 +1763,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.db.models import Q
+from django.utils import timezone
 from .models import UserFile, FileCategory
 from .serializers import UserFileSerializer
 
@@ -1809,16 +1807,11 @@ def mobile_file_list(request):
 
         # Search filter
         if search:
-            files = files.filter(
-                Q(original_filename__icontains=search) |
-                Q(category__name__icontains=search)
-            )
+            files = files.filter(search_filter(request.user, search))
 
-        # Build category counts for filter UI
-        categories = []
-        for cat in FileCategory.objects.all():
-            count = UserFile.objects.filter(user=request.user, category=cat).count()
-            categories.append({ 'id': cat.id, 'name': cat.name, 'count': count })
+        # Build category counts for filter UI (one grouped query)
+        facets = file_facets(UserFile.objects.filter(user=request.user))
+        categories = category_counts(facets, FileCategory.objects.all())
 
         # Serialize
         payload = {
@@ -1897,32 +1890,7 @@ def mobile_file_detail(request, file_id):
         elif request.method == 'DELETE':
             # Delete the file
             try:
-                # Get the full S3 key
-                file_key = user_file.file.name
-                
-                # Delete from S3
-                storage_manager = S3StorageManager(request.user)
-                
-                try:
-                    # Try to delete from S3
-                    s3_client = boto3.client(
-                        's3',
-                        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                        region_name=settings.AWS_S3_REGION_NAME
-                    )
-                    
-                    # Delete the object directly
-                    s3_client.delete_object(
-                        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
-                        Key=file_key
-                    )
-                except Exception as s3_error:
-                    print(f"S3 deletion error: {str(s3_error)}")
-                    # Continue with database deletion even if S3 deletion fails
-                
-                # Delete the database record
-                user_file.delete()
+                FileDeletionService(request.user).delete_files([user_file])
                 
                 return {
                     'message': 'File deleted successfully'
@@ -1980,12 +1948,18 @@ def mobile_file_upload(request):
              return Response({'success': False, 'error': 'File not provided'}, status=status.HTTP_400_BAD_REQUEST)
 
         storage_manager = S3StorageManager(request.user)
+        upload_id = request.data.get('upload_id')
+
+        # Identical content already stored for this user: reuse it, no upload and no extra quota
+        upload_result = find_upload_duplicate(request.user, file_obj)
 
-        if not storage_manager.check_storage_limit(file_obj.size):
-            return Response({'success': False, 'error': 'Storage limit would be exceeded'}, status=status.HTTP_400_BAD_REQUEST)
+        if upload_result is None:
+            if not storage_manager.check_storage_limit(file_obj.size):
+                return Response({'success': False, 'error': 'Storage limit would be exceeded'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Upload file to S3
-        s3_key = storage_manager.upload_file(file_obj, file_obj.name)
+            # Stream file to S3 (multipart above the threshold, checksum in the same pass)
+            upload_result = storage_manager.upload_file_stream(file_obj, file_obj.name, upload_id=upload_id)
+        s3_key = upload_result['s3_key']
         
         # Determine category
         category = None
@@ -2012,7 +1986,8 @@ def mobile_file_upload(request):
             file=s3_key,
             s3_key=s3_key,
             original_filename=file_obj.name,
-            file_size=file_obj.size,
+            file_size=upload_result['size'],
+            file_hash=upload_result['sha256'],
             category=category,
             pending_auto_categorization=should_auto_categorize
         )
@@ -2020,23 +1995,19 @@ def mobile_file_upload(request):
         # Get updated storage info
         storage_info = storage_manager.get_user_storage_info()
         
-        # Start OCR processing for document and image files
+        # Queue OCR for document and image files; the response doesn't wait for it
         ocr_result = {'status': 'not_applicable'}
         if file_type in ['document', 'image']:
-            try:
-                from .services import OCRService
-                ocr_service = OCRService()
-                ocr_result = ocr_service.process_file(user_file)
-                print(f"[Mobile Upload] OCR result: {ocr_result}")
-            except Exception as ocr_error:
-                print(f"[Mobile Upload] OCR error: {str(ocr_error)}")
-                ocr_result = {'status': 'error', 'error': str(ocr_error)}
+            ocr_result = job_status(enqueue_ocr(user_file, lane='interactive'))
         
         return Response({
             'success': True,
             'message': 'File uploaded successfully',
             'file': UserFileSerializer(user_file).data,
             'storage_info': storage_info,
+            'checksum': upload_result['sha256'],
+            'upload_id': upload_id,
+            'deduplicated': 'duplicate_of' in upload_result,
             'ocr_result': ocr_result
         }, status=status.HTTP_201_CREATED)
             
@@ -2046,6 +2017,160 @@ def mobile_file_upload(request):
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def _resolve_upload_category(category_id):
+    """Category for a new upload; auto-categorize unless the client picked one"""
+    if category_id:
+        try:
+            return FileCategory.objects.get(id=category_id), False
+        except FileCategory.DoesNotExist:
+            pass
+    misc_category, _ = FileCategory.objects.get_or_create(
+        name='Miscellaneous',
+        defaults={'is_default': True, 'description': 'Uncategorized files'}
+    )
+    return misc_category, True
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def direct_upload_initiate(request):
+    """
+    Opt-in direct-to-S3 multipart upload for large files.
+
+    Returns presigned part URLs; the client uploads the parts itself and
+    then calls direct_upload_complete, so the bytes never hit Django.
+    """
+    if not getattr(settings, 'S3_DIRECT_UPLOADS_ENABLED', True):
+        return Response({'success': False, 'error': 'Direct uploads are disabled'}, status=status.HTTP_403_FORBIDDEN)
+
+    file_name = os.path.basename(request.data.get('file_name') or '')
+    try:
+        file_size = int(request.data.get('file_size') or 0)
+    except (TypeError, ValueError):
+        file_size = 0
+
+    if not file_name or file_size <= 0:
+        return Response({
+            'success': False,
+            'error': 'file_name and a positive file_size are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    # Content the user already stored: no upload needed, complete with s3_key and file_hash only
+    duplicate = find_duplicate(request.user, request.data.get('file_hash'), file_size)
+    if duplicate is not None:
+        return Response({
+            'success': True,
+            'duplicate': True,
+            'duplicate_of': duplicate.id,
+            's3_key': duplicate.s3_key,
+        })
+
+    try:
+        storage_manager = S3StorageManager(request.user)
+        upload = storage_manager.create_direct_upload(
+            file_name,
+            file_size,
+            content_type=request.data.get('content_type')
+        )
+        return Response({'success': True, 'upload': upload}, status=status.HTTP_201_CREATED)
+    except Exception as e:
+        return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def direct_upload_complete(request):
+    """
+    Complete a direct multipart upload and register the file.
+
+    For a duplicate reported by direct_upload_initiate, send s3_key and
+    file_hash without upload_id: the row then shares the stored object.
+    """
+    s3_key = request.data.get('s3_key')
+    upload_id = request.data.get('upload_id')
+    parts = request.data.get('parts') or []
+    file_type = request.data.get('file_type')
+    file_hash = request.data.get('file_hash') or ''
+
+    duplicate = None
+    if s3_key and file_hash and not upload_id:
+        duplicate = find_duplicate(request.user, file_hash)
+        if duplicate is None or duplicate.s3_key != s3_key:
+            return Response({
+                'success': False,
+                'error': 'No stored file matches this s3_key and file_hash'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+    if not s3_key or not file_type or (duplicate is None and (not upload_id or not parts)):
+        return Response({
+            'success': False,
+            'error': 's3_key, upload_id, parts and file_type are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        storage_manager = S3StorageManager(request.user)
+        if duplicate is not None:
+            upload_result = {'size': duplicate.file_size, 'etag': None}
+        else:
+            upload_result = storage_manager.complete_direct_upload(s3_key, upload_id, parts)
+            # Client-reported hashes are never stored: only hashes computed
+            # server-side are trusted for deduplication
+            file_hash = ''
+
+        category, should_auto_categorize = _resolve_upload_category(request.data.get('category_id'))
+        original_filename = os.path.basename(request.data.get('file_name') or s3_key)
+
+        user_file = UserFile.objects.create(
+            user=request.user,
+            file_type=file_type,
+            file=s3_key,
+            s3_key=s3_key,
+            original_filename=original_filename,
+            file_size=upload_result['size'],
+            file_hash=file_hash,
+            category=category,
+            pending_auto_categorization=should_auto_categorize
+        )
+
+        storage_info = storage_manager.get_user_storage_info()
+
+        ocr_result = {'status': 'not_applicable'}
+        if file_type in ['document', 'image']:
+            ocr_result = job_status(enqueue_ocr(user_file, lane='interactive'))
+
+        return Response({
+            'success': True,
+            'message': 'File uploaded successfully',
+            'file': UserFileSerializer(user_file, context={'request': request}).data,
+            'storage_info': storage_info,
+            'etag': upload_result['etag'],
+            'deduplicated': duplicate is not None,
+            'ocr_result': ocr_result
+        }, status=status.HTTP_201_CREATED)
+    except Exception as e:
+        return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def direct_upload_abort(request):
+    """Abort a direct multipart upload"""
+    try:
+        storage_manager = S3StorageManager(request.user)
+        storage_manager.abort_direct_upload(request.data.get('s3_key'), request.data.get('upload_id'))
+        return Response({'success': True})
+    except Exception as e:
+        return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def upload_progress(request, upload_id):
+    """Progress of a server-side upload started with an upload_id"""
+    progress = UploadProgress.get(request.user.id, upload_id)
+    if progress is None:
+        return Response({'success': False, 'error': 'Unknown upload'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'success': True, 'progress': progress})
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def move_file(request, file_id):
@@ -2230,25 +2355,34 @@ def ocr_preferences(request):
         return Response({
             'success': True,
             'preference': ocr_pref.preference,
-            'display': ocr_pref.get_preference_display()
+            'display': ocr_pref.get_preference_display(),
+            'engine': ocr_pref.engine
         })
     elif request.method == 'POST':
-        preference = request.data.get('preference')
+        preference = request.data.get('preference', ocr_pref.preference)
+        engine = request.data.get('engine', ocr_pref.engine)
 
         if preference not in dict(OCRPreference.OCR_CHOICES).keys(): # Validate against choices
             return Response({
                 'success': False,
                 'error': 'Invalid preference value.'
             }, status=status.HTTP_400_BAD_REQUEST)
+        if engine not in dict(OCRPreference.ENGINE_CHOICES).keys():
+            return Response({
+                'success': False,
+                'error': 'Invalid engine value.'
+            }, status=status.HTTP_400_BAD_REQUEST)
 
         ocr_pref.preference = preference
+        ocr_pref.engine = engine
         ocr_pref.save()
 
         return Response({
             'success': True,
             'message': 'OCR preferences updated.',
             'preference': ocr_pref.preference,
-            'display': ocr_pref.get_preference_display()
+            'display': ocr_pref.get_preference_display(),
+            'engine': ocr_pref.engine
         })
     
 @api_view(['POST'])
@@ -2311,6 +2445,7 @@ def access_locked_file(request, file_id):
             return Response({
                 'success': True,
                 'access_url': access_url,
+                'stream_url': reverse('stream_file', args=[user_file.id]),
                 'expires_in': 3600,
                 'file': UserFileSerializer(user_file, context={'request': request}).data
             })
@@ -2326,6 +2461,119 @@ def access_locked_file(request, file_id):
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def stream_file(request, file_id):
+    """
+    Stream a file through the server with HTTP Range support.
+
+    Locked files need their password in the X-File-Password header (kept
+    out of URLs and access logs). Only files is_accessible_by_user allows
+    are streamed, for staff too.
+    """
+    user_file = get_object_or_404(UserFile.objects.select_related('key_index'), id=file_id)
+    password = request.headers.get('X-File-Password')
+
+    if not user_file.is_accessible_by_user(request.user, password):
+        if user_file.user_id == request.user.id and user_file.locked:
+            return Response({
+                'success': False,
+                'error': 'Access denied. Incorrect password or insufficient permissions.'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        else:
+            return Response({'success': False, 'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        s3_key = resolve_s3_key(user_file)
+    except S3KeyNotFound:
+        return Response({'success': False, 'error': 'File content not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    return stream_s3_object(
+        request,
+        s3_key,
+        filename=user_file.original_filename,
+        as_attachment=request.query_params.get('download') == '1'
+    )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ocr_pages(request, file_id):
+    """
+    OCR text page by page, without loading the whole document.
+
+    ?start=<page number> (default 1) and ?limit= (default 20, max 100).
+    """
+    user_file = get_object_or_404(UserFile, id=file_id, user=request.user)
+    try:
+        start = max(int(request.query_params.get('start', 1)), 1)
+        limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+    except ValueError:
+        return Response({'success': False, 'error': 'start and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+    pages = list(
+        OCRPage.objects.filter(ocr_result__file=user_file, page_number__gte=start)
+        .order_by('page_number')
+        .values('page_number', 'text', 'confidence', 'line_count')[:limit + 1]
+    )
+    has_more = len(pages) > limit
+    pages = pages[:limit]
+    return Response({
+        'success': True,
+        'file_id': user_file.id,
+        'pages': pages,
+        'next_start': pages[-1]['page_number'] + 1 if has_more else None,
+    })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def textract_notification(request):
+    """
+    SNS HTTP(S) subscription endpoint for Textract job completions.
+
+    Only messages signed by SNS for the configured topic are accepted (plus
+    TEXTRACT_NOTIFICATION_TOKEN as ?token= when set). The message just says
+    which job to look at: the outcome is always read back from Textract
+    before anything is stored.
+    """
+    import requests
+    from .textract_events import handle_notification, has_valid_token, is_aws_url, is_trusted_topic, verify_sns_signature
+
+    if not has_valid_token(request.GET.get('token')):
+        return JsonResponse({'success': False, 'error': 'Forbidden'}, status=403)
+
+    try:
+        envelope = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+
+    if not is_trusted_topic(envelope.get('TopicArn')):
+        return JsonResponse({'success': False, 'error': 'Unknown topic'}, status=403)
+
+    if not verify_sns_signature(envelope):
+        return JsonResponse({'success': False, 'error': 'Invalid signature'}, status=403)
+
+    message_type = envelope.get('Type')
+    if message_type == 'SubscriptionConfirmation':
+        subscribe_url = envelope.get('SubscribeURL')
+        if not is_aws_url(subscribe_url):
+            return JsonResponse({'success': False, 'error': 'Invalid SubscribeURL'}, status=400)
+        requests.get(subscribe_url, timeout=10)
+        print(f"[Textract Events] Confirmed SNS subscription to {envelope['TopicArn']}")
+        return JsonResponse({'success': True, 'outcome': 'subscribed'})
+
+    if message_type != 'Notification':
+        return JsonResponse({'success': True, 'outcome': 'ignored'})
+
+    outcome = handle_notification(envelope)
+    return JsonResponse({'success': outcome != 'invalid', 'outcome': outcome}, status=400 if outcome == 'invalid' else 200)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ocr_job_status(request, job_id):
+    """Status of a queued OCR job (the handle returned by uploads)"""
+    job = get_object_or_404(OCRJob, id=job_id, user=request.user)
+    return Response({'success': True, 'job': job_status(job)})
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_ocr_result(request, job_id):
@@ -2519,6 +2767,7 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 
 from .models import UserFile
 from .serializers import UserFileSerializer
@@ -2546,20 +2795,22 @@ def create_document_pair(request):
     front_file = get_object_or_404(UserFile, id=front_id, user=user)
     back_file  = get_object_or_404(UserFile, id=back_id,  user=user)
 
-    # 3) Update only the fields that change
-    front_file.document_side        = 'front'
-    front_file.paired_document      = back_file
-    front_file.document_type_name   = doc_type
-    front_file.save(
-        update_fields=['document_side', 'paired_document', 'document_type_name']
-    )
+    # 3) Update only the fields that change; the pairing signal queues a
+    #    single OCR job for both sides, dispatched once this commits
+    with transaction.atomic():
+        front_file.document_side        = 'front'
+        front_file.paired_document      = back_file
+        front_file.document_type_name   = doc_type
+        front_file.save(
+            update_fields=['document_side', 'paired_document', 'document_type_name']
+        )
 
-    back_file.document_side         = 'back'
-    back_file.paired_document       = front_file
-    back_file.document_type_name    = doc_type
-    back_file.save(
-        update_fields=['document_side', 'paired_document', 'document_type_name']
-    )
+        back_file.document_side         = 'back'
+        back_file.paired_document       = front_file
+        back_file.document_type_name    = doc_type
+        back_file.save(
+            update_fields=['document_side', 'paired_document', 'document_type_name']
+        )
 
     # 4) Serialize with context so any URL/user fields still work
     serializer = UserFileSerializer(
@@ -2624,6 +2875,17 @@ def get_paired_documents(request):
             document_side__in=['front', 'back']
         ).select_related('paired_document')
         
+        # Serialize every side in one batch (one signing pass, one category query)
+        docs = {}
+        for doc in paired_docs:
+            docs[doc.id] = doc
+            if doc.paired_document:
+                docs.setdefault(doc.paired_document.id, doc.paired_document)
+        serialized = {
+            data['id']: data
+            for data in UserFileSerializer(list(docs.values()), many=True, context={'request': request}).data
+        }
+        
         # Group by document type
         grouped_docs = {}
         processed_ids = set()
@@ -2643,14 +2905,14 @@ def get_paired_documents(request):
             }
             
             if doc.document_side == 'front':
-                pair_data['front'] = UserFileSerializer(doc).data
+                pair_data['front'] = serialized[doc.id]
                 if doc.paired_document:
-                    pair_data['back'] = UserFileSerializer(doc.paired_document).data
+                    pair_data['back'] = serialized[doc.paired_document.id]
                     processed_ids.add(doc.paired_document.id)
             elif doc.document_side == 'back':
-                pair_data['back'] = UserFileSerializer(doc).data
+                pair_data['back'] = serialized[doc.id]
                 if doc.paired_document:
-                    pair_data['front'] = UserFileSerializer(doc.paired_document).data
+                    pair_data['front'] = serialized[doc.paired_document.id]
                     processed_ids.add(doc.paired_document.id)
             
             grouped_docs[doc_type].append(pair_data)
@@ -2676,8 +2938,8 @@ def check_pending_ocr_jobs(request):
     try:
         from .services import OCRService
         ocr_service = OCRService()
-        ocr_service.check_pending_jobs()
-        return Response({'success': True, 'message': 'Checked pending OCR jobs'})
+        summary = ocr_service.check_pending_jobs()
+        return Response({'success': True, 'message': 'Checked pending OCR jobs', 'summary': summary})
     except Exception as e:
         return Response({'success': False, 'error': str(e)}, status=500)
 
@@ -2706,6 +2968,54 @@ def get_file_ocr_status(request, file_id):
     except Exception as e:
         return Response({'success': False, 'error': str(e)}, status=500)
     
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_delete_files(request):
+    """
+    Delete many files in one request.
+
+    Body: {"file_ids": [1, 2, ...]} and/or {"category_id": 5} to empty a category.
+    """
+    file_ids = request.data.get('file_ids') or []
+    category_id = request.data.get('category_id')
+    
+    if not isinstance(file_ids, list):
+        return Response({
+            'success': False,
+            'error': 'file_ids must be a list'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not file_ids and not category_id:
+        return Response({
+            'success': False,
+            'error': 'Provide file_ids or category_id'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        filters = Q()
+        if file_ids:
+            filters |= Q(id__in=file_ids)
+        if category_id:
+            filters |= Q(category_id=category_id)
+        
+        result = FileDeletionService(request.user).delete_files(
+            UserFile.objects.filter(filters, user=request.user)
+        )
+        
+        return Response({
+            'success': True,
+            'deleted_count': result['deleted_count'],
+            'deleted_ids': result['deleted_ids'],
+            's3_errors': len(result['s3_errors']),
+            'message': f"Deleted {result['deleted_count']} files"
+        })
+        
+    except Exception as e:
+        return Response({
+            'success': False,
+            'error': f'Error deleting files: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def toggle_favorite(request, file_id):
@@ -92,7 +92,7 @@ class UserStorageAdmin(admin.ModelAdmin):
         for storage in queryset:
             try:
                 storage_manager = S3StorageManager(storage.user)
-                storage_info = storage_manager.get_user_storage_info()
+                storage_info = storage_manager.audit_storage()
                 self.message_user(
                     request, 
                     f"Updated storage for {storage.user.email}: {self.format_size(storage_info['used'])}"
@@ -0,0 +1,123 @@
+import logging
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Shared boto3 clients, keyed by (service_name, region_name).
+#
+# boto3 clients are thread-safe once built, but building one is expensive
+# (endpoint resolution, loading the service model, creating the connection
+# pool), so every part of the app that talks to AWS should go through
+# get_client() instead of calling boto3.client() directly.
+_clients = {}
+_lock = threading.Lock()
+_stats = {
+    'clients_created': 0,
+    'cache_hits': 0,
+}
+
+
+def _build_config():
+    """Connection pool / retry configuration shared by all clients"""
+    return Config(
+        max_pool_connections=getattr(settings, 'AWS_CLIENT_MAX_POOL_CONNECTIONS', 50),
+        connect_timeout=getattr(settings, 'AWS_CLIENT_CONNECT_TIMEOUT', 5),
+        read_timeout=getattr(settings, 'AWS_CLIENT_READ_TIMEOUT', 60),
+        tcp_keepalive=getattr(settings, 'AWS_CLIENT_TCP_KEEPALIVE', True),
+        retries={
+            'max_attempts': getattr(settings, 'AWS_CLIENT_MAX_ATTEMPTS', 5),
+            'mode': getattr(settings, 'AWS_CLIENT_RETRY_MODE', 'standard'),
+        },
+    )
+
+
+def get_client(service_name, region_name=None):
+    """
+    Return the shared boto3 client for a service/region, creating it on first use.
+
+    Args:
+        service_name (str): AWS service name, e.g. 's3' or 'textract'.
+        region_name (str, optional): Defaults to settings.AWS_S3_REGION_NAME.
+
+    Returns:
+        botocore.client.BaseClient: A client safe to share between threads.
+    """
+    region_name = region_name or settings.AWS_S3_REGION_NAME
+    cache_key = (service_name, region_name)
+
+    client = _clients.get(cache_key)
+    if client is not None:
+        _stats['cache_hits'] += 1
+        return client
+
+    with _lock:
+        # Another thread may have built it while we were waiting
+        client = _clients.get(cache_key)
+        if client is not None:
+            _stats['cache_hits'] += 1
+            return client
+
+        # boto3.client() uses the default session, which is not thread-safe,
+        # so build from a private session while holding the lock.
+        session = boto3.session.Session(
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=region_name,
+        )
+        client = session.client(service_name, config=_build_config())
+        _clients[cache_key] = client
+        _stats['clients_created'] += 1
+        logger.info(f"[AWS Clients] Created {service_name} client for {region_name} "
+                    f"(total created: {_stats['clients_created']})")
+        return client
+
+
+def get_s3_client(region_name=None):
+    """Shared S3 client"""
+    return get_client('s3', region_name)
+
+
+def get_textract_client(region_name=None):
+    """Shared Textract client"""
+    return get_client('textract', region_name)
+
+
+def get_client_stats():
+    """Counters for monitoring how many clients were actually built"""
+    with _lock:
+        return {
+            'clients_created': _stats['clients_created'],
+            'cache_hits': _stats['cache_hits'],
+            'cached_clients': sorted(f"{service}:{region}" for service, region in _clients),
+        }
+
+
+def reset_clients():
+    """Drop all cached clients (used by tests and after credential rotation)"""
+    with _lock:
+        _clients.clear()
+        _stats['clients_created'] = 0
+        _stats['cache_hits'] = 0
+
+
+def _reset_after_fork():
+    """
+    A forked child (e.g. the extractor process pool) must not reuse the
+    parent's clients: their connection pools would share live sockets with
+    the parent. Another parent thread may have held the lock at fork time,
+    so the child gets a new one instead of acquiring it.
+    """
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
+    _stats['clients_created'] = 0
+    _stats['cache_hits'] = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
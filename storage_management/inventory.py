@@ -0,0 +1,317 @@
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import quote_plus, unquote_plus
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count
+from django.utils import timezone
+
+from .refresh import USER_KEY_PATTERN, apply_storage_totals
+from .utils import FileKeyCorrelator
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet inventories are optional
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCHEMA = ['Bucket', 'Key', 'Size']
+CSV_SCHEMA = 'Bucket, Key, Size, LastModifiedDate, ETag'
+
+
+class InventoryError(Exception):
+    pass
+
+
+def load_manifest(path):
+    """
+    Read an S3 Inventory manifest.json (or a single data file) from local disk.
+
+    Data file keys in the manifest are resolved relative to the manifest's
+    directory: the full key, then data/<name>, then <name>.
+
+    Returns:
+        dict: {'format': 'CSV'|'Parquet', 'schema': [column names], 'files': [paths]}
+    """
+    if not path.endswith('.json'):
+        file_format = 'Parquet' if path.endswith('.parquet') else 'CSV'
+        return {'format': file_format, 'schema': DEFAULT_SCHEMA, 'files': [path]}
+
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    files = []
+    for entry in manifest.get('files', []):
+        key = entry['key']
+        name = os.path.basename(key)
+        for candidate in (os.path.join(base_dir, key), os.path.join(base_dir, 'data', name), os.path.join(base_dir, name)):
+            if os.path.exists(candidate):
+                files.append(candidate)
+                break
+        else:
+            raise InventoryError(f"Inventory data file not found next to the manifest: {key}")
+
+    schema = [column.strip() for column in manifest.get('fileSchema', '').split(',') if column.strip()]
+    return {
+        'format': manifest.get('fileFormat', 'CSV'),
+        'schema': schema or DEFAULT_SCHEMA,
+        'files': files,
+    }
+
+
+def _iter_csv(path, schema):
+    key_index = schema.index('Key')
+    size_index = schema.index('Size')
+    etag_index = schema.index('ETag') if 'ETag' in schema else None
+    delete_marker_index = schema.index('IsDeleteMarker') if 'IsDeleteMarker' in schema else None
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline='') as data_file:
+        for record in csv.reader(data_file):
+            if delete_marker_index is not None and record[delete_marker_index] == 'true':
+                continue
+            if not record[size_index]:
+                continue
+            # Inventory CSVs URL-encode object keys
+            yield (
+                unquote_plus(record[key_index]),
+                int(record[size_index]),
+                record[etag_index] if etag_index is not None else '',
+            )
+
+
+def _iter_parquet(path, batch_size):
+    if pq is None:
+        raise InventoryError('Reading Parquet inventories requires pyarrow: pip install pyarrow')
+
+    parquet_file = pq.ParquetFile(path)
+    names = set(parquet_file.schema_arrow.names)
+    key_column = 'key' if 'key' in names else 'Key'
+    size_column = 'size' if 'size' in names else 'Size'
+    etag_column = next((name for name in ('e_tag', 'ETag', 'etag') if name in names), None)
+    columns = [key_column, size_column] + ([etag_column] if etag_column else [])
+
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        data = batch.to_pydict()
+        etags = data[etag_column] if etag_column else [''] * len(data[key_column])
+        for key, size, etag in zip(data[key_column], data[size_column], etags):
+            if size is not None:
+                yield key, int(size), etag or ''
+
+
+def iter_inventory(path, batch_size=10000):
+    """Stream (key, size, etag) for every object in an inventory, one data file at a time"""
+    manifest = load_manifest(path)
+    for data_path in manifest['files']:
+        if manifest['format'].lower() == 'parquet':
+            yield from _iter_parquet(data_path, batch_size)
+        else:
+            yield from _iter_csv(data_path, manifest['schema'])
+
+
+class InventoryReconciler:
+    """
+    Reconcile UserFile and UserStorage against an inventory instead of LIST calls.
+
+    Users are processed in id ranges holding at most max_rows UserFile rows;
+    each range is one streaming pass over the inventory, so memory stays
+    bounded by max_rows plus the capped samples, not by bucket size.
+    """
+
+    def __init__(self, manifest_path, max_rows=200000, sample_limit=100):
+        self.manifest_path = manifest_path
+        self.max_rows = max_rows
+        self.sample_limit = sample_limit
+        self.report = {
+            'passes': 0,
+            'rows_scanned': 0,
+            'objects_matched': 0,
+            'users': 0,
+            'orphans': {'count': 0, 'bytes': 0, 'sample': []},
+            'missing': {'count': 0, 'sample': []},
+            'drift': {'count': 0, 'bytes': 0, 'sample': []},
+            'storage_created': 0,
+            'storage_changed': 0,
+            'sizes_fixed': 0,
+        }
+
+    def _user_ranges(self):
+        """Contiguous (first_id, last_id) ranges with at most max_rows files each"""
+        from file_management.models import UserFile
+
+        file_counts = dict(
+            UserFile.objects.values('user_id').annotate(count=Count('id')).values_list('user_id', 'count')
+        )
+        ranges = []
+        first = last = None
+        rows = 0
+        for user_id in get_user_model().objects.order_by('id').values_list('id', flat=True).iterator():
+            count = file_counts.get(user_id, 0)
+            if first is not None and rows + count > self.max_rows:
+                ranges.append((first, last))
+                first, rows = None, 0
+            if first is None:
+                first = user_id
+            last = user_id
+            rows += count
+        if first is not None:
+            ranges.append((first, last))
+        return ranges
+
+    def _sample(self, bucket, item):
+        if len(bucket['sample']) < self.sample_limit:
+            bucket['sample'].append(item)
+
+    def _reconcile_range(self, first_id, last_id, apply, fix_sizes):
+        from file_management.models import UserFile
+
+        user_ids = list(
+            get_user_model().objects.filter(id__gte=first_id, id__lte=last_id).order_by('id').values_list('id', flat=True)
+        )
+        correlator = FileKeyCorrelator.for_queryset(
+            UserFile.objects.filter(user_id__gte=first_id, user_id__lte=last_id)
+        )
+        totals = defaultdict(lambda: {'s3_size': 0, 'orphaned_size': 0})
+        matched_ids = set()
+        drifted = {}
+
+        for key, size, etag in iter_inventory(self.manifest_path):
+            self.report['rows_scanned'] += 1
+            prefix_match = USER_KEY_PATTERN.match(key)
+            user_id = int(prefix_match.group(1)) if prefix_match else None
+            if user_id is not None and not first_id <= user_id <= last_id:
+                continue
+
+            rows = correlator.matches(key, user_id)
+            if not rows:
+                if user_id is not None:
+                    totals[user_id]['orphaned_size'] += size
+                    self.report['orphans']['count'] += 1
+                    self.report['orphans']['bytes'] += size
+                    self._sample(self.report['orphans'], {'key': key, 'size': size})
+                continue
+
+            self.report['objects_matched'] += 1
+            totals[rows[0][1]]['s3_size'] += size
+            for file_id, _, _, _, file_size in rows:
+                matched_ids.add(file_id)
+                if file_size != size:
+                    drifted[file_id] = size
+                    self.report['drift']['count'] += 1
+                    self.report['drift']['bytes'] += size - (file_size or 0)
+                    self._sample(self.report['drift'], {'file_id': file_id, 'key': key, 'db_size': file_size, 's3_size': size})
+
+        for file_id, row in correlator.rows.items():
+            if file_id not in matched_ids:
+                self.report['missing']['count'] += 1
+                self._sample(self.report['missing'], {'file_id': file_id, 'user_id': row[1], 'key': row[2] or row[3]})
+
+        if fix_sizes and drifted:
+            files = list(UserFile.objects.filter(id__in=list(drifted)).only('id', 'file_size'))
+            for user_file in files:
+                user_file.file_size = drifted[user_file.id]
+            # bulk_update skips the ledger signals; apply_storage_totals
+            # below rewrites storage_used from the corrected sizes
+            UserFile.objects.bulk_update(files, ['file_size'], batch_size=500)
+            self.report['sizes_fixed'] += len(files)
+
+        if apply:
+            result = apply_storage_totals(user_ids, totals)
+            self.report['storage_created'] += result['created']
+            self.report['storage_changed'] += result['changed']
+
+        self.report['users'] += len(user_ids)
+        self.report['passes'] += 1
+
+    def run(self, apply=False, fix_sizes=False):
+        """
+        Returns the reconciliation report. With apply, UserStorage is
+        rewritten per user; with fix_sizes, drifted UserFile.file_size values
+        are set to the inventory size first (implies apply).
+        """
+        started = time.perf_counter()
+        for first_id, last_id in self._user_ranges():
+            self._reconcile_range(first_id, last_id, apply or fix_sizes, fix_sizes)
+
+        elapsed = time.perf_counter() - started
+        self.report['elapsed'] = elapsed
+        self.report['rows_per_second'] = self.report['rows_scanned'] / elapsed if elapsed else 0
+        return self.report
+
+
+def write_synthetic_inventory(out_dir, objects, bucket='inventory-source', file_format='CSV', rows_per_file=50000):
+    """
+    Write (key, size, etag) tuples as an S3 Inventory: data files plus manifest.json.
+
+    Mirrors the real layout (gzip CSV without a header and URL-encoded keys,
+    or Parquet) so reconciliation can be exercised offline.
+    Returns the manifest path.
+    """
+    file_format = file_format.upper() if file_format.lower() == 'csv' else 'Parquet'
+    if file_format == 'Parquet' and pq is None:
+        raise InventoryError('Writing Parquet inventories requires pyarrow: pip install pyarrow')
+
+    data_dir = os.path.join(out_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    now = timezone.now()
+    files = []
+    chunk = []
+
+    def flush():
+        if not chunk:
+            return
+        if file_format == 'CSV':
+            name = f"{uuid.uuid4()}.csv.gz"
+            path = os.path.join(data_dir, name)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for key, size, etag in chunk:
+                writer.writerow([bucket, quote_plus(key, safe='/'), size, now.strftime('%Y-%m-%dT%H:%M:%S.000Z'), etag])
+            with gzip.open(path, 'wt', newline='') as data_file:
+                data_file.write(buffer.getvalue())
+        else:
+            import pyarrow as pa
+            name = f"{uuid.uuid4()}.parquet"
+            path = os.path.join(data_dir, name)
+            table = pa.table({
+                'bucket': [bucket] * len(chunk),
+                'key': [key for key, _, _ in chunk],
+                'size': [size for _, size, _ in chunk],
+                'e_tag': [etag for _, _, etag in chunk],
+            })
+            pq.write_table(table, path)
+
+        with open(path, 'rb') as data_file:
+            checksum = hashlib.md5(data_file.read()).hexdigest()
+        files.append({'key': f"data/{name}", 'size': os.path.getsize(path), 'MD5checksum': checksum})
+        chunk.clear()
+
+    for item in objects:
+        chunk.append(item)
+        if len(chunk) >= rows_per_file:
+            flush()
+    flush()
+
+    manifest = {
+        'sourceBucket': bucket,
+        'destinationBucket': f"arn:aws:s3:::{bucket}-inventory",
+        'version': '2016-11-30',
+        'creationTimestamp': str(int(now.timestamp() * 1000)),
+        'fileFormat': file_format,
+        'fileSchema': CSV_SCHEMA if file_format == 'CSV' else 'message s3.inventory { required binary bucket; required binary key; optional int64 size; optional binary e_tag; }',
+        'files': files,
+    }
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest_path
@@ -0,0 +1,61 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import UserStorage
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+
+
+def adjust_storage_used(user_id, delta):
+    """
+    Atomically add `delta` bytes to a user's storage_used (clamped at 0).
+
+    This is the only place storage_used changes on the hot path: UserFile
+    signals call it on create/resize/delete, so reading usage is a single-row
+    lookup instead of a SUM over UserFile plus an S3 listing.
+    """
+    if not delta or getattr(_state, 'suspended', False):
+        return
+
+    updated = UserStorage.objects.filter(user_id=user_id).update(
+        storage_used=Greatest(F('storage_used') + delta, Value(0)),
+        updated_at=timezone.now()
+    )
+
+    if not updated:
+        storage, created = UserStorage.objects.get_or_create(
+            user_id=user_id,
+            defaults={'storage_used': max(delta, 0), 'storage_limit': 5368709120}
+        )
+        if not created:
+            # Lost a race with another creator, apply on top of theirs
+            UserStorage.objects.filter(pk=storage.pk).update(
+                storage_used=Greatest(F('storage_used') + delta, Value(0)),
+                updated_at=timezone.now()
+            )
+
+    logger.debug(f"[Storage Ledger] User {user_id}: {delta:+d} bytes")
+
+
+@contextmanager
+def suspended():
+    """
+    Ignore ledger updates on this thread for the duration of the block.
+
+    For bulk operations that fire one signal per row but know the net
+    change up front: they make their own adjust_storage_used() call after
+    the block (see FileDeletionService), one write instead of one per row.
+    """
+    previous = getattr(_state, 'suspended', False)
+    _state.suspended = True
+    try:
+        yield
+    finally:
+        _state.suspended = previous
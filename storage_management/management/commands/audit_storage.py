@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
+from storage_management.models import UserStorage
+from storage_management.utils import S3StorageManager
+
+
+class Command(BaseCommand):
+    help = 'Reconcile the storage ledger against S3 for users whose last audit is due'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user-id',
+            type=int,
+            help='Audit a specific user ID (ignores the audit interval)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Audit every user regardless of when they were last audited',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drift without correcting it',
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        dry_run = options['dry_run']
+
+        if options['user_id']:
+            users = User.objects.filter(id=options['user_id'])
+        elif options['force']:
+            users = User.objects.all()
+        else:
+            interval = getattr(settings, 'STORAGE_AUDIT_INTERVAL', 6 * 60 * 60)
+            cutoff = timezone.now() - timedelta(seconds=interval)
+            due_ids = UserStorage.objects.filter(
+                Q(last_audited_at__isnull=True) | Q(last_audited_at__lt=cutoff)
+            ).values_list('user_id', flat=True)
+            users = User.objects.filter(id__in=due_ids)
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
+
+        audited = 0
+        drifted = 0
+        for user in users.iterator():
+            try:
+                result = S3StorageManager(user).audit_storage(dry_run=dry_run)
+                audited += 1
+                if abs(result['drift']) > 1024:
+                    drifted += 1
+                    self.stdout.write(
+                        f"{user.email}: {result['previous']} → {result['used']} bytes "
+                        f"(Δ {result['drift']:+d}, S3 {result['s3_size']})"
+                    )
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'{user.email}: {e}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Audited {audited} users, {drifted} with drift'))
@@ -0,0 +1,132 @@
+import hashlib
+import time
+
+from boto3.s3.transfer import TransferConfig
+from django.core.management.base import BaseCommand, CommandError
+
+from storage_management.transfer import MB, buffered_bytes_limit, get_transfer_config, stream_to_s3, upload_source
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto is a dev-only dependency
+    mock_aws = None
+
+
+class SyntheticStream:
+    """Deterministic pseudo-random bytes without materialising the whole file"""
+
+    BLOCK = hashlib.sha256(b'benchmark').digest() * 2048  # 64 KB
+
+    def __init__(self, size):
+        self.size = size
+        self.position = 0
+
+    def read(self, amount=-1):
+        remaining = self.size - self.position
+        if remaining <= 0:
+            return b''
+        if amount is None or amount < 0 or amount > remaining:
+            amount = remaining
+        offset = self.position % len(self.BLOCK)
+        chunks = []
+        needed = amount
+        while needed > 0:
+            chunk = self.BLOCK[offset:offset + needed]
+            chunks.append(chunk)
+            needed -= len(chunk)
+            offset = 0
+        self.position += amount
+        return b''.join(chunks)
+
+
+def spooled_upload(size):
+    """A TemporaryUploadedFile holding `size` synthetic bytes, as Django spools large uploads to disk"""
+    from django.core.files.uploadedfile import TemporaryUploadedFile
+
+    upload = TemporaryUploadedFile('benchmark.bin', 'application/octet-stream', size, None)
+    stream = SyntheticStream(size)
+    for chunk in iter(lambda: stream.read(8 * MB), b''):
+        upload.write(chunk)
+    upload.seek(0)
+    return upload
+
+
+def parse_size(value):
+    value = value.strip().upper()
+    for suffix, factor in (('GB', 1024 * MB), ('MB', MB), ('KB', 1024)):
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(value)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark default vs streaming multipart uploads against an in-memory S3 (moto), from a '
+        'non-seekable stream and from a file on disk, with the most part bytes s3transfer buffers in memory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1MB,100MB,1GB', help='Comma-separated synthetic file sizes')
+        parser.add_argument('--bucket', default='benchmark-bucket')
+
+    def handle(self, *args, **options):
+        if mock_aws is None:
+            raise CommandError('moto is required for this benchmark: pip install moto')
+
+        sizes = [parse_size(size) for size in options['sizes'].split(',') if size.strip()]
+        bucket = options['bucket']
+
+        with mock_aws():
+            import boto3
+            s3_client = boto3.client(
+                's3',
+                region_name='us-east-1',
+                aws_access_key_id='benchmark',
+                aws_secret_access_key='benchmark'
+            )
+            s3_client.create_bucket(Bucket=bucket)
+
+            config = get_transfer_config()
+            variants = [
+                ('default upload_fileobj', None),
+                ('streaming multipart', SyntheticStream),
+                ('multipart from disk', spooled_upload),
+            ]
+
+            self.stdout.write(
+                f"{'size':>10}  {'variant':<24} {'seconds':>8} {'MB/s':>8} {'buffer MB':>10}  checksum"
+            )
+            for size in sizes:
+                for label, make_source in variants:
+                    key = f"benchmark/{size}-{label.replace(' ', '-')}"
+                    if make_source is None:
+                        stream = SyntheticStream(size)
+                        default_config = TransferConfig()
+                        started = time.perf_counter()
+                        s3_client.upload_fileobj(stream, bucket, key, Config=default_config)
+                        elapsed = time.perf_counter() - started
+                        buffered = buffered_bytes_limit(upload_source(stream), default_config)
+                        checksum = '-'
+                    else:
+                        source = make_source(size)
+                        try:
+                            result = stream_to_s3(s3_client, bucket, key, source, config=config)
+                        finally:
+                            if hasattr(source, 'close'):
+                                source.close()
+                        elapsed = result['elapsed']
+                        buffered = buffered_bytes_limit(result['source'], config)
+                        checksum = result['sha256'][:12]
+
+                    throughput = (size / MB) / elapsed if elapsed else 0
+                    self.stdout.write(
+                        f"{size / MB:>8.0f}MB  {label:<24} {elapsed:>8.2f} {throughput:>8.1f} "
+                        f"{min(buffered, size) / MB:>10.0f}  {checksum}"
+                    )
+                    s3_client.delete_object(Bucket=bucket, Key=key)
+            self.stdout.write(
+                'buffer MB: the most part data s3transfer holds in memory at once '
+                '(S3_UPLOAD_MAX_BUFFERED_PARTS x part size; files on disk are read part by part)'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Upload benchmark complete'))
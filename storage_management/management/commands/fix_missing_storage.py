@@ -18,14 +18,10 @@ class Command(BaseCommand):
         
         self.stdout.write(self.style.SUCCESS('Checking for users without UserStorage records...'))
         
-        users_without_storage = []
-        for user in User.objects.all():
-            try:
-                UserStorage.objects.get(user=user)
-                self.stdout.write(f'✅ {user.email} has storage record')
-            except UserStorage.DoesNotExist:
-                self.stdout.write(self.style.WARNING(f'❌ {user.email} MISSING storage record'))
-                users_without_storage.append(user)
+        # One anti-join instead of a lookup per user
+        users_without_storage = list(User.objects.filter(userstorage__isnull=True))
+        for user in users_without_storage:
+            self.stdout.write(self.style.WARNING(f'❌ {user.email} MISSING storage record'))
 
         if not users_without_storage:
             self.stdout.write(self.style.SUCCESS('\n✅ All users have storage records'))
@@ -38,28 +34,31 @@ class Command(BaseCommand):
             for user in users_without_storage:
                 self.stdout.write(f'Would create storage record for {user.email}')
         else:
+            UserStorage.objects.bulk_create(
+                [
+                    UserStorage(user=user, storage_used=0, storage_limit=5368709120)  # 5GB default
+                    for user in users_without_storage
+                ],
+                batch_size=500,
+                ignore_conflicts=True
+            )
+            # ignore_conflicts doesn't report which rows were inserted, so re-read them
+            created_storages = UserStorage.objects.filter(
+                user__in=users_without_storage
+            ).select_related('user')
+
             created_count = 0
-            for user in users_without_storage:
-                storage, created = UserStorage.objects.get_or_create(
-                    user=user,
-                    defaults={
-                        'storage_used': 0,
-                        'storage_limit': 5368709120  # 5GB default
-                    }
-                )
-                if created:
-                    # Update storage limit based on subscription if available
-                    try:
-                        storage.update_from_subscription()
-                    except Exception as e:
-                        self.stdout.write(
-                            self.style.WARNING(f'Could not update subscription info for {user.email}: {e}')
-                        )
-                    
-                    self.stdout.write(f'✅ Created storage record for {user.email}')
-                    created_count += 1
-                else:
-                    self.stdout.write(f'⚠️  Storage record already exists for {user.email}')
+            for storage in created_storages:
+                # Update storage limit based on subscription if available
+                try:
+                    storage.update_from_subscription()
+                except Exception as e:
+                    self.stdout.write(
+                        self.style.WARNING(f'Could not update subscription info for {storage.user.email}: {e}')
+                    )
+                
+                self.stdout.write(f'✅ Created storage record for {storage.user.email}')
+                created_count += 1
 
             self.stdout.write(
                 self.style.SUCCESS(f'\n✅ Successfully created {created_count} storage records')
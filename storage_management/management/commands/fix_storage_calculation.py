@@ -2,6 +2,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from storage_management.models import UserStorage
+from storage_management.refresh import StorageRefreshEngine
 from storage_management.utils import S3StorageManager
 from file_management.models import UserFile
 from django.db import models
@@ -43,8 +44,7 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR(f'User with ID {user_id} not found'))
                 return
         else:
-            users = User.objects.all()
-            self.stdout.write(f'Fixing storage for all {users.count()} users...')
+            return self.fix_all_users(dry_run, clean_orphans)
         
         fixed_count = 0
         error_count = 0
@@ -72,7 +72,7 @@ class Command(BaseCommand):
                 
                 if dry_run:
                     # Just show what would happen
-                    storage_info = storage_manager.get_user_storage_info()
+                    storage_info = storage_manager.audit_storage(dry_run=True)
                     new_usage = storage_info['used']
                     phantom_usage = old_usage - new_usage
                     
@@ -102,7 +102,7 @@ class Command(BaseCommand):
                             )
                 else:
                     # Actually fix the storage
-                    storage_info = storage_manager.get_user_storage_info()
+                    storage_info = storage_manager.audit_storage()
                     new_usage = storage_info['used']
                     phantom_usage = old_usage - new_usage
                     
@@ -153,6 +153,49 @@ class Command(BaseCommand):
                 self.style.WARNING(f'⚠️  {error_count} errors encountered')
             )
 
+    def fix_all_users(self, dry_run, clean_orphans):
+        """All users in one sharded bucket pass (see refresh_storage_usage)"""
+        User = get_user_model()
+        self.stdout.write(f'Fixing storage for all {User.objects.count()} users...')
+        total_phantom_usage = 0
+
+        def report_user(user_id, previous, used, s3_size, orphaned_size):
+            nonlocal total_phantom_usage
+            phantom_usage = previous - used
+            if phantom_usage > 1024:  # > 1KB
+                total_phantom_usage += phantom_usage
+                self.stdout.write(
+                    f'👤 user {user_id}: {self.format_size(previous)} → {self.format_size(used)} '
+                    f'(👻 {self.format_size(phantom_usage)})'
+                )
+
+        stats = StorageRefreshEngine(dry_run=dry_run, on_user=report_user).run()
+
+        if clean_orphans and stats['orphaned_users']:
+            # Only users whose prefix actually held unreferenced objects
+            for user in User.objects.filter(id__in=stats['orphaned_users']):
+                orphan_info = S3StorageManager(user).clean_orphaned_files(dry_run=dry_run)
+                if orphan_info.get('total_size', 0) > 0:
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f'   🗑️  {user.email} orphaned files {"found" if dry_run else "cleaned"}: '
+                            f'{len(orphan_info["orphaned_files"])} ({self.format_size(orphan_info["total_size"])})'
+                        )
+                    )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\n✅ {"Checked" if dry_run else "Fixed"} {stats["users"]} users in {stats["elapsed"]:.1f}s '
+                f'({stats["users_per_second"]:.0f} users/s)'
+            )
+        )
+        if total_phantom_usage > 0:
+            self.stdout.write(
+                self.style.SUCCESS(f'👻 Total phantom usage {"would be" if dry_run else ""} recovered: {self.format_size(total_phantom_usage)}')
+            )
+        if stats['errors']:
+            self.stdout.write(self.style.WARNING(f'⚠️  {len(stats["errors"])} shards failed'))
+
     def format_size(self, size_in_bytes):
         """Format bytes to human readable size"""
         if size_in_bytes == 0:
@@ -0,0 +1,81 @@
+import hashlib
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from file_management.models import UserFile
+from storage_management.inventory import InventoryError, write_synthetic_inventory
+
+
+class Command(BaseCommand):
+    help = 'Write a synthetic S3 Inventory manifest for testing reconcile_inventory offline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('out_dir', type=str, help='Directory for manifest.json and data/')
+        parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+        parser.add_argument(
+            '--synthetic-users',
+            type=int,
+            default=0,
+            help='Ignore the database and generate this many users worth of objects',
+        )
+        parser.add_argument('--files-per-user', type=int, default=100)
+        parser.add_argument('--orphans', type=int, default=0, help='Extra objects with no UserFile row')
+        parser.add_argument('--missing-rate', type=float, default=0.0, help='Fraction of UserFile rows left out')
+        parser.add_argument('--drift-rate', type=float, default=0.0, help='Fraction of objects with a different size')
+        parser.add_argument('--rows-per-file', type=int, default=50000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        stats = {'objects': 0, 'missing': 0, 'drift': 0, 'orphans': 0}
+
+        def etag_for(key):
+            return hashlib.md5(key.encode()).hexdigest()
+
+        def database_objects():
+            rows = UserFile.objects.order_by('id').values_list('user_id', 's3_key', 'file', 'file_size')
+            for user_id, s3_key, file_name, file_size in rows.iterator():
+                key = s3_key or file_name
+                if not key:
+                    continue
+                if rng.random() < options['missing_rate']:
+                    stats['missing'] += 1
+                    continue
+                size = file_size or 0
+                if rng.random() < options['drift_rate']:
+                    size += rng.randint(1, 4096)
+                    stats['drift'] += 1
+                yield key, size, etag_for(key)
+
+        def synthetic_objects():
+            for user_id in range(1, options['synthetic_users'] + 1):
+                for index in range(options['files_per_user']):
+                    key = f"user_{user_id}/file_{index}.pdf"
+                    yield key, rng.randint(1024, 5 * 1024 * 1024), etag_for(key)
+
+        def all_objects():
+            source = synthetic_objects() if options['synthetic_users'] else database_objects()
+            for item in source:
+                stats['objects'] += 1
+                yield item
+            user_ids = list(UserFile.objects.values_list('user_id', flat=True).distinct()) or [1]
+            for index in range(options['orphans']):
+                key = f"user_{rng.choice(user_ids)}/orphan_{index}.bin"
+                stats['objects'] += 1
+                stats['orphans'] += 1
+                yield key, rng.randint(1, 1024 * 1024), etag_for(key)
+
+        try:
+            manifest_path = write_synthetic_inventory(
+                options['out_dir'],
+                all_objects(),
+                file_format=options['format'],
+                rows_per_file=options['rows_per_file']
+            )
+        except InventoryError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {stats['objects']} objects to {manifest_path} "
+            f"({stats['orphans']} orphans, {stats['missing']} rows left out, {stats['drift']} drifted)"
+        ))
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from storage_management.inventory import InventoryError, InventoryReconciler
+
+
+class Command(BaseCommand):
+    help = 'Reconcile UserFile/UserStorage against an S3 Inventory manifest on local disk (no LIST calls)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', type=str, help='Path to manifest.json, or a single .csv(.gz)/.parquet data file')
+        parser.add_argument(
+            '--apply',
+            action='store_true',
+            help='Rewrite UserStorage from the reconciliation (default is a report only)',
+        )
+        parser.add_argument(
+            '--fix-sizes',
+            action='store_true',
+            help='Set drifted UserFile.file_size values to the inventory size (implies --apply)',
+        )
+        parser.add_argument(
+            '--max-rows',
+            type=int,
+            default=200000,
+            help='UserFile rows held in memory per pass over the inventory',
+        )
+        parser.add_argument('--sample', type=int, default=20, help='Examples to print per finding')
+
+    def handle(self, *args, **options):
+        reconciler = InventoryReconciler(
+            options['manifest'],
+            max_rows=options['max_rows'],
+            sample_limit=options['sample']
+        )
+        try:
+            report = reconciler.run(apply=options['apply'], fix_sizes=options['fix_sizes'])
+        except (InventoryError, OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f"Scanned {report['rows_scanned']} inventory rows for {report['users']} users "
+            f"in {report['passes']} pass(es), {report['elapsed']:.1f}s ({report['rows_per_second']:.0f} rows/s)"
+        )
+        self.stdout.write(f"Matched objects: {report['objects_matched']}")
+
+        orphans = report['orphans']
+        self.stdout.write(self.style.WARNING(f"Orphaned objects: {orphans['count']} ({orphans['bytes']} bytes)"))
+        for orphan in orphans['sample']:
+            self.stdout.write(f"  {orphan['key']} ({orphan['size']} bytes)")
+
+        missing = report['missing']
+        self.stdout.write(self.style.WARNING(f"Files missing from S3: {missing['count']}"))
+        for item in missing['sample']:
+            self.stdout.write(f"  file {item['file_id']} (user {item['user_id']}): {item['key']}")
+
+        drift = report['drift']
+        self.stdout.write(self.style.WARNING(f"Size drift: {drift['count']} files ({drift['bytes']:+d} bytes)"))
+        for item in drift['sample']:
+            self.stdout.write(f"  file {item['file_id']}: DB {item['db_size']} vs S3 {item['s3_size']}")
+
+        if options['apply'] or options['fix_sizes']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Updated storage for {report['users']} users ({report['storage_changed']} changed, "
+                f"{report['storage_created']} created, {report['sizes_fixed']} file sizes fixed)"
+            ))
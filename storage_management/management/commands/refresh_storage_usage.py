@@ -1,6 +1,10 @@
-from django.core.management.base import BaseCommand
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
 from storage_management.models import UserStorage
+from storage_management.refresh import StorageRefreshEngine
 from storage_management.utils import S3StorageManager
 
 class Command(BaseCommand):
@@ -17,6 +21,34 @@ class Command(BaseCommand):
             action='store_true',
             help='Show what would be done without making changes',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Prefix shards listed in parallel',
+        )
+        parser.add_argument(
+            '--shard',
+            type=str,
+            default='0/1',
+            help='Only refresh shard i of n (e.g. 2/4) to split a run across machines',
+        )
+        parser.add_argument(
+            '--shard-depth',
+            type=int,
+            default=2,
+            help='Digits of the user id per prefix shard (2 gives 99 shards)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            help='Checkpoint file for resuming (default: one per --shard in the temp dir)',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Ignore an existing checkpoint and start over',
+        )
 
     def handle(self, *args, **options):
         User = get_user_model()
@@ -31,8 +63,7 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR(f'User {specific_user} not found'))
                 return
         else:
-            users = User.objects.all()
-            self.stdout.write(f'Refreshing storage for all {users.count()} users...')
+            return self.refresh_all(options)
         
         if dry_run:
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
@@ -63,7 +94,7 @@ class Command(BaseCommand):
                 if dry_run:
                     # Just show what would happen
                     try:
-                        storage_info = storage_manager.get_user_storage_info()
+                        storage_info = storage_manager.audit_storage(dry_run=True)
                         new_usage = storage_info['used']
                         self.stdout.write(
                             f'📊 {user.email}: {old_usage} bytes → {new_usage} bytes '
@@ -74,7 +105,7 @@ class Command(BaseCommand):
                         error_count += 1
                 else:
                     # Actually update the storage
-                    storage_info = storage_manager.get_user_storage_info()
+                    storage_info = storage_manager.audit_storage()
                     new_usage = storage_info['used']
                     
                     self.stdout.write(
@@ -95,4 +126,67 @@ class Command(BaseCommand):
         if error_count > 0:
             self.stdout.write(
                 self.style.WARNING(f'⚠️  {error_count} errors encountered')
-            ) 
\ No newline at end of file
+            )
+
+    def refresh_all(self, options):
+        """Refresh every user with one sharded, checkpointed pass over the bucket"""
+        try:
+            shard_index, shard_count = (int(part) for part in options['shard'].split('/'))
+        except ValueError:
+            raise CommandError('--shard must look like i/n, e.g. 0/4')
+        if not 0 <= shard_index < shard_count:
+            raise CommandError('--shard index must be between 0 and n-1')
+
+        dry_run = options['dry_run']
+        checkpoint = options['checkpoint'] or os.path.join(
+            tempfile.gettempdir(),
+            f"refresh_storage_usage_d{options['shard_depth']}_{shard_index}of{shard_count}.json"
+        )
+        if dry_run:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
+
+        def report_user(user_id, previous, used, s3_size, orphaned_size):
+            if used != previous or options['verbosity'] > 1:
+                self.stdout.write(
+                    f'{"📊" if dry_run else "✅"} user {user_id}: {previous} bytes → {used} bytes '
+                    f'(Δ {used - previous:+d} bytes, S3 {s3_size}, orphaned {orphaned_size})'
+                )
+
+        engine = StorageRefreshEngine(
+            workers=options['workers'],
+            shard_depth=options['shard_depth'],
+            shard=(shard_index, shard_count),
+            checkpoint_path=checkpoint,
+            dry_run=dry_run,
+            on_user=report_user
+        )
+        if options['reset']:
+            engine.clear_checkpoint()
+
+        self.stdout.write(
+            f'Refreshing storage for shard {shard_index}/{shard_count} with {options["workers"]} workers '
+            f'(checkpoint: {checkpoint})'
+        )
+        stats = engine.run()
+
+        if stats['shards_skipped']:
+            self.stdout.write(f'Resumed: skipped {stats["shards_skipped"]} shards completed by an earlier run')
+        self.stdout.write(
+            f'Listed {stats["objects"]} objects for {stats["users"]} users in {stats["shards"]} shards '
+            f'in {stats["elapsed"]:.1f}s ({stats["objects_per_second"]:.0f} objects/s, '
+            f'{stats["users_per_second"]:.0f} users/s)'
+        )
+        if stats['storage_created']:
+            self.stdout.write(f'Created {stats["storage_created"]} missing storage records')
+
+        if not dry_run:
+            self.stdout.write(
+                self.style.SUCCESS(f'\n✅ Refreshed {stats["users"]} users ({stats["changed"]} changed)')
+            )
+        if stats['errors']:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'⚠️  {len(stats["errors"])} shards failed, re-run to resume: '
+                    f'{", ".join(error["shard"] for error in stats["errors"])}'
+                )
+            )
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage_management', '0002_alter_userstorage_options_adminaccesslog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstorage',
+            name='last_audit_s3_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userstorage',
+            name='last_audited_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -11,6 +11,8 @@ class UserStorage(models.Model):
     storage_limit = models.BigIntegerField(default=5368709120)  # 5GB in bytes (default)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    last_audited_at = models.DateTimeField(null=True, blank=True)  # last S3 reconciliation
+    last_audit_s3_size = models.BigIntegerField(null=True, blank=True)
 
     def get_usage_percentage(self):
         if self.storage_limit == 0:
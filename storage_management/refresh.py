@@ -0,0 +1,304 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .clients import get_s3_client
+from .models import UserStorage
+from .utils import matches_valid_key
+
+logger = logging.getLogger(__name__)
+
+USER_KEY_PATTERN = re.compile(r'^user_(\d+)/')
+DEFAULT_STORAGE_LIMIT = 5368709120  # 5GB
+ID_BATCH_SIZE = 500  # stay well under SQLite's bound-parameter limit
+
+
+def shard_prefixes(depth=2):
+    """
+    Disjoint key prefixes that together cover every `user_<id>/` key.
+
+    depth=1 gives user_1 .. user_9; depth=2 splits each of those into
+    user_N/ plus user_N0 .. user_N9, and so on.
+    """
+    prefixes = [f"user_{digit}" for digit in range(1, 10)]
+    for _ in range(depth - 1):
+        expanded = []
+        for prefix in prefixes:
+            if prefix.endswith('/'):
+                expanded.append(prefix)
+            else:
+                expanded.append(prefix + '/')
+                expanded.extend(f"{prefix}{digit}" for digit in range(10))
+        prefixes = expanded
+    return sorted(prefixes)
+
+
+def shard_for_user(user_id, depth=2):
+    """The shard_prefixes(depth) entry that holds user_<id>/"""
+    digits = str(user_id)
+    if len(digits) >= depth:
+        return f"user_{digits[:depth]}"
+    return f"user_{digits}/"
+
+
+def _batched(items, size=ID_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def apply_storage_totals(user_ids, totals, dry_run=False, on_user=None):
+    """
+    Write refreshed usage for a batch of users in one transaction.
+
+    totals maps user_id -> {'s3_size', 'orphaned_size'} from a listing or an
+    inventory. storage_used is set from the database (same rule as
+    S3StorageManager.audit_storage), S3 sizes are recorded alongside.
+    Missing UserStorage rows are bulk-created.
+
+    Returns:
+        dict: {'created', 'changed', 'orphaned_users'}
+    """
+    from file_management.dedupe import shared_copy_overcount
+    from file_management.models import UserFile
+
+    result = {'created': 0, 'changed': 0, 'orphaned_users': []}
+    now = timezone.now()
+    with transaction.atomic():
+        db_sizes = {}
+        storages = {}
+        for batch in _batched(user_ids):
+            db_sizes.update(
+                UserFile.objects.filter(user_id__in=batch).values('user_id')
+                .annotate(total=Sum('file_size')).values_list('user_id', 'total')
+            )
+            storages.update(
+                (storage.user_id, storage)
+                for storage in UserStorage.objects.select_for_update().filter(user_id__in=batch)
+            )
+            # Deduplicated rows share one stored object, count it once
+            for user_id, overcount in shared_copy_overcount(batch).items():
+                db_sizes[user_id] = (db_sizes.get(user_id) or 0) - overcount
+
+        missing = [user_id for user_id in user_ids if user_id not in storages]
+        if missing and not dry_run:
+            created = UserStorage.objects.bulk_create(
+                [UserStorage(user_id=user_id, storage_used=0, storage_limit=DEFAULT_STORAGE_LIMIT) for user_id in missing],
+                batch_size=ID_BATCH_SIZE,
+                ignore_conflicts=True
+            )
+            result['created'] = len(created)
+            for batch in _batched(missing):
+                storages.update(
+                    (storage.user_id, storage)
+                    for storage in UserStorage.objects.filter(user_id__in=batch)
+                )
+
+        changed = []
+        for user_id in user_ids:
+            storage = storages.get(user_id)
+            previous = storage.storage_used if storage else 0
+            used = db_sizes.get(user_id) or 0
+            user_totals = totals.get(user_id, {'s3_size': 0, 'orphaned_size': 0})
+
+            if on_user:
+                on_user(user_id, previous, used, user_totals['s3_size'], user_totals['orphaned_size'])
+            if user_totals['orphaned_size']:
+                result['orphaned_users'].append(user_id)
+            if used != previous:
+                result['changed'] += 1
+
+            if storage is not None and not dry_run:
+                storage.storage_used = used
+                storage.last_audited_at = now
+                storage.last_audit_s3_size = user_totals['s3_size']
+                storage.updated_at = now
+                changed.append(storage)
+
+        if changed:
+            UserStorage.objects.bulk_update(
+                changed,
+                ['storage_used', 'last_audited_at', 'last_audit_s3_size', 'updated_at'],
+                batch_size=ID_BATCH_SIZE
+            )
+    return result
+
+
+class StorageRefreshEngine:
+    """
+    Fleet-wide storage refresh: one sharded pass over the bucket instead of
+    one S3 listing (plus queries) per user.
+
+    Shard prefixes are listed in parallel; sizes are grouped per user in
+    memory and written back with bulk_update, one transaction per shard.
+    Completed shards are recorded in a JSON checkpoint so an interrupted
+    run resumes where it stopped.
+
+    storage_used follows the same rule as S3StorageManager.audit_storage:
+    the database is the source of truth, S3 sizes are recorded alongside.
+    """
+
+    def __init__(self, workers=8, shard_depth=2, shard=(0, 1), checkpoint_path=None,
+                 dry_run=False, s3_client=None, on_user=None):
+        self.workers = max(1, workers)
+        self.shard_depth = shard_depth
+        self.shard_index, self.shard_count = shard
+        self.checkpoint_path = checkpoint_path
+        self.dry_run = dry_run
+        self.s3_client = s3_client or get_s3_client()
+        self.bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+        self.on_user = on_user  # callback(user_id, previous, used, s3_size, orphaned_size)
+
+        self.stats = {
+            'shards': 0,
+            'shards_skipped': 0,
+            'objects': 0,
+            'users': 0,
+            'storage_created': 0,
+            'changed': 0,
+            'orphaned_users': [],
+            'errors': [],
+        }
+
+    # Checkpointing
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return set()
+        try:
+            with open(self.checkpoint_path) as checkpoint_file:
+                data = json.load(checkpoint_file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Storage Refresh] Ignoring unreadable checkpoint {self.checkpoint_path}: {e}")
+            return set()
+        if data.get('shard_depth') != self.shard_depth or data.get('shard') != [self.shard_index, self.shard_count]:
+            logger.warning(f"[Storage Refresh] Checkpoint {self.checkpoint_path} is for another sharding, ignoring it")
+            return set()
+        return set(data.get('completed', []))
+
+    def _save_checkpoint(self, completed):
+        if not self.checkpoint_path or self.dry_run:
+            return
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump({
+                'shard_depth': self.shard_depth,
+                'shard': [self.shard_index, self.shard_count],
+                'completed': sorted(completed),
+                'updated_at': timezone.now().isoformat(),
+            }, checkpoint_file)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def clear_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    # Scanning
+
+    def _valid_keys_by_user(self, user_ids):
+        from file_management.models import UserFile
+
+        valid_keys = defaultdict(set)
+        for batch in _batched(user_ids):
+            for user_id, s3_key, file_name in UserFile.objects.filter(
+                user_id__in=batch
+            ).values_list('user_id', 's3_key', 'file'):
+                if s3_key:
+                    valid_keys[user_id].add(s3_key)
+                if file_name:
+                    valid_keys[user_id].add(file_name)
+        return valid_keys
+
+    def _scan_shard(self, prefix, valid_keys):
+        """List one prefix (worker thread, no DB access). Returns (objects, {user_id: totals})"""
+        totals = defaultdict(lambda: {'s3_size': 0, 'orphaned_size': 0})
+        objects = 0
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                objects += 1
+                match = USER_KEY_PATTERN.match(obj['Key'])
+                if not match:
+                    continue
+                user_id = int(match.group(1))
+                if matches_valid_key(obj['Key'], valid_keys.get(user_id, ()), f"user_{user_id}/"):
+                    totals[user_id]['s3_size'] += obj['Size']
+                else:
+                    totals[user_id]['orphaned_size'] += obj['Size']
+        return objects, totals
+
+    # Writing
+
+    def _apply_shard(self, user_ids, totals):
+        result = apply_storage_totals(user_ids, totals, dry_run=self.dry_run, on_user=self.on_user)
+        self.stats['storage_created'] += result['created']
+        self.stats['changed'] += result['changed']
+        self.stats['orphaned_users'].extend(result['orphaned_users'])
+
+    # Driver
+
+    def run(self):
+        started = time.perf_counter()
+        prefixes = shard_prefixes(self.shard_depth)[self.shard_index::self.shard_count]
+        completed = self._load_checkpoint()
+        pending = [prefix for prefix in prefixes if prefix not in completed]
+        self.stats['shards_skipped'] = len(prefixes) - len(pending)
+
+        users_by_shard = defaultdict(list)
+        for user_id in get_user_model().objects.order_by('id').values_list('id', flat=True).iterator():
+            users_by_shard[shard_for_user(user_id, self.shard_depth)].append(user_id)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = {}
+            queue = iter(pending)
+
+            def submit_next():
+                prefix = next(queue, None)
+                if prefix is None:
+                    return False
+                user_ids = users_by_shard.get(prefix, [])
+                # Valid keys are read here, on the main thread, and only for
+                # the shards in flight so memory stays bounded
+                future = executor.submit(self._scan_shard, prefix, self._valid_keys_by_user(user_ids))
+                in_flight[future] = (prefix, user_ids)
+                return True
+
+            for _ in range(self.workers * 2):
+                if not submit_next():
+                    break
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    prefix, user_ids = in_flight.pop(future)
+                    try:
+                        objects, totals = future.result()
+                        self._apply_shard(user_ids, totals)
+                    except Exception as e:
+                        logger.error(f"[Storage Refresh] Shard {prefix} failed: {e}")
+                        self.stats['errors'].append({'shard': prefix, 'error': str(e)})
+                    else:
+                        completed.add(prefix)
+                        self._save_checkpoint(completed)
+                        self.stats['shards'] += 1
+                        self.stats['objects'] += objects
+                        self.stats['users'] += len(user_ids)
+                    submit_next()
+
+        if not self.stats['errors'] and len(completed) >= len(prefixes):
+            self.clear_checkpoint()
+
+        elapsed = time.perf_counter() - started
+        self.stats['elapsed'] = elapsed
+        self.stats['objects_per_second'] = self.stats['objects'] / elapsed if elapsed else 0
+        self.stats['users_per_second'] = self.stats['users'] / elapsed if elapsed else 0
+        return self.stats
@@ -0,0 +1,216 @@
+import hashlib
+import hmac
+import threading
+import time
+import logging
+from collections import OrderedDict
+from urllib.parse import quote
+
+import boto3
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SIGV4_ALGORITHM = 'AWS4-HMAC-SHA256'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+MAX_PRESIGN_EXPIRY = 604800  # SigV4 limit: 7 days
+
+
+def _quote(value, safe='-_.~'):
+    return quote(value, safe=safe)
+
+
+class PresignedURLSigner:
+    """
+    Generates S3 GET presigned URLs offline (SigV4 query auth).
+
+    generate_presigned_url() goes through the full botocore request pipeline
+    for every key. For list endpoints we only need the same canonical GET
+    request signed over and over, so this signer derives the signing key once
+    per day, signs a whole batch of keys with plain HMACs, and keeps the
+    results in a bounded cache.
+
+    Signing time is rounded down to an "expiry bucket" (a quarter of the URL
+    lifetime by default), so the same (key, disposition, expiry) yields the
+    same URL for the whole bucket and repeated listings hit the cache. A
+    cached URL always has at least (expiry - bucket) seconds left.
+    """
+
+    def __init__(self, bucket_name=None, region_name=None, max_entries=None, bucket_ratio=None):
+        self.bucket_name = bucket_name or settings.AWS_STORAGE_BUCKET_NAME
+        self.region_name = region_name or settings.AWS_S3_REGION_NAME
+        self.max_entries = max_entries or getattr(settings, 'S3_PRESIGN_CACHE_MAX_ENTRIES', 20000)
+        self.bucket_ratio = bucket_ratio or getattr(settings, 'S3_PRESIGN_CACHE_BUCKET_RATIO', 0.25)
+
+        # Buckets with dots can't use virtual-hosted style over TLS
+        if '.' in self.bucket_name:
+            self.host = self._regional_host()
+            self.path_prefix = f"/{self.bucket_name}"
+        else:
+            self.host = f"{self.bucket_name}.{self._regional_host()}"
+            self.path_prefix = ''
+
+        self._session = boto3.session.Session(
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=self.region_name,
+        )
+        self._credentials = None
+        self._signing_keys = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _regional_host(self):
+        if self.region_name == 'us-east-1':
+            return 's3.amazonaws.com'
+        return f"s3.{self.region_name}.amazonaws.com"
+
+    def _get_credentials(self):
+        if self._credentials is None:
+            self._credentials = self._session.get_credentials()
+            if self._credentials is None:
+                raise Exception("No AWS credentials available for URL signing")
+        # Refreshable credentials rotate behind this call
+        return self._credentials.get_frozen_credentials()
+
+    def _signing_key(self, secret_key, datestamp):
+        cache_key = (secret_key, datestamp)
+        key = self._signing_keys.get(cache_key)
+        if key is None:
+            k_date = hmac.new(f"AWS4{secret_key}".encode('utf-8'), datestamp.encode('utf-8'), hashlib.sha256).digest()
+            k_region = hmac.new(k_date, self.region_name.encode('utf-8'), hashlib.sha256).digest()
+            k_service = hmac.new(k_region, b's3', hashlib.sha256).digest()
+            key = hmac.new(k_service, b'aws4_request', hashlib.sha256).digest()
+            # Only today's (and maybe yesterday's) key is ever useful
+            if len(self._signing_keys) > 4:
+                self._signing_keys.clear()
+            self._signing_keys[cache_key] = key
+        return key
+
+    def _bucket_seconds(self, expiry):
+        return max(1, int(expiry * self.bucket_ratio))
+
+    def _sign(self, s3_key, expiry, disposition, sign_time, credentials, signing_key):
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(sign_time))
+        datestamp = amz_date[:8]
+        scope = f"{datestamp}/{self.region_name}/s3/aws4_request"
+
+        params = {
+            'X-Amz-Algorithm': SIGV4_ALGORITHM,
+            'X-Amz-Credential': f"{credentials.access_key}/{scope}",
+            'X-Amz-Date': amz_date,
+            'X-Amz-Expires': str(expiry),
+            'X-Amz-SignedHeaders': 'host',
+        }
+        if credentials.token:
+            params['X-Amz-Security-Token'] = credentials.token
+        if disposition:
+            params['response-content-disposition'] = disposition
+
+        canonical_query = '&'.join(
+            f"{_quote(name)}={_quote(value)}" for name, value in sorted(params.items())
+        )
+        path = f"{self.path_prefix}/{_quote(s3_key, safe='/~')}"
+        canonical_request = '\n'.join([
+            'GET',
+            path,
+            canonical_query,
+            f"host:{self.host}\n",
+            'host',
+            UNSIGNED_PAYLOAD,
+        ])
+        string_to_sign = '\n'.join([
+            SIGV4_ALGORITHM,
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest(),
+        ])
+        signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        return f"https://{self.host}{path}?{canonical_query}&X-Amz-Signature={signature}"
+
+    def sign_many(self, s3_keys, expiry=3600, disposition=None, now=None):
+        """
+        Sign a batch of keys in one pass.
+
+        Args:
+            s3_keys (iterable): S3 keys; empty values are skipped.
+            expiry (int): URL lifetime in seconds.
+            disposition (str, optional): ResponseContentDisposition for every URL.
+            now (float, optional): Override the clock (tests/benchmarks).
+
+        Returns:
+            dict: {s3_key: url}
+        """
+        expiry = min(int(expiry), MAX_PRESIGN_EXPIRY)
+        now = time.time() if now is None else now
+        bucket_seconds = self._bucket_seconds(expiry)
+        bucket_index = int(now // bucket_seconds)
+        sign_time = bucket_index * bucket_seconds
+
+        urls = {}
+        missing = []
+        with self._lock:
+            for s3_key in s3_keys:
+                if not s3_key or s3_key in urls:
+                    continue
+                cached = self._cache.get((s3_key, disposition, expiry, bucket_index))
+                if cached is not None:
+                    self._cache.move_to_end((s3_key, disposition, expiry, bucket_index))
+                    self.stats['hits'] += 1
+                    urls[s3_key] = cached
+                else:
+                    missing.append(s3_key)
+
+            if not missing:
+                return urls
+
+            credentials = self._get_credentials()
+            signing_key = self._signing_key(
+                credentials.secret_key,
+                time.strftime('%Y%m%d', time.gmtime(sign_time))
+            )
+            for s3_key in missing:
+                if s3_key in urls:
+                    continue
+                url = self._sign(s3_key, expiry, disposition, sign_time, credentials, signing_key)
+                urls[s3_key] = url
+                self._cache[(s3_key, disposition, expiry, bucket_index)] = url
+                self.stats['misses'] += 1
+
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+                self.stats['evictions'] += 1
+
+        return urls
+
+    def sign(self, s3_key, expiry=3600, disposition=None):
+        """Sign a single key; returns None for an empty key"""
+        if not s3_key:
+            return None
+        return self.sign_many([s3_key], expiry=expiry, disposition=disposition).get(s3_key)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._signing_keys.clear()
+            self._credentials = None
+
+
+_signer = None
+_signer_lock = threading.Lock()
+
+
+def get_url_signer():
+    """Process-wide signer for the default bucket"""
+    global _signer
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                _signer = PresignedURLSigner()
+    return _signer
+
+
+def attachment_disposition(filename):
+    """Content-Disposition used for download links"""
+    return f'attachment; filename="{filename}"'
@@ -0,0 +1,102 @@
+import logging
+import re
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .clients import get_s3_client
+from .signing import attachment_disposition
+
+logger = logging.getLogger(__name__)
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header):
+    """
+    Normalise a single-range Range header ("bytes=0-99", "bytes=100-",
+    "bytes=-500") for S3, or None to serve the whole object.
+
+    Multi-range and malformed headers are ignored, as RFC 9110 allows:
+    the client then gets a plain 200.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip().replace(' ', ''))
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if start and end and int(end) < int(start):
+        return None
+    return f"bytes={start}-{end}"
+
+
+def iter_body(body, chunk_size):
+    """Yield a GetObject body in fixed-size chunks and always release the connection"""
+    try:
+        for chunk in body.iter_chunks(chunk_size):
+            yield chunk
+    finally:
+        body.close()
+
+
+def stream_s3_object(request, s3_key, filename=None, content_type=None, s3_client=None, as_attachment=False):
+    """
+    Proxy an S3 object with Range, ETag and If-None-Match support.
+
+    One GetObject per request: the Range and If-None-Match headers are
+    forwarded so S3 does the slicing and the conditional check, and the body
+    is relayed in S3_STREAM_CHUNK_SIZE chunks, so memory per request stays
+    constant whatever the object size.
+
+    Returns a 200/206 StreamingHttpResponse, or a 304/416 HttpResponse.
+    """
+    s3_client = s3_client or get_s3_client()
+    chunk_size = getattr(settings, 'S3_STREAM_CHUNK_SIZE', 64 * 1024)
+    params = {'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': s3_key}
+
+    byte_range = parse_range(request.headers.get('Range'))
+    if byte_range:
+        params['Range'] = byte_range
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        params['IfNoneMatch'] = if_none_match
+
+    try:
+        s3_response = s3_client.get_object(**params)
+    except ClientError as e:
+        error = e.response.get('Error', {})
+        status_code = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        if status_code == 304 or error.get('Code') in ('304', 'NotModified'):
+            response = HttpResponse(status=304)
+            response['ETag'] = if_none_match
+            return response
+        if error.get('Code') == 'InvalidRange':
+            head = s3_client.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=s3_key)
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{head['ContentLength']}"
+            return response
+        raise
+
+    response = StreamingHttpResponse(
+        iter_body(s3_response['Body'], chunk_size),
+        status=206 if 'ContentRange' in s3_response else 200,
+        content_type=content_type or s3_response.get('ContentType') or 'application/octet-stream',
+    )
+    response['Content-Length'] = s3_response['ContentLength']
+    response['Accept-Ranges'] = 'bytes'
+    if 'ContentRange' in s3_response:
+        response['Content-Range'] = s3_response['ContentRange']
+    if s3_response.get('ETag'):
+        response['ETag'] = s3_response['ETag']
+    if s3_response.get('LastModified'):
+        response['Last-Modified'] = s3_response['LastModified'].strftime('%a, %d %b %Y %H:%M:%S GMT')
+    if filename:
+        disposition = attachment_disposition(filename)
+        response['Content-Disposition'] = disposition if as_attachment else disposition.replace('attachment', 'inline', 1)
+    # Private content: never let shared caches keep it
+    response['Cache-Control'] = 'private, no-cache'
+    return response
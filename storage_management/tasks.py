@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from .utils import run_storage_audit
+
+
+@shared_task
+def audit_user_storage(user_id):
+    """Reconcile one user's storage ledger against S3 (queued by S3StorageManager.maybe_schedule_audit)"""
+    return run_storage_audit(user_id)
@@ -1,3 +1,598 @@
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from unittest.mock import patch, MagicMock
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
 
-# Create your tests here.
+from file_management.models import UserFile
+from file_management.services import FileDeletionService
+from storage_management import clients, ledger
+from storage_management.ledger import adjust_storage_used
+from storage_management.models import UserStorage
+from storage_management.inventory import InventoryReconciler, iter_inventory, load_manifest, write_synthetic_inventory
+from storage_management.refresh import StorageRefreshEngine, shard_for_user, shard_prefixes
+from storage_management.utils import S3StorageManager
+from storage_management.transfer import UploadProgress, MB, get_transfer_config
+from storage_management.signing import PresignedURLSigner
+
+User = get_user_model()
+
+
+class AWSClientRegistryTests(SimpleTestCase):
+    """The boto3 client registry should build each client once per process."""
+
+    def setUp(self):
+        clients.reset_clients()
+
+    def tearDown(self):
+        clients.reset_clients()
+
+    def test_client_is_reused(self):
+        first = clients.get_s3_client()
+        second = clients.get_s3_client()
+
+        self.assertIs(first, second)
+        self.assertEqual(clients.get_client_stats()['clients_created'], 1)
+
+    def test_clients_are_cached_per_region_and_service(self):
+        default_s3 = clients.get_s3_client()
+        eu_s3 = clients.get_s3_client('eu-west-1')
+        textract = clients.get_textract_client()
+
+        self.assertIsNot(default_s3, eu_s3)
+        self.assertIsNot(default_s3, textract)
+        self.assertEqual(eu_s3.meta.region_name, 'eu-west-1')
+        self.assertEqual(clients.get_client_stats()['clients_created'], 3)
+
+    def test_pool_configuration(self):
+        config = clients.get_s3_client().meta.config
+
+        self.assertEqual(config.max_pool_connections, 50)
+        self.assertTrue(config.tcp_keepalive)
+        self.assertEqual(config.retries['mode'], 'standard')
+
+    def test_concurrent_first_use_builds_one_client(self):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(clients.get_s3_client()))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len({id(client) for client in results}), 1)
+        self.assertEqual(clients.get_client_stats()['clients_created'], 1)
+
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+    def test_forked_children_build_their_own_clients(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        clients.get_s3_client()
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as pool:
+            self.assertEqual(pool.submit(clients.get_client_stats).result(timeout=30)['cached_clients'], [])
+        self.assertEqual(clients.get_client_stats()['cached_clients'], [f"s3:{settings.AWS_S3_REGION_NAME}"])
+
+class S3StorageManagerClientTests(TestCase):
+    def setUp(self):
+        clients.reset_clients()
+        self.user = User.objects.create_user(
+            username='storageuser',
+            email='storage@example.com',
+            password='testpassword'
+        )
+
+    def test_managers_share_one_client(self):
+        managers = [S3StorageManager(self.user) for _ in range(20)]
+
+        self.assertEqual(len({id(manager.s3_client) for manager in managers}), 1)
+
+
+class PresignedURLSignerTests(SimpleTestCase):
+    """Offline signing must produce the same URL botocore would."""
+
+    def test_signature_matches_botocore(self):
+        import datetime
+        from urllib.parse import urlsplit, parse_qs
+        from unittest.mock import patch
+        import boto3
+        from botocore.config import Config
+        from django.conf import settings
+
+        signer = PresignedURLSigner()
+        key = 'user_1/tax returns/2024 ü+final.pdf'
+        disposition = 'attachment; filename="final.pdf"'
+        now = 1760000000
+        url = signer.sign_many([key], expiry=3600, disposition=disposition, now=now)[key]
+
+        bucket_seconds = signer._bucket_seconds(3600)
+        sign_time = (now // bucket_seconds) * bucket_seconds
+
+        class FixedDatetime(datetime.datetime):
+            @classmethod
+            def utcnow(cls):
+                return datetime.datetime.utcfromtimestamp(sign_time)
+
+        session = boto3.session.Session(
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=settings.AWS_S3_REGION_NAME,
+        )
+        client = session.client('s3', config=Config(signature_version='s3v4'))
+        with patch('botocore.auth.datetime.datetime', FixedDatetime):
+            expected = client.generate_presigned_url(
+                'get_object',
+                Params={
+                    'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
+                    'Key': key,
+                    'ResponseContentDisposition': disposition,
+                },
+                ExpiresIn=3600
+            )
+
+        actual, reference = urlsplit(url), urlsplit(expected)
+        self.assertEqual(actual.netloc, reference.netloc)
+        self.assertEqual(actual.path, reference.path)
+        self.assertEqual(parse_qs(actual.query), parse_qs(reference.query))
+
+    def test_urls_are_cached_within_expiry_bucket(self):
+        signer = PresignedURLSigner()
+        keys = [f"user_1/file_{i}.pdf" for i in range(10)]
+
+        first = signer.sign_many(keys, now=1760000000)
+        second = signer.sign_many(keys, now=1760000000 + 60)
+
+        self.assertEqual(first, second)
+        self.assertEqual(signer.stats['misses'], 10)
+        self.assertEqual(signer.stats['hits'], 10)
+
+        # A new bucket re-signs, and disposition is part of the cache key
+        later = signer.sign_many(keys, now=1760000000 + 3600)
+        self.assertNotEqual(first[keys[0]], later[keys[0]])
+        download = signer.sign(keys[0], disposition='attachment; filename="file_0.pdf"')
+        self.assertIn('response-content-disposition', download)
+
+    def test_cache_is_bounded(self):
+        signer = PresignedURLSigner(max_entries=5)
+        signer.sign_many([f"user_1/file_{i}.pdf" for i in range(12)])
+
+        self.assertEqual(len(signer._cache), 5)
+        self.assertEqual(signer.stats['evictions'], 7)
+
+
+class StorageLedgerTests(TestCase):
+    """storage_used follows UserFile rows without touching S3."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='ledgeruser',
+            email='ledger@example.com',
+            password='testpassword'
+        )
+
+    def _storage_used(self):
+        return UserStorage.objects.get(user=self.user).storage_used
+
+    def _create_file(self, name, size):
+        return UserFile.objects.create(
+            user=self.user,
+            file_type='other',
+            s3_key=f"user_{self.user.id}/{name}",
+            original_filename=name,
+            file_size=size
+        )
+
+    def test_create_resize_and_delete_update_ledger(self):
+        first = self._create_file('a.pdf', 1000)
+        self._create_file('b.pdf', 500)
+        self.assertEqual(self._storage_used(), 1500)
+
+        first.file_size = 1200
+        first.save()
+        self.assertEqual(self._storage_used(), 1700)
+
+        # Saves that don't touch file_size leave the ledger alone
+        first.toggle_favorite()
+        first.original_filename = 'renamed.pdf'
+        first.save()
+        self.assertEqual(self._storage_used(), 1700)
+
+        with patch.object(S3StorageManager, 'delete_keys', return_value={'deleted': [], 'errors': []}):
+            UserFile.objects.get(pk=first.pk).delete()
+        self.assertEqual(self._storage_used(), 500)
+
+    def test_suspended_block_skips_ledger_writes(self):
+        self._create_file('a.pdf', 1000)
+
+        with self.assertNumQueries(0):
+            with ledger.suspended():
+                adjust_storage_used(self.user.id, -1000)
+        self.assertEqual(self._storage_used(), 1000)
+
+    def test_ledger_never_goes_negative(self):
+        adjust_storage_used(self.user.id, -10 ** 9)
+        self.assertEqual(self._storage_used(), 0)
+
+    def test_storage_info_is_a_single_row_read(self):
+        self._create_file('a.pdf', 2048)
+        manager = S3StorageManager(self.user)
+
+        with patch.object(manager, '_calculate_s3_storage') as s3_listing, \
+             self.assertNumQueries(2):  # get_or_create + audit claim
+            info = manager.get_user_storage_info()
+
+        s3_listing.assert_not_called()
+        self.assertEqual(info['used'], 2048)
+
+        # The audit was just claimed, so the next read is one query
+        with self.assertNumQueries(1):
+            manager.get_user_storage_info()
+
+    @override_settings(STORAGE_AUDIT_INTERVAL=60)
+    def test_due_audit_is_queued_as_a_task_on_commit(self):
+        manager = S3StorageManager(self.user)
+        storage = UserStorage.objects.get(user=self.user)
+
+        with patch('storage_management.tasks.audit_user_storage.delay') as delay:
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.assertTrue(manager.maybe_schedule_audit(storage))
+            delay.assert_not_called()
+            for callback in callbacks:
+                callback()
+        delay.assert_called_once_with(self.user.id)
+
+        # A broker that can't be reached gives the claim back for the next request
+        UserStorage.objects.filter(pk=storage.pk).update(last_audited_at=None)
+        storage.refresh_from_db()
+        with patch('storage_management.tasks.audit_user_storage.delay', side_effect=OSError('broker down')):
+            with self.captureOnCommitCallbacks(execute=True):
+                manager.maybe_schedule_audit(storage)
+        storage.refresh_from_db()
+        self.assertIsNone(storage.last_audited_at)
+
+    def test_audit_corrects_drift_with_set_lookups(self):
+        self._create_file('a.pdf', 1000)
+        UserFile.objects.create(
+            user=self.user,
+            file_type='other',
+            s3_key='b.pdf',  # legacy row that stored only the filename
+            original_filename='b.pdf',
+            file_size=500
+        )
+        UserStorage.objects.filter(user=self.user).update(storage_used=99999)
+
+        prefix = f"user_{self.user.id}/"
+        manager = S3StorageManager(self.user)
+        paginator = MagicMock()
+        paginator.paginate.return_value = [{'Contents': [
+            {'Key': f'{prefix}a.pdf', 'Size': 1000},
+            {'Key': f'{prefix}b.pdf', 'Size': 500},
+            {'Key': f'{prefix}orphan.bin', 'Size': 7},
+        ]}]
+        with patch.object(manager.s3_client, 'get_paginator', return_value=paginator):
+            result = manager.audit_storage()
+
+        self.assertEqual(result['s3_size'], 1500)
+        self.assertEqual(result['used'], 1500)
+        storage = UserStorage.objects.get(user=self.user)
+        self.assertEqual(storage.storage_used, 1500)
+        self.assertIsNotNone(storage.last_audited_at)
+
+
+class StorageAnalyticsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='analyticsuser', email='analytics@example.com', password='testpassword')
+
+    def test_breakdown_has_one_row_per_category_name(self):
+        from file_management.models import FileCategory
+        from rest_framework.test import APIClient
+
+        shared = FileCategory.objects.create(name='Miscellaneous', is_default=True)
+        custom = FileCategory.objects.create(name='Miscellaneous', created_by=self.user)
+        bills = FileCategory.objects.create(name='Bills', created_by=self.user)
+        for index, (category, size) in enumerate([(shared, 300), (custom, 400), (bills, 500), (None, 100)]):
+            UserFile.objects.create(
+                user=self.user, file_type='audio', file_size=size, category=category,
+                original_filename=f"file{index}.mp3", s3_key=f"user_{self.user.id}/file{index}.mp3"
+            )
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/storage/api/storage/analytics/')
+        self.assertEqual(response.json()['storage_breakdown'], [
+            {'category': 'Miscellaneous', 'size': 700},
+            {'category': 'Bills', 'size': 500},
+            {'category': 'Uncategorized', 'size': 100},
+        ])
+
+
+class TransferConfigTests(SimpleTestCase):
+    @override_settings(S3_UPLOAD_PART_SIZE=5 * MB, S3_UPLOAD_MAX_BUFFERED_PARTS=3)
+    def test_buffered_parts_bound_in_memory_upload_chunks(self):
+        from s3transfer.utils import NoResourcesAvailable
+        from s3transfer.futures import IN_MEMORY_UPLOAD_TAG
+        from s3transfer.manager import TransferManager
+
+        config = get_transfer_config()
+        self.assertEqual(config.max_in_memory_upload_chunks, 3)
+
+        # The semaphore s3transfer takes for every part it reads into memory
+        manager = TransferManager(MagicMock(), config)
+        try:
+            semaphore = manager._request_executor._tag_semaphores[IN_MEMORY_UPLOAD_TAG]
+            for _ in range(3):
+                semaphore.acquire('upload', blocking=False)
+            with self.assertRaises(NoResourcesAvailable):
+                semaphore.acquire('upload', blocking=False)
+        finally:
+            manager.shutdown()
+
+
+    def test_seekable_sources_are_not_wrapped(self):
+        from django.core.files.uploadedfile import TemporaryUploadedFile
+
+        from storage_management.transfer import ChecksumReader, stream_to_s3
+
+        data = os.urandom(3000)
+        digest = hashlib.sha256(data).hexdigest()
+        s3_client = MagicMock()
+        s3_client.upload_fileobj.side_effect = lambda fileobj, *args, **kwargs: fileobj.read()
+
+        # Spooled to disk: uploaded by path, so s3transfer reads parts from the file
+        spooled = TemporaryUploadedFile('a.bin', 'application/octet-stream', len(data), None)
+        spooled.write(data)
+        spooled.seek(0)
+        with spooled:
+            result = stream_to_s3(s3_client, 'bucket', 'a.bin', spooled)
+            s3_client.upload_file.assert_called_once()
+            self.assertEqual(s3_client.upload_file.call_args.args[0], spooled.temporary_file_path())
+        self.assertEqual((result['source'], result['size'], result['sha256']), ('path', 3000, digest))
+
+        in_memory = io.BytesIO(data)
+        result = stream_to_s3(s3_client, 'bucket', 'b.bin', in_memory)
+        self.assertIs(s3_client.upload_fileobj.call_args.args[0], in_memory)
+        self.assertEqual((result['source'], result['size'], result['sha256']), ('seekable', 3000, digest))
+
+        pipe = MagicMock(spec=['read'])
+        pipe.read.side_effect = io.BytesIO(data).read
+        result = stream_to_s3(s3_client, 'bucket', 'c.bin', pipe)
+        self.assertIsInstance(s3_client.upload_fileobj.call_args.args[0], ChecksumReader)
+        self.assertEqual((result['source'], result['size'], result['sha256']), ('stream', 3000, digest))
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class StreamingUploadTests(TestCase):
+    """Uploads against an in-memory S3."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='uploaduser',
+            email='upload@example.com',
+            password='testpassword'
+        )
+        self.mock = mock_aws()
+        self.mock.start()
+        import boto3
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.s3_client.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+        self.manager = S3StorageManager(self.user)
+        self.manager.s3_client = self.s3_client
+
+    def tearDown(self):
+        self.mock.stop()
+
+    @override_settings(S3_UPLOAD_MULTIPART_THRESHOLD=5 * MB, S3_UPLOAD_PART_SIZE=5 * MB)
+    def test_multipart_stream_computes_checksum_and_progress(self):
+        data = os.urandom(12 * MB)
+        upload = io.BytesIO(data)
+
+        result = self.manager.upload_file_stream(upload, 'large.bin', upload_id='abc123')
+
+        self.assertEqual(result['size'], len(data))
+        self.assertEqual(result['sha256'], hashlib.sha256(data).hexdigest())
+        head = self.s3_client.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=result['s3_key'])
+        self.assertEqual(head['ContentLength'], len(data))
+        self.assertIn('-', head['ETag'])  # multipart ETag
+
+        progress = UploadProgress.get(self.user.id, 'abc123')
+        self.assertEqual(progress['state'], 'completed')
+        self.assertEqual(progress['transferred'], len(data))
+
+    def test_direct_multipart_flow(self):
+        data = os.urandom(6 * MB)
+        upload = self.manager.create_direct_upload('direct.bin', len(data))
+        self.assertEqual(len(upload['parts']), 1)
+        self.assertTrue(upload['s3_key'].startswith(self.manager.user_prefix))
+
+        part = self.s3_client.upload_part(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Key=upload['s3_key'],
+            UploadId=upload['upload_id'],
+            PartNumber=1,
+            Body=data
+        )
+        result = self.manager.complete_direct_upload(
+            upload['s3_key'],
+            upload['upload_id'],
+            [{'part_number': 1, 'etag': part['ETag']}]
+        )
+
+        self.assertEqual(result['size'], len(data))
+        with self.assertRaises(Exception):
+            self.manager.complete_direct_upload('user_999/other.bin', upload['upload_id'], [{'part_number': 1, 'etag': 'x'}])
+
+    def test_bulk_delete_batches_objects_and_keeps_shared_keys(self):
+        bucket = settings.AWS_STORAGE_BUCKET_NAME
+        files = []
+        for index in range(3):
+            key = f"user_{self.user.id}/bulk_{index}.txt"
+            self.s3_client.put_object(Bucket=bucket, Key=key, Body=b'x' * 100)
+            files.append(UserFile.objects.create(
+                user=self.user, file_type='other', s3_key=key, file=key,
+                original_filename=f'bulk_{index}.txt', file_size=100
+            ))
+        # A row outside the delete that points at the same object keeps it alive
+        UserFile.objects.create(
+            user=self.user, file_type='other', s3_key=files[0].s3_key,
+            file=files[0].s3_key, original_filename='copy.txt', file_size=100
+        )
+
+        service = FileDeletionService(self.user)
+        service.storage_manager.s3_client = self.s3_client
+        result = service.delete_files(UserFile.objects.filter(pk__in=[f.pk for f in files]))
+
+        self.assertEqual(result['deleted_count'], 3)
+        self.assertEqual(result['s3_deleted'], 2)
+        remaining = self.s3_client.list_objects_v2(Bucket=bucket).get('Contents', [])
+        self.assertEqual([obj['Key'] for obj in remaining], [files[0].s3_key])
+        self.assertEqual(UserStorage.objects.get(user=self.user).storage_used, 100)
+
+
+class DeleteKeysTests(TestCase):
+    def test_keys_are_grouped_into_delete_objects_calls(self):
+        user = User.objects.create_user(username='batchuser', email='batch@example.com', password='testpassword')
+        manager = S3StorageManager(user)
+        manager.s3_client = MagicMock()
+        manager.s3_client.delete_objects.return_value = {}
+
+        keys = [f"user_{user.id}/file_{index}" for index in range(2500)]
+        result = manager.delete_keys(keys + keys[:10])
+
+        self.assertEqual(manager.s3_client.delete_objects.call_count, 3)
+        batch_sizes = sorted(len(call.kwargs['Delete']['Objects']) for call in manager.s3_client.delete_objects.call_args_list)
+        self.assertEqual(batch_sizes, [500, 1000, 1000])
+        self.assertEqual(len(result['deleted']), 2500)
+
+
+class ShardPrefixTests(SimpleTestCase):
+    def test_every_user_falls_in_exactly_one_shard(self):
+        for depth in (1, 2, 3):
+            prefixes = shard_prefixes(depth)
+            for user_id in (1, 9, 10, 42, 100, 123, 98765):
+                matches = [prefix for prefix in prefixes if f"user_{user_id}/".startswith(prefix)]
+                self.assertEqual(matches, [shard_for_user(user_id, depth)])
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class StorageRefreshEngineTests(TestCase):
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        import boto3
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.bucket = settings.AWS_STORAGE_BUCKET_NAME
+        self.s3_client.create_bucket(Bucket=self.bucket)
+
+        self.users = [
+            User.objects.create_user(username=f'refresh{index}', email=f'refresh{index}@example.com', password='testpassword')
+            for index in range(3)
+        ]
+        for user in self.users:
+            key = f"user_{user.id}/doc.pdf"
+            self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=b'x' * 700)
+            UserFile.objects.create(user=user, file_type='document', s3_key=key, file=key, original_filename='doc.pdf', file_size=700)
+        # An object with no database row
+        self.s3_client.put_object(Bucket=self.bucket, Key=f"user_{self.users[0].id}/orphan.bin", Body=b'x' * 50)
+        # Phantom usage for the engine to correct
+        UserStorage.objects.filter(user=self.users[1]).update(storage_used=10 ** 6)
+        UserStorage.objects.filter(user=self.users[2]).delete()
+
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'refresh.json')
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_refresh_writes_all_users_and_reports_orphans(self):
+        stats = StorageRefreshEngine(workers=4, s3_client=self.s3_client, checkpoint_path=self.checkpoint).run()
+
+        self.assertEqual(stats['users'], 3)
+        self.assertEqual(stats['objects'], 4)
+        self.assertEqual(stats['storage_created'], 1)
+        self.assertEqual(stats['orphaned_users'], [self.users[0].id])
+        for user in self.users:
+            storage = UserStorage.objects.get(user=user)
+            self.assertEqual(storage.storage_used, 700)
+            self.assertEqual(storage.last_audit_s3_size, 700)
+            self.assertIsNotNone(storage.last_audited_at)
+        # A finished run leaves no checkpoint behind
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume_skips_completed_shards(self):
+        remaining = shard_for_user(self.users[1].id)
+        with open(self.checkpoint, 'w') as checkpoint_file:
+            json.dump({
+                'shard_depth': 2,
+                'shard': [0, 1],
+                'completed': [prefix for prefix in shard_prefixes(2) if prefix != remaining],
+            }, checkpoint_file)
+
+        stats = StorageRefreshEngine(s3_client=self.s3_client, checkpoint_path=self.checkpoint).run()
+
+        self.assertEqual(stats['shards'], 1)
+        self.assertEqual(stats['shards_skipped'], 98)
+        self.assertEqual(UserStorage.objects.get(user=self.users[1]).storage_used, 700)
+
+
+class InventoryReconcilerTests(TestCase):
+    """Reconciliation from a local inventory, no S3 access at all."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='inventory', email='inventory@example.com', password='testpassword')
+        self.other = User.objects.create_user(username='inventory2', email='inventory2@example.com', password='testpassword')
+        self.files = [
+            UserFile.objects.create(
+                user=self.user, file_type='other', s3_key=f"user_{self.user.id}/file {index}.pdf",
+                original_filename=f'file {index}.pdf', file_size=100
+            )
+            for index in range(3)
+        ]
+        self.other_file = UserFile.objects.create(
+            user=self.other, file_type='other', s3_key=f"user_{self.other.id}/a.pdf",
+            original_filename='a.pdf', file_size=10
+        )
+        self.out_dir = tempfile.mkdtemp()
+        objects = [
+            (self.files[0].s3_key, 100, 'etag0'),
+            (self.files[1].s3_key, 150, 'etag1'),  # size drift; files[2] is missing
+            (f"user_{self.user.id}/orphan.bin", 40, 'etag2'),
+            (self.other_file.s3_key, 10, 'etag3'),
+        ]
+        self.manifest = write_synthetic_inventory(self.out_dir, objects, rows_per_file=2)
+
+    def test_manifest_round_trip_decodes_keys(self):
+        keys = [key for key, _, _ in iter_inventory(self.manifest)]
+        self.assertIn(self.files[0].s3_key, keys)
+        self.assertEqual(len(load_manifest(self.manifest)['files']), 2)
+
+    def test_finds_orphans_missing_and_drift(self):
+        with patch.object(S3StorageManager, '__init__', side_effect=AssertionError('no S3 access expected')):
+            # max_rows=1 forces one pass per user
+            report = InventoryReconciler(self.manifest, max_rows=1).run()
+
+        self.assertEqual(report['passes'], 2)
+        self.assertEqual(report['orphans']['count'], 1)
+        self.assertEqual(report['orphans']['bytes'], 40)
+        self.assertEqual([item['file_id'] for item in report['missing']['sample']], [self.files[2].id])
+        self.assertEqual(report['drift']['sample'][0]['file_id'], self.files[1].id)
+
+    def test_fix_sizes_rewrites_storage(self):
+        InventoryReconciler(self.manifest).run(fix_sizes=True)
+
+        self.assertEqual(UserFile.objects.get(pk=self.files[1].pk).file_size, 150)
+        storage = UserStorage.objects.get(user=self.user)
+        self.assertEqual(storage.storage_used, 350)
+        self.assertEqual(storage.last_audit_s3_size, 250)
@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from boto3.s3.transfer import TransferConfig
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+S3_MIN_PART_SIZE = 5 * MB
+S3_MAX_PARTS = 10000
+
+
+def get_transfer_config():
+    """TransferConfig for server-side uploads, tunable from settings"""
+    config = TransferConfig(
+        multipart_threshold=getattr(settings, 'S3_UPLOAD_MULTIPART_THRESHOLD', 8 * MB),
+        multipart_chunksize=getattr(settings, 'S3_UPLOAD_PART_SIZE', 8 * MB),
+        max_concurrency=getattr(settings, 'S3_UPLOAD_MAX_CONCURRENCY', 10),
+        use_threads=True,
+    )
+    # File objects are read into memory part by part; s3transfer holds at most
+    # this many parts at once (boto3's constructor doesn't take it, the attribute is read as is)
+    config.max_in_memory_upload_chunks = getattr(settings, 'S3_UPLOAD_MAX_BUFFERED_PARTS', 10)
+    return config
+
+
+def direct_upload_part_size(file_size):
+    """Part size for a presigned multipart upload (respects S3's 10,000-part limit)"""
+    configured = max(getattr(settings, 'S3_DIRECT_UPLOAD_PART_SIZE', 16 * MB), S3_MIN_PART_SIZE)
+    return max(configured, math.ceil(file_size / S3_MAX_PARTS))
+
+
+def upload_source(file_obj):
+    """
+    How stream_to_s3 hands a source to s3transfer:
+
+    'path': the data is in a file on disk (Django's TemporaryUploadedFile);
+    s3transfer is given the path and reads each part from the file as it
+    sends it. 'seekable': any other seekable object, passed through as is.
+    'stream': non-seekable, wrapped in a ChecksumReader and read once.
+    s3transfer copies each part of the last two into memory.
+    """
+    if callable(getattr(file_obj, 'temporary_file_path', None)):
+        return 'path'
+    try:
+        if file_obj.seekable():
+            return 'seekable'
+    except (AttributeError, OSError, ValueError):
+        pass
+    return 'stream'
+
+
+def buffered_bytes_limit(source, config):
+    """Most upload bytes s3transfer holds in memory at once for a source kind"""
+    if source == 'path':
+        return 0
+    return config.max_in_memory_upload_chunks * config.multipart_chunksize
+
+
+def _hash_file(file_obj, chunk_size=MB):
+    """SHA-256 and size of a seekable file from its current position, which is restored"""
+    start = file_obj.tell()
+    sha256 = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+        sha256.update(chunk)
+        size += len(chunk)
+    file_obj.seek(start)
+    return sha256.hexdigest(), size
+
+
+class ChecksumReader:
+    """
+    Wraps a non-seekable upload source and hashes it as s3transfer reads it.
+
+    It deliberately doesn't expose seek()/tell(): s3transfer then treats it as
+    a non-seekable stream and reads it exactly once, front to back, so the
+    digest is computed in the same pass as the upload.
+    """
+
+    def __init__(self, file_obj):
+        self._file_obj = file_obj
+        self._sha256 = hashlib.sha256()
+        self.bytes_read = 0
+
+    def read(self, amount=-1):
+        data = self._file_obj.read(amount)
+        if data:
+            self._sha256.update(data)
+            self.bytes_read += len(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+
+class UploadProgress:
+    """
+    s3transfer progress callback that publishes to the cache.
+
+    Clients poll GET /file_management/api/uploads/<upload_id>/progress/.
+    Writes are throttled to one per PROGRESS_INTERVAL or on completion.
+    """
+
+    PROGRESS_INTERVAL = 0.5  # seconds
+
+    def __init__(self, user_id, upload_id, total_bytes):
+        self.cache_key = self.key_for(user_id, upload_id)
+        self.total_bytes = total_bytes or 0
+        self.transferred = 0
+        self._last_published = 0
+        self._lock = threading.Lock()
+        self._publish('uploading')
+
+    @staticmethod
+    def key_for(user_id, upload_id):
+        return f"upload_progress:{user_id}:{upload_id}"
+
+    @classmethod
+    def get(cls, user_id, upload_id):
+        return cache.get(cls.key_for(user_id, upload_id))
+
+    def __call__(self, bytes_amount):
+        # Called from s3transfer worker threads
+        with self._lock:
+            self.transferred += bytes_amount
+            now = time.monotonic()
+            if now - self._last_published < self.PROGRESS_INTERVAL:
+                return
+            self._last_published = now
+        self._publish('uploading')
+
+    def _publish(self, state):
+        percentage = (self.transferred / self.total_bytes * 100) if self.total_bytes else 0
+        cache.set(self.cache_key, {
+            'state': state,
+            'transferred': self.transferred,
+            'total': self.total_bytes,
+            'percentage': round(min(percentage, 100), 1),
+        }, timeout=60 * 60)
+
+    def finish(self, state='completed'):
+        self._publish(state)
+
+
+def stream_to_s3(s3_client, bucket_name, s3_key, file_obj, extra_args=None, progress_callback=None, config=None):
+    """
+    Upload a file-like object, multipart/parallel above the threshold.
+
+    Seekable sources are hashed in a separate streaming read and handed to
+    s3transfer unwrapped (files on disk by path, see upload_source), so
+    parts aren't buffered in memory needlessly; non-seekable ones are hashed
+    in the same pass as the upload.
+
+    Returns:
+        dict: {'s3_key', 'size', 'sha256', 'elapsed', 'source'}
+    """
+    source = upload_source(file_obj)
+    config = config or get_transfer_config()
+    upload_args = {'ExtraArgs': extra_args or {}, 'Callback': progress_callback, 'Config': config}
+    started = time.perf_counter()
+    if source == 'path':
+        path = file_obj.temporary_file_path()
+        with open(path, 'rb') as stored:
+            sha256, size = _hash_file(stored)
+        s3_client.upload_file(path, bucket_name, s3_key, **upload_args)
+    elif source == 'seekable':
+        sha256, size = _hash_file(file_obj)
+        s3_client.upload_fileobj(file_obj, bucket_name, s3_key, **upload_args)
+    else:
+        reader = ChecksumReader(file_obj)
+        s3_client.upload_fileobj(reader, bucket_name, s3_key, **upload_args)
+        sha256, size = reader.hexdigest(), reader.bytes_read
+    return {
+        's3_key': s3_key,
+        'size': size,
+        'sha256': sha256,
+        'elapsed': time.perf_counter() - started,
+        'source': source,
+    }
@@ -1,46 +1,112 @@
-import boto3
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
 from django.conf import settings
 from .models import UserStorage
 from django.utils import timezone
 from storage_management.models import AdminAccessLog 
+from storage_management.clients import get_s3_client
+from storage_management.signing import get_url_signer, attachment_disposition
+from storage_management.transfer import UploadProgress, stream_to_s3, direct_upload_part_size
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import math
+import uuid
 logger = logging.getLogger(__name__)
-def log_admin_access(user, file_key):
-    """Log when admin accesses files through AWS console"""
+def log_admin_access(user, file_key, access_type='view', ip_address=None):
+    """Log when admin accesses files through AWS console or the streaming proxy"""
     if settings.AWS_LOGGING:
         admin_log = AdminAccessLog.objects.create(
             admin_user=user,
             accessed_file=file_key,
-            access_time=timezone.now()
+            access_time=timezone.now(),
+            access_type=access_type,
+            ip_address=ip_address
         )
         return admin_log
 
+S3_DELETE_BATCH_SIZE = 1000  # DeleteObjects limit per request
+
+
+def matches_valid_key(s3_key, valid_keys, user_prefix):
+    """
+    Set-based replacement for the old `any(key in s3_key ...)` scan.
+
+    Database rows reference objects by the full key, by the key without the
+    user prefix, or by the bare filename; check each form with a lookup.
+    """
+    if s3_key in valid_keys:
+        return True
+    if s3_key.startswith(user_prefix) and s3_key[len(user_prefix):] in valid_keys:
+        return True
+    return s3_key.rsplit('/', 1)[-1] in valid_keys
+
+
+class FileKeyCorrelator:
+    """
+    Maps S3 keys back to UserFile rows.
+
+    Same key forms as matches_valid_key (full key, key without the user
+    prefix, bare filename), but returns the row so callers can also spot
+    size drift and rows that never matched. Shared by get_user_files,
+    clean_orphaned_files and inventory reconciliation.
+    """
+
+    ROW_FIELDS = ('id', 'user_id', 's3_key', 'file', 'file_size')
+
+    def __init__(self, rows):
+        self.rows = {}
+        self._by_key = {}
+        self._by_user_key = {}
+        for row in rows:
+            file_id, user_id, s3_key, file_name, _ = row
+            self.rows[file_id] = row
+            for key in {s3_key, file_name}:
+                if key:
+                    self._by_key.setdefault(key, []).append(row)
+                    self._by_user_key.setdefault((user_id, key), []).append(row)
+
+    @classmethod
+    def for_queryset(cls, queryset):
+        return cls(queryset.values_list(*cls.ROW_FIELDS))
+
+    def matches(self, s3_key, user_id=None):
+        """Every (id, user_id, s3_key, file, file_size) row that points at s3_key"""
+        rows = self._by_key.get(s3_key)
+        if rows or user_id is None:
+            return rows or []
+        user_prefix = f"user_{user_id}/"
+        if s3_key.startswith(user_prefix):
+            rows = self._by_user_key.get((user_id, s3_key[len(user_prefix):]))
+            if rows:
+                return rows
+        return self._by_user_key.get((user_id, s3_key.rsplit('/', 1)[-1]), [])
+
+    def match(self, s3_key, user_id=None):
+        """The first row behind s3_key, or None"""
+        rows = self.matches(s3_key, user_id)
+        return rows[0] if rows else None
+
+    def __len__(self):
+        return len(self.rows)
+
+
 class S3StorageManager:
     def __init__(self, user):
         self.user = user
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
+        self.s3_client = get_s3_client()
         self.bucket_name = settings.AWS_STORAGE_BUCKET_NAME
         self.user_prefix = f"user_{user.id}/"
 
     def get_user_storage_info(self):
-        """Get current storage usage for user"""
+        """
+        Get current storage usage for user.
+
+        storage_used is maintained incrementally by storage_management.ledger,
+        so this is a single-row read. The full S3 reconciliation runs as a
+        throttled background audit (see maybe_schedule_audit).
+        """
         try:
-            # Method 1: Calculate from database records (primary source)
-            db_total_size = self._calculate_db_storage()
-            
-            # Method 2: Calculate from S3 (verification)
-            s3_total_size = self._calculate_s3_storage()
-            
-            # Method 3: Cross-validation and cleanup
-            validated_size = self._validate_and_cleanup_storage(db_total_size, s3_total_size)
-            
-            # Update storage usage in database
             storage, created = UserStorage.objects.get_or_create(
                 user=self.user,
                 defaults={
@@ -57,35 +123,109 @@ class S3StorageManager:
                 except Exception as e:
                     logger.warning(f"[S3StorageManager] Could not update subscription for {self.user.email}: {e}")
             
-            # Only update if there's a significant change (avoid constant updates)
-            if abs(storage.storage_used - validated_size) > 1024:  # 1KB threshold
-                storage.storage_used = validated_size
-                storage.save(update_fields=['storage_used'])
-                logger.info(f"[S3StorageManager] Updated storage for user {self.user.email}: {validated_size} bytes")
+            self.maybe_schedule_audit(storage)
             
             return {
-                'used': validated_size,
+                'used': storage.storage_used,
                 'limit': storage.storage_limit,
                 'available': storage.get_available_storage(),
                 'percentage_used': storage.get_usage_percentage(),
-                'db_size': db_total_size,
-                's3_size': s3_total_size,
-                'validation_method': 'database_primary'
+                'db_size': storage.storage_used,
+                's3_size': storage.last_audit_s3_size,
+                'last_audited_at': storage.last_audited_at,
+                'validation_method': 'ledger'
             }
             
         except Exception as e:
             logger.error(f"[S3StorageManager] Error getting storage info for user {self.user.id}: {str(e)}")
             raise Exception(f"Error getting storage info: {str(e)}")
 
+    def maybe_schedule_audit(self, storage):
+        """Queue a background S3 audit if the last one is older than STORAGE_AUDIT_INTERVAL"""
+        interval = getattr(settings, 'STORAGE_AUDIT_INTERVAL', 6 * 60 * 60)
+        if not interval or interval <= 0:
+            return False
+        
+        now = timezone.now()
+        last_audited_at = storage.last_audited_at
+        if last_audited_at and (now - last_audited_at).total_seconds() < interval:
+            return False
+        
+        # Claim the audit so concurrent requests/processes don't all start one
+        claimed = UserStorage.objects.filter(
+            pk=storage.pk,
+            last_audited_at=last_audited_at
+        ).update(last_audited_at=now)
+        if not claimed:
+            return False
+        
+        user_id = self.user.id
+
+        def dispatch():
+            from .tasks import audit_user_storage
+
+            try:
+                audit_user_storage.delay(user_id)
+            except Exception as e:
+                # Give the claim back so the next request (or audit_storage) tries again
+                logger.warning(f"[Storage Audit] Could not queue audit for user {user_id}: {e}")
+                UserStorage.objects.filter(pk=storage.pk, last_audited_at=now).update(last_audited_at=last_audited_at)
+
+        transaction.on_commit(dispatch)
+        logger.debug(f"[Storage Audit] Scheduled audit for user {user_id}")
+        return True
+
+    def audit_storage(self, dry_run=False):
+        """
+        Reconcile storage_used against the database and S3.
+
+        Returns the audit result; unless dry_run, corrects any drift in the
+        ledger and records the audit time.
+        """
+        storage, created = UserStorage.objects.get_or_create(
+            user=self.user,
+            defaults={'storage_used': 0, 'storage_limit': 5368709120}
+        )
+        ledger_size = storage.storage_used
+        
+        db_total_size = self._calculate_db_storage()
+        s3_total_size = self._calculate_s3_storage()
+        validated_size = self._validate_and_cleanup_storage(db_total_size, s3_total_size)
+        drift = validated_size - ledger_size
+        
+        if not dry_run:
+            # Apply the drift relative to the snapshot so concurrent ledger
+            # updates made while we were listing S3 are kept
+            UserStorage.objects.filter(pk=storage.pk).update(
+                storage_used=Greatest(F('storage_used') + drift, Value(0)),
+                last_audited_at=timezone.now(),
+                last_audit_s3_size=s3_total_size,
+                updated_at=timezone.now()
+            )
+            if abs(drift) > 1024:  # 1KB threshold
+                logger.info(f"[Storage Audit] Corrected storage for user {self.user.email}: {ledger_size} -> {validated_size} bytes")
+        
+        return {
+            'used': validated_size,
+            'previous': ledger_size,
+            'drift': drift,
+            'db_size': db_total_size,
+            's3_size': s3_total_size,
+            'validation_method': 'database_primary'
+        }
+
     def _calculate_db_storage(self):
         """Calculate storage from database UserFile records"""
         try:
             from file_management.models import UserFile
+            from file_management.dedupe import shared_copy_overcount
             total_size = UserFile.objects.filter(
                 user=self.user
             ).aggregate(
                 total=models.Sum('file_size')
             )['total'] or 0
+            # Deduplicated rows share one stored object, count it once
+            total_size -= shared_copy_overcount([self.user.id]).get(self.user.id, 0)
             
             logger.debug(f"[DB Storage] User {self.user.id} has {total_size} bytes from database")
             return total_size
@@ -94,28 +234,25 @@ class S3StorageManager:
             logger.error(f"[DB Storage] Error calculating database storage for user {self.user.id}: {e}")
             return 0
 
+    def _get_valid_keys(self):
+        """All keys the database knows about for this user (s3_key and file.name)"""
+        from file_management.models import UserFile
+        
+        valid_keys = set()
+        for s3_key, file_name in UserFile.objects.filter(user=self.user).values_list('s3_key', 'file'):
+            if s3_key:
+                valid_keys.add(s3_key)
+            if file_name:
+                valid_keys.add(file_name)
+        return valid_keys
+
+    def _matches_valid_key(self, s3_key, valid_keys):
+        return matches_valid_key(s3_key, valid_keys, self.user_prefix)
+
     def _calculate_s3_storage(self):
         """Calculate storage from S3 with filtering"""
         try:
-            from file_management.models import UserFile
-            
-            # Get valid S3 keys from database
-            valid_s3_keys = set(
-                UserFile.objects.filter(user=self.user)
-                .exclude(s3_key__isnull=True)
-                .exclude(s3_key__exact='')
-                .values_list('s3_key', flat=True)
-            )
-            
-            # Also include file.name as potential S3 key
-            valid_file_names = set(
-                UserFile.objects.filter(user=self.user)
-                .exclude(file__isnull=True)
-                .exclude(file__exact='')
-                .values_list('file', flat=True)
-            )
-            
-            all_valid_keys = valid_s3_keys.union(valid_file_names)
+            all_valid_keys = self._get_valid_keys()
             
             if not all_valid_keys:
                 logger.debug(f"[S3 Storage] User {self.user.id} has no valid S3 keys")
@@ -131,22 +268,21 @@ class S3StorageManager:
                 Bucket=self.bucket_name,
                 Prefix=self.user_prefix
             ):
-                if 'Contents' in page:
-                    for obj in page['Contents']:
-                        s3_key = obj['Key']
-                        file_size = obj['Size']
-                        
-                        # Check if this S3 key corresponds to a valid database record
-                        if s3_key in all_valid_keys or any(key in s3_key for key in all_valid_keys):
-                            total_size += file_size
-                            found_files += 1
-                        else:
-                            # Potential orphaned file
-                            orphaned_files.append({
-                                'key': s3_key,
-                                'size': file_size,
-                                'last_modified': obj.get('LastModified')
-                            })
+                for obj in page.get('Contents', []):
+                    s3_key = obj['Key']
+                    file_size = obj['Size']
+                    
+                    # Check if this S3 key corresponds to a valid database record
+                    if self._matches_valid_key(s3_key, all_valid_keys):
+                        total_size += file_size
+                        found_files += 1
+                    else:
+                        # Potential orphaned file
+                        orphaned_files.append({
+                            'key': s3_key,
+                            'size': file_size,
+                            'last_modified': obj.get('LastModified')
+                        })
             
             logger.debug(f"[S3 Storage] User {self.user.id}: {total_size} bytes from {found_files} valid files")
             
@@ -228,26 +364,14 @@ class S3StorageManager:
         try:
             logger.debug(f"Generating presigned URL for user {self.user.id}, key: '{s3_key}', expiry: {expiry} seconds.")
 
-            # Prepare parameters for generate_presigned_url
-            params = {
-                'Bucket': self.bucket_name,
-                'Key': s3_key
-            }
-
-            # Add Content-Disposition if requested (for download links)
-            if response_content_disposition:
-                params['ResponseContentDisposition'] = response_content_disposition
-                logger.debug(f"Setting ResponseContentDisposition: {response_content_disposition}")
-
-
-            # Generate the presigned URL for a GET request
-            url = self.s3_client.generate_presigned_url(
-                ClientMethod='get_object',
-                Params=params,
-                ExpiresIn=expiry # Pass the expiry duration here
+            # Signed offline and cached per expiry bucket (see storage_management.signing)
+            url = get_url_signer().sign(
+                s3_key,
+                expiry=expiry,
+                disposition=response_content_disposition
             )
 
-            logger.info(f"Successfully generated presigned URL for key '{s3_key}' (expires in {expiry}s).")
+            logger.debug(f"Successfully generated presigned URL for key '{s3_key}' (expires in {expiry}s).")
             logger.debug(f"Generated URL (first 100 chars): {url[:100]}...") # Log part of URL for verification
             return url
 
@@ -273,11 +397,11 @@ class S3StorageManager:
             from file_management.models import UserFile
             
             # Get database files
-            db_files = {
-                uf.s3_key or uf.file.name: uf 
-                for uf in UserFile.objects.filter(user=self.user) 
-                if uf.s3_key or uf.file.name
-            }
+            db_files = UserFile.objects.filter(user=self.user).in_bulk()
+            correlator = FileKeyCorrelator(
+                (uf.id, uf.user_id, uf.s3_key, uf.file.name, uf.file_size)
+                for uf in db_files.values()
+            )
             
             # Get S3 files
             response = self.s3_client.list_objects_v2(
@@ -292,11 +416,11 @@ class S3StorageManager:
             orphaned_files = []
             
             for obj in s3_objects:
-                s3_key = obj['Key']
-                if s3_key in db_files:
+                row = correlator.match(obj['Key'], self.user.id)
+                if row is not None:
                     correlated_files.append({
                         's3_object': obj,
-                        'db_file': db_files[s3_key],
+                        'db_file': db_files[row[0]],
                         'status': 'matched'
                     })
                 else:
@@ -362,8 +486,32 @@ class S3StorageManager:
     #     except Exception as e:
     #         raise Exception(f"Error uploading file: {str(e)}")
 
+    def new_object_key(self, file_name):
+        """
+        A fresh key for a new upload. Uploads never reuse a key, so a
+        different file with an existing name can't overwrite the stored
+        object another row (and the ledger) still counts.
+        """
+        return f"{self.user_prefix}{uuid.uuid4().hex[:12]}_{file_name}"
+
     def upload_file(self, file_obj, file_name):
         """Upload file with accurate size tracking"""
+        return self.upload_file_stream(file_obj, file_name)['s3_key']
+
+    def upload_file_stream(self, file_obj, file_name, upload_id=None):
+        """
+        Stream a file to S3 in a single pass.
+
+        Files above S3_UPLOAD_MULTIPART_THRESHOLD go up as parallel multipart
+        parts (see storage_management.transfer.get_transfer_config). Files
+        Django spooled to disk are uploaded from the file. The SHA-256 of the
+        content is computed along the way, and if upload_id is given,
+        progress is published for the upload_progress endpoint.
+
+        Returns:
+            dict: {'s3_key', 'size', 'sha256', 'elapsed'}
+        """
+        progress = None
         try:
             # Get file size before upload
             if hasattr(file_obj, 'size'):
@@ -377,14 +525,17 @@ class S3StorageManager:
             if not self.check_storage_limit(file_size):
                 raise Exception("Storage limit would be exceeded")
 
-            s3_key = f"{self.user_prefix}{file_name}"
+            s3_key = self.new_object_key(file_name)
+            if upload_id:
+                progress = UploadProgress(self.user.id, upload_id, file_size)
             
             # Upload with metadata
-            self.s3_client.upload_fileobj(
-                file_obj,
+            result = stream_to_s3(
+                self.s3_client,
                 self.bucket_name,
                 s3_key,
-                ExtraArgs={
+                file_obj,
+                extra_args={
                     'ACL': 'private',
                     'Metadata': {
                         'user_id': str(self.user.id),
@@ -392,26 +543,134 @@ class S3StorageManager:
                         'original_filename': file_name,
                         'file_size': str(file_size)
                     }
-                }
+                },
+                progress_callback=progress
             )
+            if progress:
+                progress.finish()
             
-            # Update storage usage accurately
-            storage, created = UserStorage.objects.get_or_create(
-                user=self.user,
-                defaults={'storage_used': 0, 'storage_limit': 5368709120}
-            )
-            
-            storage.storage_used += file_size
-            storage.save(update_fields=['storage_used'])
+            # storage_used is updated by the ledger when the UserFile row is created
+            logger.info(f"[Upload] User {self.user.id} uploaded {file_name} ({result['size']} bytes in {result['elapsed']:.2f}s)")
             
-            logger.info(f"[Upload] User {self.user.id} uploaded {file_name} ({file_size} bytes)")
-            
-            return s3_key
+            return result
             
         except Exception as e:
+            if progress:
+                progress.finish('failed')
             logger.error(f"Upload error for user {self.user.id}: {str(e)}")
             raise Exception(f"Error uploading file: {str(e)}")
 
+    def create_direct_upload(self, file_name, file_size, content_type=None, expires_in=3600):
+        """
+        Start a direct-to-S3 multipart upload and presign a URL for every part.
+
+        The client PUTs each part to its URL, collects the ETag headers and
+        calls complete_direct_upload; the bytes never pass through Django.
+        """
+        if file_size <= 0:
+            raise Exception("File size must be positive")
+        if not self.check_storage_limit(file_size):
+            raise Exception("Storage limit would be exceeded")
+
+        s3_key = self.new_object_key(file_name)
+        extra_args = {
+            'ACL': 'private',
+            'Metadata': {
+                'user_id': str(self.user.id),
+                'upload_date': timezone.now().isoformat(),
+                'original_filename': file_name,
+                'file_size': str(file_size)
+            }
+        }
+        if content_type:
+            extra_args['ContentType'] = content_type
+
+        response = self.s3_client.create_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            **extra_args
+        )
+        upload_id = response['UploadId']
+
+        part_size = direct_upload_part_size(file_size)
+        part_count = max(1, math.ceil(file_size / part_size))
+        parts = [
+            {
+                'part_number': part_number,
+                'url': self.s3_client.generate_presigned_url(
+                    ClientMethod='upload_part',
+                    Params={
+                        'Bucket': self.bucket_name,
+                        'Key': s3_key,
+                        'UploadId': upload_id,
+                        'PartNumber': part_number
+                    },
+                    ExpiresIn=expires_in
+                )
+            }
+            for part_number in range(1, part_count + 1)
+        ]
+
+        logger.info(f"[Direct Upload] User {self.user.id} started {s3_key} ({file_size} bytes, {part_count} parts)")
+        return {
+            'upload_id': upload_id,
+            's3_key': s3_key,
+            'part_size': part_size,
+            'parts': parts,
+            'expires_in': expires_in
+        }
+
+    def _check_own_key(self, s3_key):
+        if not s3_key or not s3_key.startswith(self.user_prefix):
+            raise Exception("Upload does not belong to this user")
+
+    def complete_direct_upload(self, s3_key, upload_id, parts):
+        """
+        Finish a direct multipart upload.
+
+        Args:
+            parts (list): [{'part_number': int, 'etag': str}, ...] as reported by the client.
+
+        Returns:
+            dict: {'s3_key', 'size', 'etag'}
+        """
+        self._check_own_key(s3_key)
+        if not parts:
+            raise Exception("No parts provided")
+
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={
+                'Parts': sorted(
+                    ({'PartNumber': int(part['part_number']), 'ETag': part['etag']} for part in parts),
+                    key=lambda part: part['PartNumber']
+                )
+            }
+        )
+
+        head = self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+        size = head['ContentLength']
+
+        # The limit was checked against the declared size; enforce the real one
+        if not self.check_storage_limit(size):
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_key)
+            raise Exception("Storage limit would be exceeded")
+
+        logger.info(f"[Direct Upload] User {self.user.id} completed {s3_key} ({size} bytes)")
+        return {'s3_key': s3_key, 'size': size, 'etag': head.get('ETag', '').strip('"')}
+
+    def abort_direct_upload(self, s3_key, upload_id):
+        """Abort a direct multipart upload and free its parts"""
+        self._check_own_key(s3_key)
+        self.s3_client.abort_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            UploadId=upload_id
+        )
+        return True
+
 
     # def delete_file(self, file_name):
     #     """Delete file from user's S3 directory"""
@@ -483,19 +742,11 @@ class S3StorageManager:
             str: The download URL
         """
         try:
-            params = {
-                'Bucket': self.bucket_name,
-                'Key': s3_key,
-                'ResponseContentDisposition': f'attachment; filename="{s3_key.split("/")[-1]}"'
-            }
-            
-            url = self.s3_client.generate_presigned_url(
-                ClientMethod='get_object',
-                Params=params,
-                ExpiresIn=expires_in
+            return get_url_signer().sign(
+                s3_key,
+                expiry=expires_in,
+                disposition=attachment_disposition(s3_key.split("/")[-1])
             )
-            
-            return url
         except Exception as e:
             logger.exception(f"Error generating download URL for {s3_key}: {str(e)}")
             raise Exception(f"Could not generate URL: {str(e)}")
@@ -515,37 +766,14 @@ class S3StorageManager:
             return False
     
     def delete_file(self, s3_key):
-        """Delete file with accurate size tracking"""
+        """Delete file from S3 (storage_used is updated by the ledger when the UserFile row goes)"""
         try:
-            # Get file size before deletion for storage update
-            file_size = 0
-            try:
-                response = self.s3_client.head_object(
-                    Bucket=self.bucket_name,
-                    Key=s3_key
-                )
-                file_size = response['ContentLength']
-            except self.s3_client.exceptions.NoSuchKey:
-                logger.warning(f"[Delete] File not found in S3: {s3_key}")
-                return True  # Consider it successful if file doesn't exist
-            
-            # Delete the file
+            # DeleteObject is idempotent, a missing key is not an error
             self.s3_client.delete_object(
                 Bucket=self.bucket_name,
                 Key=s3_key
             )
-            
-            # Update storage usage
-            if file_size > 0:
-                storage, created = UserStorage.objects.get_or_create(
-                    user=self.user,
-                    defaults={'storage_used': 0, 'storage_limit': 5368709120}
-                )
-                
-                storage.storage_used = max(0, storage.storage_used - file_size)
-                storage.save(update_fields=['storage_used'])
-                
-                logger.info(f"[Delete] User {self.user.id} deleted file {s3_key} ({file_size} bytes)")
+            logger.info(f"[Delete] User {self.user.id} deleted file {s3_key}")
             
             return True
             
@@ -553,6 +781,47 @@ class S3StorageManager:
             logger.error(f"Error deleting file from S3: {str(e)}")
             raise Exception(f"Error deleting file: {str(e)}")
 
+    def delete_keys(self, s3_keys, max_workers=None):
+        """
+        Delete many objects with DeleteObjects, 1,000 keys per call, calls in parallel.
+
+        Returns:
+            dict: {'deleted': [keys], 'errors': [{'key', 'code', 'message'}]}
+        """
+        keys = list(dict.fromkeys(key for key in s3_keys if key))
+        if not keys:
+            return {'deleted': [], 'errors': []}
+
+        batches = [keys[i:i + S3_DELETE_BATCH_SIZE] for i in range(0, len(keys), S3_DELETE_BATCH_SIZE)]
+        max_workers = max_workers or getattr(settings, 'S3_DELETE_MAX_WORKERS', 4)
+
+        def delete_batch(batch):
+            try:
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+                return [
+                    {'key': error['Key'], 'code': error.get('Code'), 'message': error.get('Message')}
+                    for error in response.get('Errors', [])
+                ]
+            except Exception as e:
+                return [{'key': key, 'code': 'RequestFailed', 'message': str(e)} for key in batch]
+
+        if len(batches) == 1:
+            errors = delete_batch(batches[0])
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+                errors = [error for batch_errors in executor.map(delete_batch, batches) for error in batch_errors]
+
+        failed = {error['key'] for error in errors}
+        deleted = [key for key in keys if key not in failed]
+        logger.info(f"[Delete] User {self.user.id} deleted {len(deleted)}/{len(keys)} objects in {len(batches)} batch(es)")
+        if errors:
+            logger.error(f"[Delete] {len(errors)} objects failed to delete, first: {errors[0]}")
+
+        return {'deleted': deleted, 'errors': errors}
+
     
     def list_user_files_with_details(self):
         """List all files for user with details for debugging"""
@@ -581,13 +850,7 @@ class S3StorageManager:
         try:
             from file_management.models import UserFile
             
-            # Get valid S3 keys from database
-            valid_keys = set()
-            for user_file in UserFile.objects.filter(user=self.user):
-                if user_file.s3_key:
-                    valid_keys.add(user_file.s3_key)
-                if user_file.file and user_file.file.name:
-                    valid_keys.add(user_file.file.name)
+            correlator = FileKeyCorrelator.for_queryset(UserFile.objects.filter(user=self.user))
             
             # List all S3 objects in user prefix
             paginator = self.s3_client.get_paginator('list_objects_v2')
@@ -598,34 +861,22 @@ class S3StorageManager:
                 Bucket=self.bucket_name,
                 Prefix=self.user_prefix
             ):
-                if 'Contents' in page:
-                    for obj in page['Contents']:
-                        s3_key = obj['Key']
-                        if s3_key not in valid_keys and not any(key in s3_key for key in valid_keys):
-                            orphaned_files.append({
-                                'key': s3_key,
-                                'size': obj['Size'],
-                                'last_modified': obj['LastModified']
-                            })
-                            total_orphaned_size += obj['Size']
+                for obj in page.get('Contents', []):
+                    s3_key = obj['Key']
+                    if correlator.match(s3_key, self.user.id) is None:
+                        orphaned_files.append({
+                            'key': s3_key,
+                            'size': obj['Size'],
+                            'last_modified': obj['LastModified']
+                        })
+                        total_orphaned_size += obj['Size']
             
             logger.info(f"[Orphan Cleanup] Found {len(orphaned_files)} orphaned files ({total_orphaned_size} bytes)")
             
             if not dry_run and orphaned_files:
                 # Actually delete the orphaned files
-                deleted_count = 0
-                for orphan in orphaned_files:
-                    try:
-                        self.s3_client.delete_object(
-                            Bucket=self.bucket_name,
-                            Key=orphan['key']
-                        )
-                        deleted_count += 1
-                        logger.info(f"[Orphan Cleanup] Deleted: {orphan['key']}")
-                    except Exception as e:
-                        logger.error(f"[Orphan Cleanup] Failed to delete {orphan['key']}: {e}")
-                
-                logger.info(f"[Orphan Cleanup] Deleted {deleted_count}/{len(orphaned_files)} orphaned files")
+                result = self.delete_keys([orphan['key'] for orphan in orphaned_files])
+                logger.info(f"[Orphan Cleanup] Deleted {len(result['deleted'])}/{len(orphaned_files)} orphaned files")
             
             return {
                 'orphaned_files': orphaned_files,
@@ -636,5 +887,15 @@ class S3StorageManager:
         except Exception as e:
             logger.error(f"[Orphan Cleanup] Error cleaning orphaned files for user {self.user.id}: {e}")
             return {'error': str(e)}
-        
 
+
+def run_storage_audit(user_id, dry_run=False):
+    """Audit one user's storage; the audit_user_storage Celery task runs it outside the request"""
+    from django.contrib.auth import get_user_model
+    
+    try:
+        user = get_user_model().objects.get(pk=user_id)
+        return S3StorageManager(user).audit_storage(dry_run=dry_run)
+    except Exception as e:
+        logger.error(f"[Storage Audit] Audit failed for user {user_id}: {e}")
+        return {'error': str(e)}
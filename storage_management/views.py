@@ -14,9 +14,11 @@ from .serializers import (
     AdminAccessLogSerializer, StorageOptimizationSerializer
 )
 
-from django.db.models import Sum, Count, Avg
+from django.db.models import Sum, Count
 from django.db.models.functions import TruncMonth
 from file_management.models import UserFile, FileCategory
+from file_management.dedupe import duplicate_groups
+from file_management.facets import file_facets
 # @login_required
 # def get_storage_info(request):
 #     try:
@@ -107,7 +109,8 @@ class StorageViewSet(viewsets.ModelViewSet):
             'db_size': storage_info.get('db_size', 0),
             's3_size': storage_info.get('s3_size', 0),
             'validated_size': storage_info.get('used', 0),
-            'method': storage_info.get('validation_method', 'database_primary')
+            'method': storage_info.get('validation_method', 'database_primary'),
+            'last_audited_at': storage_info.get('last_audited_at')
         }
         
         # Add subscription info for frontend
@@ -160,15 +163,15 @@ class StorageViewSet(viewsets.ModelViewSet):
             'is_sparkle': is_sparkle
         }
 
-        # 2. Storage Breakdown by Category
-        category_usage = UserFile.objects.filter(user=user)\
-            .values('category__name')\
-            .annotate(total_size=Sum('file_size'))\
-            .order_by('-total_size')
-
+        # 2. Storage Breakdown by Category (the same grouped query gives the totals below)
+        facets = file_facets(UserFile.objects.filter(user=user))
+        # Facets are per category id; a custom category sharing a default's name is one row, as before
+        size_by_name = {}
+        for facet in facets['categories'].values():
+            size_by_name[facet['name']] = size_by_name.get(facet['name'], 0) + facet['size']
         storage_breakdown = [
-            {'category': item['category__name'] or 'Uncategorized', 'size': item['total_size']}
-            for item in category_usage
+            {'category': name or 'Uncategorized', 'size': size}
+            for name, size in sorted(size_by_name.items(), key=lambda item: item[1], reverse=True)
         ]
 
         # 3. Enhanced Monthly Trends (more detailed for sparkle users)
@@ -206,10 +209,8 @@ class StorageViewSet(viewsets.ModelViewSet):
             
             sparkle_analytics = {
                 'file_types': list(file_types),
-                'total_files': UserFile.objects.filter(user=user).count(),
-                'average_file_size': UserFile.objects.filter(user=user).aggregate(
-                    avg_size= Avg('file_size')
-                )['avg_size'] or 0,
+                'total_files': facets['counts']['total'],
+                'average_file_size': facets['total_size'] / facets['counts']['total'] if facets['counts']['total'] else 0,
             }
 
         response_data = {
@@ -243,12 +244,8 @@ class StorageViewSet(viewsets.ModelViewSet):
         
         # Enhanced optimization for sparkle users
         if is_sparkle:
-            # More detailed duplicate detection
-            duplicates = files.values(
-                'file_size', 'file_type', 'file_hash'  # Assuming you have file_hash
-            ).annotate(
-                count=Count('id')
-            ).filter(count__gt=1)
+            # Content-hash duplicate groups
+            duplicates = duplicate_groups(request.user)
             
             # Detailed old files analysis
             six_months_ago = timezone.now() - timedelta(days=180)
@@ -272,11 +269,7 @@ class StorageViewSet(viewsets.ModelViewSet):
             ]
         else:
             # Basic duplicate detection
-            duplicates = files.values(
-                'file_size', 'file_type'
-            ).annotate(
-                count=Count('id')
-            ).filter(count__gt=1)
+            duplicates = duplicate_groups(request.user, limit=10)
             
             six_months_ago = timezone.now() - timedelta(days=180)
             old_files = files.filter(upload_date__lt=six_months_ago).values(
@@ -291,12 +284,8 @@ class StorageViewSet(viewsets.ModelViewSet):
         
         # Calculate potential savings
         potential_savings = sum(f['file_size'] for f in large_files)
-        if duplicates:
-            duplicate_savings = sum(
-                d['file_size'] * (d['count'] - 1) 
-                for d in duplicates if d['file_size']
-            )
-            potential_savings += duplicate_savings
+        # Only separately stored copies free space; deduplicated rows already share one object
+        potential_savings += sum(group['reclaimable_bytes'] for group in duplicates)
         
         data = {
             'large_files': list(large_files),
@@ -315,6 +304,7 @@ class StorageViewSet(viewsets.ModelViewSet):
         """Manually recalculate storage usage"""
         try:
             storage_manager = S3StorageManager(request.user)
+            storage_manager.audit_storage()
             storage_info = storage_manager.get_user_storage_info()
             
             return Response({
@@ -505,6 +505,43 @@ class VoiceAssistantAudioTests(TestCase):
             mock_client.audio.speech.create.assert_called_once()
             mock_speech.stream_to_file.assert_called_once()
 
+
+class FileResolutionTests(TestCase):
+    """find_file_by_name_or_id and force_open_file resolve names through the shared filename index."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='resolver', email='resolver@example.com', password='testpassword')
+        self.plan = UserFile.objects.create(
+            user=self.user, original_filename='CGProjectPlanes.pdf', file_type='document', s3_key='test/CGProjectPlanes.pdf'
+        )
+        self.bill = UserFile.objects.create(
+            user=self.user, original_filename='Last Month Electricity Bill.pdf', file_type='document', s3_key='test/bill.pdf'
+        )
+
+    def test_find_file_by_name_or_id(self):
+        from .views import find_file_by_name_or_id
+
+        self.assertEqual(find_file_by_name_or_id(self.user, 'cg project planes'), self.plan)
+        self.assertEqual(find_file_by_name_or_id(self.user, 'electricity bill pdf'), self.bill)
+        self.assertEqual(find_file_by_name_or_id(self.user, str(self.bill.id)), self.bill)
+        self.assertIsNone(find_file_by_name_or_id(self.user, 'tax return'))
+
+    @patch('voice_assistant.views.S3StorageManager')
+    def test_force_open_file(self, mock_storage):
+        from .views import force_open_file
+
+        mock_storage.return_value.generate_download_url.return_value = 'https://example.com/bill.pdf'
+        opened, _, payload = force_open_file(self.user, 'open my electrcity bill')
+        self.assertTrue(opened)
+        self.assertEqual(payload['file_id'], self.bill.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bill.original_filename = 'March Power Statement.pdf'
+            self.bill.save()
+        opened, _, payload = force_open_file(self.user, 'show the power statement')
+        self.assertEqual(payload['file_id'], self.bill.id)
+
+
 # Run the tests
 if __name__ == '__main__':
     unittest.main()
@@ -1,21 +1,26 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from openai import OpenAI
-import boto3
 from django.conf import settings
 import tempfile, json
 from .models import VoiceInteraction
 from django.shortcuts import render,get_object_or_404
 from file_management.models import UserFile, FileCategory, OCRResult
+from file_management.facets import file_facets
+from file_management.search_index import get_backend as get_search_backend
+from file_management.filename_index import resolve_file, resolve_filename
+from file_management.services import FileDeletionService
 from storage_management.utils import S3StorageManager
+from storage_management.clients import get_s3_client
 from datetime import datetime
 from rest_framework import viewsets, status
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-import tempfile, json, os, re
+import tempfile, json, os
 from datetime import datetime
-from django.db.models import Q
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
 from django.utils.decorators import method_decorator
 from django.utils import timezone
 from .models import VoiceInteraction
@@ -29,42 +34,34 @@ import uuid
 import logging
 logger = logging.getLogger(__name__)
 client = OpenAI(api_key=settings.OPENAI_API_KEY)
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    region_name=settings.AWS_S3_REGION_NAME
-)
+s3_client = get_s3_client()
 
 def get_file_context(user):
     """Get more detailed context about user's files and storage for better AI responses"""
     storage_manager = S3StorageManager(user)
     storage_info = storage_manager.get_user_storage_info()
     
-    # Get file statistics
+    # Get file statistics: all counts from one grouped query
     all_files = UserFile.objects.filter(user=user)
-    file_count = all_files.count()
+    facets = file_facets(all_files)
+    file_count = facets['counts']['total']
     
-    # Get all categories and files per category
+    # Get all categories and the 10 newest files of each, in one windowed query
     categories_with_files = {}
-    all_categories = FileCategory.objects.filter(
-        userfile__user=user
-    ).distinct()
+    for category_id, facet in sorted(facets['categories'].items(), key=lambda item: item[0] or 0):
+        if category_id is not None:
+            categories_with_files[facet['name']] = {'count': facet['count'], 'files': []}
     
-    for category in all_categories:
-        category_files = all_files.filter(category=category)
-        categories_with_files[category.name] = {
-            'count': category_files.count(),
-            'files': [
-                {
-                    'name': f.original_filename, 
-                    'type': f.file_type,
-                    'id': f.id,
-                    'upload_date': f.upload_date.strftime("%Y-%m-%d")
-                } 
-                for f in category_files.order_by('-upload_date')[:10]
-            ]
-        }
+    newest_per_category = all_files.filter(category__isnull=False).annotate(
+        rank=Window(RowNumber(), partition_by=F('category_id'), order_by=F('upload_date').desc())
+    ).filter(rank__lte=10).select_related('category').order_by('category_id', 'rank')
+    for f in newest_per_category:
+        categories_with_files[f.category.name]['files'].append({
+            'name': f.original_filename, 
+            'type': f.file_type,
+            'id': f.id,
+            'upload_date': f.upload_date.strftime("%Y-%m-%d")
+        })
     
     # Get recent files
     recent_files = all_files.order_by('-upload_date')[:5]
@@ -465,14 +462,12 @@ class VoiceAssistantViewSet(viewsets.ModelViewSet):
 
     def get_file_context(self, user):
         files = UserFile.objects.filter(user=user)
-        categories = FileCategory.objects.filter(
-            userfile__user=user
-        ).distinct()
+        facets = file_facets(files)
         recent_files = files.order_by('-upload_date')[:5]
 
         return {
-            'file_count': files.count(),
-            'categories': list(categories.values_list('name', flat=True)),
+            'file_count': facets['counts']['total'],
+            'categories': [facet['name'] for category_id, facet in facets['categories'].items() if category_id is not None],
             'recent_files': list(recent_files.values_list('original_filename', flat=True))
         }
 
@@ -510,7 +505,6 @@ def find_file_by_name_or_id(user, file_name_or_id, operation_name="operation", r
     import logging
     from django.db.models import Q
     from file_management.models import UserFile
-    import re
     
 
     logger.info(f"[{operation_name}] Finding file for user {user.id}: '{file_name_or_id}' (Conv ID: {conversation_id}) Context: {reference_context}")
@@ -629,119 +623,12 @@ def find_file_by_name_or_id(user, file_name_or_id, operation_name="operation", r
         except (ValueError, TypeError):
             pass  # Not a valid integer ID, continue to name matching
     
-    # Handle string matching
+    # Handle string matching: exact, prefix, contains, camelCase/separator and fuzzy matches, ranked by the filename index
     if isinstance(file_name_or_id, str):
-        # Clean up the filename for comparison
-        search_name = file_name_or_id.strip().lower()
-        
-        # Create alternative search name variations
-        search_variations = [search_name]
-        
-        # Add a variation with spaces removed
-        no_spaces_search = search_name.replace(" ", "")
-        if no_spaces_search != search_name:
-            search_variations.append(no_spaces_search)
-        
-        # Try to split camelCase (e.g., "CGProjectPlanes" -> "cg project planes")
-        camel_case_pattern = re.compile(r'((?<=[a-z])[A-Z]|(?<!\A)[A-Z](?=[a-z]))')
-        camel_split_search = camel_case_pattern.sub(r' \1', search_name).lower()
-        if camel_split_search != search_name:
-            search_variations.append(camel_split_search)
-            
-        # Add joined variation without spaces
-        if " " in search_name:
-            search_variations.append("".join(search_name.split()))
-            
-        logger.info(f"[{operation_name}] Search variations: {search_variations}")
-        
-        # Try each search variation
-        for variant in search_variations:
-            # 1. Try exact match first (case-insensitive)
-            file = UserFile.objects.filter(
-                user=user, 
-                original_filename__iexact=variant
-            ).first()
-            
-            if file:
-                logger.info(f"[{operation_name}] Found exact filename match with variant '{variant}': {file.original_filename}")
-                return file
-            
-            # 2. Try with added extensions if no extension present
-            if '.' not in variant:
-                common_extensions = ['.pdf', '.docx', '.doc', '.xlsx', '.txt', '.jpg', '.png']
-                for ext in common_extensions:
-                    file = UserFile.objects.filter(
-                        user=user, 
-                        original_filename__iexact=variant + ext
-                    ).first()
-                    if file:
-                        logger.info(f"[{operation_name}] Found match with added extension {ext} to variant '{variant}': {file.original_filename}")
-                        return file
-        
-        # For more fuzzy matches, use the original search term but also collect matches from all variations
-        all_base_matches = []
-        all_partial_matches = []
-        
-        for variant in search_variations:
-            # 3. Try matching the beginning of filename (startswith)
-            base_name_matches = UserFile.objects.filter(
-                user=user,
-                original_filename__istartswith=variant
-            ).order_by('-upload_date')
-            
-            all_base_matches.extend(list(base_name_matches))
-            
-            # 4. Try fuzzy partial matching within filenames (contains)
-            partial_matches = UserFile.objects.filter(
-                user=user,
-                original_filename__icontains=variant
-            ).order_by('-upload_date')
-            
-            all_partial_matches.extend(list(partial_matches))
-        
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_base_matches = [x for x in all_base_matches if not (x.id in seen or seen.add(x.id))]
-        
-        if unique_base_matches:
-            file = unique_base_matches[0]
-            logger.info(f"[{operation_name}] Found base name match: {file.original_filename}")
-            return file
-            
-        seen = set()
-        unique_partial_matches = [x for x in all_partial_matches if not (x.id in seen or seen.add(x.id))]
-        
-        if unique_partial_matches:
-            file = unique_partial_matches[0]
-            logger.info(f"[{operation_name}] Found partial name match: {file.original_filename}")
+        file = resolve_file(user, file_name_or_id)
+        if file:
+            logger.info(f"[{operation_name}] Found filename match: {file.original_filename}")
             return file
-            
-        # 5. Try splitting search term into words and matching on individual words
-        search_words = search_name.split()
-        if len(search_words) > 1:
-            logger.info(f"[{operation_name}] Trying multi-word matching with {len(search_words)} words")
-            
-            # Try matching on any individual word within the filename
-            word_matches = []
-            for word in search_words:
-                # Skip very short words (< 3 chars)
-                if len(word) < 3:
-                    continue
-                    
-                matches = UserFile.objects.filter(
-                    user=user,
-                    original_filename__icontains=word
-                )
-                word_matches.extend(list(matches))
-            
-            # Count occurrences of each file to rank by match quality
-            if word_matches:
-                from collections import Counter
-                file_counts = Counter(word_matches)
-                # Get the file with the most word matches
-                best_match = file_counts.most_common(1)[0][0]
-                logger.info(f"[{operation_name}] Found best word match: {best_match.original_filename}")
-                return best_match
     
     # No matches found
     logger.warning(f"[{operation_name}] No file found for '{file_name_or_id}'")
@@ -815,18 +702,28 @@ def search_files_for_sparkle(user, keyword):
             logger.warning(f"[{operation_name}] Keyword too short: '{keyword}'")
             return json.dumps({"success": False, "error": "Please provide a search keyword with at least 3 characters."})
 
-        name_matches = UserFile.objects.filter(Q(user=user) & Q(original_filename__icontains=keyword))
-        ocr_matches = UserFile.objects.filter(Q(user=user) & Q(ocrresult__text_content__icontains=keyword) & Q(ocrresult__status='completed'))
-        all_matches = (name_matches | ocr_matches).distinct().select_related('category').order_by('-upload_date')
-        count = all_matches.count()
+        # Ranked matches from the search index, best first
+        limit = 20
+        backend = get_search_backend()
+        count = backend.count(user, keyword)
+        hits = backend.search(user, keyword, limit=limit) if count else []
+        files = UserFile.objects.select_related('category').in_bulk([hit.file_id for hit in hits])
 
         if count == 0:
             result_text = f"I couldn't find any files containing '{keyword}' in the name or content."
             logger.info(f"[{operation_name}] Found 0 matches for '{keyword}'.")
             return json.dumps({"success": True, "count": 0, "result": result_text}) # Success, but no results
         else:
-            limit = 20
-            response_list = [f"- ID:{f.id} {f.original_filename} (Category: {f.category.name if f.category else 'Uncategorized'})" for f in all_matches[:limit]]
+            response_list = []
+            for hit in hits:
+                f = files.get(hit.file_id)
+                if f is None:
+                    continue
+                line = f"- ID:{f.id} {f.original_filename} (Category: {f.category.name if f.category else 'Uncategorized'})"
+                # Content passages only; a highlighted file name would just repeat the name
+                if hit.snippet and hit.snippet.replace('[', '').replace(']', '') != f.original_filename:
+                    line += f": {hit.snippet}"
+                response_list.append(line)
             result_text = f"I found {count} file(s) containing '{keyword}':\n" + "\n".join(response_list)
             if count > limit:
                 result_text += f"\n... and {count - limit} more matches."
@@ -1031,7 +928,7 @@ def delete_file_for_sparkle(user, file_name_or_id, reference_context=None):
     try:
         file_name_deleted = file.original_filename
         file_id_deleted = file.id # Capture ID before deletion
-        file.delete() # This should handle S3 deletion via the model's method override
+        FileDeletionService(user).delete_files([file])
         logger.info(f"[{operation_name}] Successfully deleted file '{file_name_deleted}' (ID: {file_id_deleted}) for user {user.id}")
         payload = {
             "success": True,
@@ -1559,76 +1456,14 @@ def force_open_file(user, query):
         clean_query = clean_query.replace(word, " ")
         
     # Clean up extra spaces
-    clean_query = re.sub(r'\s+', ' ', clean_query).strip()
+    clean_query = ' '.join(clean_query.split())
     if len(clean_query) < 3:
         return False, None, None
     
-    # Handle camelCase and remove spaces - create alternative query formats
-    query_variations = [clean_query]
-    
-    # Add a variation with spaces removed (e.g., "my document" -> "mydocument")
-    no_spaces_query = clean_query.replace(" ", "")
-    if no_spaces_query != clean_query:
-        query_variations.append(no_spaces_query)
-    
-    # Try to split camelCase (e.g., "CGProjectPlanes" -> "cg project planes")
-    camel_case_pattern = re.compile(r'((?<=[a-z])[A-Z]|(?<!\A)[A-Z](?=[a-z]))')
-    camel_split_query = camel_case_pattern.sub(r' \1', clean_query).lower()
-    if camel_split_query != clean_query:
-        query_variations.append(camel_split_query)
-        
-    # Add joined variations without spaces to better handle combined terms
-    if " " in clean_query:
-        query_variations.append("".join(clean_query.split()))
-    
-    logger.info(f"Force-opening file attempt with extracted queries: {query_variations}")
-    
-    # Try to find the file
-    potential_matches = []
-    all_files = UserFile.objects.filter(user=user).order_by('-upload_date')
+    logger.info(f"Force-opening file attempt with extracted query: '{clean_query}'")
     
-    # First look for exact or contains matches
-    for file in all_files:
-        filename_lower = file.original_filename.lower()
-        highest_match_weight = 0
-        
-        # Try each query variation
-        for query_var in query_variations:
-            # Check for exact match first
-            if query_var == filename_lower:
-                file_found = file
-                break
-                
-            # Check for contains match - prioritize files that contain the query
-            elif query_var in filename_lower:
-                match_weight = 2
-                # Prefer matches where the query is closer to the full filename length
-                similarity_ratio = len(query_var) / len(filename_lower)
-                if similarity_ratio > 0.5:  # If query is at least 50% of filename length
-                    match_weight += 1
-                    
-                highest_match_weight = max(highest_match_weight, match_weight)
-            else:
-                # Check individual words
-                search_terms = query_var.split()
-                word_match_weight = 0
-                for term in search_terms:
-                    if len(term) > 2 and term in filename_lower:
-                        word_match_weight += 1
-                highest_match_weight = max(highest_match_weight, word_match_weight)
-                
-        # Add to potential matches if any variation matched
-        if highest_match_weight > 0:
-            potential_matches.append((file, highest_match_weight))
-            
-        # Break early if exact match found
-        if file_found:
-            break
-    
-    # Sort potential matches by weight
-    if not file_found and potential_matches:
-        potential_matches.sort(key=lambda x: x[1], reverse=True)
-        file_found = potential_matches[0][0]
+    # Best match from the filename index (camelCase, separators and spacing are normalised there)
+    file_found = resolve_file(user, clean_query, UserFile.objects.filter(user=user).select_related('category'))
     
     # If file found, generate URL and response
     if file_found:
@@ -1892,12 +1727,7 @@ def generate_audio_response(user, text, interaction):
         audio_response.stream_to_file(temp_response_path)
         
         # Set up S3 client
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
+        s3_client = get_s3_client()
         
         # Get base filename (without path)
         s3_filename = f"media/voice_responses/response_{uuid.uuid4()}.mp3"
@@ -1970,18 +1800,28 @@ def direct_file_open_api(request):
         file = find_file_by_name_or_id(user=request.user, file_name_or_id=file_reference, operation_name="fallback_api")
         
         if not file:
+            # The nearest names with their scores, else the most recent files
+            candidates = resolve_filename(request.user, str(file_reference), min_score=0.1)
+            files = UserFile.objects.filter(user=request.user).select_related('category')
+            if candidates:
+                found = files.in_bulk([match.file_id for match in candidates])
+                ranked = [(found[match.file_id], match.score) for match in candidates if match.file_id in found]
+            else:
+                ranked = [(f, None) for f in files.order_by('-upload_date')[:5]]
+            fallback_files = [
+                {
+                    'id': f.id, 
+                    'name': f.original_filename,
+                    'type': f.file_type,
+                    'category': f.category.name if f.category else "Uncategorized",
+                    'score': score
+                } 
+                for f, score in ranked
+            ]
             return Response({
                 'success': False,
                 'error': f"Couldn't find a file matching '{file_reference}'",
-                'fallback_files': [
-                    {
-                        'id': f.id, 
-                        'name': f.original_filename,
-                        'type': f.file_type,
-                        'category': f.category.name if f.category else "Uncategorized"
-                    } 
-                    for f in UserFile.objects.filter(user=request.user).order_by('-upload_date')[:5]
-                ]
+                'fallback_files': fallback_files
             }, status=status.HTTP_404_NOT_FOUND)
             
         # Generate URL for the file
@@ -2,6 +2,7 @@
 
 import os
 from celery import Celery
+from celery.signals import worker_process_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'voice_retrieval.settings')
 
@@ -10,3 +11,11 @@ app = Celery('voice_retrieval')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def load_categorizer_model(**kwargs):
+    # Workers load the learned categorizer once at startup (no-op in keyword mode)
+    from file_management.learned_categorizer import warm_model
+
+    warm_model()
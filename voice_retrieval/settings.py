@@ -173,6 +173,102 @@ AWS_S3_FILE_OVERWRITE = False
 AWS_DEFAULT_ACL = None
 AWS_S3_VERITY = True
 
+# Shared boto3 client pool (storage_management.clients)
+AWS_CLIENT_MAX_POOL_CONNECTIONS = 50
+AWS_CLIENT_TCP_KEEPALIVE = True
+AWS_CLIENT_MAX_ATTEMPTS = 5
+AWS_CLIENT_RETRY_MODE = 'standard'
+
+# Offline presigned URL signer (storage_management.signing)
+S3_PRESIGN_CACHE_MAX_ENTRIES = 20000
+S3_PRESIGN_CACHE_BUCKET_RATIO = 0.25  # fraction of URL lifetime a cached URL is reused for
+
+# Background S3 reconciliation of the storage ledger, per user (0 disables)
+STORAGE_AUDIT_INTERVAL = 6 * 60 * 60
+
+# Streaming uploads (storage_management.transfer)
+S3_UPLOAD_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+S3_UPLOAD_PART_SIZE = 8 * 1024 * 1024
+S3_UPLOAD_MAX_CONCURRENCY = 10
+S3_UPLOAD_MAX_BUFFERED_PARTS = 10
+S3_DIRECT_UPLOADS_ENABLED = True
+S3_DIRECT_UPLOAD_PART_SIZE = 16 * 1024 * 1024
+
+# Batch deletes (S3StorageManager.delete_keys), DeleteObjects calls in flight
+S3_DELETE_MAX_WORKERS = 4
+
+# OCR job queue (file_management.ocr_queue): 'celery' or 'local' (in-process threads, no broker)
+OCR_QUEUE_BACKEND = 'celery'
+OCR_LOCAL_WORKERS = 2
+OCR_CELERY_QUEUES = {'interactive': 'ocr_interactive', 'backfill': 'ocr_backfill'}
+OCR_MAX_JOBS_PER_USER = 2
+OCR_JOB_MAX_ATTEMPTS = 3
+OCR_JOB_RETRY_DELAY = 10  # seconds, doubled on every attempt
+OCR_JOB_POLL_INTERVAL = 5  # seconds between Textract status checks for PDFs
+OCR_JOB_MAX_POLLS = 120
+OCR_JOB_STALE_AFTER = 15 * 60
+
+# Textract completion notifications (file_management.textract_events); empty = poll as before
+TEXTRACT_SNS_TOPIC_ARN = os.getenv('TEXTRACT_SNS_TOPIC_ARN', '')
+TEXTRACT_SNS_ROLE_ARN = os.getenv('TEXTRACT_SNS_ROLE_ARN', '')
+TEXTRACT_SQS_QUEUE_URL = os.getenv('TEXTRACT_SQS_QUEUE_URL', '')
+TEXTRACT_NOTIFICATION_TOKEN = os.getenv('TEXTRACT_NOTIFICATION_TOKEN', '')  # ?token= on the SNS endpoint
+OCR_SWEEP_SILENT_AFTER = 120  # seconds without news before a job is polled
+OCR_SWEEP_BATCH_SIZE = 50
+OCR_SWEEP_MAX_CALLS_PER_SECOND = 2
+OCR_PAGE_BATCH_SIZE = 50  # OCRPage rows per bulk insert while a result streams in
+
+# OCR engines (file_management.ocr_engines): 'textract' or 'tesseract'; users can override in OCRPreference
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'textract')
+OCR_TESSERACT_CMD = os.getenv('OCR_TESSERACT_CMD', 'tesseract')
+OCR_TESSERACT_LANG = 'eng'
+OCR_TESSERACT_CONFIG = ''
+OCR_TESSERACT_WORKERS = 2  # page-level process pool per document; 0 = OCR in the calling process
+OCR_PDF_RASTER_DPI = 200
+OCR_DOCUMENT_WORKERS = 4  # sides of a paired document OCR'd at the same time
+
+# Text extraction for text/Office/HTML files (file_management.extractors), no Textract involved
+EXTRACT_WORKERS = 2  # extractor processes; 0 = extract in the calling process
+EXTRACT_TIMEOUT = 120  # seconds to wait for one extraction
+EXTRACT_MAX_INPUT_BYTES = 50 * 1024 * 1024  # bytes read (decompressed, for Office files) before truncating; larger Office files are refused
+EXTRACT_MAX_TEXT_CHARS = 2 * 1024 * 1024  # extracted text kept per file
+EXTRACT_SPOOL_MEMORY = 8 * 1024 * 1024  # Office files larger than this are spooled to disk
+EXTRACT_CHUNK_SIZE = 64 * 1024
+
+# Cursor-paginated file listing (file_management.listing)
+FILE_LIST_PAGE_SIZE = 50
+FILE_LIST_MAX_PAGE_SIZE = 200
+
+# Full-text search over file names and OCR text (file_management.search_index)
+FILE_SEARCH_BACKEND = 'auto'  # 'fts5' (SQLite FTS5 index), 'database' (icontains fallback) or 'auto'
+FILE_SEARCH_MAX_RESULTS = 200
+FILE_SEARCH_WEIGHTS = (10.0, 1.0)  # BM25 weights of the file name and the OCR text
+FILE_SEARCH_SNIPPET_TOKENS = 12
+
+# Per-user trigram index of file names for the voice assistant's file resolution (file_management.filename_index)
+FILENAME_INDEX_USERS = 256  # users whose indexes a process keeps
+FILENAME_MATCH_MIN_SCORE = 0.25
+
+# OCR result cache keyed by content hash + engine version (file_management.ocr_cache)
+OCR_CACHE_ENABLED = True
+OCR_CACHE_TTL = 90 * 24 * 3600  # seconds; 0 keeps entries until LRU eviction
+OCR_CACHE_MAX_ENTRIES = 10000  # least recently used entries beyond this are evicted
+OCR_CACHE_EVICT_EVERY = 100  # stores between eviction passes; `manage.py ocr_cache --evict` runs one now
+
+# Batch categorization (file_management.batch_categorization, process_pending_files)
+BATCH_CATEGORIZE_CHUNK_SIZE = 500
+BATCH_CATEGORIZE_WORKERS = 4  # categorization processes; 0 = in the calling process
+BATCH_CATEGORIZE_MAX_FILES_PER_SECOND = 0  # throughput cap; 0 = unlimited
+
+# Categorization: 'keywords' (hand-weighted scorer) or 'learned' (file_management.learned_categorizer,
+# trained with `manage.py train_categorizer`; the keyword scorer remains the fallback)
+CATEGORIZATION_MODE = os.getenv('CATEGORIZATION_MODE', 'keywords')
+CATEGORIZER_MODEL_PATH = os.getenv('CATEGORIZER_MODEL_PATH', str(BASE_DIR / 'models' / 'categorizer.npz'))
+CATEGORIZER_MIN_PROBABILITY = 0.5  # below this the keyword scorer decides
+
+# Range/streaming download proxy (storage_management.streaming), bytes relayed per chunk
+S3_STREAM_CHUNK_SIZE = 64 * 1024
+
 FILE_UPLOAD_MAX_MEMORY_SIZE = 26214400  # 25MB
 FILE_UPLOAD_TEMP_DIR = '/tmp'
 DATA_UPLOAD_MAX_MEMORY_SIZE = 26214400